@@ -0,0 +1,271 @@
+"""
+Жизненный цикл файлов-артефактов пайплайна на диске
+
+Каталоги uploads/videos, processed, formats, thumbnails и downloaded растут
+с каждой загрузкой. Менеджер ведет реестр артефактов (размер, время
+последнего обращения), удаляет промежуточные файлы после подтвержденной
+загрузки на YouTube и периодически применяет к каждому каталогу TTL и квоту
+с вытеснением давно не использованных файлов (LRU). Файлы заданий, которые
+еще идут по конвейеру, закреплены и не вытесняются.
+
+Несколько воркеров на общем томе: закрепленные файлы каждого воркера
+публикуются в общем реестре координатора, очистку в каждый момент выполняет
+один воркер. Перед очисткой он заново читает каталоги с диска (файлы других
+воркеров в его реестр не попадают), а исключает только опубликованные
+закрепленные файлы всех воркеров.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from config import UPLOAD_DIR, ARTIFACT_QUOTAS, ARTIFACT_TTL_HOURS, ARTIFACT_CLEANUP_INTERVAL
+from coordination import coordinator, LockNotAcquired
+from metrics import ARTIFACT_BYTES, ARTIFACT_EVICTIONS
+
+logger = logging.getLogger(__name__)
+
+
+class ArtifactManager:
+    """Реестр артефактов с квотами по каталогам"""
+
+    def __init__(
+        self,
+        base_dir: str = UPLOAD_DIR,
+        quotas: Optional[Dict[str, int]] = None,
+        ttl_hours: float = ARTIFACT_TTL_HOURS,
+        cleanup_interval: int = ARTIFACT_CLEANUP_INTERVAL
+    ):
+        self.base_dir = Path(base_dir)
+        self.quotas = dict(quotas if quotas is not None else ARTIFACT_QUOTAS)
+        self.ttl_seconds = ttl_hours * 3600
+        self.cleanup_interval = cleanup_interval
+        self._artifacts: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._publish_task: Optional[asyncio.Task] = None
+        for kind in self.quotas:
+            ARTIFACT_BYTES.labels(kind).set_function(lambda kind=kind: self.used_bytes(kind))
+
+    # ==================== РЕЕСТР ====================
+
+    def scan(self) -> int:
+        """Сверка реестра с каталогами на диске
+
+        Добавляет файлы прошлых запусков и других воркеров, обновляет размеры
+        и время обращения, убирает файлы, удаленные мимо менеджера (их число
+        возвращается).
+        """
+        seen: Set[str] = set()
+        for kind in self.quotas:
+            directory = self.base_dir / kind
+            if not directory.exists():
+                continue
+            for path in directory.iterdir():
+                try:
+                    if not path.is_file():
+                        continue
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                seen.add(str(path))
+                accessed = max(stat.st_atime, stat.st_mtime)
+                artifact = self._artifacts.get(str(path))
+                if artifact is None:
+                    self._artifacts[str(path)] = {
+                        "path": str(path),
+                        "kind": kind,
+                        "size": stat.st_size,
+                        "created_at": stat.st_mtime,
+                        "last_access": accessed,
+                        "pins": 0
+                    }
+                else:
+                    artifact["size"] = stat.st_size
+                    artifact["last_access"] = max(artifact["last_access"], accessed)
+
+        missing = [p for p in self._artifacts if p not in seen and not Path(p).exists()]
+        for path in missing:
+            del self._artifacts[path]
+        return len(missing)
+
+    def register(self, path: Optional[str], kind: str, pin: bool = True) -> Optional[str]:
+        """Учет нового артефакта; закрепленный файл не вытесняется до unpin"""
+        if not path or not Path(path).exists():
+            return None
+        now = time.time()
+        artifact = self._artifacts.get(str(path))
+        if artifact is None:
+            artifact = {"path": str(path), "kind": kind, "created_at": now, "pins": 0}
+            self._artifacts[str(path)] = artifact
+        artifact["size"] = Path(path).stat().st_size
+        artifact["last_access"] = now
+        if pin:
+            artifact["pins"] += 1
+            self._pins_changed()
+        return path
+
+    def touch(self, path: Optional[str]):
+        """Отметка обращения к артефакту (для LRU)"""
+        artifact = self._artifacts.get(str(path)) if path else None
+        if artifact:
+            artifact["last_access"] = time.time()
+
+    def unpin(self, paths: Iterable[Optional[str]]):
+        for path in paths:
+            artifact = self._artifacts.get(str(path)) if path else None
+            if artifact and artifact["pins"] > 0:
+                artifact["pins"] -= 1
+        self._pins_changed()
+
+    def release(self, paths: Iterable[Optional[str]]) -> int:
+        """Удаление артефактов, которые больше не нужны (например, после загрузки на YouTube)"""
+        freed = 0
+        for path in {str(p) for p in paths if p}:
+            freed += self._delete(path, reason="released")
+        return freed
+
+    def used_bytes(self, kind: str) -> int:
+        return sum(a["size"] for a in self._artifacts.values() if a["kind"] == kind)
+
+    def _delete(self, path: str, reason: str) -> int:
+        artifact = self._artifacts.pop(path, None)
+        try:
+            size = Path(path).stat().st_size
+            Path(path).unlink()
+        except FileNotFoundError:
+            size = 0
+        except OSError as e:
+            logger.warning(f"Не удалось удалить артефакт {path}: {e}")
+            if artifact:
+                self._artifacts[path] = artifact
+            return 0
+        if artifact:
+            ARTIFACT_EVICTIONS.labels(artifact["kind"], reason).inc()
+        return size
+
+    # ==================== ОЧИСТКА ====================
+
+    def cleanup(self, protected: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """TTL и квоты по каталогам по текущему содержимому диска
+
+        Без protected пропускаются файлы, закрепленные в этом процессе; с protected
+        (закрепленные файлы всех воркеров из общего реестра) - только они.
+        """
+        now = time.time()
+        removed = {"missing": self.scan(), "expired": 0, "quota": 0}
+        freed = 0
+
+        if protected is None:
+            unpinned = [a for a in self._artifacts.values() if a["pins"] == 0]
+        else:
+            unpinned = [a for a in self._artifacts.values() if a["path"] not in protected]
+
+        if self.ttl_seconds:
+            for artifact in [a for a in unpinned if now - a["last_access"] > self.ttl_seconds]:
+                freed += self._delete(artifact["path"], reason="expired")
+                removed["expired"] += 1
+
+        for kind, quota in self.quotas.items():
+            used = self.used_bytes(kind)
+            if used <= quota:
+                continue
+            # Самые давно не использованные - первыми
+            candidates = sorted(
+                (a for a in unpinned if a["kind"] == kind and a["path"] in self._artifacts),
+                key=lambda a: a["last_access"]
+            )
+            for artifact in candidates:
+                if used <= quota:
+                    break
+                used -= artifact["size"]
+                freed += self._delete(artifact["path"], reason="quota")
+                removed["quota"] += 1
+
+        return {"removed": removed, "freed_bytes": freed}
+
+    def status(self) -> Dict[str, Any]:
+        self.scan()
+        directories = {}
+        for kind, quota in self.quotas.items():
+            artifacts: List[Dict[str, Any]] = [a for a in self._artifacts.values() if a["kind"] == kind]
+            used = sum(a["size"] for a in artifacts)
+            oldest_access = min((a["last_access"] for a in artifacts), default=None)
+            directories[kind] = {
+                "files": len(artifacts),
+                "pinned": sum(1 for a in artifacts if a["pins"]),
+                "used_bytes": used,
+                "quota_bytes": quota,
+                "usage_pct": round(used / quota * 100, 1) if quota else None,
+                "oldest_access": datetime.fromtimestamp(oldest_access).isoformat() if oldest_access else None
+            }
+        return {
+            "base_dir": str(self.base_dir),
+            "ttl_hours": self.ttl_seconds / 3600,
+            "cleanup_interval": self.cleanup_interval,
+            "directories": directories
+        }
+
+    # ==================== НЕСКОЛЬКО ВОРКЕРОВ ====================
+
+    def pinned_paths(self) -> List[str]:
+        return [a["path"] for a in self._artifacts.values() if a["pins"]]
+
+    def _pins_changed(self):
+        """Публикация закрепленных файлов в общем реестре (одна фоновая задача на серию изменений)"""
+        if not coordinator.shared or (self._publish_task and not self._publish_task.done()):
+            return
+        try:
+            self._publish_task = asyncio.get_running_loop().create_task(self._publish_pins())
+        except RuntimeError:
+            # Вне цикла событий (скрипты, init_db) - опубликуется при следующей очистке
+            pass
+
+    async def _publish_pins(self):
+        try:
+            await coordinator.publish_worker_state("artifacts:pins", self.pinned_paths(), ttl=self.cleanup_interval * 3)
+        except Exception as e:
+            logger.warning(f"Artifact pins publish failed: {e}")
+
+    async def cleanup_shared(self) -> Dict[str, Any]:
+        """Очистка с учетом файлов, закрепленных другими воркерами; параллельно выполняется только одна"""
+        try:
+            async with coordinator.lock("artifacts_cleanup", ttl=60, timeout=0):
+                await self._publish_pins()
+                # Свои закрепленные файлы - те же, что только что опубликованы (на случай сбоя публикации)
+                protected: Set[str] = set(self.pinned_paths())
+                for paths in (await coordinator.workers_state("artifacts:pins")).values():
+                    protected.update(paths)
+                return self.cleanup(protected)
+        except LockNotAcquired:
+            return {"removed": {}, "freed_bytes": 0, "skipped": "cleanup running on another worker"}
+
+    # ==================== LIFECYCLE ====================
+
+    async def _cleanup_loop(self):
+        while True:
+            try:
+                result = await self.cleanup_shared()
+                if result["freed_bytes"]:
+                    logger.info(f"Artifacts cleanup: {result}")
+            except Exception as e:
+                logger.error(f"Artifacts cleanup error: {e}")
+            await asyncio.sleep(self.cleanup_interval)
+
+    def start(self):
+        """Запуск периодической очистки"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._cleanup_loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if coordinator.shared:
+            await coordinator.remove_worker_state("artifacts:pins")
+
+
+# Глобальный менеджер артефактов
+artifact_manager = ArtifactManager()
@@ -0,0 +1,3 @@
+"""
+Бенчмарки медиа-пайплайна (запуск из каталога backend: python -m benchmarks.<имя>)
+"""
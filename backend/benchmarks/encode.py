@@ -0,0 +1,205 @@
+"""
+benchmark-encode: сравнение профилей кодирования по скорости и качеству
+
+Каждый профиль из encoding_profiles.py прогоняется по набору клипов
+(test_video.mp4 из корня проекта и синтетические lavfi-клипы). Для каждой пары
+профиль/клип измеряются скорость кодирования (fps), CPU-секунды ffmpeg,
+размер результата и качество относительно исходника (PSNR/SSIM).
+
+Запуск из каталога backend:
+    python -m benchmarks.encode
+    python -m benchmarks.encode --profiles fast balanced --duration 5 --output encode.json
+"""
+import argparse
+import json
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from encoding_profiles import ENCODING_PROFILES, build_video_args
+from benchmarks.synthetic import generate_default_clips
+
+PROJECT_ROOT = Path(__file__).resolve().parents[2]
+SAMPLE_CLIPS = [PROJECT_ROOT / "test_video.mp4"]
+
+
+def _children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def probe_dimensions(path: str) -> Optional[Dict]:
+    """Размеры и длительность клипа (None, если файл не читается как видео)"""
+    try:
+        result = subprocess.run([
+            'ffprobe', '-v', 'quiet', '-print_format', 'json',
+            '-show_streams', '-show_format', path
+        ], capture_output=True, text=True)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    data = json.loads(result.stdout)
+    video_stream = next((s for s in data.get('streams', []) if s.get('codec_type') == 'video'), None)
+    if not video_stream:
+        return None
+    return {
+        "width": int(video_stream['width']),
+        "height": int(video_stream['height']),
+        "duration": float(data.get('format', {}).get('duration') or 0)
+    }
+
+
+def measure_quality(encoded_path: str, reference_path: str) -> Dict[str, Optional[float]]:
+    """PSNR и SSIM закодированного клипа относительно исходника за один проход ffmpeg"""
+    result = subprocess.run([
+        'ffmpeg', '-i', encoded_path, '-i', reference_path,
+        '-lavfi', '[0:v]split=2[d1][d2];[1:v]split=2[r1][r2];[d1][r1]psnr;[d2][r2]ssim',
+        '-f', 'null', '-'
+    ], capture_output=True, text=True)
+
+    psnr = re.search(r"PSNR .*?average:([\d.]+|inf)", result.stderr)
+    ssim = re.search(r"SSIM .*?All:([\d.]+)", result.stderr)
+    return {
+        "psnr": float(psnr.group(1)) if psnr else None,
+        "ssim": float(ssim.group(1)) if ssim else None
+    }
+
+
+def run_encode(profile: str, clip: Dict, output_dir: Path) -> Dict:
+    """Кодирование клипа профилем и сбор метрик"""
+    resolution = min(clip["width"], clip["height"])
+    output_path = output_dir / f"{Path(clip['path']).stem}_{profile}.mp4"
+
+    ffmpeg_cmd = [
+        'ffmpeg', '-i', clip["path"],
+        *build_video_args(profile, resolution=resolution),
+        '-c:a', 'aac', '-b:a', '128k',
+        '-y', str(output_path)
+    ]
+
+    cpu_before = _children_cpu_seconds()
+    started = time.perf_counter()
+    result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+    wall_seconds = time.perf_counter() - started
+    cpu_seconds = _children_cpu_seconds() - cpu_before
+
+    if result.returncode != 0:
+        return {"profile": profile, "clip": clip["name"], "error": result.stderr.strip().splitlines()[-1:]}
+
+    frames = re.findall(r"frame=\s*(\d+)", result.stderr)
+    frame_count = int(frames[-1]) if frames else 0
+    output_bytes = output_path.stat().st_size
+
+    return {
+        "profile": profile,
+        "clip": clip["name"],
+        "resolution": f"{clip['width']}x{clip['height']}",
+        "frames": frame_count,
+        "wall_seconds": round(wall_seconds, 3),
+        "encode_fps": round(frame_count / wall_seconds, 1) if wall_seconds else None,
+        "cpu_seconds": round(cpu_seconds, 3),
+        "output_bytes": output_bytes,
+        "bitrate_kbps": round(output_bytes * 8 / 1000 / clip["duration"], 1) if clip.get("duration") else None,
+        # Сколько таких креативов можно закодировать за час одного ядра
+        "creatives_per_core_hour": round(3600 / cpu_seconds, 1) if cpu_seconds else None,
+        **measure_quality(str(output_path), clip["path"])
+    }
+
+
+def summarize(results: List[Dict], min_ssim: float) -> Dict:
+    """Средние показатели по профилям и рекомендация"""
+    summary = {}
+    for profile in {r["profile"] for r in results}:
+        runs = [r for r in results if r["profile"] == profile and "error" not in r]
+        if not runs:
+            continue
+        total_cpu = sum(r["cpu_seconds"] for r in runs)
+        ssims = [r["ssim"] for r in runs if r.get("ssim") is not None]
+        psnrs = [r["psnr"] for r in runs if r.get("psnr") is not None]
+        summary[profile] = {
+            "clips": len(runs),
+            "avg_encode_fps": round(sum(r["encode_fps"] or 0 for r in runs) / len(runs), 1),
+            "total_cpu_seconds": round(total_cpu, 3),
+            "total_output_bytes": sum(r["output_bytes"] for r in runs),
+            "avg_psnr": round(sum(psnrs) / len(psnrs), 2) if psnrs else None,
+            "min_ssim": round(min(ssims), 4) if ssims else None,
+            "creatives_per_core_hour": round(3600 * len(runs) / total_cpu, 1) if total_cpu else None
+        }
+
+    # Лучший профиль - максимум креативов на ядро-час при допустимом качестве
+    acceptable = [
+        (name, stats) for name, stats in summary.items()
+        if stats["min_ssim"] is None or stats["min_ssim"] >= min_ssim
+    ]
+    recommended = max(acceptable, key=lambda item: item[1]["creatives_per_core_hour"] or 0)[0] if acceptable else None
+
+    return {"profiles": summary, "recommended_profile": recommended, "min_ssim": min_ssim}
+
+
+def collect_clips(args) -> List[Dict]:
+    clips = []
+    for path in [Path(p) for p in args.clips] or SAMPLE_CLIPS:
+        info = probe_dimensions(str(path)) if path.exists() else None
+        if not info:
+            print(f"⚠️ Пропускаем {path}: файл не найден или не является видео")
+            continue
+        clips.append({"name": path.stem, "path": str(path), **info})
+
+    if not args.no_synthetic:
+        clips.extend(generate_default_clips(args.duration))
+    return clips
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Бенчмарк профилей кодирования видео")
+    parser.add_argument("--profiles", nargs="+", default=list(ENCODING_PROFILES), choices=list(ENCODING_PROFILES))
+    parser.add_argument("--clips", nargs="*", default=[], help="Свои клипы (по умолчанию test_video.mp4)")
+    parser.add_argument("--no-synthetic", action="store_true", help="Не генерировать lavfi-клипы")
+    parser.add_argument("--duration", type=float, default=10, help="Длительность синтетических клипов, сек")
+    parser.add_argument("--min-ssim", type=float, default=0.95, help="Минимальный SSIM для рекомендации")
+    parser.add_argument("--output", default="encode_benchmark.json", help="Файл для результатов в JSON")
+    args = parser.parse_args(argv)
+
+    clips = collect_clips(args)
+    if not clips:
+        print("❌ Нет клипов для бенчмарка")
+        sys.exit(1)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="encode_bench_") as tmp_dir:
+        for clip in clips:
+            for profile in args.profiles:
+                print(f"🎬 {profile:10s} {clip['name']} ...", end=" ", flush=True)
+                run = run_encode(profile, clip, Path(tmp_dir))
+                results.append(run)
+                if "error" in run:
+                    print(f"❌ {run['error']}")
+                else:
+                    print(f"{run['encode_fps']} fps, {run['cpu_seconds']} CPU-s, "
+                          f"{run['output_bytes'] // 1024} KB, PSNR {run['psnr']}, SSIM {run['ssim']}")
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "clips": clips,
+        "results": results,
+        "summary": summarize(results, args.min_ssim)
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    print("\n📊 Итоги по профилям:")
+    for name, stats in sorted(report["summary"]["profiles"].items(), key=lambda item: -(item[1]["creatives_per_core_hour"] or 0)):
+        print(f"   {name:10s} {stats['creatives_per_core_hour']} креативов/ядро-час, "
+              f"{stats['avg_encode_fps']} fps, PSNR {stats['avg_psnr']}, мин. SSIM {stats['min_ssim']}")
+    print(f"✅ Рекомендуемый профиль: {report['summary']['recommended_profile']}")
+    print(f"💾 Результаты сохранены: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Нагрузочный тест API: пропускная способность в зависимости от числа воркеров
+
+Для каждого значения --workers запускается uvicorn main:app --workers N,
+после прогрева CONCURRENCY клиентов в течение --duration секунд отправляют
+запросы на --path, считаются запросы в секунду, ошибки и перцентили
+задержки. По умолчанию нагружается /metrics: эндпоинт тратит CPU на
+сериализацию и не зависит от Supabase и сети, поэтому показывает масштабирование
+самих воркеров.
+
+Несколько воркеров запускаются только с общим координатором (Redis, --redis-url
+или REDIS_URL): без него квота YouTube, отмены и блокировки у каждого воркера
+свои, и такой замер не описывает рабочую конфигурацию. Перед замером скрипт
+проверяет через /health/dependencies, что воркеры действительно используют
+Redis, а после замера - сколько разных воркеров отвечало на запросы.
+
+Запуск из каталога backend:
+    python -m benchmarks.load_test --redis-url redis://localhost:6379/0
+    python -m benchmarks.load_test --workers 1 2 4 8 --concurrency 64 --duration 20 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(workers: int, port: int, redis_url: str) -> subprocess.Popen:
+    env = {**os.environ, "DRIVE_WATCH_ENABLED": "False", "API_WORKERS": str(workers), "REDIS_URL": redis_url}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def _wait_ready(port: int, process: subprocess.Popen, timeout: float) -> bool:
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        if process.poll() is not None:
+            return False
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            time.sleep(0.1)
+    return False
+
+
+def _coordination(port: int) -> Dict[str, Any]:
+    """Бэкенд координации и id воркера, ответившего на новое соединение"""
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/health/dependencies", headers={"Connection": "close"})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())["coordination"]
+
+
+def _sample_workers(port: int, workers: int) -> Dict[str, Any]:
+    """Какие воркеры отвечают: каждое соединение новое, ядро распределяет их по процессам"""
+    samples = [_coordination(port) for _ in range(max(8, workers * 8))]
+    return {
+        "backends": sorted({sample["backend"] for sample in samples}),
+        "workers_seen": len({sample["worker_id"] for sample in samples})
+    }
+
+
+async def _run_load(url: str, concurrency: int, duration: float, warmup: float) -> Dict[str, Any]:
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        async def worker(deadline: float, record: bool):
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(url)
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if not record:
+                    continue
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+        # Прогрев: соединения установлены, воркеры загрузили модули
+        await asyncio.gather(*(worker(time.perf_counter() + warmup, False) for _ in range(concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(started + duration, True) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(p: float) -> Optional[float]:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "mean": round(statistics.mean(latencies) * 1000, 1) if latencies else None
+        }
+    }
+
+
+def measure(workers: int, path: str, concurrency: int, duration: float, warmup: float, timeout: float,
+            redis_url: str) -> Dict[str, Any]:
+    port = _free_port()
+    process = _start_server(workers, port, redis_url)
+    try:
+        if not _wait_ready(port, process, timeout):
+            return {"error": "сервер не запустился"}
+        before = _sample_workers(port, workers)
+        if workers > 1 and before["backends"] != ["redis"]:
+            # Например, REDIS_URL задан, а пакета redis нет: воркеры работают с состоянием в памяти
+            return {"error": f"воркеры используют координатор {before['backends']}, а не Redis"}
+        result = asyncio.run(_run_load(f"http://127.0.0.1:{port}{path}", concurrency, duration, warmup))
+        return {**result, "coordination": before["backends"][0], "workers_seen": _sample_workers(port, workers)["workers_seen"]}
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Пропускная способность API в зависимости от числа воркеров")
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4], help="Числа воркеров uvicorn")
+    parser.add_argument("--path", default="/metrics", help="Нагружаемый эндпоинт")
+    parser.add_argument("--concurrency", type=int, default=32, help="Одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=15, help="Длительность замера, сек")
+    parser.add_argument("--warmup", type=float, default=3, help="Прогрев перед замером, сек")
+    parser.add_argument("--timeout", type=float, default=60, help="Ожидание готовности сервера, сек")
+    parser.add_argument("--output", default="load_test.json", help="Файл для результатов в JSON")
+    parser.add_argument("--redis-url", default=os.getenv("REDIS_URL", ""), help="Общий координатор воркеров (по умолчанию REDIS_URL)")
+    args = parser.parse_args(argv)
+
+    if any(workers > 1 for workers in args.workers) and not args.redis_url:
+        parser.error("для --workers больше 1 нужен общий координатор: --redis-url или REDIS_URL")
+
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(),
+        "cpu_count": os.cpu_count(),
+        "path": args.path,
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "redis": bool(args.redis_url),
+        "runs": {}
+    }
+    baseline = None
+    for workers in args.workers:
+        print(f"🚀 workers={workers}")
+        result = measure(workers, args.path, args.concurrency, args.duration, args.warmup, args.timeout, args.redis_url)
+        if "error" in result:
+            print(f"   ❌ {result['error']}")
+            report["runs"][str(workers)] = result
+            continue
+        baseline = baseline or result["rps"]
+        result["speedup"] = round(result["rps"] / baseline, 2) if baseline else None
+        report["runs"][str(workers)] = result
+        print(f"   {result['rps']:.1f} req/s (x{result['speedup']}), p50 {result['latency_ms']['p50']} ms, "
+              f"p95 {result['latency_ms']['p95']} ms, ошибок {result['errors']}, "
+              f"ответили воркеров: {result['workers_seen']} ({result['coordination']})")
+
+    output_path = Path(args.output).resolve()
+    output_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"💾 Результаты сохранены: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
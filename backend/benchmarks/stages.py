@@ -0,0 +1,255 @@
+"""
+Микро-бенчмарки стадий медиа-пайплайна из main.py
+
+Каждая стадия (save_uploaded_file, process_video, get_video_orientation,
+create_other_formats, process_thumbnail во всех режимах, выборка кадров
+frame_sampler в обоих режимах, generate_video_title)
+замеряется отдельно на синтетических видео разных разрешений и длительностей.
+Supabase и YouTube заменены заглушками из stubs.py, сеть не нужна.
+
+Результаты пишутся в JSON и сравниваются с сохраненным baseline:
+    python -m benchmarks.stages                      # замер + сравнение с baseline
+    python -m benchmarks.stages --save-baseline      # обновить baseline
+    python -m benchmarks.stages --resolutions 1280x720 --durations 3 --repeat 1
+
+Код возврата 1 означает регрессию относительно baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from starlette.datastructures import Headers, UploadFile
+
+from benchmarks.synthetic import generate_clip
+from stubs import StubDatabaseManager, StubIntegrationManager
+
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+TITLE_ITERATIONS = 10000
+
+
+def _parse_resolution(value: str) -> tuple:
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def _summary(durations: List[float]) -> Dict[str, Any]:
+    return {
+        "median_s": round(statistics.median(durations), 6),
+        "min_s": round(min(durations), 6),
+        "max_s": round(max(durations), 6),
+        "runs": len(durations)
+    }
+
+
+async def _time(func: Callable[[], Awaitable[Any]], repeat: int) -> Dict[str, Any]:
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        durations.append(time.perf_counter() - started)
+    return _summary(durations)
+
+
+def _create_modal_image(path: Path) -> Path:
+    """Полупрозрачная модалка для режима soft_modal"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGBA", (1080, 1920), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((140, 700, 940, 1220), radius=40, fill=(255, 255, 255, 230))
+    image.save(path)
+    return path
+
+
+async def run_benchmarks(clips: List[Dict[str, Any]], repeat: int) -> Dict[str, Dict[str, Any]]:
+    """Замер всех стадий по всем клипам"""
+    import main
+    from frame_sampler import frame_sampler, SAMPLE_MODES
+
+    # Внешние сервисы - заглушки
+    main.db_manager = StubDatabaseManager()
+    main.integration_manager = StubIntegrationManager()
+
+    modal_path = _create_modal_image(Path("modal.png").resolve())
+    modal = await main.db_manager.create_modal_image("modal.png", str(modal_path), modal_path.stat().st_size)
+
+    results: Dict[str, Dict[str, Any]] = {}
+
+    for clip in clips:
+        key = clip["name"]
+        print(f"🎬 {key}")
+
+        async def save():
+            with open(clip["path"], "rb") as f:
+                upload = UploadFile(f, filename=Path(clip["path"]).name, headers=Headers({"content-type": "video/mp4"}))
+                await main.save_uploaded_file(upload)
+
+        results[f"save_uploaded_file[{key}]"] = await _time(save, repeat)
+
+        processed = {}
+
+        async def process():
+            processed["path"], _ = await main.process_video(clip["path"], str(uuid.uuid4()), mode="uniquify")
+
+        results[f"process_video[{key}]"] = await _time(process, repeat)
+
+        async def process_metadata():
+            await main.process_video(clip["path"], str(uuid.uuid4()), mode="metadata")
+
+        results[f"process_video_metadata[{key}]"] = await _time(process_metadata, repeat)
+
+        orientation = {}
+
+        async def orient():
+            orientation["value"] = await main.get_video_orientation(processed["path"])
+
+        results[f"get_video_orientation[{key}]"] = await _time(orient, repeat)
+
+        async def formats():
+            await main.create_other_formats(processed["path"], str(uuid.uuid4()), orientation["value"])
+
+        results[f"create_other_formats[{key}]"] = await _time(formats, repeat)
+
+        for mode in ("none", "first_frame", "soft_modal"):
+            async def thumbnail(mode=mode):
+                await main.process_thumbnail(processed["path"], mode, modal["id"])
+
+            results[f"process_thumbnail:{mode}[{key}]"] = await _time(thumbnail, repeat)
+
+        for mode in SAMPLE_MODES:
+            async def sample(mode=mode):
+                # Без кэша - меряем извлечение кадров, а не попадание в LRU
+                frame_sampler.clear_cache()
+                await frame_sampler.sample(clip["path"], mode=mode)
+
+            results[f"sample_frames:{mode}[{key}]"] = await _time(sample, repeat)
+
+    # generate_video_title не зависит от клипа - меряем среднее на один вызов
+    async def titles():
+        for i in range(TITLE_ITERATIONS):
+            main.generate_video_title("Benchmark Campaign", "vertical", i)
+
+    title_stats = await _time(titles, repeat)
+    results["generate_video_title"] = {
+        **{k: round(v / TITLE_ITERATIONS, 9) for k, v in title_stats.items() if k.endswith("_s")},
+        "runs": title_stats["runs"],
+        "iterations": TITLE_ITERATIONS
+    }
+
+    return results
+
+
+def compare_with_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float, min_delta: float) -> List[Dict]:
+    """Стадии, медиана которых выросла больше порога относительно baseline"""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        delta = stats["median_s"] - base["median_s"]
+        if delta > min_delta and stats["median_s"] > base["median_s"] * (1 + threshold):
+            regressions.append({
+                "stage": name,
+                "baseline_median_s": base["median_s"],
+                "median_s": stats["median_s"],
+                "change_pct": round(delta / base["median_s"] * 100, 1) if base["median_s"] else None
+            })
+    return regressions
+
+
+def _environment() -> Dict[str, Any]:
+    from config import ENCODING_PROFILE
+
+    try:
+        ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+        "encoding_profile": ENCODING_PROFILE
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Микро-бенчмарки стадий медиа-пайплайна")
+    parser.add_argument("--resolutions", nargs="+", default=["1280x720", "720x1280", "1920x1080"])
+    parser.add_argument("--durations", nargs="+", type=float, default=[3, 10], help="Длительности клипов, сек")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на стадию")
+    parser.add_argument("--output", default="stage_benchmark.json", help="Файл для результатов в JSON")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Файл baseline для сравнения")
+    parser.add_argument("--save-baseline", action="store_true", help="Сохранить результаты как новый baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Допустимый рост медианы (0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="Игнорировать рост меньше N секунд")
+    args = parser.parse_args(argv)
+
+    backend_dir = Path(__file__).resolve().parents[1]
+    output_path = Path(args.output).resolve()
+    baseline_path = Path(args.baseline).resolve()
+
+    with tempfile.TemporaryDirectory(prefix="stage_bench_") as work_dir:
+        clips = []
+        for resolution in args.resolutions:
+            width, height = _parse_resolution(resolution)
+            for duration in args.durations:
+                clips.append({
+                    "name": f"{width}x{height}_{duration:g}s",
+                    "path": str(generate_clip(width, height, duration))
+                })
+
+        # main.py пишет артефакты относительно текущего каталога (UPLOAD_DIR)
+        sys.path.insert(0, str(backend_dir))
+        os.chdir(work_dir)
+        results = asyncio.run(run_benchmarks(clips, args.repeat))
+        os.chdir(backend_dir)
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "environment": _environment(),
+        "results": results
+    }
+    output_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"💾 Результаты сохранены: {output_path}")
+
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        print(f"📌 Baseline обновлен: {baseline_path}")
+        return
+
+    if not baseline_path.exists():
+        print("⚠️ Baseline не найден - запустите с --save-baseline")
+        return
+
+    baseline = json.loads(baseline_path.read_text())
+    regressions = compare_with_baseline(results, baseline.get("results", {}), args.threshold, args.min_delta)
+
+    print(f"\n📊 Сравнение с baseline от {baseline.get('created_at')}:")
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        base_text = f"{base['median_s']:.4f}s" if base else "—"
+        print(f"   {name:55s} {stats['median_s']:.4f}s  (baseline {base_text})")
+
+    if regressions:
+        print(f"\n❌ Регрессии ({len(regressions)}):")
+        for r in regressions:
+            print(f"   {r['stage']}: {r['baseline_median_s']:.4f}s → {r['median_s']:.4f}s (+{r['change_pct']}%)")
+        sys.exit(1)
+
+    print("\n✅ Регрессий нет")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Холодный старт API: время импорта main.py и время до первого ответа
+
+Для каждого режима STARTUP_MODE (fast, eager) несколько раз запускается
+uvicorn в отдельном процессе и измеряется время от запуска процесса до
+первого успешного ответа GET /. Отдельно меряется чистый импорт main и
+самые тяжелые модули по данным python -X importtime.
+
+Запуск из каталога backend:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --modes fast --repeat 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _env(mode: str) -> Dict[str, str]:
+    return {**os.environ, "STARTUP_MODE": mode, "DRIVE_WATCH_ENABLED": "False"}
+
+
+def measure_import(mode: str, repeat: int) -> Dict[str, Any]:
+    """Медиана времени import main в свежем интерпретаторе"""
+    durations = []
+    for _ in range(repeat):
+        result = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=_env(mode),
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr[-500:])
+        durations.append(float(result.stdout.strip().splitlines()[-1]))
+    return {"median_s": round(statistics.median(durations), 3), "min_s": round(min(durations), 3), "runs": repeat}
+
+
+def heaviest_imports(limit: int = 10) -> List[Dict[str, Any]]:
+    """Модули верхнего уровня с наибольшим накопленным временем импорта"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                            env=_env("fast"), capture_output=True, text=True)
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue
+        # Отступ в имени - глубина вложенности; нужны прямые импорты main
+        if name.startswith("   ") and not name.startswith("    "):
+            modules.append({"module": name.strip(), "cumulative_s": round(cumulative_us / 1_000_000, 3)})
+    return sorted(modules, key=lambda m: m["cumulative_s"], reverse=True)[:limit]
+
+
+def measure_first_request(mode: str, timeout: float) -> Optional[float]:
+    """Секунды от запуска uvicorn до первого ответа 200 на GET /"""
+    port = _free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=_env(mode), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                return None
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        return None
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Время импорта и время до первого запроса API")
+    parser.add_argument("--modes", nargs="+", default=["fast", "eager"], help="Режимы STARTUP_MODE")
+    parser.add_argument("--repeat", type=int, default=3, help="Повторов на режим")
+    parser.add_argument("--timeout", type=float, default=60, help="Ожидание первого ответа, сек")
+    parser.add_argument("--output", default="startup_benchmark.json", help="Файл для результатов в JSON")
+    args = parser.parse_args(argv)
+
+    report: Dict[str, Any] = {"created_at": datetime.now().isoformat(), "python": sys.version.split()[0], "modes": {}}
+
+    for mode in args.modes:
+        print(f"🚀 STARTUP_MODE={mode}")
+        first_request = [measure_first_request(mode, args.timeout) for _ in range(args.repeat)]
+        successful = [t for t in first_request if t is not None]
+        report["modes"][mode] = {
+            "import_main": measure_import(mode, args.repeat),
+            "time_to_first_request": {
+                "median_s": round(statistics.median(successful), 3) if successful else None,
+                "min_s": round(min(successful), 3) if successful else None,
+                "failed": len(first_request) - len(successful),
+                "runs": args.repeat
+            }
+        }
+        stats = report["modes"][mode]
+        print(f"   import main:           {stats['import_main']['median_s']:.3f}s")
+        ttfr = stats["time_to_first_request"]["median_s"]
+        print(f"   time to first request: {f'{ttfr:.3f}s' if ttfr is not None else '—'}")
+
+    report["heaviest_imports"] = heaviest_imports()
+    print("\n📦 Самые тяжелые импорты main:")
+    for module in report["heaviest_imports"]:
+        print(f"   {module['module']:30s} {module['cumulative_s']:.3f}s")
+
+    output_path = Path(args.output).resolve()
+    output_path.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    print(f"💾 Результаты сохранены: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
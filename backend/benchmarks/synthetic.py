@@ -0,0 +1,50 @@
+"""
+Синтетические тестовые видео (ffmpeg lavfi) для бенчмарков
+"""
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_CLIPS_DIR = Path(__file__).parent / "clips"
+
+# Набор по умолчанию: основные форматы креативов
+SYNTHETIC_CLIPS: List[Dict] = [
+    {"name": "lavfi_720x1280_vertical", "width": 720, "height": 1280},
+    {"name": "lavfi_1280x720_horizontal", "width": 1280, "height": 720},
+    {"name": "lavfi_720x720_square", "width": 720, "height": 720},
+    {"name": "lavfi_1920x1080_horizontal", "width": 1920, "height": 1080},
+]
+
+
+def generate_clip(width: int, height: int, duration: float, output_dir: Optional[Path] = None, fps: int = 30) -> Path:
+    """Генерация (или переиспользование) клипа testsrc2 + синус заданного размера и длительности"""
+    output_dir = Path(output_dir or DEFAULT_CLIPS_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_path = output_dir / f"lavfi_{width}x{height}_{duration:g}s_{fps}fps.mp4"
+    if output_path.exists():
+        return output_path
+
+    ffmpeg_cmd = [
+        'ffmpeg', '-v', 'error',
+        '-f', 'lavfi', '-i', f'testsrc2=size={width}x{height}:rate={fps}:duration={duration}',
+        '-f', 'lavfi', '-i', f'sine=frequency=440:sample_rate=44100:duration={duration}',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '16', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-shortest',
+        '-y', str(output_path)
+    ]
+    subprocess.run(ffmpeg_cmd, check=True, capture_output=True)
+    return output_path
+
+
+def generate_default_clips(duration: float, output_dir: Optional[Path] = None) -> List[Dict]:
+    """Генерация набора клипов SYNTHETIC_CLIPS"""
+    return [
+        {
+            "name": clip["name"],
+            "path": str(generate_clip(clip["width"], clip["height"], duration, output_dir)),
+            "width": clip["width"],
+            "height": clip["height"],
+            "duration": duration
+        }
+        for clip in SYNTHETIC_CLIPS
+    ]
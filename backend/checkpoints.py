@@ -0,0 +1,158 @@
+"""
+Чекпоинты заданий пакетной загрузки
+
+Для каждого видео пакета в таблице batch_items хранятся параметры задания,
+последняя завершенная стадия и ее результаты: пути исходника, обработанного
+видео, форматов и миниатюр, ссылки на уже загруженные на YouTube форматы.
+Повтор пакета запускает только неуспешные и прерванные видео и продолжает
+каждое с самой поздней стадии, для которой на диске есть все нужные файлы:
+готовое видео не транскодируется заново, а загруженный формат не
+загружается на YouTube второй раз. Запись чекпоинта - вспомогательная: сбой
+БД не останавливает загрузку, а только лишает ее возможности продолжения.
+"""
+import asyncio
+import logging
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Стадии с чекпоинтом (admission резервирует квоту заново при каждом запуске)
+STAGES = ("ingest", "transcode", "thumbnail", "upload", "persist")
+# Параметры, из которых задание создается заново
+PARAM_FIELDS = (
+    "campaign_name", "thumbnail_option", "modal_image_id", "create_formats", "copy_number",
+    "log_action", "log_extra", "video_source", "drive_url", "upload_ref", "original_filename", "processing"
+)
+# Результаты стадий
+CHECKPOINT_FIELDS = ("source_path", "processed_path", "processing_path", "original_filename", "variants", "uploaded", "results")
+
+
+class CheckpointError(Exception):
+    """Задание нельзя продолжить: нет ни результатов стадий, ни исходника"""
+
+
+def _exists(path: Optional[str]) -> bool:
+    return bool(path) and Path(path).exists()
+
+
+def resume_stage(row: Dict[str, Any]) -> int:
+    """Индекс стадии в STAGES, с которой продолжается задание (стадии до нее пропускаются)
+
+    Продолжить со стадии можно, если все ее входные файлы на месте; если нет -
+    проверяется предыдущая стадия, вплоть до повторного скачивания исходника.
+    """
+    checkpoint = row.get("checkpoint") or {}
+    last_stage = row.get("last_stage")
+    done = STAGES.index(last_stage) + 1 if last_stage in STAGES else 0
+    uploaded = checkpoint.get("uploaded") or {}
+    variants = checkpoint.get("variants") or []
+    pending = [v for v in variants if v["orientation"] not in uploaded]
+
+    def variant_files() -> bool:
+        return bool(variants) and all(_exists(v.get("path") or v.get("stream_source")) for v in pending)
+
+    feasible = {
+        "persist": lambda: bool(variants) and not pending,
+        "upload": lambda: variant_files() and all(not v.get("thumbnail_path") or _exists(v["thumbnail_path"]) for v in pending),
+        "thumbnail": variant_files,
+        # Пропавшее обработанное видео транскодируется заново из исходника
+        "transcode": lambda: _exists(checkpoint.get("processed_path")) or _exists(checkpoint.get("source_path")),
+        # Файл из запроса не сохранен - заново можно скачать из Drive или взять возобновляемую загрузку
+        "ingest": lambda: row["params"].get("video_source") != "local" or bool(row["params"].get("upload_ref")),
+    }
+    if done == len(STAGES):
+        return done
+    for index in range(done, -1, -1):
+        if feasible[STAGES[index]]():
+            return index
+    raise CheckpointError("Исходный файл больше не хранится на сервере, загрузите видео заново")
+
+
+class BatchCheckpoints:
+    """Запись и чтение чекпоинтов заданий пакета (таблица batch_items)"""
+
+    def __init__(self, db=None):
+        self._db = db
+
+    @property
+    def db(self):
+        if self._db is None:
+            from database import db_manager
+            self._db = db_manager
+        return self._db
+
+    @staticmethod
+    def snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {field: job.get(field) for field in CHECKPOINT_FIELDS}
+
+    async def start(self, batch_id: str, jobs: List[Dict[str, Any]]) -> bool:
+        """Строки пакета до запуска конвейера; False - чекпоинты для пакета недоступны"""
+        rows = [
+            {
+                "batch_id": batch_id,
+                "item_index": job["checkpoint"]["index"],
+                "job_id": job["upload_id"],
+                "campaign_name": job["campaign_name"],
+                "status": "queued",
+                "last_stage": None,
+                "params": {field: job.get(field) for field in PARAM_FIELDS},
+                "checkpoint": self.snapshot(job),
+                "error": None,
+                "failed_stage": None,
+                "attempts": job["checkpoint"]["attempt"]
+            }
+            for job in jobs
+        ]
+        try:
+            await self.db.save_batch_items(rows)
+            return True
+        except Exception as e:
+            logger.warning(f"Batch {batch_id} checkpoints unavailable, items will not be resumable: {e}")
+            return False
+
+    async def record(self, job: Dict[str, Any], stage: Optional[str] = None):
+        """Результаты задания после стадии stage (или промежуточные - без смены стадии)"""
+        target = job.get("checkpoint")
+        if not target:
+            return
+        data = {"status": "running", "checkpoint": self.snapshot(job)}
+        if stage is not None:
+            data["last_stage"] = stage
+        try:
+            await self.db.update_batch_item(target["batch_id"], target["index"], data)
+        except Exception as e:
+            logger.warning(f"Checkpoint write failed for job {job['upload_id']}: {e}")
+
+    async def finish(self, items: Iterable[Any]):
+        """Итог заданий пакета после конвейера (элементы PipelineItem)"""
+        from scheduler import JobCancelledError
+
+        async def save(item):
+            target = item.data["checkpoint"]
+            if item.success:
+                status = "done"
+            else:
+                status = "cancelled" if isinstance(item.error, JobCancelledError) else "failed"
+            try:
+                await self.db.update_batch_item(target["batch_id"], target["index"], {
+                    "status": status,
+                    "error": None if item.success else str(item.error),
+                    "failed_stage": item.failed_stage,
+                    "attempts": target["attempt"]
+                })
+            except Exception as e:
+                logger.warning(f"Checkpoint status write failed for job {item.data['upload_id']}: {e}")
+
+        await asyncio.gather(*(save(item) for item in items if item.data.get("checkpoint")))
+
+    async def mark_failed(self, row: Dict[str, Any], error: str):
+        """Задание, которое нельзя продолжить"""
+        try:
+            await self.db.update_batch_item(row["batch_id"], row["item_index"], {"status": "failed", "error": error})
+        except Exception as e:
+            logger.warning(f"Checkpoint status write failed for job {row['job_id']}: {e}")
+
+
+# Глобальные чекпоинты пакетов
+batch_checkpoints = BatchCheckpoints()
@@ -29,3 +29,173 @@ UPLOAD_DIR = "uploads"
 MAX_FILE_SIZE = 100 * 1024 * 1024  # 100MB
 ALLOWED_VIDEO_TYPES = ["video/mp4", "video/avi", "video/mov", "video/mkv", "video/webm"]
 ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+
+# Хранилище файлов: local (UPLOAD_DIR на диске узла) или s3 (S3-совместимый бакет, UPLOAD_DIR - локальный кэш)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_CHUNK_SIZE = int(os.getenv("STORAGE_CHUNK_SIZE", str(1024 * 1024)))  # блок потокового чтения и записи
+STORAGE_CACHE_MAX_MB = int(os.getenv("STORAGE_CACHE_MAX_MB", "512"))  # кэш модалок и превью (видео - квоты артефактов)
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL", "")  # MinIO: http://minio:9000
+S3_REGION = os.getenv("S3_REGION", "")
+S3_ACCESS_KEY_ID = os.getenv("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.getenv("S3_SECRET_ACCESS_KEY", "")
+S3_PART_SIZE = int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024)))  # часть multipart upload и диапазонного GET (от 5 МБ)
+S3_MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "4"))  # частей одного файла в полете
+
+# Возобновляемая загрузка исходников (tus): максимальный размер файла и сколько часов живет незавершенная/неиспользованная загрузка
+RESUMABLE_UPLOAD_MAX_SIZE = int(os.getenv("RESUMABLE_UPLOAD_MAX_SIZE_MB", "5120")) * 1024 * 1024
+RESUMABLE_UPLOAD_TTL_HOURS = float(os.getenv("RESUMABLE_UPLOAD_TTL_HOURS", "24"))
+
+# Изменения реестра: LISTEN на канал триггеров uploads/templates (прямое соединение DATABASE_URL, не пулер транзакций)
+REGISTRY_EVENTS_ENABLED = os.getenv("REGISTRY_EVENTS_ENABLED", "True").lower() == "true"
+REGISTRY_EVENTS_QUEUE_SIZE = int(os.getenv("REGISTRY_EVENTS_QUEUE_SIZE", "100"))  # событий в очереди клиента до resync
+
+# Массовый импорт шаблонов (COPY по DATABASE_URL): строк в пачке (одна транзакция) и ошибок в ответе
+TEMPLATE_IMPORT_BATCH_SIZE = int(os.getenv("TEMPLATE_IMPORT_BATCH_SIZE", "5000"))
+TEMPLATE_IMPORT_MAX_ERRORS = int(os.getenv("TEMPLATE_IMPORT_MAX_ERRORS", "1000"))
+
+# Наблюдение за папками Google Drive
+DRIVE_WATCH_ENABLED = os.getenv("DRIVE_WATCH_ENABLED", "True").lower() == "true"
+DRIVE_WATCH_INTERVAL = int(os.getenv("DRIVE_WATCH_INTERVAL", "300"))  # секунды между опросами
+DRIVE_WATCH_QUEUE_SIZE = int(os.getenv("DRIVE_WATCH_QUEUE_SIZE", "100"))
+# Повтор файла после временной ошибки (сервис недоступен, квота, сбой обработки): попыток и предел паузы,
+# пауза растет от интервала опроса вдвое с каждой попыткой
+DRIVE_WATCH_MAX_ATTEMPTS = int(os.getenv("DRIVE_WATCH_MAX_ATTEMPTS", "6"))
+DRIVE_WATCH_RETRY_MAX_DELAY = int(os.getenv("DRIVE_WATCH_RETRY_MAX_DELAY", "3600"))  # секунды
+
+# Конвейер пакетной загрузки: лимит параллелизма каждой стадии и размер очередей между ними
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "2"))
+PIPELINE_STAGE_CONCURRENCY = {
+    "ingest": int(os.getenv("PIPELINE_INGEST_CONCURRENCY", "2")),
+    "transcode": int(os.getenv("PIPELINE_TRANSCODE_CONCURRENCY", str(max(1, (os.cpu_count() or 2) // 2)))),
+    "thumbnail": int(os.getenv("PIPELINE_THUMBNAIL_CONCURRENCY", "2")),
+    "upload": int(os.getenv("PIPELINE_UPLOAD_CONCURRENCY", "3")),
+    "persist": int(os.getenv("PIPELINE_PERSIST_CONCURRENCY", "4")),
+}
+
+# Профиль кодирования видео (legacy, fast, balanced, quality - см. encoding_profiles.py)
+ENCODING_PROFILE = os.getenv("ENCODING_PROFILE", "legacy")
+
+# Обработка исходника по умолчанию: uniquify - перекодирование с вариацией FPS и битрейта,
+# metadata - только очистка метаданных (перепаковка без кодирования, если кодеки исходника подходят)
+PROCESSING_MODES = ("uniquify", "metadata")
+PROCESSING_MODE = os.getenv("PROCESSING_MODE", "uniquify")
+
+# Прогресс загрузок (SSE): минимальный интервал между событиями и время хранения пакета
+PROGRESS_MIN_INTERVAL = float(os.getenv("PROGRESS_MIN_INTERVAL", "0.5"))
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", "600"))
+
+# Размер части при возобновляемой загрузке на YouTube (кратен 256 КБ)
+YOUTUBE_UPLOAD_CHUNK_SIZE = int(os.getenv("YOUTUBE_UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+
+# Жизненный цикл артефактов на диске: квоты каталогов uploads/* (МБ), TTL и период очистки
+ARTIFACT_QUOTAS = {
+    kind: int(os.getenv(f"ARTIFACT_QUOTA_{kind.upper()}_MB", str(default_mb))) * 1024 * 1024
+    for kind, default_mb in {
+        "videos": 5120,
+        "downloaded": 5120,
+        "processed": 5120,
+        "formats": 5120,
+        "thumbnails": 512,
+        "incoming": 10240,  # недокачанные возобновляемые загрузки
+    }.items()
+}
+ARTIFACT_TTL_HOURS = float(os.getenv("ARTIFACT_TTL_HOURS", "72"))
+ARTIFACT_CLEANUP_INTERVAL = int(os.getenv("ARTIFACT_CLEANUP_INTERVAL", "600"))  # секунды
+ARTIFACT_DELETE_AFTER_UPLOAD = os.getenv("ARTIFACT_DELETE_AFTER_UPLOAD", "True").lower() == "true"
+
+# Токен для /admin/* (заголовок X-Admin-Token); пустой - эндпоинты открыты, как остальное API
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+# Логи: секции по месяцам, сколько месяцев хранить (0 - без удаления), отсоединять ли старые секции
+# в архивные таблицы вместо удаления, на сколько месяцев вперед создавать секции и период задачи хранения
+LOG_RETENTION_MONTHS = int(os.getenv("LOG_RETENTION_MONTHS", "6"))
+LOG_ARCHIVE = os.getenv("LOG_ARCHIVE", "False").lower() == "true"
+LOG_PARTITIONS_AHEAD = int(os.getenv("LOG_PARTITIONS_AHEAD", "2"))
+LOG_RETENTION_INTERVAL = int(os.getenv("LOG_RETENTION_INTERVAL", "86400"))  # секунды
+LOGS_PAGE_MAX = int(os.getenv("LOGS_PAGE_MAX", "500"))  # максимальный limit в GET /logs
+
+# Потоковая загрузка форматов: ffmpeg пишет в пайп, YouTube читает из буфера в памяти (без файла на диске)
+STREAMING_UPLOAD_ENABLED = os.getenv("STREAMING_UPLOAD_ENABLED", "False").lower() == "true"
+STREAMING_BUFFER_CHUNKS = int(os.getenv("STREAMING_BUFFER_CHUNKS", "3"))  # размер буфера в частях загрузки
+
+# Превью модалок для галереи: максимальная сторона (px) для каждого размера и качество WebP
+MODAL_PREVIEW_SIZES = {
+    "thumb": int(os.getenv("MODAL_PREVIEW_THUMB_SIZE", "320")),
+    "medium": int(os.getenv("MODAL_PREVIEW_MEDIUM_SIZE", "960")),
+}
+MODAL_PREVIEW_QUALITY = int(os.getenv("MODAL_PREVIEW_QUALITY", "80"))
+MODAL_ETAG_CACHE_SIZE = int(os.getenv("MODAL_ETAG_CACHE_SIZE", "1024"))  # файлов в LRU-кэше ETag
+
+# Выборка кадров для AI-анализа креативов: число кадров, режим (keyframes | scene), размер и качество JPEG
+FRAME_SAMPLE_COUNT = int(os.getenv("FRAME_SAMPLE_COUNT", "4"))
+FRAME_SAMPLE_MODE = os.getenv("FRAME_SAMPLE_MODE", "keyframes")
+FRAME_SAMPLE_MAX_SIDE = int(os.getenv("FRAME_SAMPLE_MAX_SIDE", "512"))
+FRAME_SAMPLE_JPEG_QUALITY = int(os.getenv("FRAME_SAMPLE_JPEG_QUALITY", "5"))  # -q:v ffmpeg: 2 (лучше) .. 31
+FRAME_SCENE_THRESHOLD = float(os.getenv("FRAME_SCENE_THRESHOLD", "0.3"))
+FRAME_SAMPLER_WORKERS = int(os.getenv("FRAME_SAMPLER_WORKERS", "4"))
+FRAME_CACHE_SIZE = int(os.getenv("FRAME_CACHE_SIZE", "256"))  # записей (видео x параметры) в LRU-кэше
+
+# Режим старта: fast - клиенты интеграций импортируются при первом использовании, БД прогревается
+# в фоне после начала обслуживания; eager - все загружается и проверяется до первого запроса
+STARTUP_MODE = os.getenv("STARTUP_MODE", "fast")
+
+# Квота YouTube Data API: дневной лимит (сбрасывается в полночь по тихоокеанскому времени) и стоимость вызовов
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+YOUTUBE_QUOTA_COSTS = {
+    "videos.insert": int(os.getenv("YOUTUBE_QUOTA_COST_VIDEOS_INSERT", "1600")),
+    "thumbnails.set": int(os.getenv("YOUTUBE_QUOTA_COST_THUMBNAILS_SET", "50")),
+    "channels.list": int(os.getenv("YOUTUBE_QUOTA_COST_CHANNELS_LIST", "1")),
+}
+YOUTUBE_QUOTA_TIMEZONE = os.getenv("YOUTUBE_QUOTA_TIMEZONE", "America/Los_Angeles")
+# Сколько секунд задание ждет квоту перед транскодированием (0 - сразу ошибка, -1 - до сброса квоты)
+YOUTUBE_QUOTA_MAX_WAIT = float(os.getenv("YOUTUBE_QUOTA_MAX_WAIT", "0"))
+
+# Внешние вызовы: таймаут на запрос по сервисам (сек), повторы временных ошибок и автоматический выключатель
+EXTERNAL_TIMEOUTS = {
+    "supabase": float(os.getenv("EXTERNAL_TIMEOUT_SUPABASE", "15")),
+    "youtube": float(os.getenv("EXTERNAL_TIMEOUT_YOUTUBE", "60")),
+    "drive": float(os.getenv("EXTERNAL_TIMEOUT_DRIVE", "60")),
+    "telegram": float(os.getenv("EXTERNAL_TIMEOUT_TELEGRAM", "15")),
+    "s3": float(os.getenv("EXTERNAL_TIMEOUT_S3", "120")),  # на запрос, т.е. на одну часть multipart
+}
+EXTERNAL_RETRY_ATTEMPTS = int(os.getenv("EXTERNAL_RETRY_ATTEMPTS", "4"))  # всего попыток, включая первую
+EXTERNAL_RETRY_BASE_DELAY = float(os.getenv("EXTERNAL_RETRY_BASE_DELAY", "0.5"))
+EXTERNAL_RETRY_MAX_DELAY = float(os.getenv("EXTERNAL_RETRY_MAX_DELAY", "30"))  # Retry-After больше этого - без повтора
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # временных ошибок подряд до размыкания
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))  # пауза до пробного вызова
+
+# Несколько воркеров и узлов: общий кэш и блокировки в Redis (без REDIS_URL - в памяти процесса, один воркер)
+REDIS_URL = os.getenv("REDIS_URL", "")
+COORDINATION_PREFIX = os.getenv("COORDINATION_PREFIX", "uac:")
+API_WORKERS = int(os.getenv("API_WORKERS", os.getenv("WEB_CONCURRENCY", "1")))  # воркеров uvicorn при запуске python main.py
+OAUTH_CACHE_TTL = float(os.getenv("OAUTH_CACHE_TTL", "60"))  # секунды кэширования OAuth-данных в общем кэше
+
+# Планировщик тяжелых стадий: общие для всех пакетов слоты транскодирования и загрузки на YouTube,
+# классы приоритета single > batch > background и веса кампаний при справедливом разделении слотов
+SCHEDULER_SLOTS = {
+    "transcode": int(os.getenv("SCHEDULER_TRANSCODE_SLOTS", str(PIPELINE_STAGE_CONCURRENCY["transcode"]))),
+    "upload": int(os.getenv("SCHEDULER_UPLOAD_SLOTS", str(PIPELINE_STAGE_CONCURRENCY["upload"]))),
+}
+SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "300"))  # ожидание, поднимающее задание на класс выше
+# Веса кампаний: "Кампания A=3,Кампания B=1" (по умолчанию 1)
+SCHEDULER_TENANT_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, _, weight in (pair.rpartition("=") for pair in os.getenv("SCHEDULER_TENANT_WEIGHTS", "").split(","))
+    if name.strip()
+}
+
+# Профилирование запроса по требованию (заголовок X-Profile: 1 или ?profile=1 с X-Admin-Token)
+# Профилирование по запросу (X-Profile): работает только вместе с заданным ADMIN_TOKEN
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "False").lower() == "true"
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))  # дольше запрос не семплируется
+PROFILE_TTL_HOURS = float(os.getenv("PROFILE_TTL_HOURS", "24"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))  # профилей этого воркера в списке GET /admin/profiles
+
+# Сторож цикла событий: остановки дольше порога записываются со стеком блокирующего вызова (/debug/loop)
+LOOP_WATCH_ENABLED = os.getenv("LOOP_WATCH_ENABLED", "True").lower() == "true"
+LOOP_WATCH_INTERVAL_MS = float(os.getenv("LOOP_WATCH_INTERVAL_MS", "100"))  # период пульса цикла
+LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "250"))
+LOOP_STALL_MAX_SITES = int(os.getenv("LOOP_STALL_MAX_SITES", "200"))
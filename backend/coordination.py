@@ -0,0 +1,280 @@
+"""
+Общее состояние и блокировки для нескольких воркеров и узлов API
+
+При REDIS_URL кэш, распределенные блокировки и реестры воркеров хранятся в
+Redis и видны всем процессам uvicorn --workers N и всем контейнерам. Без
+Redis используется хранилище в памяти процесса - это прежний режим одного
+воркера: блокировки работают только внутри процесса.
+
+Блокировка - ключ с токеном владельца и TTL (SET NX PX): упавший воркер не
+держит ее вечно, а пока секция выполняется, TTL продлевается в фоне.
+Снимается блокировка только владельцем (сравнение токена в Lua-скрипте).
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import weakref
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+
+from config import REDIS_URL, COORDINATION_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Идентификатор процесса: узел и PID воркера
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_RELEASE_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("del", KEYS[1]) else return 0 end
+"""
+_EXTEND_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then return redis.call("pexpire", KEYS[1], ARGV[2]) else return 0 end
+"""
+
+
+class LockNotAcquired(Exception):
+    """Блокировку держит другой воркер дольше допустимого ожидания"""
+
+
+class _LocalBackend:
+    """Хранилище в памяти процесса (один воркер)"""
+
+    name = "local"
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}
+        # Прогрев БД идет в отдельном потоке со своим циклом событий
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str) -> Optional[tuple]:
+        entry = self._data.get(key)
+        if entry and entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        return entry
+
+    @staticmethod
+    def _expires(ttl: Optional[float]) -> Optional[float]:
+        return time.monotonic() + ttl if ttl else None
+
+    async def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._alive(key)
+            return entry[0] if entry else None
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        with self._lock:
+            if nx and self._alive(key):
+                return False
+            self._data[key] = (value, self._expires(ttl))
+            return True
+
+    async def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        with self._lock:
+            entry = self._alive(key)
+            if entry and entry[0] == value:
+                del self._data[key]
+                return True
+            return False
+
+    async def expire_if(self, key: str, value: str, ttl: float) -> bool:
+        with self._lock:
+            entry = self._alive(key)
+            if entry and entry[0] == value:
+                self._data[key] = (value, self._expires(ttl))
+                return True
+            return False
+
+    async def incrby(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        with self._lock:
+            entry = self._alive(key)
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (str(value), self._expires(ttl) if ttl else (entry[1] if entry else None))
+            return value
+
+    async def hset(self, key: str, field: str, value: str):
+        with self._lock:
+            entry = self._alive(key)
+            fields = dict(entry[0]) if entry else {}
+            fields[field] = value
+            self._data[key] = (fields, None)
+
+    async def hdel(self, key: str, field: str):
+        with self._lock:
+            entry = self._alive(key)
+            if entry:
+                entry[0].pop(field, None)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        with self._lock:
+            entry = self._alive(key)
+            return dict(entry[0]) if entry else {}
+
+
+class _RedisBackend:
+    """Redis (redis.asyncio); у каждого цикла событий свой клиент"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        self.url = url
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            import redis.asyncio as redis
+            client = redis.from_url(self.url, decode_responses=True)
+            self._clients[loop] = client
+        return client
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        return bool(await self.client.set(key, value, px=int(ttl * 1000) if ttl else None, nx=nx))
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def delete_if(self, key: str, value: str) -> bool:
+        return bool(await self.client.eval(_RELEASE_SCRIPT, 1, key, value))
+
+    async def expire_if(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self.client.eval(_EXTEND_SCRIPT, 1, key, value, int(ttl * 1000)))
+
+    async def incrby(self, key: str, amount: int, ttl: Optional[float] = None) -> int:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.incrby(key, amount)
+            if ttl:
+                pipe.pexpire(key, int(ttl * 1000))
+            value, *_ = await pipe.execute()
+        return int(value)
+
+    async def hset(self, key: str, field: str, value: str):
+        await self.client.hset(key, field, value)
+
+    async def hdel(self, key: str, field: str):
+        await self.client.hdel(key, field)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return await self.client.hgetall(key)
+
+
+class Coordinator:
+    """Общий кэш, блокировки и реестры воркеров"""
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = COORDINATION_PREFIX):
+        self.url = url
+        self.prefix = prefix
+        self._backend = None
+
+    @property
+    def backend(self):
+        """Бэкенд выбирается при первом обращении (redis импортируется только если нужен)"""
+        if self._backend is None:
+            if self.url:
+                try:
+                    import redis.asyncio  # noqa: F401
+                    self._backend = _RedisBackend(self.url)
+                except ImportError:
+                    logger.warning("REDIS_URL задан, но пакет redis не установлен - состояние хранится в памяти процесса")
+                    self._backend = _LocalBackend()
+            else:
+                self._backend = _LocalBackend()
+        return self._backend
+
+    @property
+    def shared(self) -> bool:
+        """Состояние видно другим воркерам и узлам"""
+        return self.backend.name != "local"
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    # ==================== КЭШ ====================
+
+    async def get(self, key: str) -> Any:
+        value = await self.backend.get(self._key(key))
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.backend.set(self._key(key), json.dumps(value, default=str), ttl)
+
+    async def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Запись, только если ключа нет (например, «операция уже выполнялась в этом интервале»)"""
+        return await self.backend.set(self._key(key), json.dumps(value, default=str), ttl, nx=True)
+
+    async def delete(self, key: str):
+        await self.backend.delete(self._key(key))
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """Атомарное изменение общего счетчика; возвращает новое значение (ttl продлевает срок жизни ключа)"""
+        return await self.backend.incrby(self._key(key), amount, ttl)
+
+    # ==================== РЕЕСТРЫ ВОРКЕРОВ ====================
+
+    async def publish_worker_state(self, key: str, value: Any, ttl: float):
+        """Состояние этого воркера в общем реестре; запись устаревает, если воркер перестал ее обновлять"""
+        await self.backend.hset(self._key(key), WORKER_ID, json.dumps({"value": value, "expires": time.time() + ttl}))
+
+    async def remove_worker_state(self, key: str):
+        await self.backend.hdel(self._key(key), WORKER_ID)
+
+    async def workers_state(self, key: str) -> Dict[str, Any]:
+        """Актуальные записи всех воркеров: {worker_id: value}"""
+        now = time.time()
+        states = {}
+        for worker, raw in (await self.backend.hgetall(self._key(key))).items():
+            entry = json.loads(raw)
+            if entry["expires"] > now:
+                states[worker] = entry["value"]
+        return states
+
+    # ==================== БЛОКИРОВКИ ====================
+
+    @asynccontextmanager
+    async def lock(self, name: str, ttl: float = 30, timeout: Optional[float] = None,
+                   poll_interval: float = 0.1) -> AsyncIterator[None]:
+        """Распределенная блокировка; timeout=None - ждать без ограничения, 0 - не ждать"""
+        key = self._key(f"lock:{name}")
+        token = f"{WORKER_ID}:{uuid.uuid4().hex}"
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not await self.backend.set(key, token, ttl, nx=True):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockNotAcquired(f"Блокировка {name} занята")
+            await asyncio.sleep(poll_interval)
+
+        async def _keep_alive():
+            # Продление TTL, пока секция выполняется
+            while True:
+                await asyncio.sleep(ttl / 3)
+                if not await self.backend.expire_if(key, token, ttl):
+                    logger.warning(f"Блокировка {name} потеряна до завершения секции")
+                    return
+
+        keeper = asyncio.create_task(_keep_alive())
+        try:
+            yield
+        finally:
+            keeper.cancel()
+            await asyncio.gather(keeper, return_exceptions=True)
+            await self.backend.delete_if(key, token)
+
+    def status(self) -> Dict[str, Any]:
+        return {"backend": self.backend.name, "worker_id": WORKER_ID}
+
+
+# Глобальный координатор воркеров
+coordinator = Coordinator()
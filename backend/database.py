@@ -1,13 +1,45 @@
-from supabase import create_client, Client
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 import asyncio
+import threading
 from datetime import datetime
 import uuid
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import SUPABASE_URL, SUPABASE_KEY, EXTERNAL_TIMEOUTS, OAUTH_CACHE_TTL
+import resilience
+from coordination import coordinator
 
 class DatabaseManager:
     def __init__(self):
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        self._supabase = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def supabase(self):
+        """Клиент Supabase создается при первом запросе (импорт supabase заметно замедляет старт)"""
+        if self._supabase is None:
+            # Клиент может создаваться из фонового прогрева и из обработчика одновременно
+            with self._client_lock:
+                if self._supabase is None:
+                    from supabase import create_client, ClientOptions
+                    # Таймаут HTTP-клиента совпадает с таймаутом resilience.call, чтобы поток не висел дольше вызова
+                    self._supabase = create_client(SUPABASE_URL, SUPABASE_KEY, options=ClientOptions(
+                        postgrest_client_timeout=EXTERNAL_TIMEOUTS["supabase"]
+                    ))
+        return self._supabase
+    
+    async def _execute(self, table: str, query, idempotent: Optional[bool] = None):
+        """Выполнение запроса к Supabase: таймаут, повторы временных ошибок, выключатель и замер времени
+
+        Чтение, обновление, удаление и upsert повторяются при любой временной ошибке,
+        вставки и вызовы функций (POST) - только если запрос не дошел до сервера.
+        """
+        request = getattr(query, "request", None)
+        if idempotent is None and request is not None:
+            # upsert - тоже POST, но с Prefer: resolution=... и повторяется безопасно
+            idempotent = request.http_method != "POST" or "resolution=" in request.headers.get("prefer", "")
+        if hasattr(query, "retry"):
+            # Повторы postgrest выключены - ими управляет resilience.call
+            query = query.retry(False)
+        return await resilience.call("supabase", table, query.execute, idempotent=bool(idempotent))
     
     # ==================== MODAL IMAGES ====================
     
@@ -22,22 +54,22 @@ class DatabaseManager:
             "created_at": datetime.now().isoformat()
         }
         
-        result = self.supabase.table("modal_images").insert(modal_data).execute()
+        result = await self._execute("modal_images", self.supabase.table("modal_images").insert(modal_data))
         return result.data[0] if result.data else None
     
     async def get_modal_images(self) -> List[Dict[str, Any]]:
         """Получение всех модалок"""
-        result = self.supabase.table("modal_images").select("*").order("created_at", desc=True).execute()
+        result = await self._execute("modal_images", self.supabase.table("modal_images").select("*").order("created_at", desc=True))
         return result.data if result.data else []
     
     async def get_modal_image_by_id(self, modal_id: str) -> Optional[Dict[str, Any]]:
         """Получение модалки по ID"""
-        result = self.supabase.table("modal_images").select("*").eq("id", modal_id).execute()
+        result = await self._execute("modal_images", self.supabase.table("modal_images").select("*").eq("id", modal_id))
         return result.data[0] if result.data else None
     
     async def delete_modal_image(self, modal_id: str) -> bool:
         """Удаление модалки"""
-        result = self.supabase.table("modal_images").delete().eq("id", modal_id).execute()
+        result = await self._execute("modal_images", self.supabase.table("modal_images").delete().eq("id", modal_id))
         return len(result.data) > 0
     
     # ==================== TEMPLATES ====================
@@ -49,17 +81,24 @@ class DatabaseManager:
             "created_at": datetime.now().isoformat()
         })
         
-        result = self.supabase.table("templates").insert(template_data).execute()
+        result = await self._execute("templates", self.supabase.table("templates").insert(template_data))
         return result.data[0] if result.data else None
     
     async def get_templates(self) -> List[Dict[str, Any]]:
         """Получение всех шаблонов"""
-        result = self.supabase.table("templates").select("*").order("created_at", desc=True).execute()
+        result = await self._execute("templates", self.supabase.table("templates").select("*").order("created_at", desc=True))
         return result.data if result.data else []
     
+    async def search_templates(self, filters: Dict[str, Any], limit: int = 50, offset: int = 0) -> Dict[str, Any]:
+        """Поиск шаблонов по фасетам (RPC search_templates): страница, total и счетчики фасетов"""
+        params = {f"p_{key}": value for key, value in filters.items() if value is not None}
+        params.update({"p_limit": limit, "p_offset": offset})
+        result = await self._execute("templates", self.supabase.rpc("search_templates", params), idempotent=True)
+        return result.data or {"total": 0, "items": [], "facets": {}}
+    
     async def get_template_by_id(self, template_id: str) -> Optional[Dict[str, Any]]:
         """Получение шаблона по ID"""
-        result = self.supabase.table("templates").select("*").eq("id", template_id).execute()
+        result = await self._execute("templates", self.supabase.table("templates").select("*").eq("id", template_id))
         return result.data[0] if result.data else None
     
     # ==================== UPLOADS ====================
@@ -72,37 +111,76 @@ class DatabaseManager:
             "status": upload_data.get("status", "active")
         })
         
-        result = self.supabase.table("uploads").insert(upload_data).execute()
+        result = await self._execute("uploads", self.supabase.table("uploads").insert(upload_data))
         return result.data[0] if result.data else None
     
+    async def get_or_create_upload(self, upload_data: Dict[str, Any], idempotency_key: str) -> Tuple[Dict[str, Any], bool]:
+        """Запись загрузки с ключом идемпотентности: повтор с тем же ключом возвращает существующую запись
+
+        Возвращает (запись, создана ли она сейчас).
+        """
+        upload_data.update({
+            "id": str(uuid.uuid4()),
+            "upload_date": datetime.now().isoformat(),
+            "status": upload_data.get("status", "active"),
+            "idempotency_key": idempotency_key
+        })
+        
+        result = await self._execute("uploads", self.supabase.table("uploads").upsert(
+            upload_data, on_conflict="idempotency_key", ignore_duplicates=True
+        ))
+        if result.data:
+            return result.data[0], True
+        existing = await self._execute("uploads", self.supabase.table("uploads").select("*").eq("idempotency_key", idempotency_key))
+        return existing.data[0], False
+    
     async def get_uploads(self) -> List[Dict[str, Any]]:
         """Получение всех загрузок"""
-        result = self.supabase.table("uploads").select("*").order("upload_date", desc=True).execute()
+        result = await self._execute("uploads", self.supabase.table("uploads").select("*").order("upload_date", desc=True))
         return result.data if result.data else []
     
     async def get_upload_by_id(self, upload_id: str) -> Optional[Dict[str, Any]]:
         """Получение загрузки по ID"""
-        result = self.supabase.table("uploads").select("*").eq("id", upload_id).execute()
+        result = await self._execute("uploads", self.supabase.table("uploads").select("*").eq("id", upload_id))
         return result.data[0] if result.data else None
     
     async def update_upload_status(self, upload_id: str, status: str) -> bool:
         """Обновление статуса загрузки"""
-        result = self.supabase.table("uploads").update({
+        result = await self._execute("uploads", self.supabase.table("uploads").update({
             "status": status,
             "updated_at": datetime.now().isoformat()
-        }).eq("id", upload_id).execute()
+        }).eq("id", upload_id))
         
         return len(result.data) > 0
     
     async def update_upload_performance(self, upload_id: str, performance_data: Dict[str, Any]) -> bool:
         """Обновление метрик загрузки"""
-        result = self.supabase.table("uploads").update({
+        result = await self._execute("uploads", self.supabase.table("uploads").update({
             "performance": performance_data,
             "updated_at": datetime.now().isoformat()
-        }).eq("id", upload_id).execute()
+        }).eq("id", upload_id))
         
         return len(result.data) > 0
     
+    # ==================== BATCH ITEMS ====================
+    
+    async def save_batch_items(self, items: List[Dict[str, Any]]):
+        """Строки заданий пакета (upsert по batch_id + item_index, одним запросом)"""
+        now = datetime.now().isoformat()
+        rows = [{**item, "updated_at": now} for item in items]
+        await self._execute("batch_items", self.supabase.table("batch_items").upsert(rows, on_conflict="batch_id,item_index"))
+    
+    async def update_batch_item(self, batch_id: str, item_index: int, data: Dict[str, Any]) -> bool:
+        """Обновление чекпоинта или статуса задания пакета"""
+        data["updated_at"] = datetime.now().isoformat()
+        result = await self._execute("batch_items", self.supabase.table("batch_items").update(data).eq("batch_id", batch_id).eq("item_index", item_index))
+        return len(result.data) > 0
+    
+    async def get_batch_items(self, batch_id: str) -> List[Dict[str, Any]]:
+        """Задания пакета по порядку"""
+        result = await self._execute("batch_items", self.supabase.table("batch_items").select("*").eq("batch_id", batch_id).order("item_index"))
+        return result.data if result.data else []
+    
     # ==================== USERS ====================
     
     async def create_user(self, email: str, role_id: str = None) -> Dict[str, Any]:
@@ -114,41 +192,58 @@ class DatabaseManager:
             "created_at": datetime.now().isoformat()
         }
         
-        result = self.supabase.table("users").insert(user_data).execute()
+        result = await self._execute("users", self.supabase.table("users").insert(user_data))
         return result.data[0] if result.data else None
     
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Получение пользователя по email"""
-        result = self.supabase.table("users").select("*").eq("email", email).execute()
+        result = await self._execute("users", self.supabase.table("users").select("*").eq("email", email))
         return result.data[0] if result.data else None
     
     # ==================== ROLES ====================
     
     async def get_roles(self) -> List[Dict[str, Any]]:
         """Получение всех ролей"""
-        result = self.supabase.table("roles").select("*").execute()
+        result = await self._execute("roles", self.supabase.table("roles").select("*"))
         return result.data if result.data else []
     
     async def create_default_roles(self):
-        """Создание ролей по умолчанию"""
+        """Создание ролей по умолчанию (идемпотентно, один запрос)"""
         default_roles = [
             {"id": str(uuid.uuid4()), "name": "admin", "description": "Администратор"},
             {"id": str(uuid.uuid4()), "name": "user", "description": "Обычный пользователь"},
             {"id": str(uuid.uuid4()), "name": "viewer", "description": "Только просмотр"}
         ]
         
-        for role in default_roles:
-            # Проверяем, существует ли роль
-            existing = self.supabase.table("roles").select("*").eq("name", role["name"]).execute()
-            if not existing.data:
-                self.supabase.table("roles").insert(role).execute()
+        # Существующие роли (уникальное имя) остаются без изменений
+        await self._execute("roles", self.supabase.table("roles").upsert(default_roles, on_conflict="name", ignore_duplicates=True))
+    
+    # ==================== MIGRATIONS ====================
+    
+    async def get_applied_migrations(self) -> List[str]:
+        """Имена уже примененных миграций данных"""
+        result = await self._execute("schema_migrations", self.supabase.table("schema_migrations").select("name"))
+        return [row["name"] for row in result.data] if result.data else []
+    
+    async def record_migration(self, name: str):
+        """Отметка миграции как примененной"""
+        await self._execute("schema_migrations", self.supabase.table("schema_migrations").upsert(
+            {"name": name, "applied_at": datetime.now().isoformat()}, on_conflict="name", ignore_duplicates=True
+        ))
     
     # ==================== OAUTH CREDENTIALS ====================
     
     async def save_oauth_credentials(self, service: str, credentials: Dict[str, Any]) -> Dict[str, Any]:
         """Сохранение OAuth учетных данных (upsert)"""
+        # Проверка и запись под общей блокировкой: два воркера не создадут две записи сервиса
+        async with coordinator.lock(f"oauth_credentials:{service}", ttl=30, timeout=60):
+            result = await self._save_oauth_credentials(service, credentials)
+        await coordinator.delete(f"oauth:{service}")
+        return result
+    
+    async def _save_oauth_credentials(self, service: str, credentials: Dict[str, Any]) -> Dict[str, Any]:
         # Сначала проверим, есть ли уже запись для этого сервиса
-        existing = await self.get_oauth_credentials(service)
+        existing = await self.get_oauth_credentials(service, use_cache=False)
         
         if existing:
             # Обновляем существующую запись
@@ -156,7 +251,7 @@ class DatabaseManager:
                 "credentials": credentials,
                 "updated_at": datetime.now().isoformat()
             }
-            result = self.supabase.table("oauth_credentials").update(credentials_data).eq("id", existing["id"]).execute()
+            result = await self._execute("oauth_credentials", self.supabase.table("oauth_credentials").update(credentials_data).eq("id", existing["id"]))
         else:
             # Создаем новую запись
             credentials_data = {
@@ -166,15 +261,72 @@ class DatabaseManager:
                 "created_at": datetime.now().isoformat(),
                 "updated_at": datetime.now().isoformat()
             }
-            result = self.supabase.table("oauth_credentials").insert(credentials_data).execute()
+            result = await self._execute("oauth_credentials", self.supabase.table("oauth_credentials").insert(credentials_data))
         
         return result.data[0] if result.data else None
     
-    async def get_oauth_credentials(self, service: str) -> Optional[Dict[str, Any]]:
-        """Получение OAuth учетных данных"""
-        result = self.supabase.table("oauth_credentials").select("*").eq("service", service).order("created_at", desc=True).limit(1).execute()
-        return result.data[0] if result.data else None
+    async def get_oauth_credentials(self, service: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        """Получение OAuth учетных данных (через общий кэш воркеров на OAUTH_CACHE_TTL секунд)"""
+        if use_cache:
+            cached = await coordinator.get(f"oauth:{service}")
+            if cached is not None:
+                return cached or None
+        result = await self._execute("oauth_credentials", self.supabase.table("oauth_credentials").select("*").eq("service", service).order("created_at", desc=True).limit(1))
+        credentials = result.data[0] if result.data else None
+        # Отсутствие записи тоже кэшируется (как {}), чтобы ненастроенная интеграция не опрашивала БД
+        await coordinator.set(f"oauth:{service}", credentials or {}, OAUTH_CACHE_TTL)
+        return credentials
     
+    # ==================== DRIVE SOURCES ====================
+
+    async def create_drive_source(self, source_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Регистрация папки Google Drive как источника видео"""
+        source_data.update({
+            "id": str(uuid.uuid4()),
+            "is_active": True,
+            "created_at": datetime.now().isoformat()
+        })
+
+        result = await self._execute("drive_sources", self.supabase.table("drive_sources").insert(source_data))
+        return result.data[0] if result.data else None
+
+    async def get_drive_sources(self, active_only: bool = False) -> List[Dict[str, Any]]:
+        """Получение зарегистрированных папок Google Drive"""
+        query = self.supabase.table("drive_sources").select("*")
+        if active_only:
+            query = query.eq("is_active", True)
+        result = await self._execute("drive_sources", query.order("created_at", desc=True))
+        return result.data if result.data else []
+
+    async def get_drive_source_by_id(self, source_id: str) -> Optional[Dict[str, Any]]:
+        """Получение папки Google Drive по ID"""
+        result = await self._execute("drive_sources", self.supabase.table("drive_sources").select("*").eq("id", source_id))
+        return result.data[0] if result.data else None
+
+    async def update_drive_source(self, source_id: str, source_data: Dict[str, Any]) -> bool:
+        """Обновление папки Google Drive (токен ленты изменений, известные файлы)"""
+        source_data["updated_at"] = datetime.now().isoformat()
+        result = await self._execute("drive_sources", self.supabase.table("drive_sources").update(source_data).eq("id", source_id))
+        return len(result.data) > 0
+
+    async def delete_drive_source(self, source_id: str) -> bool:
+        """Удаление папки Google Drive"""
+        result = await self._execute("drive_sources", self.supabase.table("drive_sources").delete().eq("id", source_id))
+        return len(result.data) > 0
+
+    # ==================== YOUTUBE QUOTA ====================
+
+    async def get_youtube_quota_usage(self, day: str) -> List[Dict[str, Any]]:
+        """Расход квоты YouTube за сутки по операциям"""
+        result = await self._execute("youtube_quota_usage", self.supabase.table("youtube_quota_usage").select("operation, units, calls").eq("day", day))
+        return result.data if result.data else []
+
+    async def add_youtube_quota_usage(self, day: str, operation: str, units: int):
+        """Атомарное увеличение расхода квоты (RPC increment_youtube_quota)"""
+        await self._execute("youtube_quota_usage", self.supabase.rpc("increment_youtube_quota", {
+            "p_day": day, "p_operation": operation, "p_units": units
+        }))
+
     # ==================== LOGS ====================
     
     async def create_log(self, action: str, metadata: Dict[str, Any] = None, user_id: str = None) -> Dict[str, Any]:
@@ -187,8 +339,15 @@ class DatabaseManager:
             "created_at": datetime.now().isoformat()
         }
         
-        result = self.supabase.table("logs").insert(log_data).execute()
+        result = await self._execute("logs", self.supabase.table("logs").insert(log_data))
         return result.data[0] if result.data else None
+    
+    async def query_logs(self, filters: Dict[str, Any], limit: int = 100) -> List[Dict[str, Any]]:
+        """Страница логов по ключу (created_at, id), новые первыми (RPC query_logs)"""
+        params = {f"p_{key}": value for key, value in filters.items() if value is not None}
+        params["p_limit"] = limit
+        result = await self._execute("logs", self.supabase.rpc("query_logs", params), idempotent=True)
+        return result.data or []
 
 # Глобальный экземпляр менеджера БД
 db_manager = DatabaseManager()
@@ -0,0 +1,463 @@
+"""
+Наблюдение за папками Google Drive через ленту изменений (changes feed)
+
+Вместо полного пересканирования папки наблюдатель хранит для каждого источника
+page token ленты изменений Drive и на каждом опросе забирает только изменения,
+появившиеся после последнего чекпоинта. Новые и измененные видео ставятся
+в очередь и передаются в пайплайн загрузки с настройками кампании источника.
+
+Очередь живет в памяти процесса, поэтому файлы сначала записываются в
+pending_files источника вместе со сдвигом page token, и только потом
+попадают в очередь. Отпечаток файла переходит в known_files, когда его
+загрузка завершилась успешно или с ошибкой, которую повтор не исправит
+(Drive или YouTube отклонили сам файл). После временной ошибки запись
+остается в pending_files без воркера и с паузой: ее снова забирает опрос,
+пока не исчерпаны DRIVE_WATCH_MAX_ATTEMPTS попыток. Файлы воркера, который
+упал или перезапустился (его нет в реестре наблюдателей у координатора),
+забирает следующий опрос.
+"""
+import asyncio
+import re
+import time
+import uuid
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import (
+    UPLOAD_DIR, DRIVE_WATCH_INTERVAL, DRIVE_WATCH_QUEUE_SIZE, DRIVE_WATCH_MAX_ATTEMPTS, DRIVE_WATCH_RETRY_MAX_DELAY
+)
+from coordination import coordinator, WORKER_ID
+from database import db_manager
+from integrations import integration_manager
+from metrics import track_external, register_queue, BYTES_IN
+from resilience import call as resilient_call, is_transient, ExternalServiceError
+from youtube_quota import is_quota_error
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые запрашиваем у Drive API (меньше полей - меньше трафик)
+FILE_FIELDS = "id,name,mimeType,parents,md5Checksum,modifiedTime,size,trashed"
+CHANGE_FIELDS = f"nextPageToken,newStartPageToken,changes(fileId,removed,file({FILE_FIELDS}))"
+FOLDER_FIELDS = f"nextPageToken,files({FILE_FIELDS})"
+# Реестр работающих наблюдателей у координатора: их файлы в pending_files не забираются
+WATCHERS_KEY = "drive_watchers"
+
+
+def extract_drive_folder_id(folder: str) -> str:
+    """Извлечение ID папки из ссылки Google Drive (или возврат ID как есть)"""
+    match = re.search(r"/folders/([A-Za-z0-9_-]+)", folder) or re.search(r"[?&]id=([A-Za-z0-9_-]+)", folder)
+    return match.group(1) if match else folder.strip()
+
+
+def is_video_file(file: Dict[str, Any]) -> bool:
+    """Проверка, что файл Drive является видео и не удален в корзину"""
+    return (file.get("mimeType") or "").startswith("video/") and not file.get("trashed")
+
+
+def is_retryable(error: Exception) -> bool:
+    """Стоит ли загрузить файл повторно после ошибки
+
+    Повторяются недоступность сервисов (в том числе разомкнутый выключатель),
+    квота YouTube, сбои скачивания и обработки, отмена задачи. Не повторяется
+    отказ Drive или YouTube по самому файлу (4xx, кроме лимитов): файл удален,
+    нет доступа, видео отклонено.
+    """
+    if isinstance(error, ExternalServiceError) or is_transient(error) or is_quota_error(error):
+        return True
+    status = getattr(getattr(error, "resp", None), "status", None)
+    try:
+        return not 400 <= int(status) < 500
+    except (TypeError, ValueError):
+        return True
+
+
+class GoogleDriveClient:
+    """Тонкая обертка над Google Drive API v3, используемая наблюдателем"""
+
+    def __init__(self, service):
+        self.service = service
+
+    async def get_start_page_token(self) -> str:
+        """Текущая позиция ленты изменений"""
+        response = await resilient_call("drive", "changes.getStartPageToken", self.service.changes().getStartPageToken().execute)
+        return response["startPageToken"]
+
+    async def list_changes(self, page_token: str) -> Dict[str, Any]:
+        """Страница ленты изменений начиная с page_token"""
+        request = self.service.changes().list(
+            pageToken=page_token,
+            spaces="drive",
+            pageSize=100,
+            includeRemoved=True,
+            fields=CHANGE_FIELDS
+        )
+        return await resilient_call("drive", "changes.list", request.execute)
+
+    async def list_folder(self, folder_id: str, page_token: Optional[str] = None) -> Dict[str, Any]:
+        """Страница файлов в папке (используется только при первичной регистрации)"""
+        request = self.service.files().list(
+            q=f"'{folder_id}' in parents and mimeType contains 'video/' and trashed = false",
+            pageToken=page_token,
+            pageSize=100,
+            fields=FOLDER_FIELDS
+        )
+        return await resilient_call("drive", "files.list", request.execute)
+
+    async def download(self, file_id: str, destination: Path) -> None:
+        """Потоковое скачивание файла на диск частями, без загрузки целиком в память
+
+        Упавшая часть повторяется с того же смещения (записываются только принятые части).
+        """
+        from googleapiclient.http import MediaIoBaseDownload
+
+        request = self.service.files().get_media(fileId=file_id)
+        with track_external("drive", "files.get_media"), open(destination, "wb") as f:
+            downloader = MediaIoBaseDownload(f, request, chunksize=8 * 1024 * 1024)
+            done = False
+            while not done:
+                _, done = await resilient_call("drive", "files.get_media", downloader.next_chunk, timeout=None, track=False)
+
+
+async def _default_client_factory() -> GoogleDriveClient:
+    service = await integration_manager.get_google_drive_service()
+    if service is None:
+        raise RuntimeError("Google Drive не авторизован. Выполните авторизацию.")
+    return GoogleDriveClient(service)
+
+
+class DriveWatcher:
+    """Фоновый наблюдатель за зарегистрированными папками Google Drive"""
+
+    def __init__(
+        self,
+        client_factory: Optional[Callable[[], Awaitable[Any]]] = None,
+        poll_interval: int = DRIVE_WATCH_INTERVAL,
+        queue_size: int = DRIVE_WATCH_QUEUE_SIZE,
+        max_attempts: int = DRIVE_WATCH_MAX_ATTEMPTS,
+        retry_max_delay: int = DRIVE_WATCH_RETRY_MAX_DELAY
+    ):
+        self._client_factory = client_factory or _default_client_factory
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_max_delay = retry_max_delay
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._handler: Optional[Callable[..., Awaitable[Any]]] = None
+        self._poll_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        # Владелец записей pending_files: WORKER_ID может повториться после перезапуска контейнера
+        self.instance_id = f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+
+    def set_handler(self, handler: Callable[..., Awaitable[Any]]):
+        """Обработчик нового файла: handler(source, file, file_path, copy_number)"""
+        self._handler = handler
+
+    # ==================== SOURCES ====================
+
+    async def register_source(
+        self,
+        folder: str,
+        campaign_name: str,
+        thumbnail_option: str = "none",
+        modal_image_id: Optional[str] = None,
+        create_formats: bool = False,
+        ingest_existing: bool = False
+    ) -> Dict[str, Any]:
+        """Регистрация папки Drive как источника видео"""
+        client = await self._client_factory()
+        folder_id = extract_drive_folder_id(folder)
+
+        # Чекпоинт берем до листинга папки, чтобы не потерять файлы,
+        # добавленные между листингом и первым опросом
+        page_token = await client.get_start_page_token()
+
+        source = await db_manager.create_drive_source({
+            "folder_id": folder_id,
+            "campaign_name": campaign_name,
+            "thumbnail_option": thumbnail_option,
+            "modal_image_id": modal_image_id,
+            "create_formats": create_formats,
+            "page_token": page_token,
+            "known_files": {},
+            "pending_files": {},
+            "files_ingested": 0
+        })
+
+        if ingest_existing:
+            existing_files = []
+            folder_page = None
+            while True:
+                response = await client.list_folder(folder_id, folder_page)
+                existing_files.extend(f for f in response.get("files", []) if is_video_file(f))
+                folder_page = response.get("nextPageToken")
+                if not folder_page:
+                    break
+
+            await self._enqueue(source, await self._checkpoint(source, existing_files))
+
+        await db_manager.create_log("drive_source_registered", {
+            "source_id": source["id"],
+            "folder_id": folder_id,
+            "campaign_name": campaign_name,
+            "ingest_existing": ingest_existing
+        })
+
+        return source
+
+    async def poll_source(self, source: Dict[str, Any]) -> int:
+        """Внеочередной опрос одного источника"""
+        async with self._poll_lock, coordinator.lock("drive_watch_poll", ttl=60):
+            # Чекпоинт мог сдвинуть другой воркер, пока ждали блокировку
+            fresh = await db_manager.get_drive_source_by_id(source["id"])
+            return await self._poll_source(fresh or source)
+
+    async def _poll_source(self, source: Dict[str, Any]) -> int:
+        """Инкрементальный опрос ленты изменений для одного источника"""
+        client = await self._client_factory()
+        page_token = source.get("page_token") or await client.get_start_page_token()
+        known_files = source.get("known_files") or {}
+        pending_files = source.get("pending_files") or {}
+        new_files: Dict[str, Dict[str, Any]] = {}
+
+        while True:
+            response = await client.list_changes(page_token)
+
+            for change in response.get("changes", []):
+                file = change.get("file")
+                if change.get("removed") or not file:
+                    continue
+                if source["folder_id"] not in (file.get("parents") or []) or not is_video_file(file):
+                    continue
+
+                # Лента сообщает и о переименованиях/правах - берем только новое содержимое
+                fingerprint = self._fingerprint(file)
+                if known_files.get(file["id"]) == fingerprint:
+                    continue
+                if (pending_files.get(file["id"]) or {}).get("fingerprint") == fingerprint:
+                    continue
+
+                new_files[file["id"]] = file
+
+            if "newStartPageToken" in response:
+                page_token = response["newStartPageToken"]
+                break
+            page_token = response["nextPageToken"]
+
+        # Чекпоинт сдвигается вместе с записью файлов в pending_files, до постановки в очередь
+        entries = await self._checkpoint(source, list(new_files.values()), page_token)
+        queued = await self._enqueue(source, entries)
+
+        if queued:
+            print(f"☁️ Drive: {queued} новых видео в папке {source['folder_id']}")
+
+        return queued
+
+    async def poll_all(self) -> int:
+        """Опрос всех активных источников (общая блокировка: воркеры не опрашивают одни и те же папки параллельно)"""
+        async with self._poll_lock, coordinator.lock("drive_watch_poll", ttl=60):
+            total = 0
+            for source in await db_manager.get_drive_sources(active_only=True):
+                try:
+                    total += await self._poll_source(source)
+                except Exception as e:
+                    logger.error(f"Drive watch poll error ({source.get('folder_id')}): {e}")
+                    await db_manager.create_log("drive_watch_poll_error", {
+                        "source_id": source.get("id"),
+                        "error": str(e)
+                    })
+            return total
+
+    # ==================== PENDING FILES ====================
+
+    async def _checkpoint(self, source: Dict[str, Any], files: List[Dict[str, Any]],
+                          page_token: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Запись новых файлов в pending_files (и сдвиг page token) до постановки в очередь
+
+        Возвращает записи для очереди: новые файлы, файлы упавших воркеров
+        и файлы, чья пауза после временной ошибки истекла, - этот воркер забирает их себе.
+        """
+        await self._heartbeat()
+        alive = set((await coordinator.workers_state(WATCHERS_KEY)).values())
+        now = time.time()
+        async with coordinator.lock(f"drive_source:{source['id']}", ttl=30):
+            fresh = await db_manager.get_drive_source_by_id(source["id"]) or source
+            pending_files = dict(fresh.get("pending_files") or {})
+            copy_number = fresh.get("files_ingested") or 0
+
+            entries = []
+            for file_id, entry in pending_files.items():
+                if entry.get("retry_at", 0) > now:
+                    continue
+                if entry.get("worker") not in alive and entry.get("worker") != self.instance_id:
+                    entry["worker"] = self.instance_id
+                    entries.append(entry)
+            for file in files:
+                copy_number += 1
+                entry = {"file": file, "fingerprint": self._fingerprint(file), "copy_number": copy_number, "worker": self.instance_id}
+                pending_files[file["id"]] = entry
+                entries.append(entry)
+
+            data = {"pending_files": pending_files, "files_ingested": copy_number}
+            if page_token is not None:
+                data.update(page_token=page_token, last_checked_at=datetime.now().isoformat())
+            if entries or page_token is not None:
+                await db_manager.update_drive_source(source["id"], data)
+            source.update(data)
+        if len(entries) > len(files):
+            logger.warning(f"Drive: {len(entries) - len(files)} файлов после ошибки или остановки воркера снова в очереди ({source['folder_id']})")
+        return entries
+
+    async def _complete(self, item: Dict[str, Any]):
+        """Загрузка файла завершена (успешно или окончательной ошибкой): отпечаток в known_files, запись из pending_files удаляется"""
+        source, file = item["source"], item["file"]
+        async with coordinator.lock(f"drive_source:{source['id']}", ttl=30):
+            fresh = await db_manager.get_drive_source_by_id(source["id"])
+            if fresh is None:
+                return
+            pending_files = dict(fresh.get("pending_files") or {})
+            entry = pending_files.get(file["id"])
+            # Файл мог измениться еще раз, пока загружался: новую версию ждет своя запись
+            if entry is None or entry["fingerprint"] != item["fingerprint"]:
+                return
+            del pending_files[file["id"]]
+            known_files = {**(fresh.get("known_files") or {}), file["id"]: item["fingerprint"]}
+            await db_manager.update_drive_source(source["id"], {"pending_files": pending_files, "known_files": known_files})
+
+    async def _retry_later(self, item: Dict[str, Any]) -> Optional[int]:
+        """Временная ошибка: запись остается в pending_files без воркера, опрос заберет ее после паузы
+
+        Возвращает номер неудачной попытки или None, если попытки исчерпаны
+        либо файл уже изменился (новую версию ждет своя запись).
+        """
+        source, file = item["source"], item["file"]
+        async with coordinator.lock(f"drive_source:{source['id']}", ttl=30):
+            fresh = await db_manager.get_drive_source_by_id(source["id"])
+            if fresh is None:
+                return None
+            pending_files = dict(fresh.get("pending_files") or {})
+            entry = pending_files.get(file["id"])
+            if entry is None or entry["fingerprint"] != item["fingerprint"]:
+                return None
+            attempts = (entry.get("attempts") or 0) + 1
+            if attempts >= self.max_attempts:
+                return None
+            delay = min(self.poll_interval * 2 ** (attempts - 1), self.retry_max_delay)
+            pending_files[file["id"]] = {**entry, "worker": None, "attempts": attempts, "retry_at": time.time() + delay}
+            await db_manager.update_drive_source(source["id"], {"pending_files": pending_files})
+            return attempts
+
+    async def _failed(self, item: Dict[str, Any], error: Exception):
+        """Ошибка загрузки: повтор после паузы или, если повтор не поможет, завершение файла"""
+        attempt = await self._retry_later(item) if is_retryable(error) else None
+        logger.error(f"Drive watch item error ({item['file'].get('name')}): {error}")
+        await db_manager.create_log("drive_watch_item_error", {
+            "source_id": item["source"].get("id"),
+            "file_id": item["file"].get("id"),
+            "file_name": item["file"].get("name"),
+            "error": str(error),
+            "attempt": attempt,
+            "will_retry": attempt is not None
+        })
+        if attempt is None:
+            await self._complete(item)
+
+    async def _heartbeat(self):
+        await coordinator.publish_worker_state(WATCHERS_KEY, self.instance_id, ttl=self.poll_interval * 3)
+
+    # ==================== QUEUE ====================
+
+    async def _enqueue(self, source: Dict[str, Any], entries: List[Dict[str, Any]]) -> int:
+        for entry in entries:
+            # put() ждет при заполненной очереди - естественный backpressure для опроса
+            await self.queue.put({
+                "source": source,
+                "file": entry["file"],
+                "fingerprint": entry["fingerprint"],
+                "copy_number": entry["copy_number"]
+            })
+        return len(entries)
+
+    async def _process_item(self, item: Dict[str, Any]):
+        source, file = item["source"], item["file"]
+
+        downloaded_dir = Path(UPLOAD_DIR) / "downloaded"
+        downloaded_dir.mkdir(parents=True, exist_ok=True)
+        # Имя файла в Drive может содержать "/" - в путь идет только последняя часть
+        filename = Path(file.get("name") or "").name or "video.mp4"
+        file_path = downloaded_dir / f"{uuid.uuid4()}_{filename}"
+
+        client = await self._client_factory()
+        await client.download(file["id"], file_path)
+        BYTES_IN.labels("drive").inc(file_path.stat().st_size)
+
+        if self._handler:
+            await self._handler(source, file, str(file_path), item["copy_number"])
+
+    async def _worker_loop(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                try:
+                    await self._process_item(item)
+                except Exception as e:
+                    await self._failed(item, e)
+                else:
+                    await self._complete(item)
+            except Exception as e:
+                # Запись остается в pending_files этого воркера: после перезапуска ее заберет опрос
+                logger.warning(f"Drive watch: не удалось обновить запись файла {item['file'].get('id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self._heartbeat()
+            except Exception as e:
+                logger.warning(f"Drive watch heartbeat error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _poll_loop(self):
+        while True:
+            try:
+                # Наблюдатель запущен в каждом воркере, а опрашивает один за интервал:
+                # остальные видят отметку последнего опроса и пропускают свой
+                if await coordinator.add("drive_watch_last_poll", datetime.now().isoformat(), ttl=self.poll_interval * 0.9):
+                    await self.poll_all()
+            except Exception as e:
+                logger.error(f"Drive watch error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    # ==================== LIFECYCLE ====================
+
+    def start(self):
+        """Запуск фонового опроса и обработчика очереди"""
+        if self._tasks:
+            return
+        register_queue("drive_watch", self.queue.qsize)
+        self._tasks = [
+            asyncio.create_task(self._heartbeat_loop()),
+            asyncio.create_task(self._poll_loop()),
+            asyncio.create_task(self._worker_loop())
+        ]
+
+    async def stop(self):
+        """Остановка фоновых задач"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        try:
+            # Файлы, оставшиеся в очереди, забирает следующий опрос другого воркера
+            await coordinator.remove_worker_state(WATCHERS_KEY)
+        except Exception as e:
+            logger.warning(f"Drive watch: не удалось снять воркер с реестра: {e}")
+
+    @staticmethod
+    def _fingerprint(file: Dict[str, Any]) -> str:
+        return file.get("md5Checksum") or file.get("modifiedTime") or ""
+
+
+# Глобальный экземпляр наблюдателя
+drive_watcher = DriveWatcher()
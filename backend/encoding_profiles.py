@@ -0,0 +1,108 @@
+"""
+Профили кодирования видео (libx264)
+
+Профиль задает preset, режим качества (CRF или битрейт), число потоков и tune,
+а также переопределения для разных выходных разрешений. Активный профиль
+выбирается через ENCODING_PROFILE; сравнить профили на своем железе можно
+командой `python -m benchmarks.encode`.
+"""
+import os
+import random
+from typing import Any, Dict, List, Optional
+
+from config import ENCODING_PROFILE, PIPELINE_STAGE_CONCURRENCY
+
+# "threads": "auto" - ядра делятся поровну между параллельными транскодами конвейера
+ENCODING_PROFILES: Dict[str, Dict[str, Any]] = {
+    "legacy": {
+        "description": "Прежнее поведение: preset по умолчанию, фиксированный битрейт 1000k",
+        "preset": "medium",
+        "bitrate": 1000,
+        "threads": 0,
+        "tune": None,
+        "resolutions": {}
+    },
+    "fast": {
+        "description": "Максимум креативов на ядро: veryfast + CRF",
+        "preset": "veryfast",
+        "crf": 24,
+        "threads": "auto",
+        "tune": None,
+        "resolutions": {
+            720: {"maxrate": "2000k", "bufsize": "4000k"},
+            1080: {"crf": 25, "maxrate": "4000k", "bufsize": "8000k"}
+        }
+    },
+    "balanced": {
+        "description": "Баланс скорости и качества: faster + CRF",
+        "preset": "faster",
+        "crf": 22,
+        "threads": "auto",
+        "tune": None,
+        "resolutions": {
+            720: {"maxrate": "2500k", "bufsize": "5000k"},
+            1080: {"crf": 23, "maxrate": "5000k", "bufsize": "10000k"}
+        }
+    },
+    "quality": {
+        "description": "Максимальное качество: slow + CRF + tune film",
+        "preset": "slow",
+        "crf": 20,
+        "threads": "auto",
+        "tune": "film",
+        "resolutions": {
+            1080: {"crf": 21}
+        }
+    }
+}
+
+
+def get_profile(name: Optional[str] = None) -> Dict[str, Any]:
+    """Профиль по имени (по умолчанию - ENCODING_PROFILE)"""
+    name = name or ENCODING_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Неизвестный профиль кодирования: {name}. Доступны: {', '.join(ENCODING_PROFILES)}")
+    return ENCODING_PROFILES[name]
+
+
+def resolve_settings(name: Optional[str] = None, resolution: Optional[int] = None) -> Dict[str, Any]:
+    """Итоговые настройки профиля для выходного разрешения (меньшая сторона кадра, например 720)"""
+    profile = get_profile(name)
+    settings = {key: value for key, value in profile.items() if key not in ("resolutions", "description")}
+
+    # Переопределение действует начиная со своего разрешения и выше
+    if resolution:
+        matching = [res for res in profile["resolutions"] if res <= resolution]
+        if matching:
+            settings.update(profile["resolutions"][max(matching)])
+
+    if settings.get("threads") == "auto":
+        settings["threads"] = max(1, (os.cpu_count() or 1) // PIPELINE_STAGE_CONCURRENCY["transcode"])
+
+    return settings
+
+
+def build_video_args(name: Optional[str] = None, resolution: Optional[int] = None, uniquify: bool = False) -> List[str]:
+    """Аргументы ffmpeg для видеодорожки
+
+    uniquify добавляет небольшую случайную вариацию битрейта/CRF,
+    чтобы каждая копия креатива кодировалась немного по-разному.
+    """
+    settings = resolve_settings(name, resolution)
+    args = ['-c:v', 'libx264', '-preset', settings["preset"]]
+
+    if "crf" in settings:
+        crf = settings["crf"] + (random.uniform(-0.5, 0.5) if uniquify else 0)
+        args += ['-crf', f'{crf:.1f}']
+        if settings.get("maxrate"):
+            args += ['-maxrate', settings["maxrate"], '-bufsize', settings["bufsize"]]
+    else:
+        bitrate = settings["bitrate"] + (random.randint(-100, 100) if uniquify else 0)  # ±100 kbps
+        args += ['-b:v', f'{bitrate}k']
+
+    if settings.get("tune"):
+        args += ['-tune', settings["tune"]]
+    if settings.get("threads"):
+        args += ['-threads', str(settings["threads"])]
+
+    return args
@@ -0,0 +1,290 @@
+"""
+Выборка репрезентативных кадров креатива для AI-анализа
+
+N кадров достаются за один проход ffmpeg: в режиме keyframes декодируются
+только ключевые кадры (-skip_frame nokey), а фильтр select берет первый кадр
+и далее ближайший ключевой кадр через каждые duration/N секунд; в режиме
+scene берутся смены сцен. Кадры уменьшаются и кодируются в JPEG прямо в
+пайп (image2pipe), на диск ничего не пишется. Результат кэшируется по
+sha256 содержимого исходника, поэтому повторный анализ того же видео (или
+его копии под другим именем) не запускает ffmpeg. Пакет видео проходит
+через пул из FRAME_SAMPLER_WORKERS параллельных ffmpeg.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from config import (
+    FRAME_SAMPLE_COUNT, FRAME_SAMPLE_MODE, FRAME_SAMPLE_MAX_SIDE, FRAME_SAMPLE_JPEG_QUALITY,
+    FRAME_SCENE_THRESHOLD, FRAME_SAMPLER_WORKERS, FRAME_CACHE_SIZE
+)
+from media import run_command, probe_video, get_duration
+from metrics import observe_cache, track_stage
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_MODES = ("keyframes", "scene")
+
+_SHOWINFO_PTS = re.compile(r"Parsed_showinfo.*?pts_time:\s*([0-9.]+)")
+
+
+class FrameSamplingError(Exception):
+    """ffmpeg не смог извлечь ни одного кадра"""
+
+
+def split_jpegs(data: bytes) -> List[bytes]:
+    """Разбиение потока image2pipe (mjpeg) на отдельные JPEG
+
+    Сегменты заголовка пропускаются по длине, а конец кадра (EOI) ищется
+    только в сжатых данных после SOS, где байт 0xFF всегда экранирован -
+    так FF D9 внутри таблиц квантования не обрежет кадр.
+    """
+    frames = []
+    position = 0
+    while True:
+        start = data.find(b"\xff\xd8", position)
+        if start < 0:
+            return frames
+        i = start + 2
+        end = None
+        while i + 2 <= len(data):
+            if data[i] != 0xFF:
+                break
+            marker = data[i + 1]
+            if marker == 0xD9:
+                end = i + 2
+                break
+            if i + 4 > len(data):
+                break
+            length = int.from_bytes(data[i + 2:i + 4], "big")
+            i += 2 + length
+            if marker != 0xDA:
+                continue
+            # Сжатые данные скана: до первого маркера, кроме FF00 и RST0-7
+            while i + 1 < len(data):
+                if data[i] == 0xFF and data[i + 1] != 0x00 and not 0xD0 <= data[i + 1] <= 0xD7:
+                    break
+                i += 1
+        if end is None:
+            return frames
+        frames.append(data[start:end])
+        position = end
+
+
+def jpeg_to_array(jpeg: bytes):
+    """JPEG в массив numpy (H x W x 3, RGB) для моделей, принимающих пиксели"""
+    import numpy as np
+    from PIL import Image
+
+    with Image.open(io.BytesIO(jpeg)) as image:
+        return np.asarray(image.convert("RGB"))
+
+
+class FrameSampler:
+    """Извлечение кадров с LRU-кэшем по хэшу исходника"""
+
+    def __init__(
+        self,
+        max_side: int = FRAME_SAMPLE_MAX_SIDE,
+        jpeg_quality: int = FRAME_SAMPLE_JPEG_QUALITY,
+        scene_threshold: float = FRAME_SCENE_THRESHOLD,
+        workers: int = FRAME_SAMPLER_WORKERS,
+        cache_size: int = FRAME_CACHE_SIZE
+    ):
+        self.max_side = max_side
+        self.jpeg_quality = jpeg_quality
+        self.scene_threshold = scene_threshold
+        self.workers = max(1, workers)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, List[Dict[str, Any]]]" = OrderedDict()
+        self._pending: Dict[tuple, asyncio.Future] = {}
+        # sha256 по (путь, mtime, размер) - файл не перечитывается при каждом обращении;
+        # LRU того же размера, что и кэш кадров. Хэши считаются в потоках - доступ под блокировкой
+        self._hashes: "OrderedDict[tuple, str]" = OrderedDict()
+        self._hashes_lock = threading.Lock()
+
+    # ==================== ХЭШ ИСХОДНИКА ====================
+
+    def _hash_file(self, path: str) -> str:
+        stat = Path(path).stat()
+        key = (str(path), stat.st_mtime_ns, stat.st_size)
+        with self._hashes_lock:
+            digest = self._hashes.get(key)
+            if digest is not None:
+                self._hashes.move_to_end(key)
+                return digest
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        digest = sha.hexdigest()
+        with self._hashes_lock:
+            self._hashes[key] = digest
+            while len(self._hashes) > self.cache_size:
+                self._hashes.popitem(last=False)
+        return digest
+
+    async def source_hash(self, path: str) -> str:
+        return await asyncio.to_thread(self._hash_file, path)
+
+    # ==================== FFMPEG ====================
+
+    def _build_command(self, video_path: str, select: str, keyframes_only: bool, limit: Optional[int]) -> List[str]:
+        scale = (
+            f"scale=w='min(iw\\,{self.max_side})':h='min(ih\\,{self.max_side})'"
+            ":force_original_aspect_ratio=decrease"
+        )
+        return [
+            'ffmpeg', '-hide_banner', '-nostdin',
+            *(['-skip_frame', 'nokey'] if keyframes_only else []),
+            '-i', video_path,
+            '-an', '-sn',
+            '-vf', f"select='{select}',{scale},showinfo",
+            *(['-frames:v', str(limit)] if limit else []),
+            '-fps_mode', 'vfr',
+            '-f', 'image2pipe',
+            '-c:v', 'mjpeg',
+            '-pix_fmt', 'yuvj420p',
+            '-q:v', str(self.jpeg_quality),
+            'pipe:1'
+        ]
+
+    async def _extract(self, video_path: str, select: str, keyframes_only: bool,
+                       limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Один проход ffmpeg: JPEG из stdout, время кадров из showinfo в stderr"""
+        result = await run_command(self._build_command(video_path, select, keyframes_only, limit), text=False)
+        if result.returncode != 0:
+            raise FrameSamplingError(f"ffmpeg завершился с кодом {result.returncode}: {result.stderr[-500:]}")
+        jpegs = split_jpegs(result.stdout)
+        timestamps = [float(t) for t in _SHOWINFO_PTS.findall(result.stderr)]
+        return [
+            {"timestamp": round(timestamps[i], 3) if i < len(timestamps) else None, "jpeg": jpeg, "size": len(jpeg)}
+            for i, jpeg in enumerate(jpegs)
+        ]
+
+    async def _sample_keyframes(self, video_path: str, count: int, duration: Optional[float]) -> List[Dict[str, Any]]:
+        # Первый кадр и затем кадр не раньше чем через duration/count после предыдущего выбранного
+        step = duration / count if duration else 0
+        select = f"isnan(prev_selected_t)+gte(t-prev_selected_t\\,{step:.3f})"
+        frames = await self._extract(video_path, select, keyframes_only=True, limit=count)
+        if len(frames) < count:
+            # Ключевых кадров меньше, чем нужно (короткий ролик, длинный GOP) - декодируем все кадры
+            frames = await self._extract(video_path, select, keyframes_only=False, limit=count)
+        return frames
+
+    async def _sample_scenes(self, video_path: str, count: int, duration: Optional[float]) -> List[Dict[str, Any]]:
+        # Смены сцен не чаще duration/(count*4), чтобы вспышки и переходы не забили выборку
+        min_gap = duration / (count * 4) if duration else 0
+        select = (
+            f"isnan(prev_selected_t)"
+            f"+gt(scene\\,{self.scene_threshold})*gte(t-prev_selected_t\\,{min_gap:.3f})"
+        )
+        candidates = await self._extract(video_path, select, keyframes_only=False)
+        if len(candidates) > count:
+            # Равномерно по найденным сценам, первый кадр всегда в выборке
+            step = (len(candidates) - 1) / (count - 1) if count > 1 else 0
+            return [candidates[round(i * step)] for i in range(count)]
+        if len(candidates) < count:
+            # Сцен мало - дополняем ключевыми кадрами, далекими от уже выбранных
+            known = [f["timestamp"] for f in candidates if f["timestamp"] is not None]
+            gap = duration / (count * 2) if duration else 0
+            for frame in await self._sample_keyframes(video_path, count, duration):
+                if len(candidates) >= count:
+                    break
+                if frame["timestamp"] is None or all(abs(frame["timestamp"] - t) >= gap for t in known):
+                    candidates.append(frame)
+                    known.append(frame["timestamp"])
+            candidates.sort(key=lambda f: f["timestamp"] if f["timestamp"] is not None else 0)
+        return candidates
+
+    # ==================== API ====================
+
+    async def sample(self, video_path: str, count: int = FRAME_SAMPLE_COUNT, mode: str = FRAME_SAMPLE_MODE,
+                     as_arrays: bool = False) -> Dict[str, Any]:
+        """Кадры видео: [{"timestamp", "jpeg", "size"}] (+ "array" при as_arrays)"""
+        if mode not in SAMPLE_MODES:
+            raise ValueError(f"Неизвестный режим выборки кадров: {mode}")
+        count = max(1, count)
+
+        source_hash = await self.source_hash(video_path)
+        key = (source_hash, mode, count, self.max_side, self.jpeg_quality)
+
+        frames = self._cache.get(key)
+        observe_cache("frames", frames is not None)
+        if frames is not None:
+            self._cache.move_to_end(key)
+        elif key in self._pending:
+            # То же видео уже обрабатывается другим запросом - ждем его результат
+            frames = await asyncio.shield(self._pending[key])
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[key] = future
+            try:
+                frames = await self._sample(video_path, count, mode)
+                future.set_result(frames)
+            except Exception as e:
+                future.set_exception(e)
+                # Исключение уже передано ожидающим, само future не проверяется
+                future.exception()
+                raise
+            finally:
+                del self._pending[key]
+            self._cache[key] = frames
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        result_frames = [dict(frame) for frame in frames]
+        if as_arrays:
+            arrays = await asyncio.to_thread(lambda: [jpeg_to_array(f["jpeg"]) for f in result_frames])
+            for frame, array in zip(result_frames, arrays):
+                frame["array"] = array
+
+        return {"path": str(video_path), "source_hash": source_hash, "mode": mode, "frames": result_frames}
+
+    async def _sample(self, video_path: str, count: int, mode: str) -> List[Dict[str, Any]]:
+        with track_stage("sample_frames"):
+            duration = get_duration(await probe_video(video_path))
+            if mode == "scene":
+                frames = await self._sample_scenes(video_path, count, duration)
+            else:
+                frames = await self._sample_keyframes(video_path, count, duration)
+        if not frames:
+            raise FrameSamplingError(f"Не удалось извлечь кадры: {video_path}")
+        return frames
+
+    async def sample_many(self, video_paths: Iterable[str], count: int = FRAME_SAMPLE_COUNT,
+                          mode: str = FRAME_SAMPLE_MODE, as_arrays: bool = False) -> List[Dict[str, Any]]:
+        """Пакет видео через пул воркеров; ошибка одного видео не прерывает остальные"""
+        paths = list(video_paths)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(paths)
+        queue: "asyncio.Queue[Tuple[int, str]]" = asyncio.Queue()
+        for item in enumerate(paths):
+            queue.put_nowait(item)
+
+        async def worker():
+            while not queue.empty():
+                index, path = queue.get_nowait()
+                try:
+                    results[index] = await self.sample(path, count, mode, as_arrays)
+                except Exception as e:
+                    logger.warning(f"Frame sampling failed for {path}: {e}")
+                    results[index] = {"path": str(path), "error": str(e), "frames": []}
+
+        await asyncio.gather(*(worker() for _ in range(min(self.workers, len(paths)))))
+        return results
+
+    def clear_cache(self):
+        self._cache.clear()
+        with self._hashes_lock:
+            self._hashes.clear()
+
+
+# Глобальный сэмплер кадров
+frame_sampler = FrameSampler()
@@ -7,6 +7,7 @@ import asyncio
 import sys
 from pathlib import Path
 from database import db_manager
+from migrations import apply_migrations
 from config import SUPABASE_URL, SUPABASE_KEY
 
 async def init_database():
@@ -19,9 +20,10 @@ async def init_database():
         print(f"   URL: {SUPABASE_URL}")
         print(f"   Key: {SUPABASE_KEY[:20]}...")
         
-        # Создание ролей по умолчанию
-        print("👥 Создание ролей по умолчанию...")
-        await db_manager.create_default_roles()
+        # Одноразовые миграции данных (роли по умолчанию и т.п.)
+        print("👥 Применение миграций данных...")
+        applied = await apply_migrations()
+        print(f"✅ Применено миграций: {len(applied)}")
         
         # Получение списка ролей для проверки
         roles = await db_manager.get_roles()
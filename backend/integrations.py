@@ -5,16 +5,15 @@ import asyncio
 import json
 import os
 from typing import Dict, Any, Optional, Tuple
-from datetime import datetime, timedelta
-import httpx
-import telegram
-from telegram import Bot
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
+from datetime import datetime, timedelta, timezone
+# Клиенты Google и Telegram импортируются внутри методов при первом использовании:
+# их импорт занимает заметную часть холодного старта API, а нужны они не каждому процессу
+from config import YOUTUBE_UPLOAD_CHUNK_SIZE, EXTERNAL_TIMEOUTS
 from database import db_manager
+from metrics import track_external, BYTES_IN, BYTES_OUT
+from coordination import coordinator
+from resilience import call as resilient_call, is_transient, ExternalServiceError
+from youtube_quota import youtube_quota, is_quota_error
 import logging
 
 # Настройка логирования
@@ -27,6 +26,55 @@ class IntegrationManager:
     def __init__(self):
         self.youtube_service = None
         self.telegram_bot = None
+    
+    @staticmethod
+    def _credentials_from(creds_data: Dict[str, Any]):
+        from google.oauth2.credentials import Credentials
+        expiry = creds_data.get("expiry")
+        if expiry:
+            # google-auth сравнивает expiry с наивным UTC-временем
+            expiry = datetime.fromisoformat(expiry)
+            if expiry.tzinfo is not None:
+                expiry = expiry.astimezone(timezone.utc).replace(tzinfo=None)
+        return Credentials(
+            token=creds_data.get("access_token"),
+            refresh_token=creds_data.get("refresh_token"),
+            token_uri="https://oauth2.googleapis.com/token",
+            client_id=creds_data.get("client_id"),
+            client_secret=creds_data.get("client_secret"),
+            expiry=expiry or None
+        )
+    
+    async def _google_credentials(self, service: str, creds_data: Dict[str, Any]):
+        """Учетные данные Google; истекший токен обновляется одним воркером и сохраняется в БД для остальных"""
+        creds = self._credentials_from(creds_data)
+        if not (creds.expired and creds.refresh_token):
+            return creds
+        
+        async with coordinator.lock(f"oauth_refresh:{service}", ttl=60, timeout=90):
+            # Пока ждали блокировку, токен мог обновить другой воркер
+            stored = await db_manager.get_oauth_credentials(service, use_cache=False)
+            if stored:
+                creds_data = stored.get("credentials", creds_data)
+                creds = self._credentials_from(creds_data)
+            if creds.expired and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                await resilient_call("drive" if service == "google_drive" else service, "oauth.refresh", creds.refresh, Request())
+                await db_manager.save_oauth_credentials(service, {
+                    **creds_data,
+                    "access_token": creds.token,
+                    "expiry": creds.expiry.isoformat() if creds.expiry else None
+                })
+        return creds
+    
+    @staticmethod
+    def _build_google_service(api: str, version: str, creds, timeout: float):
+        """Клиент Google API с таймаутом сокета: зависший запрос не держит поток дольше timeout"""
+        import google_auth_httplib2
+        import httplib2
+        from googleapiclient.discovery import build
+        http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=timeout))
+        return build(api, version, http=http)
         
     # ==================== YOUTUBE INTEGRATION ====================
     
@@ -65,6 +113,7 @@ class IntegrationManager:
     
     async def handle_youtube_oauth_callback(self, code: str, state: str) -> Dict[str, Any]:
         """Обработка OAuth callback для YouTube"""
+        from google_auth_oauthlib.flow import Flow
         try:
             # Получаем сохраненные credentials
             credentials = await db_manager.get_oauth_credentials("youtube")
@@ -99,8 +148,8 @@ class IntegrationManager:
             )
             flow.redirect_uri = redirect_uri
             
-            # Обмениваем код на токен
-            flow.fetch_token(code=code)
+            # Обмениваем код на токен (код одноразовый - повтор только если запрос не ушел)
+            await resilient_call("youtube", "oauth.fetch_token", flow.fetch_token, code=code, idempotent=False)
             
             # Сохраняем токены
             token_data = {
@@ -130,6 +179,7 @@ class IntegrationManager:
     
     def _get_youtube_auth_url(self, client_id: str, redirect_uri: str, client_secret: str = "") -> str:
         """Получение URL для авторизации YouTube"""
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -150,6 +200,7 @@ class IntegrationManager:
     
     async def test_youtube_connection(self) -> Dict[str, Any]:
         """Тестирование подключения к YouTube API"""
+        from googleapiclient.errors import HttpError
         try:
             # Получение credentials из БД
             credentials = await db_manager.get_oauth_credentials("youtube")
@@ -162,19 +213,18 @@ class IntegrationManager:
                 return {"success": False, "error": "YouTube не авторизован. Выполните авторизацию."}
             
             # Создание сервиса YouTube
-            creds = Credentials(
-                token=creds_data.get("access_token"),
-                refresh_token=creds_data.get("refresh_token"),
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=creds_data.get("client_id"),
-                client_secret=creds_data.get("client_secret")
-            )
+            creds = await self._google_credentials("youtube", creds_data)
             
-            service = build('youtube', 'v3', credentials=creds)
+            service = self._build_google_service('youtube', 'v3', creds, EXTERNAL_TIMEOUTS["youtube"])
             
-            # Тестовый запрос
+            # Тестовый запрос (каждая попытка списывает квоту)
             request = service.channels().list(part="snippet", mine=True)
-            response = request.execute()
+            
+            async def _list_channels():
+                await youtube_quota.record("channels.list")
+                return await asyncio.to_thread(request.execute)
+            
+            response = await resilient_call("youtube", "channels.list", _list_channels)
             
             await db_manager.create_log("youtube_connection_test", {"success": True})
             
@@ -195,23 +245,21 @@ class IntegrationManager:
             await db_manager.create_log("youtube_connection_error", {"error": error_msg})
             return {"success": False, "error": error_msg}
     
-    async def upload_video_to_youtube(self, video_path: str, title: str, description: str = "", thumbnail_path: str = None) -> Dict[str, Any]:
-        """Загрузка видео на YouTube"""
+    async def upload_video_to_youtube(self, video_path: Optional[str], title: str, description: str = "", thumbnail_path: str = None, progress_callback=None, media_body=None) -> Dict[str, Any]:
+        """Загрузка видео на YouTube (возобновляемая, частями; progress_callback получает {"percent": ...})
+
+        Вместо файла можно передать готовый MediaUpload (media_body), например поток из ffmpeg.
+        """
+        from googleapiclient.http import MediaFileUpload
         try:
             credentials = await db_manager.get_oauth_credentials("youtube")
             if not credentials:
                 return {"success": False, "error": "YouTube credentials не настроены"}
             
             creds_data = credentials.get("credentials", {})
-            creds = Credentials(
-                token=creds_data.get("access_token"),
-                refresh_token=creds_data.get("refresh_token"),
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=creds_data.get("client_id"),
-                client_secret=creds_data.get("client_secret")
-            )
+            creds = await self._google_credentials("youtube", creds_data)
             
-            service = build('youtube', 'v3', credentials=creds)
+            service = self._build_google_service('youtube', 'v3', creds, EXTERNAL_TIMEOUTS["youtube"])
             
             # Подготовка метаданных видео
             body = {
@@ -232,11 +280,27 @@ class IntegrationManager:
             media_body = service.videos().insert(
                 part=','.join(body.keys()),
                 body=body,
-                media_body=video_path
+                media_body=media_body or MediaFileUpload(video_path, chunksize=YOUTUBE_UPLOAD_CHUNK_SIZE, resumable=True)
             )
             
-            # Выполнение загрузки
-            response = media_body.execute()
+            # Выполнение загрузки по частям (каждая в отдельном потоке, чтобы не блокировать параллельные стадии).
+            # Упавшая часть повторяется: сессия сама запросит у YouTube принятый объем и продолжит с него.
+            # Таймаут asyncio не ставится - повтор не должен пойти параллельно с зависшей частью,
+            # ее ограничивает таймаут сокета клиента
+            await youtube_quota.record("videos.insert")
+            response = None
+            with track_external("youtube", "videos.insert"):
+                while response is None:
+                    status, response = await resilient_call(
+                        "youtube", "videos.insert", media_body.next_chunk, timeout=None, track=False
+                    )
+                    if status and progress_callback:
+                        # Для потока без известного размера сообщаем только отправленные байты
+                        progress_callback({"percent": round(status.progress() * 100, 1)} if status.total_size else {"uploaded_bytes": status.resumable_progress})
+            if progress_callback:
+                progress_callback({"percent": 100.0})
+            if video_path:
+                BYTES_OUT.labels("youtube").inc(os.path.getsize(video_path))
             video_id = response['id']
             video_url = f"https://www.youtube.com/watch?v={video_id}"
             
@@ -244,13 +308,18 @@ class IntegrationManager:
             if thumbnail_path and os.path.exists(thumbnail_path):
                 try:
                     print(f"🖼️ Загрузка миниатюры: {thumbnail_path}")
-                    service.thumbnails().set(
-                        videoId=video_id,
-                        media_body=thumbnail_path
-                    ).execute()
+                    thumbnail_request = service.thumbnails().set(videoId=video_id, media_body=thumbnail_path)
+                    
+                    async def _set_thumbnail():
+                        await youtube_quota.record("thumbnails.set")
+                        return await asyncio.to_thread(thumbnail_request.execute)
+                    
+                    await resilient_call("youtube", "thumbnails.set", _set_thumbnail)
                     print(f"✅ Миниатюра загружена для видео {video_id}")
                 except Exception as e:
                     print(f"⚠️ Ошибка загрузки миниатюры: {e}")
+                    if is_quota_error(e):
+                        await youtube_quota.mark_exhausted()
                     # Продолжаем без миниатюры
             
             await db_manager.create_log(
@@ -269,16 +338,24 @@ class IntegrationManager:
             error_msg = f"YouTube upload error: {e}"
             logger.error(error_msg)
             await db_manager.create_log("youtube_upload_error", {"error": error_msg})
+            if is_quota_error(e):
+                # Квота исчерпана - загрузки до сброса не пройдут
+                await youtube_quota.mark_exhausted()
+                return {"success": False, "error": error_msg, "quota_exceeded": True}
+            if isinstance(e, ExternalServiceError) or is_transient(e):
+                # YouTube недоступен (повторы не помогли) - это не отсутствие настроек, заглушка не нужна
+                return {"success": False, "error": error_msg, "unavailable": True}
             return {"success": False, "error": error_msg}
     
     # ==================== TELEGRAM INTEGRATION ====================
     
     async def setup_telegram_bot(self, bot_token: str, chat_id: str) -> Dict[str, Any]:
         """Настройка Telegram Bot"""
+        from telegram import Bot
         try:
             # Тестирование токена
             bot = Bot(token=bot_token)
-            bot_info = await bot.get_me()
+            bot_info = await resilient_call("telegram", "get_me", bot.get_me)
             
             credentials_data = {
                 "bot_token": bot_token,
@@ -314,6 +391,7 @@ class IntegrationManager:
     
     async def test_telegram_connection(self) -> Dict[str, Any]:
         """Тестирование подключения к Telegram"""
+        from telegram import Bot
         try:
             credentials = await db_manager.get_oauth_credentials("telegram")
             if not credentials:
@@ -328,13 +406,14 @@ class IntegrationManager:
             
             # Тестирование бота
             bot = Bot(token=bot_token)
-            bot_info = await bot.get_me()
+            bot_info = await resilient_call("telegram", "get_me", bot.get_me)
             
             # Тестирование отправки сообщения (если указан chat_id)
             if chat_id:
                 try:
                     test_message = f"🧪 Тест подключения UAC Creative Manager\nВремя: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-                    await bot.send_message(chat_id=chat_id, text=test_message)
+                    await resilient_call("telegram", "send_message", bot.send_message,
+                                         chat_id=chat_id, text=test_message, idempotent=False)
                     message_sent = True
                 except Exception as e:
                     message_sent = False
@@ -363,6 +442,7 @@ class IntegrationManager:
     
     async def send_telegram_notification(self, message: str, parse_mode: str = "HTML") -> Dict[str, Any]:
         """Отправка уведомления в Telegram"""
+        from telegram import Bot
         try:
             credentials = await db_manager.get_oauth_credentials("telegram")
             if not credentials:
@@ -376,7 +456,9 @@ class IntegrationManager:
                 return {"success": False, "error": "Telegram Bot токен или chat_id не настроены"}
             
             bot = Bot(token=bot_token)
-            await bot.send_message(chat_id=chat_id, text=message, parse_mode=parse_mode)
+            # Отправка не идемпотентна: повтор только если сообщение точно не принято (сеть, RetryAfter)
+            await resilient_call("telegram", "send_message", bot.send_message,
+                                 chat_id=chat_id, text=message, parse_mode=parse_mode, idempotent=False)
             
             await db_manager.create_log("telegram_notification_sent", {"message_length": len(message)})
             
@@ -426,6 +508,7 @@ class IntegrationManager:
     
     def _get_google_drive_auth_url(self, client_id: str, redirect_uri: str) -> str:
         """Получение URL для авторизации Google Drive"""
+        from google_auth_oauthlib.flow import Flow
         flow = Flow.from_client_config(
             {
                 "web": {
@@ -456,18 +539,12 @@ class IntegrationManager:
                 return {"success": False, "error": "Google Drive не авторизован. Выполните авторизацию."}
             
             # Создание сервиса Google Drive
-            creds = Credentials(
-                token=creds_data.get("access_token"),
-                refresh_token=creds_data.get("refresh_token"),
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=creds_data.get("client_id"),
-                client_secret=creds_data.get("client_secret")
-            )
+            creds = await self._google_credentials("google_drive", creds_data)
             
-            service = build('drive', 'v3', credentials=creds)
+            service = self._build_google_service('drive', 'v3', creds, EXTERNAL_TIMEOUTS["drive"])
             
             # Тестовый запрос - получение информации о пользователе
-            about = service.about().get(fields="user").execute()
+            about = await resilient_call("drive", "about.get", service.about().get(fields="user").execute)
             
             await db_manager.create_log("google_drive_connection_test", {"success": True})
             
@@ -483,6 +560,20 @@ class IntegrationManager:
             await db_manager.create_log("google_drive_connection_error", {"error": error_msg})
             return {"success": False, "error": error_msg}
     
+    async def get_google_drive_service(self):
+        """Создание клиента Google Drive API из сохраненных токенов"""
+        credentials = await db_manager.get_oauth_credentials("google_drive")
+        if not credentials:
+            return None
+
+        creds_data = credentials.get("credentials", {})
+        if not creds_data.get("access_token"):
+            return None
+
+        creds = await self._google_credentials("google_drive", creds_data)
+
+        return self._build_google_service('drive', 'v3', creds, EXTERNAL_TIMEOUTS["drive"])
+
     async def download_from_google_drive(self, file_id: str) -> Dict[str, Any]:
         """Скачивание файла из Google Drive"""
         try:
@@ -491,22 +582,17 @@ class IntegrationManager:
                 return {"success": False, "error": "Google Drive credentials не настроены"}
             
             creds_data = credentials.get("credentials", {})
-            creds = Credentials(
-                token=creds_data.get("access_token"),
-                refresh_token=creds_data.get("refresh_token"),
-                token_uri="https://oauth2.googleapis.com/token",
-                client_id=creds_data.get("client_id"),
-                client_secret=creds_data.get("client_secret")
-            )
+            creds = await self._google_credentials("google_drive", creds_data)
             
-            service = build('drive', 'v3', credentials=creds)
+            service = self._build_google_service('drive', 'v3', creds, EXTERNAL_TIMEOUTS["drive"])
             
             # Получение информации о файле
-            file_metadata = service.files().get(fileId=file_id).execute()
+            file_metadata = await resilient_call("drive", "files.get", service.files().get(fileId=file_id).execute)
             
-            # Скачивание файла
+            # Скачивание файла (длительность зависит от размера - ограничивает только таймаут сокета)
             request = service.files().get_media(fileId=file_id)
-            file_content = request.execute()
+            file_content = await resilient_call("drive", "files.get_media", request.execute, timeout=None)
+            BYTES_IN.labels("drive").inc(len(file_content))
             
             await db_manager.create_log(
                 "file_downloaded_from_drive",
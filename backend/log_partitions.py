@@ -0,0 +1,167 @@
+"""
+Секции таблицы logs: хранение и постраничное чтение
+
+Таблица logs секционирована по месяцам (sql/create_tables.sql, раздел
+«ПАРТИЦИИ ЛОГОВ»). Фоновая задача раз в LOG_RETENTION_INTERVAL создает
+секции на LOG_PARTITIONS_AHEAD месяцев вперед и удаляет секции старше
+LOG_RETENTION_MONTHS (или отсоединяет их в архивные таблицы при
+LOG_ARCHIVE). Удаление секции - это DROP TABLE, а не DELETE миллионов строк:
+вставки не замедляются, таблица не раздувается. При нескольких воркерах
+задачу выполняет один из них (ключ у координатора на интервал).
+
+Создание и удаление секций - это DDL: функции ensure_log_partitions и
+drop_log_partitions закрыты для ключей API и вызываются через прямое
+соединение DATABASE_URL (нужен psycopg2), как массовый импорт шаблонов.
+
+GET /logs читает страницы по ключу (created_at, id): курсор - позиция
+последней строки, а не OFFSET, поэтому дальние страницы не дороже первых.
+"""
+import asyncio
+import base64
+import json
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import DATABASE_URL, LOG_RETENTION_MONTHS, LOG_ARCHIVE, LOG_PARTITIONS_AHEAD, LOG_RETENTION_INTERVAL
+from coordination import coordinator
+
+logger = logging.getLogger(__name__)
+
+# Первый запуск после старта: клиент БД к этому времени прогрет и не грузится в цикле событий
+START_DELAY = 60
+# Ожидание блокировки logs при DDL: не держим вставки логов, при занятой таблице повтор в следующий интервал
+LOCK_TIMEOUT = "5s"
+
+
+class InvalidLogQuery(ValueError):
+    """Некорректный курсор или фильтр metadata"""
+
+
+class LogPartitionsError(Exception):
+    """Обслуживание секций недоступно: нет psycopg2 или соединения с PostgreSQL"""
+
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    raw = json.dumps([row["created_at"], row["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    """(created_at, id) последней строки предыдущей страницы"""
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        datetime.fromisoformat(created_at)
+        return created_at, str(uuid.UUID(row_id))
+    except (ValueError, TypeError):
+        raise InvalidLogQuery("Некорректный cursor")
+
+
+def parse_metadata_filters(pairs: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """Фильтры meta=ключ=значение в объект для metadata @>
+
+    Значение разбирается как JSON (числа, true/false), иначе сравнивается как
+    строка: meta=batch_index=2 и meta=campaign_name=Весна.
+    """
+    if not pairs:
+        return None
+    filters = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise InvalidLogQuery(f"meta: ожидается ключ=значение, получено {pair}")
+        try:
+            filters[key] = json.loads(value)
+        except ValueError:
+            filters[key] = value
+    return filters
+
+
+class LogPartitions:
+    """Периодическое создание секций логов и удаление старых"""
+
+    def __init__(self, keep_months: int = LOG_RETENTION_MONTHS, archive: bool = LOG_ARCHIVE,
+                 months_ahead: int = LOG_PARTITIONS_AHEAD, interval: int = LOG_RETENTION_INTERVAL,
+                 dsn: str = DATABASE_URL):
+        self.keep_months = keep_months
+        self.archive = archive
+        self.months_ahead = months_ahead
+        self.interval = interval
+        self.dsn = dsn
+        self._task: Optional[asyncio.Task] = None
+        self.last_run: Optional[Dict[str, Any]] = None
+
+    def _connect(self):
+        try:
+            import psycopg2
+        except ImportError:
+            raise LogPartitionsError("Для обслуживания секций логов нужен psycopg2")
+
+        try:
+            return psycopg2.connect(self.dsn)
+        except psycopg2.Error as e:
+            raise LogPartitionsError(f"Нет соединения с PostgreSQL: {e}")
+
+    def _call(self, connection, query: str, params: Tuple[Any, ...]) -> List[str]:
+        """Вызов функции обслуживания в отдельной короткой транзакции"""
+        with connection, connection.cursor() as cursor:
+            cursor.execute(f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}'")
+            cursor.execute(query, params)
+            return cursor.fetchone()[0] or []
+
+    def _maintain(self) -> Dict[str, List[str]]:
+        """Синхронная часть run(): секции вперед, затем удаление старых; 0 месяцев хранения - без удаления"""
+        connection = self._connect()
+        try:
+            created = self._call(connection, "SELECT ensure_log_partitions(%s)", (self.months_ahead,))
+            removed = []
+            if self.keep_months > 0:
+                removed = self._call(connection, "SELECT drop_log_partitions(%s, %s)", (self.keep_months, self.archive))
+            return {"created": created, "removed": removed}
+        finally:
+            connection.close()
+
+    async def run(self) -> Dict[str, Any]:
+        """Секции на будущие месяцы и удаление (архивирование) устаревших"""
+        # psycopg2 синхронный - обслуживание в потоке, цикл событий не блокируется
+        result = await asyncio.to_thread(self._maintain)
+        self.last_run = {"at": time.time(), **result}
+        if result["created"] or result["removed"]:
+            action = "архивированы" if self.archive else "удалены"
+            print(f"🗂 Логи: созданы секции {result['created'] or '-'}, {action} {result['removed'] or '-'}")
+        return result
+
+    async def _loop(self):
+        await asyncio.sleep(START_DELAY)
+        while True:
+            try:
+                # Одна проверка за интервал на все воркеры
+                if await coordinator.add("logs:retention", time.time(), ttl=self.interval * 0.9):
+                    await self.run()
+            except Exception as e:
+                logger.error(f"Log partitions maintenance error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "retention_months": self.keep_months,
+            "archive": self.archive,
+            "months_ahead": self.months_ahead,
+            "last_run": self.last_run,
+        }
+
+
+# Глобальное обслуживание секций логов
+log_partitions = LogPartitions()
@@ -0,0 +1,180 @@
+"""
+Сторож цикла событий: где блокируется цикл
+
+Синхронные вызовы внутри async-обработчиков (клиент Supabase, клиенты
+Google, subprocess.run) останавливают цикл событий целиком: все запросы
+воркера ждут. Задача-пульс просыпается каждые LOOP_WATCH_INTERVAL_MS и
+измеряет, на сколько опоздала (uac_event_loop_lag_seconds). Фоновый поток
+следит за пульсом; если его нет дольше LOOP_STALL_THRESHOLD_MS, он снимает
+стек потока цикла - в нем и есть блокирующий вызов.
+
+Остановки группируются по месту вызова: самому глубокому кадру кода
+проекта в стеке (не стандартной библиотеки и не site-packages), например
+"database.py:120 DatabaseManager.get_uploads". Для каждого места хранятся
+число остановок, суммарная и максимальная длительность и стек самой долгой.
+Отчет - GET /debug/loop, счетчики - uac_event_loop_stalls_total{site}.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from config import LOOP_WATCH_ENABLED, LOOP_WATCH_INTERVAL_MS, LOOP_STALL_THRESHOLD_MS, LOOP_STALL_MAX_SITES
+from metrics import LOOP_LAG_SECONDS, LOOP_STALLS, LOOP_STALL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# Стек в отчете обрезается до последних кадров
+STACK_DEPTH = 30
+# Место остановки, которую поток не успел застать (короче порога плюс период опроса)
+UNKNOWN_SITE = "unknown"
+
+
+def _is_project(filename: str) -> bool:
+    path = os.path.abspath(filename)
+    return path.startswith(PROJECT_DIR + os.sep) and "site-packages" not in path and path != os.path.abspath(__file__)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{os.path.relpath(code.co_filename, PROJECT_DIR) if _is_project(code.co_filename) else code.co_filename}:{frame.f_lineno} {name}"
+
+
+def blocking_site(frame) -> Dict[str, Any]:
+    """Место блокирующего вызова в стеке потока цикла: кадр проекта, лист и стек"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    # frames: от листа к корню
+    site = next((f for f in frames if _is_project(f.f_code.co_filename)), None)
+    return {
+        "site": _frame_label(site) if site is not None else _frame_label(frames[0]) if frames else UNKNOWN_SITE,
+        "leaf": _frame_label(frames[0]) if frames else None,
+        "stack": [_frame_label(f) for f in reversed(frames[:STACK_DEPTH])],
+    }
+
+
+class LoopWatch:
+    """Пульс цикла событий, поток-сторож и сводка остановок по местам вызова"""
+
+    def __init__(self, interval_ms: float = LOOP_WATCH_INTERVAL_MS, threshold_ms: float = LOOP_STALL_THRESHOLD_MS,
+                 max_sites: int = LOOP_STALL_MAX_SITES):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.max_sites = max_sites
+        self._beat = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        # Стек, застигнутый сторожем во время текущей остановки
+        self._captured: Optional[Dict[str, Any]] = None
+        self.sites: Dict[str, Dict[str, Any]] = {}
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.stalls = 0
+
+    # ==================== ПУЛЬС ====================
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(now - started - self.interval, 0.0)
+            self._beat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+            with self._lock:
+                captured, self._captured = self._captured, None
+            if lag >= self.threshold:
+                self._record(captured or {"site": UNKNOWN_SITE, "leaf": None, "stack": []}, lag)
+
+    def _record(self, captured: Dict[str, Any], duration: float):
+        self.stalls += 1
+        site = captured["site"]
+        LOOP_STALLS.labels(site).inc()
+        LOOP_STALL_SECONDS.labels(site).inc(duration)
+        entry = self.sites.get(site)
+        if entry is None:
+            if len(self.sites) >= self.max_sites:
+                # Вытесняется место с наименьшим суммарным временем
+                del self.sites[min(self.sites, key=lambda s: self.sites[s]["total_s"])]
+            entry = self.sites[site] = {"site": site, "count": 0, "total_s": 0.0, "max_s": 0.0}
+        entry["count"] += 1
+        entry["total_s"] += duration
+        entry["last_at"] = time.time()
+        if duration >= entry["max_s"]:
+            entry.update(max_s=duration, leaf=captured["leaf"], stack=captured["stack"])
+        logger.warning(f"Event loop blocked for {duration * 1000:.0f} ms at {site}")
+
+    # ==================== СТОРОЖ ====================
+
+    def _watch(self):
+        # Опрос чаще порога, чтобы застать остановку, пока она идет
+        poll = min(self.interval, self.threshold) / 2
+        while not self._stopped.wait(poll):
+            if time.monotonic() - self._beat - self.interval < self.threshold:
+                continue
+            with self._lock:
+                if self._captured is not None:
+                    continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            captured = blocking_site(frame)
+            with self._lock:
+                self._captured = captured
+
+    def start(self):
+        if not LOOP_WATCH_ENABLED or self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watch", daemon=True)
+        self._thread.start()
+        print(f"🐢 Loop watch: остановки цикла событий дольше {self.threshold * 1000:.0f} мс записываются")
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self.sites.clear()
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def report(self) -> Dict[str, Any]:
+        """Сводка для /debug/loop: места блокирующих вызовов по суммарному времени остановок"""
+        sites: List[Dict[str, Any]] = sorted(self.sites.values(), key=lambda s: s["total_s"], reverse=True)
+        return {
+            "running": self._task is not None,
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "lag_ms": {"last": round(self.last_lag * 1000, 1), "max": round(self.max_lag * 1000, 1)},
+            "stalls": self.stalls,
+            "sites": [
+                {**site, "total_s": round(site["total_s"], 3), "max_s": round(site["max_s"], 3)}
+                for site in sites
+            ],
+        }
+
+
+# Глобальный сторож цикла событий
+loop_watch = LoopWatch()
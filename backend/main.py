@@ -1,17 +1,41 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
+from starlette.requests import ClientDisconnect
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import os
 import uuid
 from datetime import datetime
 import asyncio
-import aiofiles
 from pathlib import Path
 from database import db_manager
-from config import ALLOWED_ORIGINS, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_VIDEO_TYPES, ALLOWED_IMAGE_TYPES
+from config import ALLOWED_ORIGINS, UPLOAD_DIR, MAX_FILE_SIZE, ALLOWED_VIDEO_TYPES, ALLOWED_IMAGE_TYPES, DRIVE_WATCH_ENABLED
+from config import PIPELINE_QUEUE_SIZE, PIPELINE_STAGE_CONCURRENCY, PROCESSING_MODE, PROCESSING_MODES
+from config import ARTIFACT_DELETE_AFTER_UPLOAD, ADMIN_TOKEN, STREAMING_UPLOAD_ENABLED, MODAL_PREVIEW_SIZES, STARTUP_MODE
+from config import YOUTUBE_QUOTA_MAX_WAIT, API_WORKERS, STORAGE_CHUNK_SIZE, PROFILING_ENABLED, LOGS_PAGE_MAX
 from integrations import integration_manager
+from drive_watcher import drive_watcher
+from media import run_command, probe_video, get_video_stream, get_duration, stream_copy_plan
+from encoding_profiles import build_video_args
+from pipeline import Stage, run_pipeline
+from metrics import track_stage, observe_cache, render_metrics, BYTES_IN, PROCESSING_PATHS
+from progress import progress_tracker, ProgressReporter
+from artifacts import artifact_manager
+from migrations import apply_migrations
+from youtube_quota import youtube_quota, QuotaExhaustedError
+from resilience import ExternalServiceError, breaker_states
+from coordination import coordinator, LockNotAcquired
+from scheduler import scheduler, JobCancelledError
+from checkpoints import batch_checkpoints, resume_stage, CheckpointError, STAGES as CHECKPOINT_STAGES
+from previews import generate_previews, preview_path, get_etag, get_content_type, etag_matches, CACHE_CONTROL
+from storage import storage, key_for
+from registry_events import registry_events, TABLES as REGISTRY_TABLES
+from resumable import resumable_uploads, parse_metadata, ResumableUploadError, TUS_VERSION, PATCH_CONTENT_TYPE
+from profiling import request_profiler
+from loop_watch import loop_watch
+from template_bulk import template_bulk, detect_format, TemplateImportError
+from log_partitions import log_partitions, encode_cursor, decode_cursor, parse_metadata_filters, InvalidLogQuery, LogPartitionsError
 
 app = FastAPI(title="UAC Creative Manager", version="1.0.0")
 
@@ -22,8 +46,35 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Заголовки возобновляемой загрузки должны быть видны клиенту
+    expose_headers=["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable", "X-Request-ID", "X-Profile-Id"],
 )
 
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    """Профилирование запроса по X-Profile: 1 или ?profile=1 с X-Admin-Token
+
+    Без ADMIN_TOKEN флаг игнорируется: иначе любой клиент мог бы запустить семплирование.
+    """
+    flag = request.headers.get("x-profile") or request.query_params.get("profile")
+    if not PROFILING_ENABLED or not ADMIN_TOKEN or (flag or "").lower() not in ("1", "true"):
+        return await call_next(request)
+    if request.headers.get("x-admin-token") != ADMIN_TOKEN:
+        return JSONResponse(status_code=403, content={"detail": "Профилирование требует X-Admin-Token"})
+
+    request_id = request.headers.get("x-request-id") or request_profiler.new_request_id()
+    profile = request_profiler.start(request_id, request.method, request.url.path)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        request_profiler.stop(profile, status_code)
+        await request_profiler.save(profile)
+    response.headers["X-Request-ID"] = request_id
+    response.headers["X-Profile-Id"] = request_id
+    return response
+
 # Модели данных
 class VideoUpload(BaseModel):
     campaign_name: str
@@ -54,34 +105,226 @@ class Upload(BaseModel):
     metrics: Optional[dict] = None
 
 # Инициализация базы данных при запуске
+async def warm_up_database():
+    """Прогрев БД: клиент Supabase, одноразовые миграции данных и лог старта"""
+    try:
+        applied = await apply_migrations()
+        await db_manager.create_log("app_startup", {"message": "UAC Creative Manager started", "migrations_applied": applied})
+        print("✅ Database connected successfully")
+    except Exception as db_error:
+        print(f"⚠️ Database connection failed: {db_error}")
+        print("💡 To fix this:")
+        print("   1. Get API keys from Supabase Dashboard")
+        print("   2. Update config.py with your keys")
+        print("   3. Run: python3 init_db.py")
+        print("   4. Restart the application")
+
+def preload_integrations():
+    """Импорт клиентов Google и Telegram заранее (в режиме fast они грузятся при первом использовании)"""
+    import googleapiclient.discovery
+    import google_auth_oauthlib.flow
+    import telegram
+    import streaming
+
+_warmup_task: Optional[asyncio.Task] = None
+
 @app.on_event("startup")
 async def startup_event():
     """Инициализация при запуске приложения"""
+    global _warmup_task
     try:
         print("🚀 Starting UAC Creative Manager...")
+        # Замер задержки цикла событий и поиск блокирующих вызовов (/debug/loop)
+        loop_watch.start()
+        if API_WORKERS > 1 and not coordinator.shared:
+            print("⚠️ API_WORKERS > 1 без REDIS_URL: блокировки и прогресс не разделяются между воркерами")
+        
+        if STARTUP_MODE == "eager":
+            await warm_up_database()
+            preload_integrations()
+        else:
+            # Клиент Supabase синхронный: прогрев идет в отдельном потоке со своим циклом событий,
+            # чтобы импорт supabase и сетевые запросы не задерживали первые запросы к API
+            _warmup_task = asyncio.create_task(asyncio.to_thread(asyncio.run, warm_up_database()))
         
-        # Проверка подключения к базе данных
-        try:
-            await db_manager.create_default_roles()
-            await db_manager.create_log("app_startup", {"message": "UAC Creative Manager started"})
-            print("✅ Database connected successfully")
-        except Exception as db_error:
-            print(f"⚠️ Database connection failed: {db_error}")
-            print("💡 To fix this:")
-            print("   1. Get API keys from Supabase Dashboard")
-            print("   2. Update config.py with your keys")
-            print("   3. Run: python3 init_db.py")
-            print("   4. Restart the application")
+        # Запуск наблюдателя за папками Google Drive
+        if DRIVE_WATCH_ENABLED:
+            drive_watcher.set_handler(ingest_drive_file)
+            drive_watcher.start()
+            print("☁️ Drive folder watcher started")
+        
+        # Периодическая очистка артефактов на диске (TTL и квоты каталогов)
+        artifact_manager.start()
+        
+        # Изменения uploads/templates из PostgreSQL для потоков /registry/events
+        registry_events.start()
+        
+        # Секции logs на следующие месяцы и удаление секций старше срока хранения
+        log_partitions.start()
         
         print("🌟 Application started successfully!")
         
     except Exception as e:
         print(f"❌ Application startup failed: {e}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Остановка фоновых задач"""
+    await drive_watcher.stop()
+    await artifact_manager.stop()
+    await registry_events.stop()
+    await log_partitions.stop()
+    await loop_watch.stop()
+
 @app.get("/")
 async def root():
     return {"message": "UAC Creative Manager API"}
 
+@app.get("/uploads/progress/{batch_id}")
+async def upload_progress(batch_id: str):
+    """Поток прогресса пакета загрузки (Server-Sent Events)"""
+    return StreamingResponse(
+        progress_tracker.stream(batch_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/uploads/batches/{batch_id}/cancel")
+async def cancel_upload_batch(batch_id: str):
+    """Отмена пакета: задания снимаются с очередей, выполняющиеся стадии прерываются"""
+    result = await scheduler.cancel(batch_id=batch_id)
+    await db_manager.create_log("upload_batch_cancelled", {"batch_id": batch_id, **result})
+    return {"success": True, **result}
+
+@app.get("/scheduler")
+async def get_scheduler_status():
+    """Слоты, очереди по классам приоритета и статистика ожидания планировщика (этого воркера)"""
+    return {"success": True, **scheduler.status()}
+
+@app.post("/scheduler/jobs/{job_id}/cancel")
+async def cancel_scheduler_job(job_id: str):
+    """Отмена одного задания по job_id из GET /scheduler"""
+    result = await scheduler.cancel(job_id=job_id)
+    await db_manager.create_log("upload_job_cancelled", {"job_id": job_id, **result})
+    return {"success": True, **result}
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Проверка токена администратора (если ADMIN_TOKEN задан)"""
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Требуется X-Admin-Token")
+
+def require_profiling(x_admin_token: Optional[str] = Header(None)):
+    """Профили доступны, только если профилирование включено и задан ADMIN_TOKEN"""
+    if not PROFILING_ENABLED or not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Профилирование выключено")
+    require_admin(x_admin_token)
+
+@app.get("/admin/artifacts", dependencies=[Depends(require_admin)])
+async def get_artifacts_status():
+    """Состояние артефактов на диске: объем, квоты и закрепленные файлы по каталогам"""
+    return {"success": True, **artifact_manager.status()}
+
+@app.post("/admin/artifacts/cleanup", dependencies=[Depends(require_admin)])
+async def cleanup_artifacts():
+    """Внеочередная очистка артефактов по TTL и квотам"""
+    result = await artifact_manager.cleanup_shared()
+    await db_manager.create_log("artifacts_cleanup", result)
+    return {"success": True, **result}
+
+@app.get("/admin/profiles", dependencies=[Depends(require_profiling)])
+async def list_profiles():
+    """Последние профили запросов всех воркеров"""
+    return {"success": True, "profiles": await request_profiler.recent()}
+
+@app.get("/admin/profiles/{request_id}", dependencies=[Depends(require_profiling)])
+async def get_profile(request_id: str, format: str = "folded"):
+    """Профиль запроса: collapsed stacks для flamegraph.pl/inferno/speedscope или JSON с метаданными"""
+    if format not in ("folded", "json"):
+        raise HTTPException(status_code=400, detail="Неизвестный формат. Доступны: folded, json")
+    profile = await request_profiler.get(request_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Профиль не найден или истек")
+    if format == "json":
+        return {"success": True, **profile}
+    return Response(
+        content=profile["folded"],
+        media_type="text/plain; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="profile-{request_id}.folded"'}
+    )
+
+@app.get("/debug/loop", dependencies=[Depends(require_admin)])
+async def get_loop_report():
+    """Задержка цикла событий этого воркера и места блокирующих вызовов по суммарному времени остановок"""
+    return {"success": True, "worker_id": coordinator.status()["worker_id"], **loop_watch.report()}
+
+@app.post("/debug/loop/reset", dependencies=[Depends(require_admin)])
+async def reset_loop_report():
+    """Сброс сводки остановок (например, после исправления блокирующего вызова)"""
+    loop_watch.reset()
+    return {"success": True}
+
+@app.get("/logs", dependencies=[Depends(require_admin)])
+async def get_logs(
+    action: Optional[List[str]] = Query(None),
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    meta: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=LOGS_PAGE_MAX)
+):
+    """Логи, новые первыми: фильтры по action, интервалу created_at и metadata (meta=ключ=значение),
+    страницы по курсору next_cursor"""
+    try:
+        after_created_at, after_id = decode_cursor(cursor) if cursor else (None, None)
+        filters = {
+            "actions": action,
+            "since": since.isoformat() if since else None,
+            "until": until.isoformat() if until else None,
+            "metadata": parse_metadata_filters(meta),
+            "after_created_at": after_created_at,
+            "after_id": after_id
+        }
+    except InvalidLogQuery as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Лишняя строка показывает, есть ли следующая страница
+    rows = await db_manager.query_logs(filters, limit + 1)
+    items = rows[:limit]
+    return {
+        "success": True,
+        "logs": items,
+        "next_cursor": encode_cursor(items[-1]) if len(rows) > limit else None
+    }
+
+@app.get("/admin/logs/partitions", dependencies=[Depends(require_admin)])
+async def get_log_partitions_status():
+    """Настройки хранения логов и результат последнего обслуживания секций на этом воркере"""
+    return {"success": True, **log_partitions.status()}
+
+@app.post("/admin/logs/partitions/maintain", dependencies=[Depends(require_admin)])
+async def maintain_log_partitions():
+    """Внеочередное создание секций логов и удаление (архивирование) устаревших"""
+    try:
+        result = await log_partitions.run()
+    except LogPartitionsError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"success": True, **result}
+
+@app.get("/health/dependencies")
+async def dependencies_health():
+    """Состояние автоматических выключателей внешних сервисов, бэкенд координации воркеров и хранилище файлов"""
+    return {
+        "dependencies": breaker_states(),
+        "coordination": coordinator.status(),
+        "storage": storage.status(),
+        "registry_events": registry_events.status()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Метрики в формате Prometheus"""
+    body, content_type = render_metrics()
+    return Response(content=body, headers={"Content-Type": content_type})
+
 @app.post("/upload/video")
 async def upload_video(
     campaign_name: str = Form(...),
@@ -90,7 +333,10 @@ async def upload_video(
     thumbnail_option: str = Form(...),
     modal_image_id: Optional[str] = Form(None),
     create_formats: bool = Form(False),
-    video_file: Optional[UploadFile] = File(None)
+    video_file: Optional[UploadFile] = File(None),
+    upload_ref: Optional[str] = Form(None),  # id завершенной возобновляемой загрузки вместо video_file
+    processing: str = Form(PROCESSING_MODE),  # uniquify или metadata (только очистка метаданных)
+    batch_id: Optional[str] = Form(None)  # ID для потока прогресса /uploads/progress/{batch_id}
 ):
     """Загрузка видео на YouTube"""
     try:
@@ -109,121 +355,39 @@ async def upload_video(
             "thumbnail_option": thumbnail_option,
             "modal_image_id": modal_image_id,
             "video_filename": video_file.filename if video_file else None,
-            "video_content_type": video_file.content_type if video_file else None
+            "video_content_type": video_file.content_type if video_file else None,
+            "upload_ref": upload_ref
         })
-        # Генерация уникального ID для загрузки
-        upload_id = str(uuid.uuid4())
-        
-        # Обработка видео в зависимости от источника
-        print(f"🔧 Начинаем обработку видео...")
-        original_filename = None
-        if video_source == "local" and video_file:
-            # Обработка локального файла
-            print(f"📁 Сохранение загруженного файла...")
-            original_filename = video_file.filename
-            file_path = await save_uploaded_file(video_file)
-            print(f"✅ Файл сохранен: {file_path}")
-            
-            print(f"🔧 Обработка видео (очистка метаданных и уникализация)...")
-            processed_path = await process_video(file_path, upload_id)
-            print(f"✅ Видео обработано: {processed_path}")
-        elif video_source == "drive" and drive_url:
-            # Скачивание из Google Drive
-            print(f"☁️ Скачивание из Google Drive...")
-            original_filename = drive_url.split('/')[-1]  # Берем последнюю часть URL
-            processed_path = await download_from_drive(drive_url, upload_id)
-            print(f"✅ Видео скачано: {processed_path}")
-        else:
+        # Проверка параметров загрузки
+        if not ((video_source == "local" and (video_file or upload_ref)) or (video_source == "drive" and drive_url)):
             print(f"❌ Неверные параметры загрузки")
             raise HTTPException(status_code=400, detail="Неверные параметры загрузки")
+        if processing not in PROCESSING_MODES:
+            raise HTTPException(status_code=400, detail=f"processing: ожидается одно из {', '.join(PROCESSING_MODES)}")
+        
+        job = create_upload_job(
+            campaign_name=campaign_name,
+            thumbnail_option=thumbnail_option,
+            modal_image_id=modal_image_id,
+            create_formats=create_formats,
+            copy_number=1,  # Номер копии (для одиночной загрузки всегда 1)
+            log_action="video_uploaded",
+            video_source=video_source,
+            video_file=video_file,
+            upload_ref=upload_ref,
+            drive_url=drive_url,
+            processing=processing,
+            progress=progress_tracker.reporter(batch_id, 0),
+            priority="single"  # интерактивная загрузка обгоняет пакеты в очередях планировщика
+        )
         
-        # Определяем ориентацию видео
-        print(f"📐 Определение ориентации видео...")
-        orientation = await get_video_orientation(processed_path)
-        print(f"✅ Ориентация видео: {orientation}")
-        
-        # Номер копии (для одиночной загрузки всегда 1)
-        video_copy_number = 1
+        # Одиночная загрузка проходит те же стадии, что и пакетная
+        print(f"🔧 Начинаем обработку видео...")
+        [item] = await run_upload_pipeline([job], batch_id)
+        if not item.success:
+            raise item.error
         
-        # Список видео для загрузки (основное + другие форматы)
-        videos_to_upload = [
-            {
-                "path": processed_path,
-                "orientation": orientation,
-                "copy_number": video_copy_number
-            }
-        ]
-        
-        # Создаем другие форматы если выбрана опция
-        if create_formats:
-            print(f"🎬 Создание других форматов видео...")
-            other_formats = await create_other_formats(processed_path, upload_id, orientation)
-            
-            # Добавляем созданные форматы с тем же номером копии
-            for fmt in other_formats:
-                videos_to_upload.append({
-                    "path": fmt["path"],
-                    "orientation": fmt["orientation"],
-                    "copy_number": video_copy_number  # Тот же номер для всех форматов
-                })
-        
-        # Загружаем все видео на YouTube
-        upload_results = []
-        
-        for video_data in videos_to_upload:
-            # Генерируем название для каждого видео
-            video_title = generate_video_title(
-                campaign_name,
-                video_data["orientation"],
-                video_data["copy_number"]
-            )
-            
-            print(f"📤 Загрузка: {video_title}")
-            
-            # Обработка миниатюры
-            thumbnail_path = await process_thumbnail(
-                video_data["path"], thumbnail_option, modal_image_id
-            )
-            
-            # Загрузка на YouTube
-            youtube_url = await upload_to_youtube(video_data["path"], video_title, thumbnail_path)
-            
-            # Сохранение в базу данных
-            upload_data = {
-                "youtube_url": youtube_url,
-                "video_title": video_title,
-                "campaign_name": campaign_name,
-                "thumbnail_type": thumbnail_option,
-                "thumbnail_image_id": modal_image_id if thumbnail_option == "soft_modal" else None,
-                "status": "active"
-            }
-            
-            upload_record = await db_manager.create_upload(upload_data)
-            
-            # Убираем расширение из имени файла для группы
-            group_name = original_filename.rsplit('.', 1)[0] if original_filename else f"{campaign_name} #{video_data['copy_number']}"
-            
-            upload_results.append({
-                "upload_id": upload_record["id"],
-                "youtube_url": youtube_url,
-                "video_title": video_title,
-                "orientation": video_data["orientation"],
-                "copy_number": video_data["copy_number"],
-                "group_name": group_name,
-                "original_filename": original_filename
-            })
-            
-            # Логирование успешной загрузки
-            await db_manager.create_log(
-                "video_uploaded",
-                {
-                    "upload_id": upload_record["id"],
-                    "campaign_name": campaign_name,
-                    "youtube_url": youtube_url,
-                    "thumbnail_type": thumbnail_option,
-                    "orientation": video_data["orientation"]
-                }
-            )
+        upload_results = job["results"]
         
         # Возвращаем результаты
         if len(upload_results) == 1:
@@ -258,7 +422,13 @@ async def upload_video(
             "thumbnail_option": thumbnail_option
         })
         return JSONResponse(
-            status_code=500,
+            status_code=(
+                429 if isinstance(e, QuotaExhaustedError)
+                else 503 if isinstance(e, ExternalServiceError)
+                else 409 if isinstance(e, JobCancelledError)
+                else e.status_code if isinstance(e, (ResumableUploadError, HTTPException))
+                else 500
+            ),
             content={"success": False, "error": str(e), "error_type": type(e).__name__}
         )
 
@@ -270,12 +440,24 @@ async def upload_videos_batch(
     thumbnail_option: str = Form(...),
     modal_image_id: Optional[str] = Form(None),
     create_formats: bool = Form(False),
-    video_files: List[UploadFile] = File(...)
+    video_files: List[UploadFile] = File(None),
+    upload_refs: Optional[str] = Form(None),  # JSON строка с массивом id завершенных возобновляемых загрузок
+    processing: str = Form(PROCESSING_MODE),  # uniquify или metadata (только очистка метаданных)
+    batch_id: Optional[str] = Form(None)  # ID для потока прогресса /uploads/progress/{batch_id}
 ):
     """Загрузка нескольких видео на YouTube"""
     try:
         import json
         
+        # По batch_id пакет можно повторить: POST /uploads/batches/{batch_id}/retry
+        batch_id = batch_id or str(uuid.uuid4())
+        
+        if processing not in PROCESSING_MODES:
+            return JSONResponse(
+                status_code=400,
+                content={"success": False, "error": f"processing: ожидается одно из {', '.join(PROCESSING_MODES)}"}
+            )
+        
         # Парсинг ссылок на Google Drive если указаны
         drive_url_list = []
         if drive_urls:
@@ -287,9 +469,20 @@ async def upload_videos_batch(
                     content={"success": False, "error": "Неверный формат ссылок на Google Drive"}
                 )
         
+        # Файлы из запроса и возобновляемые загрузки - равноправные локальные исходники
+        local_sources = [{"video_file": f} for f in video_files or []]
+        if upload_refs:
+            try:
+                local_sources += [{"upload_ref": ref} for ref in json.loads(upload_refs)]
+            except json.JSONDecodeError:
+                return JSONResponse(
+                    status_code=400,
+                    content={"success": False, "error": "Неверный формат списка загрузок"}
+                )
+        
         # Определяем количество видео для обработки
         if video_source == "local":
-            video_count = len(video_files)
+            video_count = len(local_sources)
         else:
             video_count = len(drive_url_list)
         
@@ -299,139 +492,46 @@ async def upload_videos_batch(
                 content={"success": False, "error": "Не указаны видео для загрузки"}
             )
         
-        results = []
-        
-        # Обработка каждого видео
+        # Формируем задания для конвейера
+        jobs = []
         for i in range(video_count):
-            upload_id = str(uuid.uuid4())
+            if video_source == "local" and i < len(local_sources):
+                job_source = {"video_source": "local", **local_sources[i]}
+            elif video_source == "drive" and i < len(drive_url_list):
+                job_source = {"video_source": "drive", "drive_url": drive_url_list[i]}
+            else:
+                continue
             
-            try:
-                # Обработка видео в зависимости от источника
-                original_filename = None
-                if video_source == "local" and i < len(video_files):
-                    original_filename = video_files[i].filename
-                    file_path = await save_uploaded_file(video_files[i])
-                    processed_path = await process_video(file_path, upload_id)
-                elif video_source == "drive" and i < len(drive_url_list):
-                    original_filename = drive_url_list[i].split('/')[-1]
-                    processed_path = await download_from_drive(drive_url_list[i], upload_id)
-                else:
-                    continue
-                
-                # Определяем ориентацию видео
-                orientation = await get_video_orientation(processed_path)
-                
-                # Номер копии для текущего видео (i+1)
-                video_copy_number = i + 1
-                
-                # Список видео для загрузки (основное + другие форматы)
-                videos_to_upload = [
-                    {
-                        "path": processed_path,
-                        "orientation": orientation,
-                        "copy_number": video_copy_number
-                    }
-                ]
-                
-                # Создаем другие форматы если выбрана опция
-                if create_formats:
-                    other_formats = await create_other_formats(processed_path, upload_id, orientation)
-                    
-                    # Добавляем форматы с тем же номером копии
-                    for fmt in other_formats:
-                        videos_to_upload.append({
-                            "path": fmt["path"],
-                            "orientation": fmt["orientation"],
-                            "copy_number": video_copy_number  # Тот же номер для всех форматов
-                        })
-                
-                # Загружаем все видео
-                for video_data in videos_to_upload:
-                    # Генерируем название
-                    video_title = generate_video_title(
-                        campaign_name,
-                        video_data["orientation"],
-                        video_data["copy_number"]
-                    )
-                    
-                    # Обработка миниатюры
-                    thumbnail_path = await process_thumbnail(
-                        video_data["path"], thumbnail_option, modal_image_id
-                    )
-                    
-                    # Загрузка на YouTube
-                    youtube_url = await upload_to_youtube(video_data["path"], video_title, thumbnail_path)
-                    
-                    # Сохранение в базу данных
-                    upload_data = {
-                        "youtube_url": youtube_url,
-                        "video_title": video_title,
-                        "campaign_name": campaign_name,
-                        "thumbnail_type": thumbnail_option,
-                        "thumbnail_image_id": modal_image_id if thumbnail_option == "soft_modal" else None,
-                        "status": "active"
-                    }
-                    
-                    upload_record = await db_manager.create_upload(upload_data)
-                    
-                    # Убираем расширение из имени файла для группы
-                    group_name = original_filename.rsplit('.', 1)[0] if original_filename else f"{campaign_name} #{video_data['copy_number']}"
-                    
-                    results.append({
-                        "upload_id": upload_record["id"],
-                        "youtube_url": youtube_url,
-                        "video_title": video_title,
-                        "orientation": video_data["orientation"],
-                        "copy_number": video_data["copy_number"],
-                        "group_name": group_name,
-                        "original_filename": original_filename,
-                        "success": True
-                    })
-                    
-                    # Логирование успешной загрузки
-                    await db_manager.create_log(
-                        "video_uploaded_batch",
-                        {
-                            "upload_id": upload_record["id"],
-                            "campaign_name": campaign_name,
-                            "youtube_url": youtube_url,
-                            "thumbnail_type": thumbnail_option,
-                            "orientation": video_data["orientation"],
-                            "batch_index": i + 1
-                        }
-                    )
-                
-            except Exception as e:
-                # Логируем ошибку для конкретного видео
-                await db_manager.create_log(
-                    "video_upload_batch_error",
-                    {
-                        "campaign_name": campaign_name,
-                        "batch_index": i + 1,
-                        "error": str(e)
-                    }
-                )
-                
-                results.append({
-                    "video_title": f"{campaign_name} Видео #{i+1}",
-                    "success": False,
-                    "error": str(e)
-                })
-        
-        successful_uploads = [r for r in results if r.get("success")]
-        failed_uploads = [r for r in results if not r.get("success")]
+            jobs.append(create_upload_job(
+                campaign_name=campaign_name,
+                thumbnail_option=thumbnail_option,
+                modal_image_id=modal_image_id,
+                create_formats=create_formats,
+                copy_number=i + 1,  # Номер копии для текущего видео (i+1)
+                log_action="video_uploaded_batch",
+                log_extra={"batch_index": i + 1},
+                processing=processing,
+                progress=progress_tracker.reporter(batch_id, len(jobs)),
+                priority="batch",
+                checkpoint={"batch_id": batch_id, "index": i, "attempt": 1},
+                **job_source
+            ))
         
-        # Считаем уникальные группы (по copy_number)
-        unique_groups = set(r.get("copy_number") for r in successful_uploads if r.get("copy_number"))
+        try:
+            async with coordinator.lock(f"batch:{batch_id}", ttl=60, timeout=0):
+                if not await batch_checkpoints.start(batch_id, jobs):
+                    for job in jobs:
+                        job["checkpoint"] = None
+                # Стадии разных видео выполняются параллельно, результаты - в исходном порядке
+                pipeline_items = await run_upload_pipeline(jobs, batch_id)
+        except LockNotAcquired:
+            return JSONResponse(
+                status_code=409,
+                content={"success": False, "error": f"Пакет {batch_id} уже обрабатывается"}
+            )
         
-        return {
-            "success": True,
-            "total_videos": video_count,  # Количество исходных видео
-            "successful_uploads": len(unique_groups),  # Количество успешных групп
-            "total_formats": len(successful_uploads),  # Общее количество загруженных форматов
-            "failed_uploads": len(failed_uploads),
-            "results": results
-        }
+        results = await collect_batch_results(pipeline_items)
+        return {"success": True, "batch_id": batch_id, "total_videos": video_count, **summarize_batch_results(results)}
         
     except Exception as e:
         await db_manager.create_log("batch_upload_error", {"error": str(e)})
@@ -440,6 +540,176 @@ async def upload_videos_batch(
             content={"success": False, "error": str(e)}
         )
 
+async def collect_batch_results(pipeline_items: list) -> List[dict]:
+    """Результаты заданий пакета в исходном порядке; ошибки логируются по каждому видео"""
+    results = []
+    for item in pipeline_items:
+        job = item.data
+        if item.success:
+            results.extend({**result, "success": True} for result in job["results"])
+            continue
+        
+        # Логируем ошибку для конкретного видео
+        await db_manager.create_log(
+            "video_upload_batch_error",
+            {
+                "campaign_name": job["campaign_name"],
+                "batch_index": job["copy_number"],
+                "stage": item.failed_stage,
+                "error": str(item.error)
+            }
+        )
+        
+        results.append({
+            "video_title": f"{job['campaign_name']} Видео #{job['copy_number']}",
+            "copy_number": job["copy_number"],
+            "success": False,
+            "error": str(item.error)
+        })
+    return results
+
+def summarize_batch_results(results: List[dict]) -> dict:
+    successful_uploads = [r for r in results if r.get("success")]
+    failed_uploads = [r for r in results if not r.get("success")]
+    
+    # Считаем уникальные группы (по copy_number)
+    unique_groups = set(r.get("copy_number") for r in successful_uploads if r.get("copy_number"))
+    
+    return {
+        "successful_uploads": len(unique_groups),  # Количество успешных групп
+        "total_formats": len(successful_uploads),  # Общее количество загруженных форматов
+        "failed_uploads": len(failed_uploads),
+        "results": results
+    }
+
+@app.get("/uploads/batches/{batch_id}")
+async def get_upload_batch(batch_id: str):
+    """Задания пакета: статус, последняя завершенная стадия, ошибка и число попыток"""
+    items = await db_manager.get_batch_items(batch_id)
+    if not items:
+        raise HTTPException(status_code=404, detail="Пакет не найден")
+    fields = ("item_index", "job_id", "status", "last_stage", "failed_stage", "error", "attempts", "updated_at")
+    return {"success": True, "batch_id": batch_id, "items": [{key: item.get(key) for key in fields} for item in items]}
+
+@app.post("/uploads/batches/{batch_id}/retry")
+async def retry_upload_batch(batch_id: str):
+    """Повтор неуспешных и прерванных видео пакета с последней стадии, результаты которой сохранились"""
+    try:
+        async with coordinator.lock(f"batch:{batch_id}", ttl=60, timeout=0):
+            rows = await db_manager.get_batch_items(batch_id)
+            if not rows:
+                raise HTTPException(status_code=404, detail="Пакет не найден")
+            
+            jobs, unrecoverable = [], []
+            for row in rows:
+                if row["status"] == "done":
+                    continue
+                try:
+                    jobs.append(await restore_upload_job(row, progress_tracker.reporter(batch_id, len(jobs))))
+                except CheckpointError as e:
+                    await batch_checkpoints.mark_failed(row, str(e))
+                    unrecoverable.append({
+                        "video_title": f"{row['campaign_name']} Видео #{row['params'].get('copy_number')}",
+                        "copy_number": row["params"].get("copy_number"),
+                        "success": False,
+                        "error": str(e)
+                    })
+            
+            # Повтор идет с теми же batch_id и job_id: отметки об отмене прошлого запуска снимаются
+            await scheduler.forget(batch_id=batch_id)
+            for job in jobs:
+                await scheduler.forget(job_id=job["upload_id"])
+            
+            pipeline_items = await run_upload_pipeline(jobs, batch_id) if jobs else []
+    except LockNotAcquired:
+        return JSONResponse(
+            status_code=409,
+            content={"success": False, "error": f"Пакет {batch_id} еще обрабатывается"}
+        )
+    
+    results = await collect_batch_results(pipeline_items) + unrecoverable
+    await db_manager.create_log("upload_batch_retried", {
+        "batch_id": batch_id,
+        "retried": len(jobs),
+        "resumed_from": {job["upload_id"]: resumed_from(job) for job in jobs}
+    })
+    return {
+        "success": True,
+        "batch_id": batch_id,
+        "total_videos": len(rows),
+        "retried_videos": len(jobs) + len(unrecoverable),
+        **summarize_batch_results(results)
+    }
+
+def tus_headers(**headers) -> dict:
+    return {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store", **headers}
+
+def tus_error(e: ResumableUploadError) -> JSONResponse:
+    return JSONResponse(status_code=e.status_code, content={"success": False, "error": str(e)}, headers=tus_headers())
+
+@app.post("/uploads/resumable")
+async def create_resumable_upload(
+    upload_length: int = Header(...),
+    upload_metadata: Optional[str] = Header(None)  # tus: "filename <base64>,filetype <base64>"
+):
+    """Создание возобновляемой загрузки исходника (tus)"""
+    try:
+        state = await resumable_uploads.create(upload_length, parse_metadata(upload_metadata))
+    except ResumableUploadError as e:
+        return tus_error(e)
+    return JSONResponse(
+        status_code=201,
+        content={"success": True, "upload_id": state["id"], "offset": 0, "length": state["length"]},
+        headers=tus_headers(Location=f"/uploads/resumable/{state['id']}", **{"Upload-Offset": "0"})
+    )
+
+@app.head("/uploads/resumable/{upload_id}")
+async def get_resumable_upload_offset(upload_id: str):
+    """Сколько байт загрузки уже принято (с этого места клиент продолжает отправку)"""
+    try:
+        state = await resumable_uploads.get(upload_id)
+    except ResumableUploadError as e:
+        return Response(status_code=e.status_code, headers=tus_headers())
+    offset = state["length"] if state["status"] == "final" else resumable_uploads.offset(upload_id)
+    return Response(headers=tus_headers(**{"Upload-Offset": str(offset), "Upload-Length": str(state["length"])}))
+
+@app.patch("/uploads/resumable/{upload_id}")
+async def append_resumable_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(...),
+    content_type: Optional[str] = Header(None)
+):
+    """Часть загрузки с позиции Upload-Offset; принятые байты сохраняются и при обрыве"""
+    if content_type != PATCH_CONTENT_TYPE:
+        return tus_error(ResumableUploadError(f"Content-Type должен быть {PATCH_CONTENT_TYPE}", 415))
+    try:
+        offset = await resumable_uploads.append(upload_id, upload_offset, request.stream())
+    except ResumableUploadError as e:
+        return tus_error(e)
+    except ClientDisconnect:
+        # Клиент ушел - принятое сохранено, ответ некому отдавать
+        return Response(status_code=204, headers=tus_headers())
+    return Response(status_code=204, headers=tus_headers(**{"Upload-Offset": str(offset)}))
+
+@app.post("/uploads/resumable/{upload_id}/finalize")
+async def finalize_resumable_upload(upload_id: str, sha256: Optional[str] = Form(None)):
+    """Завершение загрузки: проверка размера и SHA-256, файл переносится в хранилище"""
+    try:
+        state = await resumable_uploads.finalize(upload_id, sha256)
+    except ResumableUploadError as e:
+        return tus_error(e)
+    return {"success": True, "upload_id": upload_id, "filename": state["filename"], "size": state["length"], "sha256": state["sha256"]}
+
+@app.delete("/uploads/resumable/{upload_id}")
+async def delete_resumable_upload(upload_id: str):
+    """Отмена загрузки и удаление принятых данных"""
+    try:
+        await resumable_uploads.delete(upload_id)
+    except ResumableUploadError as e:
+        return tus_error(e)
+    return Response(status_code=204, headers=tus_headers())
+
 @app.post("/upload/modal")
 async def upload_modal_image(image: UploadFile = File(...)):
     """Загрузка изображения модалки для наложения на кадры"""
@@ -461,21 +731,23 @@ async def upload_modal_image(image: UploadFile = File(...)):
         
         modal_id = str(uuid.uuid4())
         
-        # Сохранение изображения
-        upload_dir = Path(UPLOAD_DIR) / "modals"
-        upload_dir.mkdir(parents=True, exist_ok=True)
-        
-        file_path = upload_dir / f"{modal_id}_{image.filename}"
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(content)
+        # Сохранение изображения: в БД пишется ключ хранилища, а не путь на диске узла
+        file_key = f"modals/{modal_id}_{image.filename}"
+        await storage.put_bytes(file_key, content)
         
         # Сохранение в базу данных
         modal_data = await db_manager.create_modal_image(
             filename=image.filename,
-            file_path=str(file_path),
+            file_path=file_key,
             file_size=len(content)
         )
         
+        # Превью для галереи создаем сразу, чтобы не отдавать оригинал
+        try:
+            await store_modal_previews(await storage.local_path(file_key), modal_data["id"])
+        except Exception as e:
+            print(f"⚠️ Не удалось создать превью модалки: {e}")
+        
         # Логирование
         await db_manager.create_log(
             "modal_uploaded", 
@@ -522,19 +794,43 @@ async def get_modal_images():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/modals/{modal_id}/preview")
-async def get_modal_preview(modal_id: str):
+async def get_modal_preview(
+    modal_id: str,
+    size: str = "original",  # "thumb", "medium" (WebP) или "original"
+    if_none_match: Optional[str] = Header(None)
+):
     """Получение превью изображения модалки"""
     try:
-        modal = await db_manager.get_modal_image_by_id(modal_id)
-        if not modal:
-            raise HTTPException(status_code=404, detail="Модалка не найдена")
+        if size != "original" and size not in MODAL_PREVIEW_SIZES:
+            raise HTTPException(status_code=400, detail=f"Неизвестный размер превью. Доступны: original, {', '.join(MODAL_PREVIEW_SIZES)}")
         
-        file_path = modal.get("file_path")
-        if not file_path or not os.path.exists(file_path):
+        if size == "original":
+            file_path = await get_modal_path(modal_id)
+            if not file_path:
+                raise HTTPException(status_code=404, detail="Модалка не найдена")
+        else:
+            # Превью лежат по ID модалки - запрос в БД не нужен
+            file_path = str(preview_path(modal_id, size))
+            try:
+                file_path = await storage.local_path(key_for(file_path))
+            except FileNotFoundError:
+                # Модалки, загруженные до появления превью, получают их при первом запросе
+                original_path = await get_modal_path(modal_id)
+                if not original_path:
+                    raise HTTPException(status_code=404, detail="Модалка не найдена")
+                if os.path.exists(original_path):
+                    await store_modal_previews(original_path, modal_id)
+        
+        if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="Файл модалки не найден")
         
+        etag = await asyncio.to_thread(get_etag, file_path)
+        headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+        
         from fastapi.responses import FileResponse
-        return FileResponse(file_path, media_type="image/jpeg")
+        return FileResponse(file_path, media_type=get_content_type(file_path), headers=headers)
         
     except HTTPException:
         raise
@@ -552,6 +848,35 @@ async def get_uploads():
         await db_manager.create_log("get_uploads_error", {"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/registry/events")
+async def registry_changes(
+    table: Optional[List[str]] = Query(None),  # uploads, templates (по умолчанию обе)
+    campaign_name: Optional[List[str]] = Query(None),
+    status: Optional[List[str]] = Query(None),
+    template_id: Optional[List[str]] = Query(None),
+    language: Optional[List[str]] = Query(None),
+    orientation: Optional[List[str]] = Query(None),
+    ai_tag: Optional[List[str]] = Query(None)
+):
+    """Поток изменений реестра (Server-Sent Events): только измененные строки, с фильтрами клиента"""
+    tables = table or list(REGISTRY_TABLES)
+    unknown = set(tables) - set(REGISTRY_TABLES)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Неизвестные таблицы: {', '.join(sorted(unknown))}")
+    filters = {
+        column: set(values)
+        for column, values in {
+            "campaign_name": campaign_name, "status": status, "template_id": template_id,
+            "language": language, "orientation": orientation, "ai_tag": ai_tag
+        }.items()
+        if values
+    }
+    return StreamingResponse(
+        registry_events.stream(tables, filters),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/templates")
 async def get_templates():
     """Получение списка шаблонов"""
@@ -562,6 +887,173 @@ async def get_templates():
         await db_manager.create_log("get_templates_error", {"error": str(e)})
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/templates/search")
+async def search_templates(
+    language: Optional[List[str]] = Query(None),
+    style: Optional[List[str]] = Query(None),
+    orientation: Optional[List[str]] = Query(None),
+    ai_tag: Optional[List[str]] = Query(None),
+    hardness_min: Optional[int] = Query(None, ge=1, le=5),
+    hardness_max: Optional[int] = Query(None, ge=1, le=5),
+    tag: Optional[List[str]] = Query(None),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0)
+):
+    """Поиск шаблонов по фасетам, диапазону ai_hardness и тегам characteristics
+
+    Несколько значений одного фасета объединяются через ИЛИ, разные фасеты и
+    теги - через И. В ответе счетчики значений фасетов по найденным шаблонам.
+    """
+    if hardness_min is not None and hardness_max is not None and hardness_min > hardness_max:
+        raise HTTPException(status_code=400, detail="hardness_min больше hardness_max")
+    try:
+        result = await db_manager.search_templates({
+            "language": language,
+            "style": style,
+            "orientation": orientation,
+            "ai_tag": ai_tag,
+            "hardness_min": hardness_min,
+            "hardness_max": hardness_max,
+            "characteristics": tag
+        }, limit=limit, offset=offset)
+        return {"templates": result.get("items", []), "total": result.get("total", 0), "facets": result.get("facets", {}),
+                "limit": limit, "offset": offset}
+    except Exception as e:
+        await db_manager.create_log("search_templates_error", {"error": str(e)})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/templates/import", dependencies=[Depends(require_admin)])
+async def import_templates(
+    file: UploadFile = File(...),
+    format: Optional[str] = Form(None),  # csv, ndjson (по умолчанию - по расширению файла)
+    on_conflict: str = Form("update"),  # update - обновить шаблон с тем же id, skip - оставить
+    dry_run: bool = Form(False)
+):
+    """Массовый импорт шаблонов из CSV/NDJSON: проверка пачками, COPY во временную таблицу и перенос в templates
+
+    Строки с ошибками не загружаются и возвращаются в errors с номером строки и полем.
+    """
+    try:
+        fmt = format or detect_format(file.filename, file.content_type)
+        if fmt not in ("csv", "ndjson"):
+            raise TemplateImportError("format: ожидается csv или ndjson")
+        # psycopg2 синхронный - импорт целиком в потоке, цикл событий не блокируется
+        result = await asyncio.to_thread(template_bulk.import_file, file.file, fmt, on_conflict, dry_run)
+    except TemplateImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+    await db_manager.create_log("templates_import", {
+        "filename": file.filename, "dry_run": dry_run, **{k: v for k, v in result.items() if k != "errors"}
+    })
+    return {"success": True, **result}
+
+@app.get("/templates/export", dependencies=[Depends(require_admin)])
+async def export_templates(format: str = "csv"):
+    """Выгрузка всех шаблонов: CSV (COPY, формат импорта) или NDJSON"""
+    try:
+        stream = await template_bulk.export(format)
+    except TemplateImportError as e:
+        raise HTTPException(status_code=400 if format not in ("csv", "ndjson") else 503, detail=str(e))
+    return StreamingResponse(
+        stream,
+        media_type="text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="templates.{format}"'}
+    )
+
+# ==================== DRIVE FOLDER WATCH ====================
+
+@app.post("/drive/sources")
+async def register_drive_source(request: Request):
+    """Регистрация папки Google Drive как источника видео"""
+    try:
+        data = await request.json()
+        folder = data.get("folder")
+        campaign_name = data.get("campaign_name")
+        
+        if not folder or not campaign_name:
+            return {"success": False, "error": "folder и campaign_name обязательны"}
+        
+        source = await drive_watcher.register_source(
+            folder=folder,
+            campaign_name=campaign_name,
+            thumbnail_option=data.get("thumbnail_option", "none"),
+            modal_image_id=data.get("modal_image_id"),
+            create_formats=bool(data.get("create_formats", False)),
+            ingest_existing=bool(data.get("ingest_existing", False))
+        )
+        return {"success": True, "source": source}
+    except Exception as e:
+        await db_manager.create_log("drive_source_register_error", {"error": str(e)})
+        return {"success": False, "error": str(e)}
+
+@app.get("/drive/sources")
+async def get_drive_sources():
+    """Получение списка наблюдаемых папок Google Drive"""
+    try:
+        sources = await db_manager.get_drive_sources()
+        return {
+            "sources": [
+                {key: value for key, value in source.items() if key != "known_files"}
+                for source in sources
+            ],
+            "queue_size": drive_watcher.queue.qsize()
+        }
+    except Exception as e:
+        await db_manager.create_log("get_drive_sources_error", {"error": str(e)})
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/drive/sources/{source_id}/poll")
+async def poll_drive_source(source_id: str):
+    """Внеочередной опрос папки Google Drive"""
+    try:
+        source = await db_manager.get_drive_source_by_id(source_id)
+        if not source:
+            raise HTTPException(status_code=404, detail="Источник не найден")
+        
+        queued = await drive_watcher.poll_source(source)
+        return {"success": True, "queued": queued}
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db_manager.create_log("drive_source_poll_error", {"error": str(e), "source_id": source_id})
+        return {"success": False, "error": str(e)}
+
+@app.delete("/drive/sources/{source_id}")
+async def delete_drive_source(source_id: str):
+    """Удаление папки Google Drive из наблюдения"""
+    try:
+        deleted = await db_manager.delete_drive_source(source_id)
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Источник не найден")
+        return {"success": True}
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db_manager.create_log("drive_source_delete_error", {"error": str(e), "source_id": source_id})
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def ingest_drive_file(source: dict, file: dict, file_path: str, copy_number: int):
+    """Обработка нового видео из наблюдаемой папки Google Drive"""
+    job = create_upload_job(
+        campaign_name=source["campaign_name"],
+        thumbnail_option=source.get("thumbnail_option") or "none",
+        modal_image_id=source.get("modal_image_id"),
+        create_formats=bool(source.get("create_formats")),
+        copy_number=copy_number,
+        log_action="video_uploaded_drive_watch",
+        log_extra={"drive_source_id": source["id"], "drive_file_id": file["id"]},
+        video_source="path",
+        source_path=file_path,
+        original_filename=file.get("name"),
+        quota_max_wait=-1,  # фоновая загрузка ждет сброса квоты YouTube
+        priority="background"
+    )
+    
+    [item] = await run_upload_pipeline([job])
+    if not item.success:
+        raise item.error
+
 # Вспомогательные функции
 async def save_uploaded_file(file: UploadFile) -> str:
     """Сохранение загруженного файла"""
@@ -576,44 +1068,91 @@ async def save_uploaded_file(file: UploadFile) -> str:
         print(f"❌ ERROR: {error_msg}")
         raise HTTPException(status_code=400, detail=error_msg)
     
-    upload_dir = Path(UPLOAD_DIR) / "videos"
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    async def chunks():
+        while chunk := await file.read(STORAGE_CHUNK_SIZE):
+            yield chunk
     
-    file_path = upload_dir / f"{uuid.uuid4()}_{file.filename}"
-    async with aiofiles.open(file_path, 'wb') as f:
-        content = await file.read()
-        await f.write(content)
+    # Файл пишется в хранилище потоком, без чтения в память целиком
+    file_key = f"videos/{uuid.uuid4()}_{file.filename}"
+    size = await storage.write_stream(file_key, chunks())
+    BYTES_IN.labels("upload").inc(size)
     
-    return str(file_path)
+    return await storage.local_path(file_key)
+
+# Очистка метаданных контейнера и дорожек
+METADATA_ARGS = [
+    '-map_metadata', '-1',  # Удаление всех метаданных
+    '-metadata', 'title=',
+    '-metadata', 'artist=',
+    '-metadata', 'album=',
+    '-metadata', 'date=',
+    '-metadata', 'comment=',
+]
+
+async def process_video(file_path: str, upload_id: str, progress: Optional[ProgressReporter] = None,
+                        mode: str = PROCESSING_MODE) -> Tuple[str, str]:
+    """Обработка видео: очистка метаданных и уникализация
 
-async def process_video(file_path: str, upload_id: str) -> str:
-    """Обработка видео: очистка метаданных и уникализация"""
-    import subprocess
+    mode="metadata" - только очистка метаданных: подходящие дорожки исходника
+    (H.264/AAC, см. stream_copy_plan) копируются без кодирования, кодируется
+    только то, что нужно. Возвращает путь и способ обработки: copy, copy_video
+    (перекодирован только звук), encode или original (ffmpeg не сработал).
+    """
     import random
     
     processed_dir = Path(UPLOAD_DIR) / "processed"
     processed_dir.mkdir(parents=True, exist_ok=True)
     
     processed_path = processed_dir / f"{upload_id}_processed.mp4"
+    method = "encode"
     
     try:
-        # Очистка метаданных и легкая уникализация через ffmpeg
-        # Небольшие изменения для уникализации
-        bitrate_variation = random.randint(-100, 100)  # ±100 kbps
-        fps_variation = random.uniform(0.95, 1.05)  # ±5% FPS
+        # Настройки кодирования берем из профиля под разрешение исходника
+        probe = await probe_video(file_path)
+        video_stream = get_video_stream(probe)
+        resolution = min(int(video_stream['width']), int(video_stream['height'])) if video_stream else None
+        on_progress = progress.stage_callback("transcode") if progress and progress.enabled else None
+        
+        if mode == "metadata":
+            plan = stream_copy_plan(probe)
+            if plan["video"]:
+                # Кадры не меняются - перепаковка занимает секунды вместо полного кодирования
+                method = "copy" if plan["audio"] else "copy_video"
+                copy_cmd = [
+                    'ffmpeg', '-i', file_path,
+                    '-map', '0:v:0', '-map', '0:a:0?',
+                    '-c:v', 'copy',
+                    '-c:a', 'copy' if plan["audio"] else 'aac',
+                    *METADATA_ARGS,
+                    '-map_chapters', '-1',
+                    '-movflags', '+faststart',
+                    '-y',
+                    str(processed_path)
+                ]
+                print(f"📦 Перепаковка без кодирования: {' '.join(copy_cmd)}")
+                result = await run_command(copy_cmd, on_progress=on_progress, duration=get_duration(probe))
+                if result.returncode == 0:
+                    print(f"✅ Видео обработано ({method}): {processed_path}")
+                    PROCESSING_PATHS.labels(mode, method).inc()
+                    return str(processed_path), method
+                print(f"⚠️ Перепаковка не удалась, кодируем: {result.stderr[-500:]}")
+                method = "encode"
+            else:
+                print(f"ℹ️ Перепаковка невозможна ({plan['reason']}), кодируем")
+            # Без уникализации: кадры кодируются заново, но FPS и битрейт не меняются
+            video_args, rate_args = build_video_args(resolution=resolution), []
+        else:
+            # Небольшие изменения для уникализации
+            fps_variation = random.uniform(0.95, 1.05)  # ±5% FPS
+            video_args = build_video_args(resolution=resolution, uniquify=True)  # Битрейт/CRF с вариацией
+            rate_args = ['-r', f'{30 * fps_variation:.2f}']  # Базовый FPS с вариацией
         
         ffmpeg_cmd = [
             'ffmpeg', '-i', file_path,
-            '-c:v', 'libx264',
+            *video_args,
             '-c:a', 'aac',
-            '-b:v', f'{1000 + bitrate_variation}k',  # Базовый битрейт с вариацией
-            '-r', f'{30 * fps_variation:.2f}',  # Базовый FPS с вариацией
-            '-map_metadata', '-1',  # Удаление всех метаданных
-            '-metadata', 'title=',
-            '-metadata', 'artist=',
-            '-metadata', 'album=',
-            '-metadata', 'date=',
-            '-metadata', 'comment=',
+            *rate_args,
+            *METADATA_ARGS,
             '-y',  # Перезаписать файл
             str(processed_path)
         ]
@@ -622,58 +1161,46 @@ async def process_video(file_path: str, upload_id: str) -> str:
         print(f"   Команда ffmpeg: {' '.join(ffmpeg_cmd)}")
         
         # Выполняем обработку
-        result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+        result = await run_command(ffmpeg_cmd, on_progress=on_progress, duration=get_duration(probe))
         
         if result.returncode == 0:
             print(f"✅ Видео обработано: {processed_path}")
-            return str(processed_path)
         else:
             print(f"⚠️ Ошибка ffmpeg, используем оригинал: {result.stderr}")
             # Если ffmpeg не работает, копируем оригинал
             import shutil
             shutil.copy2(file_path, processed_path)
-            return str(processed_path)
+            method = "original"
             
     except Exception as e:
         print(f"⚠️ Ошибка обработки видео: {e}")
         # Fallback - простое копирование
         import shutil
         shutil.copy2(file_path, processed_path)
-        return str(processed_path)
+        method = "original"
+    
+    PROCESSING_PATHS.labels(mode, method).inc()
+    return str(processed_path), method
 
 async def get_video_orientation(video_path: str) -> str:
     """Определение ориентации видео"""
-    import subprocess
-    import json
-    
     try:
         # Получаем информацию о видео через ffprobe
-        ffprobe_cmd = [
-            'ffprobe', '-v', 'quiet',
-            '-print_format', 'json',
-            '-show_streams',
-            video_path
-        ]
-        
-        result = subprocess.run(ffprobe_cmd, capture_output=True, text=True)
+        video_stream = get_video_stream(await probe_video(video_path))
         
-        if result.returncode == 0:
-            data = json.loads(result.stdout)
-            video_stream = next((s for s in data['streams'] if s['codec_type'] == 'video'), None)
+        if video_stream:
+            width = int(video_stream['width'])
+            height = int(video_stream['height'])
             
-            if video_stream:
-                width = int(video_stream['width'])
-                height = int(video_stream['height'])
-                
-                print(f"📐 Размеры видео: {width}x{height}")
-                
-                # Определяем ориентацию
-                if width > height:
-                    return "horizontal"  # 16:9
-                elif height > width:
-                    return "vertical"    # 9:16
-                else:
-                    return "square"      # 1:1
+            print(f"📐 Размеры видео: {width}x{height}")
+            
+            # Определяем ориентацию
+            if width > height:
+                return "horizontal"  # 16:9
+            elif height > width:
+                return "vertical"    # 9:16
+            else:
+                return "square"      # 1:1
         
         # По умолчанию считаем горизонтальным
         return "horizontal"
@@ -682,69 +1209,90 @@ async def get_video_orientation(video_path: str) -> str:
         print(f"⚠️ Ошибка определения ориентации: {e}")
         return "horizontal"
 
-async def create_other_formats(video_path: str, base_upload_id: str, orientation: str) -> List[dict]:
-    """Создание других форматов видео с черными полосами"""
-    import subprocess
-    
-    formats_dir = Path(UPLOAD_DIR) / "formats"
-    formats_dir.mkdir(parents=True, exist_ok=True)
-    
-    created_formats = []
-    
-    # Определяем какие форматы нужно создать
-    formats_to_create = []
+def get_formats_to_create(orientation: str) -> List[dict]:
+    """Форматы, которые нужно создать для видео данной ориентации"""
     if orientation == "square":
-        formats_to_create = [
+        return [
             {"name": "vertical", "width": 720, "height": 1280, "aspect": "9:16"},
             {"name": "horizontal", "width": 1280, "height": 720, "aspect": "16:9"}
         ]
     elif orientation == "horizontal":
-        formats_to_create = [
+        return [
             {"name": "square", "width": 720, "height": 720, "aspect": "1:1"},
             {"name": "vertical", "width": 720, "height": 1280, "aspect": "9:16"}
         ]
     elif orientation == "vertical":
-        formats_to_create = [
+        return [
             {"name": "square", "width": 720, "height": 720, "aspect": "1:1"},
             {"name": "horizontal", "width": 1280, "height": 720, "aspect": "16:9"}
         ]
+    return []
+
+def format_video_filter(fmt: dict) -> str:
+    """Видео с черными полосами (letterbox/pillarbox)
+
+    scale: масштабирование с сохранением пропорций
+    pad: добавление черных полос
+    """
+    return f"scale={fmt['width']}:{fmt['height']}:force_original_aspect_ratio=decrease,pad={fmt['width']}:{fmt['height']}:(ow-iw)/2:(oh-ih)/2:black"
+
+def build_format_command(video_path: str, fmt: dict) -> List[str]:
+    """Команда ffmpeg для формата без выходного файла (файл или пайп добавляет вызывающий)"""
+    return [
+        'ffmpeg', '-i', video_path,
+        '-vf', format_video_filter(fmt),
+        *build_video_args(resolution=min(fmt['width'], fmt['height'])),
+        '-c:a', 'aac',
+        '-b:a', '128k'
+    ]
+
+async def render_format(video_path: str, base_upload_id: str, fmt: dict, progress: Optional[ProgressReporter] = None, duration: Optional[float] = None) -> Optional[dict]:
+    """Создание одного формата в файл uploads/formats"""
+    formats_dir = Path(UPLOAD_DIR) / "formats"
+    formats_dir.mkdir(parents=True, exist_ok=True)
+    
+    try:
+        output_path = formats_dir / f"{base_upload_id}_{fmt['name']}.mp4"
+        ffmpeg_cmd = [*build_format_command(video_path, fmt), '-y', str(output_path)]
+        
+        print(f"   🔧 Создание {fmt['name']} формата ({fmt['width']}x{fmt['height']})...")
+        with track_stage("format_render"):
+            result = await run_command(
+                ffmpeg_cmd,
+                on_progress=progress.stage_callback("format_render", format=fmt['name']) if progress and progress.enabled else None,
+                duration=duration
+            )
+        
+        if result.returncode == 0:
+            print(f"   ✅ {fmt['name'].capitalize()} формат создан: {output_path}")
+            return {
+                "orientation": fmt['name'],
+                "path": str(output_path),
+                "resolution": f"{fmt['width']}x{fmt['height']}",
+                "aspect": fmt['aspect']
+            }
+        else:
+            print(f"   ⚠️ Ошибка создания {fmt['name']} формата: {result.stderr}")
+            
+    except Exception as e:
+        print(f"   ⚠️ Ошибка создания {fmt['name']} формата: {e}")
+    
+    return None
+
+async def create_other_formats(video_path: str, base_upload_id: str, orientation: str, progress: Optional[ProgressReporter] = None) -> List[dict]:
+    """Создание других форматов видео с черными полосами"""
+    formats_to_create = get_formats_to_create(orientation)
     
     print(f"🎬 Создание форматов для {orientation} видео: {[f['name'] for f in formats_to_create]}")
     
+    # Длительность нужна только для процента прогресса
+    duration = get_duration(await probe_video(video_path)) if progress and progress.enabled else None
+    
+    created_formats = []
     for fmt in formats_to_create:
-        try:
-            output_path = formats_dir / f"{base_upload_id}_{fmt['name']}.mp4"
-            
-            # Создаем видео с черными полосами (letterbox/pillarbox)
-            # scale: масштабирование с сохранением пропорций
-            # pad: добавление черных полос
-            ffmpeg_cmd = [
-                'ffmpeg', '-i', video_path,
-                '-vf', f"scale={fmt['width']}:{fmt['height']}:force_original_aspect_ratio=decrease,pad={fmt['width']}:{fmt['height']}:(ow-iw)/2:(oh-ih)/2:black",
-                '-c:v', 'libx264',
-                '-c:a', 'aac',
-                '-b:v', '1000k',
-                '-b:a', '128k',
-                '-y',
-                str(output_path)
-            ]
-            
-            print(f"   🔧 Создание {fmt['name']} формата ({fmt['width']}x{fmt['height']})...")
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                print(f"   ✅ {fmt['name'].capitalize()} формат создан: {output_path}")
-                created_formats.append({
-                    "orientation": fmt['name'],
-                    "path": str(output_path),
-                    "resolution": f"{fmt['width']}x{fmt['height']}",
-                    "aspect": fmt['aspect']
-                })
-            else:
-                print(f"   ⚠️ Ошибка создания {fmt['name']} формата: {result.stderr}")
-                
-        except Exception as e:
-            print(f"   ⚠️ Ошибка создания {fmt['name']} формата: {e}")
+        created = await render_format(video_path, base_upload_id, fmt, progress, duration)
+        if created:
+            created_formats.append(created)
     
     return created_formats
 
@@ -767,6 +1315,437 @@ def generate_video_title(campaign_name: str, orientation: str, copy_number: int
     
     return title
 
+# ==================== КОНВЕЙЕР ЗАГРУЗКИ ====================
+
+def create_upload_job(
+    campaign_name: str,
+    thumbnail_option: str,
+    modal_image_id: Optional[str],
+    create_formats: bool,
+    copy_number: int,
+    log_action: str,
+    video_source: str,  # "local", "drive" или "path" (файл уже на диске)
+    video_file: Optional[UploadFile] = None,
+    upload_ref: Optional[str] = None,  # id возобновляемой загрузки (локальный исходник без video_file)
+    drive_url: Optional[str] = None,
+    source_path: Optional[str] = None,
+    original_filename: Optional[str] = None,
+    log_extra: Optional[dict] = None,
+    progress: Optional[ProgressReporter] = None,
+    quota_max_wait: float = YOUTUBE_QUOTA_MAX_WAIT,
+    priority: str = "batch",  # класс планировщика: single, batch или background
+    checkpoint: Optional[dict] = None,  # {batch_id, index, attempt} - стадии сохраняются в batch_items
+    processing: str = PROCESSING_MODE  # uniquify или metadata (только очистка метаданных)
+) -> dict:
+    """Задание конвейера загрузки: параметры и промежуточные результаты стадий"""
+    # Оценка квоты YouTube: основное видео + два других формата, у каждого своя миниатюра
+    quota_units = youtube_quota.estimate_units(3 if create_formats else 1, thumbnail_option != "none")
+    return {
+        "upload_id": str(uuid.uuid4()),
+        "campaign_name": campaign_name,
+        "thumbnail_option": thumbnail_option,
+        "modal_image_id": modal_image_id,
+        "create_formats": create_formats,
+        "processing": processing,
+        "copy_number": copy_number,
+        "log_action": log_action,
+        "log_extra": log_extra or {},
+        "video_source": video_source,
+        "video_file": video_file,
+        "upload_ref": upload_ref,
+        "drive_url": drive_url,
+        "source_path": source_path,
+        "original_filename": original_filename,
+        "processing_path": None,  # как обработан исходник: copy, copy_video, encode, original
+        "progress": progress or progress_tracker.reporter(None, 0),
+        "quota_units": quota_units,
+        "quota_max_wait": quota_max_wait,
+        "priority": priority,
+        "checkpoint": checkpoint,
+        "completed_stages": [],  # стадии, восстановленные из чекпоинта (пропускаются)
+        "uploaded": {},  # ориентация -> загруженное на YouTube видео
+        "quota": None,  # резерв квоты YouTube после стадии admission
+        "artifacts": [],  # файлы задания на диске (закреплены до конца конвейера)
+        "variants": [],
+        "results": []
+    }
+
+async def restore_upload_job(row: dict, progress: ProgressReporter) -> dict:
+    """Задание из чекпоинта batch_items: стадии с сохраненными результатами пропускаются"""
+    # Повтор на другом узле: загруженный исходник берется из хранилища в локальный кэш
+    source_path = (row["checkpoint"] or {}).get("source_path")
+    if source_path and row["params"].get("video_source") == "local" and not Path(source_path).exists():
+        try:
+            row["checkpoint"]["source_path"] = await storage.local_path(key_for(source_path))
+        except FileNotFoundError:
+            pass
+    resume_index = resume_stage(row)
+    params, checkpoint = row["params"], row["checkpoint"] or {}
+    completed = list(CHECKPOINT_STAGES[:resume_index])
+    job = create_upload_job(
+        **params,
+        progress=progress,
+        checkpoint={"batch_id": row["batch_id"], "index": row["item_index"], "attempt": row["attempts"] + 1}
+    )
+    job["upload_id"] = row["job_id"]  # те же имена файлов и ключи идемпотентности
+    job["completed_stages"] = completed
+    job["uploaded"] = checkpoint.get("uploaded") or {}
+    job["original_filename"] = checkpoint.get("original_filename") or params.get("original_filename")
+    
+    # Файлы проверены resume_stage; устаревшие пути не переносятся, чтобы стадии создали их заново
+    for field, kind in (("source_path", "videos"), ("processed_path", "processed")):
+        if checkpoint.get(field) and Path(checkpoint[field]).exists():
+            job[field] = checkpoint[field]
+            track_artifact(job, job[field], kind if params.get("video_source") == "local" else "downloaded")
+    if "transcode" in completed:
+        job["processing_path"] = checkpoint.get("processing_path")
+        job["variants"] = checkpoint.get("variants") or []
+        for variant in job["variants"]:
+            if "thumbnail" not in completed:
+                variant.pop("thumbnail_path", None)
+            if variant["orientation"] not in job["uploaded"]:
+                track_artifact(job, variant.get("path"), "formats")
+                track_artifact(job, variant.get("thumbnail_path"), "thumbnails")
+    if "persist" in completed:
+        job["results"] = checkpoint.get("results") or []
+    
+    # Квота резервируется только на еще не загруженные видео
+    videos = (3 if job["create_formats"] else 1) - len(job["uploaded"])
+    job["quota_units"] = youtube_quota.estimate_units(max(0, videos), job["thumbnail_option"] != "none")
+    return job
+
+def resumed_from(job: dict) -> str:
+    """Стадия, с которой продолжено задание"""
+    remaining = [stage for stage in CHECKPOINT_STAGES if stage not in job["completed_stages"]]
+    return remaining[0] if remaining else "done"
+
+def scheduled(handler, resource: Optional[str] = None, stage: Optional[str] = None):
+    """Стадия через планировщик: слот общего ресурса по приоритету задания и отмена задания
+
+    Стадия stage, восстановленная из чекпоинта, пропускается; после выполнения ее результаты
+    сохраняются в batch_items.
+    """
+    async def run(job: dict):
+        if stage in job["completed_stages"]:
+            return
+        await scheduler.run(
+            resource, job["upload_id"], handler, job,
+            priority=job["priority"],
+            tenant=job["campaign_name"],
+            batch_id=job["progress"].batch_id,
+            on_wait=lambda: job["progress"].update("waiting", resource=resource, priority=job["priority"])
+        )
+        if stage is not None:
+            await batch_checkpoints.record(job, stage)
+    return run
+
+def build_upload_stages() -> List[Stage]:
+    """Стадии конвейера: admission → ingest → transcode/formats → thumbnail → upload → persist"""
+    return [
+        # Допуск по квоте YouTube строго по очереди, до скачивания и транскодирования
+        Stage("admission", scheduled(stage_admission), 1),
+        Stage("ingest", scheduled(stage_ingest, stage="ingest"), PIPELINE_STAGE_CONCURRENCY["ingest"]),
+        # Транскодирование и загрузка занимают слоты, общие для всех пакетов процесса
+        Stage("transcode", scheduled(stage_transcode, "transcode", "transcode"), PIPELINE_STAGE_CONCURRENCY["transcode"]),
+        Stage("thumbnail", scheduled(stage_thumbnail, stage="thumbnail"), PIPELINE_STAGE_CONCURRENCY["thumbnail"]),
+        Stage("upload", scheduled(stage_upload, "upload", "upload"), PIPELINE_STAGE_CONCURRENCY["upload"]),
+        Stage("persist", scheduled(stage_persist, stage="persist"), PIPELINE_STAGE_CONCURRENCY["persist"]),
+    ]
+
+async def run_upload_pipeline(jobs: List[dict], batch_id: Optional[str] = None) -> list:
+    """Прогон заданий через конвейер с публикацией прогресса пакета"""
+    async def on_item_done(item):
+        # Файлы упавших заданий остаются на диске до очистки по TTL/квоте
+        artifact_manager.unpin(item.data["artifacts"])
+        youtube_quota.discard_pending(item.data["upload_id"])
+        await youtube_quota.release(item.data["quota"])
+        await scheduler.forget(job_id=item.data["upload_id"])
+        if batch_id:
+            progress_tracker.finish_item(batch_id, item.index, item.success, None if item.success else str(item.error))
+    
+    for job in jobs:
+        youtube_quota.add_pending(job["upload_id"], job["quota_units"], batch_id)
+    
+    if batch_id:
+        progress_tracker.start_batch(batch_id, len(jobs))
+    try:
+        items = await run_pipeline(jobs, build_upload_stages(), queue_size=PIPELINE_QUEUE_SIZE, on_item_done=on_item_done)
+    finally:
+        if batch_id:
+            await scheduler.forget(batch_id=batch_id)
+            progress_tracker.finish_batch(batch_id)
+    await batch_checkpoints.finish(items)
+    return items
+
+async def stage_admission(job: dict):
+    """Стадия admission: резерв квоты YouTube (ожидание или ошибка, если квоты не хватает)"""
+    job["progress"].update("admission", quota_units=job["quota_units"])
+    job["quota"] = await youtube_quota.admit(
+        job["upload_id"], job["quota_units"], job["progress"].batch_id, max_wait=job["quota_max_wait"]
+    )
+
+async def stage_ingest(job: dict):
+    """Стадия ingest: сохранение загруженного файла или скачивание из Google Drive"""
+    job["progress"].update("ingest")
+    with track_stage("ingest"):
+        if job["video_source"] == "local" and job["upload_ref"]:
+            print(f"📁 Исходник из возобновляемой загрузки {job['upload_ref']}...")
+            job["source_path"], job["original_filename"] = await resumable_uploads.claim(job["upload_ref"], job["upload_id"])
+            print(f"✅ Файл получен: {job['source_path']}")
+        elif job["video_source"] == "local":
+            print(f"📁 Сохранение загруженного файла...")
+            job["original_filename"] = job["video_file"].filename
+            job["source_path"] = await save_uploaded_file(job["video_file"])
+            print(f"✅ Файл сохранен: {job['source_path']}")
+        elif job["video_source"] == "drive":
+            print(f"☁️ Скачивание из Google Drive...")
+            job["original_filename"] = job["drive_url"].split('/')[-1]  # Берем последнюю часть URL
+            job["processed_path"] = await download_from_drive(job["drive_url"], job["upload_id"])
+            print(f"✅ Видео скачано: {job['processed_path']}")
+    
+    kind = "videos" if job["video_source"] == "local" else "downloaded"
+    track_artifact(job, job["source_path"], kind)
+    track_artifact(job, job.get("processed_path"), kind)
+
+async def stage_transcode(job: dict):
+    """Стадия transcode: очистка метаданных, ориентация и другие форматы"""
+    job["progress"].update("transcode")
+    if not job.get("processed_path"):
+        print(f"🔧 Обработка видео ({'очистка метаданных' if job['processing'] == 'metadata' else 'очистка метаданных и уникализация'})...")
+        with track_stage("transcode"):
+            job["processed_path"], job["processing_path"] = await process_video(
+                job["source_path"], job["upload_id"], job["progress"], job["processing"]
+            )
+        track_artifact(job, job["processed_path"], "processed")
+    
+    orientation = await get_video_orientation(job["processed_path"])
+    print(f"✅ Ориентация видео: {orientation}")
+    
+    # Список видео для загрузки (основное + другие форматы)
+    job["variants"] = [
+        {
+            "path": job["processed_path"],
+            "orientation": orientation,
+            "copy_number": job["copy_number"]
+        }
+    ]
+    
+    # В потоковом режиме форматы кодируются прямо в загрузку на YouTube (стадия upload)
+    if job["create_formats"] and STREAMING_UPLOAD_ENABLED:
+        for fmt in get_formats_to_create(orientation):
+            job["variants"].append({
+                "path": None,
+                "stream_source": job["processed_path"],
+                "format": fmt,
+                "orientation": fmt["name"],
+                "copy_number": job["copy_number"]
+            })
+    
+    # Создаем другие форматы если выбрана опция
+    elif job["create_formats"]:
+        print(f"🎬 Создание других форматов видео...")
+        other_formats = await create_other_formats(job["processed_path"], job["upload_id"], orientation, job["progress"])
+        for fmt in other_formats:
+            track_artifact(job, fmt["path"], "formats")
+        
+        # Добавляем созданные форматы с тем же номером копии
+        for fmt in other_formats:
+            job["variants"].append({
+                "path": fmt["path"],
+                "orientation": fmt["orientation"],
+                "copy_number": job["copy_number"]  # Тот же номер для всех форматов
+            })
+
+async def stage_thumbnail(job: dict):
+    """Стадия thumbnail: миниатюры для каждого формата"""
+    for number, variant in enumerate(job["variants"]):
+        job["progress"].update("thumbnail", round(number / len(job["variants"]) * 100, 1))
+        with track_stage("thumbnail"):
+            if variant["path"]:
+                variant["thumbnail_path"] = await process_thumbnail(
+                    variant["path"], job["thumbnail_option"], job["modal_image_id"]
+                )
+            else:
+                # Формат еще не создан - кадр берем из исходника с тем же фильтром
+                variant["thumbnail_path"] = await process_thumbnail(
+                    variant["stream_source"], job["thumbnail_option"], job["modal_image_id"],
+                    video_filter=format_video_filter(variant["format"])
+                )
+        track_artifact(job, variant["thumbnail_path"], "thumbnails")
+
+async def stage_upload(job: dict):
+    """Стадия upload: загрузка всех форматов на YouTube"""
+    with youtube_quota.use(job["quota"]):
+        await upload_variants(job)
+    # Неизрасходованный резерв (например, без миниатюр) возвращается в общую квоту
+    await youtube_quota.release(job["quota"])
+
+async def upload_variants(job: dict):
+    """Загрузка основного видео и форматов по очереди"""
+    for variant in job["variants"]:
+        # Генерируем название для каждого видео
+        variant["video_title"] = generate_video_title(
+            job["campaign_name"],
+            variant["orientation"],
+            variant["copy_number"]
+        )
+        
+        if variant["orientation"] in job["uploaded"]:
+            # Загружено при прошлой попытке пакета
+            variant.update(job["uploaded"][variant["orientation"]])
+            print(f"⏭ Уже загружено: {variant['video_title']}")
+            continue
+        
+        print(f"📤 Загрузка: {variant['video_title']}")
+        progress_callback = job["progress"].stage_callback("upload", orientation=variant["orientation"])
+        progress_callback({"percent": 0.0})
+        
+        if not variant["path"]:
+            with track_stage("youtube_upload"):
+                await stream_variant_to_youtube(job, variant, progress_callback)
+        
+        if not variant.get("streamed"):
+            artifact_manager.touch(variant["path"])
+            with track_stage("youtube_upload"):
+                variant["youtube_url"], variant["youtube_confirmed"] = await upload_to_youtube(
+                    variant["path"], variant["video_title"], variant["thumbnail_path"], progress_callback
+                )
+        
+        if variant["youtube_confirmed"]:
+            # Чекпоинт после каждого видео: повтор пакета не загрузит его второй раз
+            job["uploaded"][variant["orientation"]] = {
+                key: variant[key] for key in ("youtube_url", "youtube_confirmed", "video_title")
+            }
+            await batch_checkpoints.record(job)
+
+async def stream_variant_to_youtube(job: dict, variant: dict, progress_callback=None) -> bool:
+    """Потоковая загрузка формата; при ошибке формат создается файлом для обычной загрузки"""
+    fmt = variant["format"]
+    print(f"   📡 Потоковая загрузка {fmt['name']} формата ({fmt['width']}x{fmt['height']})...")
+    from streaming import upload_stream  # googleapiclient нужен только при потоковой загрузке
+    
+    try:
+        result = await upload_stream(
+            build_format_command(variant["stream_source"], fmt),
+            variant["video_title"],
+            build_video_description(),
+            variant["thumbnail_path"],
+            progress_callback
+        )
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    
+    if result.get("quota_exceeded"):
+        # Файловая загрузка упрется в ту же квоту - формат не создаем
+        raise QuotaExhaustedError(result.get("error"))
+    if result.get("unavailable"):
+        # YouTube недоступен и после повторов - файловая загрузка тоже не пройдет
+        raise ExternalServiceError(result.get("error"))
+    
+    if result.get("success"):
+        variant["youtube_url"], variant["youtube_confirmed"] = result["video_url"], True
+        variant["streamed"] = True
+        print(f"   ✅ Загружено потоком: {result.get('bytes_streamed', 0) // 1024} KB")
+        return True
+    
+    print(f"   ⚠️ Потоковая загрузка не удалась, создаем файл: {result.get('error')}")
+    await db_manager.create_log("streaming_upload_fallback", {
+        "upload_id": job["upload_id"],
+        "format": fmt["name"],
+        "error": result.get("error")
+    })
+    
+    created = await render_format(variant["stream_source"], job["upload_id"], fmt, job["progress"])
+    if not created:
+        raise RuntimeError(f"Не удалось создать {fmt['name']} формат")
+    variant["path"] = created["path"]
+    track_artifact(job, variant["path"], "formats")
+    return False
+
+async def stage_persist(job: dict):
+    """Стадия persist: сохранение загрузок в базу данных и логирование"""
+    campaign_name = job["campaign_name"]
+    original_filename = job["original_filename"]
+    
+    job["progress"].update("persist")
+    for variant in job["variants"]:
+        upload_data = {
+            "youtube_url": variant["youtube_url"],
+            "video_title": variant["video_title"],
+            "campaign_name": campaign_name,
+            "thumbnail_type": job["thumbnail_option"],
+            "thumbnail_image_id": job["modal_image_id"] if job["thumbnail_option"] == "soft_modal" else None,
+            "status": "active"
+        }
+        
+        with track_stage("db_write"):
+            # Ключ идемпотентности: повтор пакета после сбоя не создает вторую запись
+            upload_record, created = await db_manager.get_or_create_upload(
+                upload_data, idempotency_key=f"{job['upload_id']}:{variant['orientation']}"
+            )
+        
+        # Убираем расширение из имени файла для группы
+        group_name = original_filename.rsplit('.', 1)[0] if original_filename else f"{campaign_name} #{variant['copy_number']}"
+        
+        job["results"].append({
+            "upload_id": upload_record["id"],
+            "youtube_url": variant["youtube_url"],
+            "video_title": variant["video_title"],
+            "orientation": variant["orientation"],
+            "copy_number": variant["copy_number"],
+            "group_name": group_name,
+            "original_filename": original_filename
+        })
+        
+        # Логирование успешной загрузки (запись из прошлой попытки уже залогирована)
+        if not created:
+            continue
+        with track_stage("db_write"):
+            await db_manager.create_log(
+                job["log_action"],
+                {
+                    "upload_id": upload_record["id"],
+                    "campaign_name": campaign_name,
+                    "youtube_url": variant["youtube_url"],
+                    "thumbnail_type": job["thumbnail_option"],
+                    "orientation": variant["orientation"],
+                    "processing": job["processing"],
+                    "processing_path": job["processing_path"],
+                    **job["log_extra"]
+                }
+            )
+    
+    await release_job_artifacts(job)
+
+def track_artifact(job: dict, path: Optional[str], kind: str):
+    """Учет файла задания в менеджере артефактов"""
+    if path and path not in job["artifacts"] and artifact_manager.register(path, kind):
+        job["artifacts"].append(path)
+
+async def release_job_artifacts(job: dict):
+    """Удаление промежуточных файлов после подтвержденной загрузки на YouTube"""
+    if not ARTIFACT_DELETE_AFTER_UPLOAD:
+        return
+    
+    confirmed = [v for v in job["variants"] if v.get("youtube_confirmed")]
+    to_release = [path for v in confirmed for path in (v["path"], v.get("thumbnail_path"))]
+    # Исходник и обработанная копия нужны, пока не загружены все форматы
+    if len(confirmed) == len(job["variants"]):
+        to_release += [job["source_path"], job.get("processed_path")]
+        # Локальный кэш освобождает менеджер артефактов, объект в бакете удаляется здесь
+        if job["video_source"] == "local" and job["source_path"] and storage.name != "local":
+            try:
+                await storage.delete(key_for(job["source_path"]))
+            except Exception as e:
+                print(f"⚠️ Не удалось удалить исходник из хранилища: {e}")
+    
+    to_release = [path for path in to_release if path in job["artifacts"]]
+    artifact_manager.unpin(to_release)
+    freed = artifact_manager.release(to_release)
+    job["artifacts"] = [path for path in job["artifacts"] if path not in to_release]
+    if freed:
+        print(f"🧹 Удалено промежуточных файлов: {len(to_release)} ({freed // 1024} KB)")
+
 async def download_from_drive(drive_url: str, upload_id: str) -> str:
     """Скачивание видео из Google Drive"""
     # Здесь будет логика скачивания из Google Drive
@@ -776,9 +1755,33 @@ async def download_from_drive(drive_url: str, upload_id: str) -> str:
     
     return str(downloaded_dir / f"{upload_id}_from_drive.mp4")
 
-async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str]) -> Optional[str]:
-    """Обработка миниатюры"""
-    import subprocess
+# Ключи файлов модалок: записи модалок не меняются, поэтому кэш не инвалидируется
+_modal_path_cache = {}
+
+async def get_modal_path(modal_id: str) -> Optional[str]:
+    """Локальный путь к файлу модалки по ID (ключ кэшируется, файл берется из кэша хранилища)"""
+    modal_key = _modal_path_cache.get(modal_id)
+    observe_cache("modal_path", modal_key is not None)
+    if not modal_key:
+        modal_data = await db_manager.get_modal_image_by_id(modal_id)
+        if not modal_data or not modal_data.get("file_path"):
+            return None
+        # Старые записи содержат путь в UPLOAD_DIR - он переводится в ключ
+        modal_key = _modal_path_cache[modal_id] = key_for(modal_data["file_path"])
+    
+    try:
+        return await storage.local_path(modal_key)
+    except FileNotFoundError:
+        return str(storage.cache_path(modal_key))
+
+async def store_modal_previews(original_path: str, modal_id: str):
+    """Создание превью модалки и сохранение их в хранилище"""
+    created = await asyncio.to_thread(generate_previews, original_path, modal_id)
+    for path in created.values():
+        await storage.put_file(key_for(path), path)
+
+async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str], video_filter: Optional[str] = None) -> Optional[str]:
+    """Обработка миниатюры (video_filter - фильтр ffmpeg для кадра, например формат с полосами)"""
     from PIL import Image, ImageDraw, ImageFont
     import os
     
@@ -787,6 +1790,7 @@ async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str
     
     thumbnails_dir = Path(UPLOAD_DIR) / "thumbnails"
     thumbnails_dir.mkdir(parents=True, exist_ok=True)
+    temp_frame = None
     
     try:
         if option == "first_frame":
@@ -797,13 +1801,14 @@ async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str
                 'ffmpeg', '-i', video_path,
                 '-ss', '00:00:00.1',  # 100 миллисекунд от начала
                 '-vframes', '1',      # Один кадр
+                *(['-vf', video_filter] if video_filter else []),
                 '-q:v', '2',          # Высокое качество
                 '-y',
                 str(thumbnail_path)
             ]
             
             print(f"🖼️ Извлечение первого кадра: {video_path}")
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+            result = await run_command(ffmpeg_cmd)
             
             if result.returncode == 0:
                 print(f"✅ Первый кадр извлечен: {thumbnail_path}")
@@ -822,24 +1827,23 @@ async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str
                 'ffmpeg', '-i', video_path,
                 '-ss', '00:00:00.1',  # 100 миллисекунд от начала
                 '-vframes', '1',
+                *(['-vf', video_filter] if video_filter else []),
                 '-q:v', '2',
                 '-y',
                 str(temp_frame)
             ]
             
-            result = subprocess.run(ffmpeg_cmd, capture_output=True, text=True)
+            result = await run_command(ffmpeg_cmd)
             if result.returncode != 0:
                 print(f"⚠️ Ошибка извлечения кадра для модалки: {result.stderr}")
                 return None
             
-            # Получаем путь к модалке из базы данных
-            modal_data = await db_manager.get_modal_image_by_id(modal_id)
-            if not modal_data or not modal_data.get("file_path"):
+            # Получаем путь к модалке (из кэша или из базы данных)
+            modal_path = await get_modal_path(modal_id)
+            if not modal_path:
                 print(f"⚠️ Модалка не найдена: {modal_id}")
                 return None
             
-            modal_path = modal_data["file_path"]
-            
             # Накладываем модалку на кадр
             try:
                 # Открываем изображения
@@ -878,10 +1882,6 @@ async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str
                 # Сохраняем результат
                 composite_rgb.save(thumbnail_path, 'JPEG', quality=95)
                 
-                # Удаляем временный файл
-                if temp_frame.exists():
-                    temp_frame.unlink()
-                
                 print(f"✅ Миниатюра с модалкой создана: {thumbnail_path}")
                 print(f"🖼️ Файл сохранен: {thumbnail_path.exists()}")
                 return str(thumbnail_path)
@@ -894,30 +1894,48 @@ async def process_thumbnail(video_path: str, option: str, modal_id: Optional[str
         print(f"⚠️ Общая ошибка обработки миниатюры: {e}")
         return None
     
+    finally:
+        # Временный кадр удаляем при любом исходе, в том числе при ошибке наложения
+        if temp_frame is not None and temp_frame.exists():
+            temp_frame.unlink()
+    
     return None
 
-async def upload_to_youtube(video_path: str, title: str, thumbnail_path: Optional[str]) -> str:
-    """Загрузка видео на YouTube"""
+def build_video_description() -> str:
+    """Описание видео на YouTube"""
+    return f"Видео загружено через UAC Creative Manager\nДата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+
+async def upload_to_youtube(video_path: str, title: str, thumbnail_path: Optional[str], progress_callback=None) -> tuple:
+    """Загрузка видео на YouTube: (ссылка, подтверждена ли загрузка)"""
     try:
         # Используем реальную интеграцию с YouTube
         result = await integration_manager.upload_video_to_youtube(
             video_path=video_path,
             title=title,
-            description=f"Видео загружено через UAC Creative Manager\nДата: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            thumbnail_path=thumbnail_path
+            description=build_video_description(),
+            thumbnail_path=thumbnail_path,
+            progress_callback=progress_callback
         )
         
         if result.get("success"):
-            return result.get("video_url")
+            return result.get("video_url"), True
+        elif result.get("quota_exceeded"):
+            # Без квоты заглушка только скрыла бы, что видео не загружено
+            raise QuotaExhaustedError(result.get("error"))
+        elif result.get("unavailable"):
+            # Сбой YouTube (5xx, сеть, разомкнутый выключатель) - задание должно упасть, а не получить заглушку
+            raise ExternalServiceError(result.get("error"))
         else:
             # Если интеграция не настроена, возвращаем заглушку
             await db_manager.create_log("youtube_upload_fallback", {"error": result.get("error", "Unknown error")})
-            return f"https://youtube.com/watch?v={str(uuid.uuid4())[:11]}"
+            return f"https://youtube.com/watch?v={str(uuid.uuid4())[:11]}", False
             
+    except (QuotaExhaustedError, ExternalServiceError):
+        raise
     except Exception as e:
         # Логируем ошибку и возвращаем заглушку
         await db_manager.create_log("youtube_upload_error", {"error": str(e)})
-        return f"https://youtube.com/watch?v={str(uuid.uuid4())[:11]}"
+        return f"https://youtube.com/watch?v={str(uuid.uuid4())[:11]}", False
 
 # ==================== INTEGRATION ENDPOINTS ====================
 
@@ -949,6 +1967,22 @@ async def test_youtube_integration():
         await db_manager.create_log("youtube_test_error", {"error": str(e)})
         return {"success": False, "error": str(e)}
 
+@app.get("/youtube/quota")
+async def get_youtube_quota():
+    """Расход квоты YouTube за текущие сутки, резервы и задания в очереди допуска"""
+    return await youtube_quota.status()
+
+@app.get("/youtube/quota/forecast")
+async def forecast_youtube_quota(
+    batch_id: Optional[str] = None,
+    videos: int = Query(0, ge=0, le=1000),
+    create_formats: bool = False,
+    thumbnail: bool = False
+):
+    """Прогноз допуска: когда квоты хватит на задания пакета batch_id и/или на новый пакет из videos видео"""
+    per_video = youtube_quota.estimate_units(3 if create_formats else 1, thumbnail)
+    return await youtube_quota.forecast(batch_id, [per_video] * videos)
+
 @app.post("/integrations/telegram/setup")
 async def setup_telegram_integration(request: Request):
     """Настройка Telegram интеграции"""
@@ -1254,4 +2288,8 @@ async def youtube_oauth_callback(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if API_WORKERS > 1:
+        # Несколько процессов uvicorn запускаются только по строке импорта приложения
+        uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=API_WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,170 @@
+"""
+Запуск внешних медиа-утилит (ffmpeg / ffprobe) без блокировки event loop
+"""
+import asyncio
+import json
+import subprocess
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import ACTIVE_FFMPEG, track_stage
+
+ProgressCallback = Callable[[Dict[str, Any]], None]
+
+# Исходник, который можно перепаковать в MP4 без кодирования
+COPY_VIDEO_CODECS = ("h264",)
+COPY_PIXEL_FORMATS = ("yuv420p", "yuvj420p")
+COPY_AUDIO_CODECS = ("aac",)
+COPY_MAX_FPS = 60
+
+
+async def run_command(
+    cmd: List[str],
+    on_progress: Optional[ProgressCallback] = None,
+    duration: Optional[float] = None,
+    text: bool = True
+) -> subprocess.CompletedProcess:
+    """Асинхронный аналог subprocess.run(cmd, capture_output=True, text=True)
+
+    С text=False stdout возвращается байтами (кадры из image2pipe и т.п.),
+    stderr всегда декодируется.
+
+    Если передан on_progress, ffmpeg запускается с -progress pipe:1 и колбэк
+    получает словарь percent/fps/speed/out_time_s на каждом блоке прогресса
+    (percent считается только при известной длительности исходника).
+    """
+    if on_progress and cmd[0] == 'ffmpeg':
+        cmd = [cmd[0], '-progress', 'pipe:1', '-nostats', *cmd[1:]]
+
+    active = ACTIVE_FFMPEG.labels(cmd[0])
+    active.inc()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            if on_progress:
+                # stderr читаем параллельно, иначе ffmpeg заблокируется на полном пайпе
+                stderr_task = asyncio.create_task(process.stderr.read())
+                stdout = await _read_progress(process.stdout, on_progress, duration)
+                stderr = await stderr_task
+                await process.wait()
+            else:
+                stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # Задание отменено - процесс не должен доедать CPU после отмены
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+    finally:
+        active.dec()
+    return subprocess.CompletedProcess(
+        cmd,
+        process.returncode,
+        stdout.decode(errors="replace") if text else stdout,
+        stderr.decode(errors="replace")
+    )
+
+
+async def _read_progress(stream: asyncio.StreamReader, on_progress: ProgressCallback, duration: Optional[float]) -> bytes:
+    """Разбор блоков key=value из -progress; блок заканчивается строкой progress=continue|end"""
+    block: Dict[str, str] = {}
+    async for raw_line in stream:
+        key, _, value = raw_line.decode(errors="replace").strip().partition('=')
+        if not key:
+            continue
+        block[key] = value
+        if key == 'progress':
+            on_progress(parse_progress(block, duration))
+            block = {}
+    return b""
+
+
+def parse_progress(block: Dict[str, str], duration: Optional[float] = None) -> Dict[str, Any]:
+    """Прогресс ffmpeg в удобном виде: процент, fps кодирования и скорость относительно реального времени"""
+    # out_time_ms исторически тоже в микросекундах
+    out_time_us = block.get('out_time_us') or block.get('out_time_ms')
+    try:
+        out_time_s = max(0.0, int(out_time_us) / 1_000_000)
+    except (TypeError, ValueError):
+        out_time_s = None
+    try:
+        fps = float(block.get('fps', ''))
+    except ValueError:
+        fps = None
+    try:
+        speed = float(block.get('speed', '').rstrip('x'))
+    except ValueError:
+        speed = None
+
+    if block.get('progress') == 'end':
+        percent = 100.0
+    elif duration and out_time_s is not None:
+        percent = round(min(99.9, out_time_s / duration * 100), 1)
+    else:
+        percent = None
+
+    return {"percent": percent, "fps": fps, "speed": speed, "out_time_s": out_time_s}
+
+
+async def probe_video(video_path: str) -> Optional[Dict[str, Any]]:
+    """Информация о потоках и контейнере через ffprobe (None при ошибке)"""
+    try:
+        with track_stage("probe"):
+            result = await run_command([
+                'ffprobe', '-v', 'quiet',
+                '-print_format', 'json',
+                '-show_streams',
+                '-show_format',
+                video_path
+            ])
+        if result.returncode != 0:
+            return None
+        return json.loads(result.stdout)
+    except (OSError, ValueError):
+        return None
+
+
+def get_video_stream(probe: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Первая видеодорожка из результата probe_video"""
+    if not probe:
+        return None
+    return next((s for s in probe.get('streams', []) if s.get('codec_type') == 'video'), None)
+
+
+def get_duration(probe: Optional[Dict[str, Any]]) -> Optional[float]:
+    """Длительность контейнера в секундах из результата probe_video"""
+    try:
+        return float(probe['format']['duration']) or None
+    except (TypeError, KeyError, ValueError):
+        return None
+
+
+def stream_copy_plan(probe: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Какие дорожки исходника можно скопировать без кодирования
+
+    {"video": bool, "audio": bool, "reason": str | None}: видео - H.264 8 бит
+    4:2:0 не выше COPY_MAX_FPS, звук - AAC (или звука нет). reason - почему
+    видео нужно кодировать.
+    """
+    video = get_video_stream(probe)
+    if not video:
+        return {"video": False, "audio": False, "reason": "нет данных ffprobe о видеодорожке"}
+    audio = next((s for s in probe.get('streams', []) if s.get('codec_type') == 'audio'), None)
+    audio_ok = audio is None or audio.get('codec_name') in COPY_AUDIO_CODECS
+
+    reason = None
+    try:
+        fps = float(Fraction(video.get('avg_frame_rate') or '0/1'))
+    except (ValueError, ZeroDivisionError):
+        fps = 0.0
+    if video.get('codec_name') not in COPY_VIDEO_CODECS:
+        reason = f"кодек видео {video.get('codec_name')}"
+    elif video.get('pix_fmt') not in COPY_PIXEL_FORMATS:
+        reason = f"формат пикселей {video.get('pix_fmt')}"
+    elif fps > COPY_MAX_FPS:
+        reason = f"{fps:.0f} fps"
+    return {"video": reason is None, "audio": audio_ok, "reason": reason}
@@ -0,0 +1,128 @@
+"""
+Метрики Prometheus для пайплайна и внешних вызовов (эндпоинт /metrics)
+
+Все метрики - обычные счетчики/гистограммы prometheus_client: запись стоит
+единицы микросекунд и не требует блокировок на горячем пути. Глубина очередей
+считается лениво в момент сбора метрик через set_function.
+"""
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Стадии: ingest, probe, transcode, format_render, thumbnail, youtube_upload, db_write
+PIPELINE_STAGE_SECONDS = Histogram(
+    "uac_pipeline_stage_seconds",
+    "Длительность стадий пайплайна обработки видео",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+# Сервисы: supabase, youtube, drive, telegram
+EXTERNAL_CALL_SECONDS = Histogram(
+    "uac_external_call_seconds",
+    "Длительность вызовов внешних сервисов",
+    ["service", "operation"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+)
+EXTERNAL_CALL_ERRORS = Counter(
+    "uac_external_call_errors_total",
+    "Ошибки вызовов внешних сервисов",
+    ["service", "operation"]
+)
+EXTERNAL_CALL_RETRIES = Counter(
+    "uac_external_call_retries_total",
+    "Повторы вызовов внешних сервисов после временных ошибок",
+    ["service", "operation"]
+)
+# 0 - замкнут (вызовы идут), 1 - пробный вызов, 2 - разомкнут (вызовы отклоняются)
+CIRCUIT_STATE = Gauge("uac_circuit_state", "Состояние автоматического выключателя сервиса", ["service"])
+CIRCUIT_REJECTIONS = Counter("uac_circuit_rejections_total", "Вызовы, отклоненные разомкнутым выключателем", ["service"])
+
+BYTES_IN = Counter("uac_bytes_in_total", "Принятые байты (загрузки, Google Drive)", ["source"])
+BYTES_OUT = Counter("uac_bytes_out_total", "Отправленные байты (YouTube)", ["destination"])
+
+QUEUE_DEPTH = Gauge("uac_queue_depth", "Глубина очередей обработки", ["queue"])
+# path: copy, copy_video (перекодирован только звук), encode, original (ffmpeg не сработал)
+PROCESSING_PATHS = Counter("uac_processing_path_total", "Способ обработки исходников", ["mode", "path"])
+ACTIVE_FFMPEG = Gauge("uac_active_ffmpeg_processes", "Запущенные процессы ffmpeg/ffprobe", ["binary"])
+
+ARTIFACT_BYTES = Gauge("uac_artifact_bytes", "Объем артефактов на диске по каталогам", ["directory"])
+ARTIFACT_EVICTIONS = Counter("uac_artifact_evictions_total", "Удаленные артефакты", ["directory", "reason"])
+
+CACHE_REQUESTS = Counter("uac_cache_requests_total", "Обращения к кэшам", ["cache", "result"])
+CACHE_HIT_RATIO = Gauge("uac_cache_hit_ratio", "Доля попаданий в кэш", ["cache"])
+STORAGE_CACHE_BYTES = Gauge("uac_storage_cache_bytes", "Объем локального кэша объектов хранилища (модалки и превью)")
+
+YOUTUBE_QUOTA_UNITS = Counter("uac_youtube_quota_units_total", "Израсходованные единицы квоты YouTube", ["operation"])
+YOUTUBE_QUOTA_REMAINING = Gauge("uac_youtube_quota_remaining", "Свободная квота YouTube на сегодня за вычетом резервов")
+YOUTUBE_QUOTA_RESERVED = Gauge("uac_youtube_quota_reserved", "Квота YouTube, зарезервированная допущенными заданиями")
+YOUTUBE_QUOTA_WAITING = Gauge("uac_youtube_quota_waiting_jobs", "Задания, ожидающие квоту YouTube")
+
+# Планировщик: ресурсы transcode, upload; классы приоритета single, batch, background
+SCHEDULER_WAIT_SECONDS = Histogram(
+    "uac_scheduler_wait_seconds",
+    "Ожидание слота планировщика",
+    ["resource", "priority"],
+    buckets=(0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+)
+SCHEDULER_WAITING = Gauge("uac_scheduler_waiting_jobs", "Задания в очереди планировщика", ["resource", "priority"])
+SCHEDULER_RUNNING = Gauge("uac_scheduler_running_jobs", "Задания, занявшие слот планировщика", ["resource", "priority"])
+SCHEDULER_CANCELLED = Counter("uac_scheduler_cancelled_total", "Отмененные задания", ["priority", "state"])
+
+REGISTRY_SUBSCRIBERS = Gauge("uac_registry_subscribers", "Открытые потоки изменений реестра")
+REGISTRY_EVENTS = Counter("uac_registry_events_total", "Уведомления об изменениях реестра из PostgreSQL", ["table", "op"])
+
+# Цикл событий: задержка пробуждения и блокирующие вызовы по месту в коде (site - "файл:строка функция")
+LOOP_LAG_SECONDS = Histogram(
+    "uac_event_loop_lag_seconds",
+    "Задержка цикла событий относительно запланированного пробуждения",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+LOOP_STALLS = Counter("uac_event_loop_stalls_total", "Остановки цикла событий дольше порога", ["site"])
+LOOP_STALL_SECONDS = Counter("uac_event_loop_stall_seconds_total", "Суммарная длительность остановок цикла событий", ["site"])
+
+_cache_counts: Dict[str, list] = {}
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Замер длительности стадии пайплайна"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def track_external(service: str, operation: str):
+    """Замер длительности и ошибок вызова внешнего сервиса"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_CALL_ERRORS.labels(service, operation).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_SECONDS.labels(service, operation).observe(time.perf_counter() - started)
+
+
+def observe_cache(cache: str, hit: bool):
+    """Учет попадания/промаха кэша и пересчет доли попаданий"""
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+    counts = _cache_counts.setdefault(cache, [0, 0])
+    counts[0] += int(hit)
+    counts[1] += 1
+    CACHE_HIT_RATIO.labels(cache).set(counts[0] / counts[1])
+
+
+def register_queue(name: str, size_func: Callable[[], int]):
+    """Глубина очереди считывается только при сборе метрик"""
+    QUEUE_DEPTH.labels(name).set_function(size_func)
+
+
+def render_metrics():
+    """Тело ответа /metrics и его content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,50 @@
+"""
+Одноразовые миграции данных (начальное наполнение БД)
+
+Раньше роли по умолчанию проверялись и создавались при каждом старте
+приложения. Теперь каждая миграция выполняется один раз: примененные
+отмечаются в таблице schema_migrations, и следующий старт обходится одним
+запросом на чтение. Сами миграции идемпотентны, поэтому повторный запуск
+(например, без таблицы schema_migrations в старой базе) безопасен.
+"""
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+from coordination import coordinator
+from database import db_manager
+
+logger = logging.getLogger(__name__)
+
+# Порядок важен: новые миграции добавляются в конец
+MIGRATIONS: List[Tuple[str, Callable[..., Awaitable[None]]]] = [
+    ("0001_default_roles", lambda db: db.create_default_roles()),
+]
+
+
+async def apply_migrations(db=db_manager) -> List[str]:
+    """Применение еще не выполненных миграций; возвращает имена примененных
+
+    Воркеры стартуют одновременно: миграции выполняет тот, кто взял блокировку,
+    остальные дожидаются ее и видят миграции уже отмеченными.
+    """
+    async with coordinator.lock("migrations", ttl=60, timeout=300):
+        return await _apply_migrations(db)
+
+
+async def _apply_migrations(db) -> List[str]:
+    try:
+        applied = set(await db.get_applied_migrations())
+    except Exception as e:
+        # Старая база без schema_migrations: миграции идемпотентны, просто не запоминаем их
+        logger.warning(f"schema_migrations недоступна ({e}), миграции выполняются без учета")
+        applied = None
+
+    done = []
+    for name, migrate in MIGRATIONS:
+        if applied is not None and name in applied:
+            continue
+        await migrate(db)
+        if applied is not None:
+            await db.record_migration(name)
+        done.append(name)
+    return done
@@ -0,0 +1,132 @@
+"""
+Конвейерное (pipelined) выполнение стадий обработки видео
+
+Элементы проходят стадии по очереди, но разные элементы обрабатываются
+одновременно на разных стадиях: пока видео #2 транскодируется, видео #1
+уже загружается на YouTube. Стадии связаны ограниченными очередями
+(backpressure), у каждой стадии свой лимит параллелизма, поэтому время
+пакета стремится ко времени самой медленной стадии, а не к сумме всех.
+"""
+import asyncio
+import inspect
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from metrics import QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """Стадия конвейера: асинхронный обработчик и лимит параллелизма"""
+
+    def __init__(self, name: str, handler: Callable[[Dict[str, Any]], Awaitable[Any]], concurrency: int = 1):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+
+
+class PipelineItem:
+    """Элемент конвейера с результатом или ошибкой"""
+
+    def __init__(self, index: int, data: Dict[str, Any]):
+        self.index = index
+        self.data = data
+        self.error: Optional[Exception] = None
+        self.failed_stage: Optional[str] = None
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+
+async def run_pipeline(
+    items: List[Dict[str, Any]],
+    stages: List[Stage],
+    queue_size: int = 2,
+    on_item_done: Optional[Callable[[PipelineItem], Any]] = None
+) -> List[PipelineItem]:
+    """Прогон элементов через стадии; результаты возвращаются в исходном порядке
+
+    Обработчик стадии получает словарь элемента и дополняет его на месте.
+    Ошибка на любой стадии помечает элемент как неуспешный, остальные стадии
+    для него пропускаются, а остальные элементы продолжают обработку.
+    on_item_done вызывается сразу, как только элемент прошел последнюю стадию
+    (или упал), не дожидаясь остальных элементов пакета; может быть корутиной.
+    Ошибка в on_item_done или при передаче элемента дальше помечает элемент
+    как неуспешный и не останавливает стадию.
+    """
+    pipeline_items = [PipelineItem(i, data) for i, data in enumerate(items)]
+    if not pipeline_items or not stages:
+        return pipeline_items
+
+    # Первая очередь вмещает весь пакет, межстадийные очереди ограничены
+    queues = [asyncio.Queue()] + [asyncio.Queue(maxsize=max(1, queue_size)) for _ in stages[1:]]
+    # Глубина очередей суммируется по всем одновременно идущим пакетам
+    depth = [QUEUE_DEPTH.labels(f"pipeline_{stage.name}") for stage in stages]
+
+    def fail(item: PipelineItem, error: Exception, stage_name: str):
+        if item.success:
+            item.error = error
+            item.failed_stage = stage_name
+
+    async def finish(item: PipelineItem, stage_name: str):
+        if on_item_done is None:
+            return
+        try:
+            result = on_item_done(item)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Pipeline item {item.index} completion failed: {e}")
+            fail(item, e, stage_name)
+
+    async def worker(stage_index: int):
+        stage = stages[stage_index]
+        queue = queues[stage_index]
+        next_queue = queues[stage_index + 1] if stage_index + 1 < len(stages) else None
+        while True:
+            item = await queue.get()
+            depth[stage_index].dec()
+            try:
+                if item.success:
+                    try:
+                        await stage.handler(item.data)
+                    except Exception as e:
+                        fail(item, e, stage.name)
+                if next_queue is not None:
+                    # Ждем места в следующей очереди - стадия не убегает вперед
+                    await next_queue.put(item)
+                    depth[stage_index + 1].inc()
+                else:
+                    await finish(item, stage.name)
+            except Exception as e:
+                # Элемент не дошел до следующей стадии: завершаем его здесь, воркер продолжает работу
+                fail(item, e, stage.name)
+                if next_queue is not None:
+                    await finish(item, stage.name)
+            finally:
+                # task_done обязателен при любой ошибке, иначе queue.join() ждет вечно
+                queue.task_done()
+
+    workers = [
+        asyncio.create_task(worker(stage_index))
+        for stage_index, stage in enumerate(stages)
+        for _ in range(stage.concurrency)
+    ]
+
+    try:
+        for item in pipeline_items:
+            queues[0].put_nowait(item)
+            depth[0].inc()
+
+        # Элемент попадает в следующую очередь до task_done в текущей,
+        # поэтому последовательное ожидание очередей дожидается всех стадий
+        for queue in queues:
+            await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    return pipeline_items
@@ -0,0 +1,87 @@
+"""
+Превью модалок: уменьшенные WebP-копии и HTTP-кэширование
+
+Превью (thumb и medium) создаются один раз при загрузке модалки и лежат
+рядом с оригиналами в uploads/modals/previews. Файлы модалок не меняются,
+поэтому ответы отдаются со строгим ETag (хэш содержимого) и
+Cache-Control: immutable, а повторный запрос с If-None-Match получает 304.
+"""
+import hashlib
+import mimetypes
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import UPLOAD_DIR, MODAL_PREVIEW_SIZES, MODAL_PREVIEW_QUALITY, MODAL_ETAG_CACHE_SIZE
+
+PREVIEWS_DIR = Path(UPLOAD_DIR) / "modals" / "previews"
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# ETag по (путь, mtime, размер) - хэш файла считается один раз; LRU на MODAL_ETAG_CACHE_SIZE файлов
+_etag_cache: "OrderedDict[tuple, str]" = OrderedDict()
+_etag_lock = threading.Lock()
+
+
+def preview_path(modal_id: str, size: str) -> Path:
+    return PREVIEWS_DIR / f"{modal_id}_{size}.webp"
+
+
+def generate_previews(source_path: str, modal_id: str) -> Dict[str, str]:
+    """Создание всех размеров превью (синхронно, вызывать через asyncio.to_thread)"""
+    from PIL import Image
+
+    PREVIEWS_DIR.mkdir(parents=True, exist_ok=True)
+    created = {}
+    with Image.open(source_path) as image:
+        image.load()
+        # WebP поддерживает прозрачность - модалки с альфа-каналом ее сохраняют
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        for size, max_side in MODAL_PREVIEW_SIZES.items():
+            derivative = image.copy()
+            derivative.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            output_path = preview_path(modal_id, size)
+            # Пишем во временный файл и переименовываем, чтобы не отдать недописанный
+            tmp_path = output_path.with_name(f"{output_path.name}.{uuid.uuid4().hex}.tmp")
+            derivative.save(tmp_path, "WEBP", quality=MODAL_PREVIEW_QUALITY, method=4)
+            tmp_path.replace(output_path)
+            created[size] = str(output_path)
+    return created
+
+
+def get_etag(path: str) -> str:
+    """Строгий ETag по содержимому файла"""
+    stat = Path(path).stat()
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _etag_lock:
+        etag = _etag_cache.get(key)
+        if etag is not None:
+            _etag_cache.move_to_end(key)
+            return etag
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    etag = f'"{digest.hexdigest()[:32]}"'
+    with _etag_lock:
+        _etag_cache[key] = etag
+        while len(_etag_cache) > MODAL_ETAG_CACHE_SIZE:
+            _etag_cache.popitem(last=False)
+    return etag
+
+
+def get_content_type(path: str) -> str:
+    if path.endswith(".webp"):
+        return "image/webp"
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверка If-None-Match (список ETag или *)"""
+    if not if_none_match:
+        return False
+    candidates = [value.strip() for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
@@ -0,0 +1,250 @@
+"""
+Профилирование отдельного запроса по требованию
+
+Запрос с заголовком X-Profile: 1 (или ?profile=1) и токеном администратора
+выполняется под семплирующим профилировщиком: фоновый поток каждые
+PROFILE_SAMPLE_INTERVAL_MS снимает стеки и складывает их в профиль запроса.
+
+Снимаются стеки:
+- задач asyncio, созданных в контексте запроса (фабрика задач цикла событий
+  отмечает их по contextvar). Задача, которая сейчас выполняется, - по
+  реальному стеку потока цикла, включая синхронные вызовы под ней;
+  ожидающая - по цепочке await с листом [await] (ожидание ffmpeg через
+  run_command, to_thread, сети);
+- рабочих потоков (to_thread, executor): поток не знает, чей запрос он
+  выполняет, поэтому при нескольких одновременно профилируемых запросах
+  стеки потоков попадут в каждый из них.
+
+Профиль сохраняется в формате collapsed stacks ("корень;...;лист число"),
+который читают flamegraph.pl, inferno и speedscope, у координатора под
+request id, поэтому доступен с любого воркера. Для потоковых ответов
+профиль охватывает время до начала отправки тела.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+
+from config import PROFILE_SAMPLE_INTERVAL_MS, PROFILE_MAX_SECONDS, PROFILE_TTL_HOURS, PROFILE_KEEP
+from coordination import coordinator
+
+logger = logging.getLogger(__name__)
+
+# Профиль запроса, в контексте которого создается задача
+current_profile: ContextVar[Optional["Profile"]] = ContextVar("current_profile", default=None)
+
+# Листья стеков простаивающих потоков: пустой executor, цикл событий в select
+IDLE_FRAMES = {("thread.py", "_worker"), ("selectors.py", "select")}
+
+
+def _label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    # ';' разделяет кадры в формате collapsed stacks
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _thread_stack(frame) -> List[Any]:
+    """Кадры потока от корня к листу"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(coro) -> List[Any]:
+    """Кадры приостановленной корутины по цепочке await, от внешней к внутренней"""
+    frames = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class Profile:
+    """Семплы одного запроса"""
+
+    def __init__(self, request_id: str, method: str, path: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.started = time.monotonic()
+        self.duration = 0.0
+        self.status_code: Optional[int] = None
+        self.ticks = 0
+        self.stacks: Counter = Counter()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self._token = None
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "request_id": self.request_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": self.status_code,
+            "started_at": self.started_at,
+            "duration_s": round(self.duration, 3),
+            "samples": self.ticks,
+            "interval_ms": PROFILE_SAMPLE_INTERVAL_MS,
+        }
+
+
+class RequestProfiler:
+    """Фоновый поток семплирования, фабрика задач и хранение профилей"""
+
+    def __init__(self, interval_ms: float = PROFILE_SAMPLE_INTERVAL_MS, max_seconds: float = PROFILE_MAX_SECONDS,
+                 ttl_hours: float = PROFILE_TTL_HOURS, keep: int = PROFILE_KEEP):
+        self.interval = interval_ms / 1000
+        self.max_seconds = max_seconds
+        self.ttl = ttl_hours * 3600
+        self._active: List[Profile] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread: Optional[int] = None
+        self._loops: "weakref.WeakSet[asyncio.AbstractEventLoop]" = weakref.WeakSet()
+        # Последние профили этого воркера для GET /admin/profiles
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=keep)
+
+    # ==================== ЗАДАЧИ ЗАПРОСА ====================
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """Фабрика задач цикла: задачи, созданные в контексте профилируемого запроса, попадают в его профиль"""
+        self._loops.add(loop)
+        previous = loop.get_task_factory()
+
+        def task_factory(loop, coro, **kwargs):
+            task = previous(loop, coro, **kwargs) if previous else asyncio.Task(coro, loop=loop, **kwargs)
+            context = kwargs.get("context")
+            profile = context.get(current_profile, None) if context is not None else current_profile.get()
+            if profile is not None:
+                profile.tasks.add(task)
+            return task
+
+        loop.set_task_factory(task_factory)
+
+    def start(self, request_id: str, method: str, path: str) -> Profile:
+        profile = Profile(request_id, method, path)
+        profile._token = current_profile.set(profile)
+        task = asyncio.current_task()
+        if task is not None:
+            profile.tasks.add(task)
+        loop = asyncio.get_running_loop()
+        if loop not in self._loops:
+            self.install(loop)
+        self._loop_thread = threading.get_ident()
+        with self._lock:
+            self._active.append(profile)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+        return profile
+
+    def stop(self, profile: Profile, status_code: Optional[int] = None):
+        profile.duration = time.monotonic() - profile.started
+        profile.status_code = status_code
+        current_profile.reset(profile._token)
+        with self._lock:
+            if profile in self._active:
+                self._active.remove(profile)
+
+    # ==================== СЕМПЛИРОВАНИЕ ====================
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # Забытый или бесконечный запрос не профилируется дольше max_seconds
+                self._active = [p for p in self._active if now - p.started < self.max_seconds]
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active)
+            try:
+                self._sample(active)
+            except Exception as e:
+                logger.debug(f"Profiler sample failed: {e}")
+            time.sleep(self.interval)
+
+    def _sample(self, profiles: List[Profile]):
+        frames = sys._current_frames()
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+        threads = []
+        for ident, frame in frames.items():
+            if ident in (own, self._loop_thread):
+                continue
+            stack = _thread_stack(frame)
+            leaf = stack[-1].f_code
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_FRAMES:
+                continue
+            threads.append(f"thread:{names.get(ident, ident)};" + ";".join(_label(f) for f in stack))
+
+        loop_stack = _thread_stack(frames.get(self._loop_thread))
+        for profile in profiles:
+            profile.ticks += 1
+            for task in list(profile.tasks):
+                stack = self._task_stack(task, loop_stack)
+                if stack:
+                    profile.stacks[stack] += 1
+            for stack in threads:
+                profile.stacks[stack] += 1
+
+    @staticmethod
+    def _task_stack(task: asyncio.Task, loop_stack: List[Any]) -> Optional[str]:
+        if task.done():
+            return None
+        coro = task.get_coro()
+        chain = _await_chain(coro)
+        if not chain:
+            return None
+        root = f"task:{task.get_name()}"
+        if getattr(coro, "cr_running", False) and chain[0] in loop_stack:
+            # Задача на CPU: реальный стек потока цикла от ее корутины вниз
+            running = loop_stack[loop_stack.index(chain[0]):]
+            return ";".join([root] + [_label(f) for f in running])
+        return ";".join([root] + [_label(f) for f in chain] + ["[await]"])
+
+    # ==================== ХРАНЕНИЕ ====================
+
+    async def save(self, profile: Profile):
+        """Профиль у координатора под request id (вспомогательная запись, ошибка не влияет на запрос)"""
+        summary = profile.summary()
+        try:
+            await coordinator.set(f"profile:{profile.request_id}", {**summary, "folded": profile.folded()}, ttl=self.ttl)
+            self._recent.appendleft(summary)
+            await coordinator.publish_worker_state("profiles", list(self._recent), ttl=self.ttl)
+        except Exception as e:
+            logger.warning(f"Profile {profile.request_id} save failed: {e}")
+
+    async def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        return await coordinator.get(f"profile:{request_id}")
+
+    async def recent(self) -> List[Dict[str, Any]]:
+        """Последние профили всех воркеров, новые первыми"""
+        profiles = [p for worker in (await coordinator.workers_state("profiles")).values() for p in worker]
+        return sorted(profiles, key=lambda p: p["started_at"], reverse=True)
+
+    @staticmethod
+    def new_request_id() -> str:
+        return uuid.uuid4().hex
+
+
+# Глобальный профилировщик запросов
+request_profiler = RequestProfiler()
@@ -0,0 +1,241 @@
+"""
+Прогресс загрузок для фронтенда (Server-Sent Events)
+
+Клиент генерирует batch_id, открывает GET /uploads/progress/{batch_id} и
+передает тот же batch_id в /upload/video или /upload/videos/batch. Стадии
+конвейера сообщают сюда стадию и процент для каждого видео пакета, а поток
+SSE отправляет клиенту снимок состояния пакета не чаще PROGRESS_MIN_INTERVAL:
+частые обновления ffmpeg и YouTube схлопываются в один снимок.
+
+С общим координатором (Redis) POST загрузки и поток SSE могут попасть в
+разные воркеры: воркер, обрабатывающий пакет, публикует снимок в общий кэш
+(тоже не чаще PROGRESS_MIN_INTERVAL), а поток читает его оттуда.
+"""
+import asyncio
+import json
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from config import PROGRESS_MIN_INTERVAL, PROGRESS_TTL
+from coordination import coordinator
+
+HEARTBEAT_INTERVAL = 15  # секунды между комментариями-пингами, чтобы прокси не рвали соединение
+
+
+class ProgressReporter:
+    """Отчет о прогрессе одного видео пакета (без batch_id - ничего не делает)"""
+
+    def __init__(self, tracker: "ProgressTracker", batch_id: Optional[str], index: int):
+        self.tracker = tracker
+        self.batch_id = batch_id
+        self.index = index
+
+    @property
+    def enabled(self) -> bool:
+        return self.batch_id is not None
+
+    def update(self, stage: str, percent: Optional[float] = None, **fields):
+        if self.batch_id:
+            self.tracker.update(self.batch_id, self.index, stage=stage, percent=percent, **fields)
+
+    def stage_callback(self, stage: str, **fields):
+        """Колбэк для run_command(on_progress=...) и загрузки на YouTube"""
+        return lambda info: self.update(stage, **{**info, **fields})
+
+
+class ProgressTracker:
+    """Состояние пакетов загрузки в памяти процесса"""
+
+    def __init__(self, min_interval: float = PROGRESS_MIN_INTERVAL, ttl: int = PROGRESS_TTL):
+        self.min_interval = min_interval
+        self.ttl = ttl
+        self._batches: Dict[str, Dict[str, Any]] = {}
+        self._mirror_tasks: Dict[str, asyncio.Task] = {}
+
+    def _get_batch(self, batch_id: str) -> Dict[str, Any]:
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            batch = {
+                "id": batch_id,
+                "items": {},
+                "total": None,
+                "finished": False,
+                "version": 0,
+                "updated_at": time.monotonic(),
+                "changed": asyncio.Event()
+            }
+            self._batches[batch_id] = batch
+        return batch
+
+    def _notify(self, batch: Dict[str, Any]):
+        batch["version"] += 1
+        batch["updated_at"] = time.monotonic()
+        # Будим всех подписчиков и заводим новое событие для следующего изменения
+        batch["changed"].set()
+        batch["changed"] = asyncio.Event()
+        if coordinator.shared:
+            self._schedule_mirror(batch)
+
+    def _schedule_mirror(self, batch: Dict[str, Any]):
+        """Публикация снимка в общий кэш: одна отложенная запись на интервал"""
+        batch_id = batch["id"]
+        task = self._mirror_tasks.get(batch_id)
+        if task and not task.done():
+            return
+        try:
+            self._mirror_tasks[batch_id] = asyncio.get_running_loop().create_task(self._mirror(batch_id))
+        except RuntimeError:
+            pass
+
+    async def _mirror(self, batch_id: str):
+        # Финальное состояние публикуется сразу, промежуточные - не чаще min_interval
+        batch = self._batches.get(batch_id)
+        if batch is not None and not batch["finished"]:
+            await asyncio.sleep(self.min_interval)
+        snapshot = self.snapshot(batch_id)
+        if snapshot is None:
+            self._mirror_tasks.pop(batch_id, None)
+            return
+        version = self._batches[batch_id]["version"]
+        try:
+            await coordinator.set(f"progress:{batch_id}", {**snapshot, "version": version}, self.ttl)
+        except Exception:
+            # Прогресс - вспомогательная информация, сбой кэша не должен мешать загрузке
+            pass
+        finally:
+            self._mirror_tasks.pop(batch_id, None)
+            # Изменения, пришедшие во время записи, уходят следующей записью
+            batch = self._batches.get(batch_id)
+            if batch is not None and batch["version"] != version:
+                self._schedule_mirror(batch)
+
+    def _prune(self):
+        """Удаление завершенных и заброшенных пакетов старше ttl"""
+        now = time.monotonic()
+        for batch_id in [b for b, batch in self._batches.items() if now - batch["updated_at"] > self.ttl]:
+            del self._batches[batch_id]
+
+    # ==================== ЗАПИСЬ ====================
+
+    def start_batch(self, batch_id: str, total: int):
+        self._prune()
+        batch = self._get_batch(batch_id)
+        batch["total"] = total
+        batch["finished"] = False
+        for index in range(total):
+            batch["items"].setdefault(index, {"index": index, "stage": "queued", "status": "queued", "percent": None})
+        self._notify(batch)
+
+    def update(self, batch_id: str, index: int, stage: str, percent: Optional[float] = None, **fields):
+        batch = self._get_batch(batch_id)
+        item = batch["items"].setdefault(index, {"index": index})
+        # Строковые поля (формат, ориентация) идентифицируют подзадачу стадии
+        labels = {k: v for k, v in fields.items() if isinstance(v, str)}
+        if item.get("stage") != stage or any(item.get(k) != v for k, v in labels.items()):
+            # Новая стадия или подзадача - сбрасываем показатели предыдущей
+            for key in [k for k in item if k not in ("index", "status")]:
+                del item[key]
+            item["percent"] = None
+        item.update({"stage": stage, "status": "running"})
+        # Пустые значения (ffmpeg иногда отдает N/A) не затирают последние известные
+        item.update({k: v for k, v in {"percent": percent, **fields}.items() if v is not None})
+        self._notify(batch)
+
+    def finish_item(self, batch_id: str, index: int, success: bool, error: Optional[str] = None):
+        batch = self._get_batch(batch_id)
+        item = batch["items"].setdefault(index, {"index": index})
+        item.update({"status": "done" if success else "error", "percent": 100.0 if success else item.get("percent")})
+        if error:
+            item["error"] = error
+        self._notify(batch)
+
+    def finish_batch(self, batch_id: str):
+        batch = self._get_batch(batch_id)
+        batch["finished"] = True
+        self._notify(batch)
+
+    def reporter(self, batch_id: Optional[str], index: int) -> ProgressReporter:
+        return ProgressReporter(self, batch_id, index)
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def snapshot(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        batch = self._batches.get(batch_id)
+        if batch is None:
+            return None
+        return {
+            "batch_id": batch_id,
+            "total": batch["total"],
+            "finished": batch["finished"],
+            "items": [dict(batch["items"][i]) for i in sorted(batch["items"])]
+        }
+
+    async def stream(self, batch_id: str) -> AsyncIterator[str]:
+        """События SSE: снимок пакета при каждом изменении, не чаще min_interval"""
+        if coordinator.shared:
+            async for event in self._stream_shared(batch_id):
+                yield event
+            return
+
+        # Подписка раньше старта пакета допустима - клиент открывает поток до POST
+        batch = self._get_batch(batch_id)
+        sent_version = -1
+        last_sent = 0.0
+
+        while True:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                yield "event: expired\ndata: {}\n\n"
+                return
+
+            if batch["version"] != sent_version:
+                wait = last_sent + self.min_interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                sent_version = batch["version"]
+                last_sent = time.monotonic()
+                payload = json.dumps(self.snapshot(batch_id), ensure_ascii=False)
+                if batch["finished"]:
+                    yield f"event: done\ndata: {payload}\n\n"
+                    return
+                yield f"data: {payload}\n\n"
+
+            try:
+                await asyncio.wait_for(batch["changed"].wait(), timeout=HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                self._prune()
+                yield ": ping\n\n"
+
+
+    async def _stream_shared(self, batch_id: str) -> AsyncIterator[str]:
+        """События SSE по снимкам из общего кэша (пакет может обрабатываться другим воркером)"""
+        sent_version = None
+        last_event = time.monotonic()
+        waiting_since = time.monotonic()
+
+        while True:
+            snapshot = await coordinator.get(f"progress:{batch_id}")
+            now = time.monotonic()
+            if snapshot is None:
+                # Пакет еще не начат (поток открыт до POST) или снимок истек
+                if now - waiting_since > self.ttl:
+                    yield "event: expired\ndata: {}\n\n"
+                    return
+            elif snapshot["version"] != sent_version:
+                sent_version = snapshot.pop("version")
+                waiting_since = last_event = now
+                payload = json.dumps(snapshot, ensure_ascii=False)
+                if snapshot["finished"]:
+                    yield f"event: done\ndata: {payload}\n\n"
+                    return
+                yield f"data: {payload}\n\n"
+
+            if now - last_event >= HEARTBEAT_INTERVAL:
+                last_event = now
+                yield ": ping\n\n"
+            await asyncio.sleep(self.min_interval)
+
+
+# Глобальный трекер прогресса
+progress_tracker = ProgressTracker()
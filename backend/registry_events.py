@@ -0,0 +1,194 @@
+"""
+Изменения реестра (uploads, templates) для браузеров без перечитывания таблиц
+
+Триггеры notify_registry_change (sql/create_tables.sql) отправляют в канал
+PostgreSQL registry_changes только изменившиеся строки: новую строку при
+вставке, измененные колонки при обновлении и id при удалении, плюс значения
+колонок для фильтров (campaign_name, status, ...). Каждый воркер держит одно
+соединение LISTEN (psycopg2 по DATABASE_URL, чтение через add_reader цикла
+событий) и раздает события своим подписчикам SSE с их фильтрами.
+
+Медленный клиент не задерживает остальных: при переполнении его очереди
+события отбрасываются, а клиент получает событие resync и перечитывает список.
+Событие resync получают все клиенты и после восстановления соединения с БД:
+уведомления, пришедшие без LISTEN, потеряны.
+"""
+import asyncio
+import json
+import logging
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Set
+
+from config import DATABASE_URL, REGISTRY_EVENTS_ENABLED, REGISTRY_EVENTS_QUEUE_SIZE
+from metrics import REGISTRY_SUBSCRIBERS, REGISTRY_EVENTS, register_queue
+
+logger = logging.getLogger(__name__)
+
+TABLES = ("uploads", "templates")
+# Канал задан в функции notify_registry_change
+CHANNEL = "registry_changes"
+HEARTBEAT_INTERVAL = 15  # секунды между комментариями-пингами, чтобы прокси не рвали соединение
+RECONNECT_DELAYS = (1, 2, 5, 10, 30)
+
+
+class Subscriber:
+    """Клиент потока: таблицы, фильтры по колонкам и очередь событий"""
+
+    def __init__(self, tables: Iterable[str], filters: Dict[str, Set[str]], queue_size: int):
+        self.tables = set(tables)
+        self.filters = filters
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if event["table"] not in self.tables:
+            return False
+        keys = event.get("keys") or {}
+        # Фильтр по колонке, которой нет у таблицы события, не применяется
+        return all(
+            str(keys[column]) in values
+            for column, values in self.filters.items()
+            if column in keys
+        )
+
+    def offer(self, event: Dict[str, Any]):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает: вместо потерянных событий он перечитает список
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"op": "resync", "reason": "overflow"})
+
+
+class RegistryEvents:
+    """Соединение LISTEN и раздача изменений подписчикам этого воркера"""
+
+    def __init__(self, dsn: str = DATABASE_URL, channel: str = CHANNEL,
+                 queue_size: int = REGISTRY_EVENTS_QUEUE_SIZE):
+        self.dsn = dsn
+        self.channel = channel
+        self.queue_size = queue_size
+        self._subscribers: List[Subscriber] = []
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        REGISTRY_SUBSCRIBERS.set_function(lambda: len(self._subscribers))
+        register_queue("registry_events", lambda: sum(s.queue.qsize() for s in self._subscribers))
+
+    # ==================== ПОДПИСЧИКИ ====================
+
+    @contextmanager
+    def subscribe(self, tables: Iterable[str] = TABLES, filters: Optional[Dict[str, Set[str]]] = None) -> Iterator[Subscriber]:
+        subscriber = Subscriber(tables, filters or {}, self.queue_size)
+        self._subscribers.append(subscriber)
+        try:
+            yield subscriber
+        finally:
+            self._subscribers.remove(subscriber)
+
+    def publish(self, event: Dict[str, Any]):
+        """Раздача события подходящим подписчикам"""
+        REGISTRY_EVENTS.labels(event.get("table", "all"), event.get("op", "")).inc()
+        for subscriber in self._subscribers:
+            if event.get("op") == "resync" or subscriber.matches(event):
+                subscriber.offer(event)
+
+    async def stream(self, tables: Iterable[str] = TABLES, filters: Optional[Dict[str, Set[str]]] = None) -> AsyncIterator[str]:
+        """События SSE: insert, update (только измененные колонки), delete и resync"""
+        with self.subscribe(tables, filters) as subscriber:
+            yield f"event: ready\ndata: {json.dumps({'listening': self.connected})}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if event["op"] == "resync":
+                    subscriber.overflowed = False
+                yield f"event: {event['op']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+
+    # ==================== LISTEN ====================
+
+    def _connect(self):
+        import psycopg2
+
+        # TCP keepalive: оборванное соединение обнаруживается, хотя LISTEN ничего не отправляет
+        connection = psycopg2.connect(self.dsn, keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3)
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return connection
+
+    def _drain(self, connection):
+        """Чтение пришедших уведомлений (вызывается, когда сокет соединения готов к чтению)"""
+        connection.poll()
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            try:
+                event = json.loads(notify.payload)
+            except ValueError:
+                logger.warning(f"Некорректное уведомление реестра: {notify.payload[:200]}")
+                continue
+            self.publish(event)
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        attempt = 0
+        while True:
+            connection = None
+            try:
+                connection = await asyncio.to_thread(self._connect)
+                lost = loop.create_future()
+
+                def on_readable():
+                    try:
+                        self._drain(connection)
+                    except Exception as e:
+                        if not lost.done():
+                            lost.set_exception(e)
+
+                loop.add_reader(connection.fileno(), on_readable)
+                try:
+                    if attempt:
+                        # Пока соединения не было, уведомления терялись
+                        self.publish({"op": "resync", "reason": "reconnected"})
+                    self.connected = True
+                    attempt = 0
+                    print(f"📣 Registry events: LISTEN {self.channel}")
+                    await lost
+                finally:
+                    self.connected = False
+                    loop.remove_reader(connection.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                delay = RECONNECT_DELAYS[min(attempt, len(RECONNECT_DELAYS) - 1)]
+                attempt += 1
+                logger.warning(f"Registry events: соединение LISTEN недоступно ({e}), повтор через {delay} с")
+                await asyncio.sleep(delay)
+            finally:
+                if connection is not None:
+                    connection.close()
+
+    def start(self):
+        if REGISTRY_EVENTS_ENABLED and self.dsn and self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status(self) -> Dict[str, Any]:
+        return {"listening": self.connected, "channel": self.channel, "subscribers": len(self._subscribers)}
+
+
+# Глобальная раздача изменений реестра
+registry_events = RegistryEvents()
@@ -0,0 +1,311 @@
+"""
+Таймауты, повторы и автоматический выключатель для внешних вызовов
+
+Все обращения к Supabase, YouTube, Google Drive, Telegram и S3 проходят через
+call(): у каждого сервиса свой таймаут (EXTERNAL_TIMEOUTS), временные ошибки
+(сеть, 408/429/5xx, rateLimitExceeded) повторяются с экспоненциальной
+задержкой со случайным разбросом (full jitter), а заголовок Retry-After
+задает минимальную паузу. Неидемпотентные запросы (вставки, отправка
+сообщений) повторяются только если сервер их точно не обработал.
+
+После CIRCUIT_FAILURE_THRESHOLD временных ошибок подряд выключатель сервиса
+размыкается: следующие CIRCUIT_RESET_TIMEOUT секунд вызовы сразу получают
+CircuitOpenError, не занимая потоки и соединения, затем один пробный вызов
+решает, замкнуть выключатель или снова разомкнуть.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+from config import (
+    EXTERNAL_TIMEOUTS, EXTERNAL_RETRY_ATTEMPTS, EXTERNAL_RETRY_BASE_DELAY, EXTERNAL_RETRY_MAX_DELAY,
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT
+)
+from metrics import track_external, EXTERNAL_CALL_RETRIES, CIRCUIT_STATE, CIRCUIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+# Ограничение частоты Google API приходит как 403 с этими причинами
+RETRYABLE_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "backendError", "internalError")
+# Ошибки PostgreSQL, после которых запрос можно повторить: таймаут, конфликт сериализации, дедлок, нет соединений
+RETRYABLE_PG_CODES = ("57014", "40001", "40P01", "53300")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Значение timeout по умолчанию: таймаут сервиса из EXTERNAL_TIMEOUTS
+SERVICE_TIMEOUT: Any = object()
+
+
+class ExternalServiceError(Exception):
+    """Внешний сервис недоступен: повторы не помогли или выключатель разомкнут"""
+
+
+class CircuitOpenError(ExternalServiceError):
+    """Выключатель сервиса разомкнут - вызов отклонен без обращения к сервису"""
+
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} недоступен, повтор через {retry_after:.0f} с")
+        self.service = service
+        self.retry_after = retry_after
+
+
+# ==================== КЛАССИФИКАЦИЯ ОШИБОК ====================
+
+_transport_errors: Optional[tuple] = None
+_connect_errors: Optional[tuple] = None
+
+
+def _load_error_types():
+    """Сетевые исключения клиентских библиотек (импортируются только если установлены)"""
+    global _transport_errors, _connect_errors
+    transport = [TimeoutError, asyncio.TimeoutError, ConnectionError]
+    connect = [ConnectionRefusedError]
+    try:
+        import httpx
+        transport.append(httpx.TransportError)
+        connect += [httpx.ConnectError, httpx.ConnectTimeout]
+    except ImportError:
+        pass
+    try:
+        import httplib2
+        transport.append(httplib2.HttpLib2Error)
+        connect.append(httplib2.ServerNotFoundError)
+    except ImportError:
+        pass
+    try:
+        from telegram.error import NetworkError
+        transport.append(NetworkError)
+    except ImportError:
+        pass
+    try:
+        from botocore.exceptions import HTTPClientError, EndpointConnectionError, ConnectTimeoutError
+        transport.append(HTTPClientError)
+        connect += [EndpointConnectionError, ConnectTimeoutError]
+    except ImportError:
+        pass
+    _transport_errors, _connect_errors = tuple(transport), tuple(connect)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    """HTTP-статус из HttpError (googleapiclient), HTTPStatusError (httpx) или ClientError (botocore)"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    response = getattr(error, "response", None)
+    if status is None and isinstance(response, dict):
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    elif status is None:
+        status = getattr(response, "status_code", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _reasons(error: Exception) -> list:
+    details = getattr(error, "error_details", None) or []
+    return [d.get("reason") for d in details if isinstance(d, dict)]
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Пауза из Retry-After (секунды или HTTP-дата) или из RetryAfter Telegram"""
+    value = getattr(error, "retry_after", None)
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    headers = getattr(error, "resp", None)
+    if headers is None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+    header = headers.get("retry-after") if hasattr(headers, "get") else None
+    if not header:
+        return None
+    try:
+        return max(0.0, float(header))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(header)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_transient(error: Exception) -> bool:
+    """Временная ошибка, которую имеет смысл повторить"""
+    from youtube_quota import is_quota_error
+
+    if isinstance(error, CircuitOpenError) or is_quota_error(error):
+        # Квота до сброса не появится - повтор только потратит время
+        return False
+    if getattr(error, "retry_after", None) is not None:
+        return True
+    status = _status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUSES or (status == 403 and any(r in RETRYABLE_REASONS for r in _reasons(error)))
+    if getattr(error, "code", None) in RETRYABLE_PG_CODES:
+        return True
+    if _transport_errors is None:
+        _load_error_types()
+    return isinstance(error, _transport_errors)
+
+
+def _not_processed(error: Exception) -> bool:
+    """Сервер точно не выполнил запрос: соединение не установлено или запрос отклонен лимитом"""
+    if _connect_errors is None:
+        _load_error_types()
+    return (
+        isinstance(error, _connect_errors)
+        or getattr(error, "retry_after", None) is not None
+        or _status_code(error) == 429
+    )
+
+
+# ==================== ВЫКЛЮЧАТЕЛЬ ====================
+
+class CircuitBreaker:
+    """Автоматический выключатель одного сервиса (closed -> open -> half_open -> closed)"""
+
+    def __init__(self, service: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.service = service
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        # Вызовы идут и из основного цикла событий, и из фоновых (прогрев БД)
+        self._lock = threading.Lock()
+        CIRCUIT_STATE.labels(service).set(0)
+
+    def _set_state(self, state: str):
+        if state != self.state:
+            logger.warning(f"Circuit {self.service}: {self.state} -> {state}")
+        self.state = state
+        CIRCUIT_STATE.labels(self.service).set(_STATE_VALUES[state])
+
+    def before_call(self) -> bool:
+        """Разрешение вызова; True - это пробный вызов после паузы"""
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            waited = time.monotonic() - self.opened_at
+            if self.state == OPEN and waited >= self.reset_timeout:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+        CIRCUIT_REJECTIONS.labels(self.service).inc()
+        raise CircuitOpenError(self.service, max(0.0, self.reset_timeout - waited))
+
+    def on_success(self, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            self.failures = 0
+            self._set_state(CLOSED)
+
+    def on_failure(self, probe: bool = False):
+        with self._lock:
+            if probe:
+                self._probe_in_flight = False
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def on_abandoned(self, probe: bool = False):
+        """Вызов отменен до ответа - результат пробы неизвестен"""
+        if probe:
+            with self._lock:
+                self._probe_in_flight = False
+
+    def status(self) -> Dict[str, Any]:
+        retry_in = self.reset_timeout - (time.monotonic() - self.opened_at) if self.state == OPEN else 0
+        return {"state": self.state, "failures": self.failures, "retry_in": round(max(0.0, retry_in), 1)}
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(service: str) -> CircuitBreaker:
+    breaker = _breakers.get(service)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(service, CircuitBreaker(service))
+    return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    return {service: breaker.status() for service, breaker in _breakers.items()}
+
+
+# ==================== ВЫЗОВ ====================
+
+def backoff_delay(attempt: int, base: float = EXTERNAL_RETRY_BASE_DELAY, cap: float = EXTERNAL_RETRY_MAX_DELAY) -> float:
+    """Full jitter: случайная пауза от 0 до base * 2^(attempt-1), не больше cap"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def call(service: str, operation: str, func: Callable, *args,
+               timeout: Optional[float] = SERVICE_TIMEOUT, attempts: int = EXTERNAL_RETRY_ATTEMPTS,
+               idempotent: bool = True, track: bool = True, **kwargs):
+    """Вызов внешнего сервиса с таймаутом, повторами и выключателем
+
+    func - корутинная функция или синхронная функция (выполняется в потоке).
+    timeout=None отключает таймаут asyncio: нужно для частей возобновляемых
+    загрузок, где прерванный поток нельзя повторять параллельно с ним самим
+    (их ограничивает таймаут сокета клиента).
+    """
+    if timeout is SERVICE_TIMEOUT:
+        timeout = EXTERNAL_TIMEOUTS.get(service)
+    breaker = get_breaker(service)
+    attempt = 0
+    while True:
+        attempt += 1
+        probe = breaker.before_call()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                awaitable = func(*args, **kwargs)
+            else:
+                awaitable = asyncio.to_thread(func, *args, **kwargs)
+            if track:
+                with track_external(service, operation):
+                    result = await asyncio.wait_for(awaitable, timeout)
+            else:
+                result = await asyncio.wait_for(awaitable, timeout)
+        except asyncio.CancelledError:
+            breaker.on_abandoned(probe)
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                # Сервис ответил (4xx, ошибка данных) - он доступен
+                breaker.on_success(probe)
+                raise
+            breaker.on_failure(probe)
+
+            pause = retry_after(e)
+            # Разомкнутый выключатель отклонит повтор - ошибка отдается сразу, без паузы
+            can_retry = attempt < attempts and breaker.state != OPEN and (idempotent or _not_processed(e))
+            if not can_retry or (pause is not None and pause > EXTERNAL_RETRY_MAX_DELAY):
+                raise
+            delay = max(pause or 0.0, backoff_delay(attempt))
+            EXTERNAL_CALL_RETRIES.labels(service, operation).inc()
+            logger.warning(
+                f"{service} {operation}: {type(e).__name__}: {e} - "
+                f"повтор {attempt}/{attempts - 1} через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+            continue
+        breaker.on_success(probe)
+        return result
@@ -0,0 +1,237 @@
+"""
+Возобновляемая загрузка исходных видео (протокол tus 1.0)
+
+Клиент создает загрузку с объявленным размером, затем отправляет файл
+частями PATCH с Upload-Offset. После обрыва связи HEAD возвращает, сколько
+байт уже принято, и отправка продолжается с этого места, а не с начала.
+Части дописываются в uploads/incoming/<id>.part по мере поступления, хэш
+SHA-256 считается инкрементально. Завершенная загрузка переносится в
+хранилище (videos/) и ее id принимается конвейером вместо файла в запросе.
+
+Принятый объем - это размер файла части: если файл удален (квота или TTL
+каталога incoming), загрузка продолжается с нуля. Описание загрузки
+хранится у координатора, поэтому HEAD и PATCH работают на любом воркере
+узла; файл части лежит в UPLOAD_DIR узла, принимавшего загрузку.
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterable, Dict, Optional, Tuple
+
+import aiofiles
+
+from config import UPLOAD_DIR, ALLOWED_VIDEO_TYPES, RESUMABLE_UPLOAD_MAX_SIZE, RESUMABLE_UPLOAD_TTL_HOURS
+from coordination import coordinator, LockNotAcquired
+from metrics import BYTES_IN
+
+logger = logging.getLogger(__name__)
+
+TUS_VERSION = "1.0.0"
+# Тип тела PATCH по протоколу tus
+PATCH_CONTENT_TYPE = "application/offset+octet-stream"
+
+
+class ResumableUploadError(Exception):
+    """Ошибка протокола загрузки с HTTP-статусом ответа"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def parse_metadata(header: Optional[str]) -> Dict[str, str]:
+    """Upload-Metadata: пары "ключ base64(значение)" через запятую"""
+    metadata = {}
+    for pair in (header or "").split(","):
+        key, _, value = pair.strip().partition(" ")
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+        except (ValueError, UnicodeDecodeError):
+            raise ResumableUploadError(f"Некорректное значение Upload-Metadata для {key}")
+    return metadata
+
+
+class ResumableUploads:
+    """Создание, прием частей и завершение возобновляемых загрузок"""
+
+    def __init__(self, root: str = UPLOAD_DIR, max_size: int = RESUMABLE_UPLOAD_MAX_SIZE,
+                 ttl_hours: float = RESUMABLE_UPLOAD_TTL_HOURS):
+        self.incoming_dir = Path(root) / "incoming"
+        self.max_size = max_size
+        self.ttl = ttl_hours * 3600
+        # Хэш принятых байт: id -> (объект sha256, сколько байт в него вошло)
+        self._hashes: Dict[str, Tuple[Any, int]] = {}
+
+    @property
+    def storage(self):
+        from storage import storage
+        return storage
+
+    def part_path(self, upload_id: str) -> Path:
+        return self.incoming_dir / f"{upload_id}.part"
+
+    def offset(self, upload_id: str) -> int:
+        path = self.part_path(upload_id)
+        return path.stat().st_size if path.exists() else 0
+
+    async def _save(self, state: Dict[str, Any]):
+        state["updated_at"] = time.time()
+        await coordinator.set(f"resumable:{state['id']}", state, ttl=self.ttl)
+
+    async def get(self, upload_id: str) -> Dict[str, Any]:
+        state = await coordinator.get(f"resumable:{upload_id}")
+        if not state:
+            raise ResumableUploadError("Загрузка не найдена или истекла", 404)
+        return state
+
+    async def create(self, length: int, metadata: Dict[str, str]) -> Dict[str, Any]:
+        filename = Path(metadata.get("filename") or "video.mp4").name
+        content_type = metadata.get("filetype") or metadata.get("content_type")
+        if length < 0:
+            raise ResumableUploadError("Некорректный Upload-Length")
+        if length > self.max_size:
+            raise ResumableUploadError(f"Файл больше {self.max_size // (1024 * 1024)} МБ", 413)
+        if content_type and content_type not in ALLOWED_VIDEO_TYPES:
+            raise ResumableUploadError(
+                f"Неподдерживаемый тип видео файла. Получен: {content_type}, разрешены: {', '.join(ALLOWED_VIDEO_TYPES)}", 415
+            )
+
+        upload_id = uuid.uuid4().hex
+        self.incoming_dir.mkdir(parents=True, exist_ok=True)
+        self.part_path(upload_id).touch()
+        state = {
+            "id": upload_id,
+            "filename": filename,
+            "content_type": content_type,
+            "length": length,
+            "status": "open",
+            "key": None,
+            "sha256": None,
+            "created_at": time.time()
+        }
+        await self._save(state)
+        self._track(upload_id)
+        return state
+
+    def _track(self, upload_id: str):
+        """Незавершенная часть - артефакт каталога incoming (TTL и квота без закрепления)"""
+        from artifacts import artifact_manager
+        artifact_manager.register(str(self.part_path(upload_id)), "incoming", pin=False)
+
+    @staticmethod
+    def _hash_file(path: Path, length: int):
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            remaining = length
+            while remaining > 0:
+                block = f.read(min(1024 * 1024, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                remaining -= len(block)
+        return digest
+
+    async def _hasher(self, upload_id: str, offset: int):
+        """Хэш первых offset байт: из памяти или (другой воркер, перезапуск) досчитанный по файлу"""
+        cached = self._hashes.get(upload_id)
+        if cached and cached[1] == offset:
+            return cached[0]
+        return await asyncio.to_thread(self._hash_file, self.part_path(upload_id), offset)
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterable[bytes]) -> int:
+        """Прием части с позиции offset; возвращает новое смещение
+
+        Данные пишутся по мере поступления: при обрыве соединения принятые
+        байты остаются, и клиент продолжит с них.
+        """
+        state = await self.get(upload_id)
+        if state["status"] != "open":
+            raise ResumableUploadError("Загрузка уже завершена", 409)
+        try:
+            async with coordinator.lock(f"resumable:{upload_id}", ttl=60, timeout=0):
+                current = self.offset(upload_id)
+                if offset != current:
+                    raise ResumableUploadError(f"Upload-Offset {offset} не совпадает с принятым объемом {current}", 409)
+
+                hasher = await self._hasher(upload_id, current)
+                written = current
+                try:
+                    async with aiofiles.open(self.part_path(upload_id), "ab") as f:
+                        async for chunk in chunks:
+                            if written + len(chunk) > state["length"]:
+                                raise ResumableUploadError("Данных больше, чем Upload-Length", 413)
+                            await f.write(chunk)
+                            hasher.update(chunk)
+                            written += len(chunk)
+                            BYTES_IN.labels("upload").inc(len(chunk))
+                finally:
+                    self._hashes[upload_id] = (hasher, written)
+                    self._track(upload_id)
+                    await self._save(state)
+        except LockNotAcquired:
+            raise ResumableUploadError("Загрузка уже принимает данные в другом запросе", 423)
+        return written
+
+    async def finalize(self, upload_id: str, sha256: Optional[str] = None) -> Dict[str, Any]:
+        """Проверка полноты и контрольной суммы, перенос файла в хранилище"""
+        try:
+            async with coordinator.lock(f"resumable:{upload_id}", ttl=60, timeout=0):
+                state = await self.get(upload_id)
+                if state["status"] == "final":
+                    return state
+
+                received = self.offset(upload_id)
+                if received != state["length"]:
+                    raise ResumableUploadError(f"Получено {received} из {state['length']} байт", 409)
+                digest = (await self._hasher(upload_id, received)).hexdigest()
+                self._hashes.pop(upload_id, None)
+                if sha256 and sha256.lower() != digest:
+                    # Поврежденные данные не докачать - загрузку нужно начать заново
+                    await self.delete(upload_id)
+                    raise ResumableUploadError("Контрольная сумма SHA-256 не совпадает, загрузите файл заново", 422)
+
+                key = f"videos/{upload_id}_{state['filename']}"
+                await self.storage.put_file(key, str(self.part_path(upload_id)), move=True)
+                state.update(status="final", key=key, sha256=digest)
+                await self._save(state)
+                return state
+        except LockNotAcquired:
+            raise ResumableUploadError("Загрузка еще принимает данные", 423)
+
+    async def delete(self, upload_id: str):
+        """Отмена загрузки: часть и описание удаляются; завершенная - если ее еще не взяло задание"""
+        state = await self.get(upload_id)
+        if state["status"] == "final":
+            if await coordinator.get(f"resumable:claimed:{upload_id}"):
+                raise ResumableUploadError("Загрузка уже используется заданием", 409)
+            await self.storage.delete(state["key"])
+        self._hashes.pop(upload_id, None)
+        self.part_path(upload_id).unlink(missing_ok=True)
+        await coordinator.delete(f"resumable:{upload_id}")
+
+    async def claim(self, upload_id: str, job_id: str) -> Tuple[str, str]:
+        """Исходник задания из завершенной загрузки: (локальный путь, имя файла)
+
+        Загрузку берет одно задание; повтор того же задания получает ее снова.
+        """
+        state = await self.get(upload_id)
+        if state["status"] != "final":
+            raise ResumableUploadError("Загрузка не завершена", 409)
+        claimed_key = f"resumable:claimed:{upload_id}"
+        if not await coordinator.add(claimed_key, job_id, ttl=self.ttl) and await coordinator.get(claimed_key) != job_id:
+            raise ResumableUploadError("Загрузка уже используется другим заданием", 409)
+        try:
+            path = await self.storage.local_path(state["key"])
+        except FileNotFoundError:
+            raise ResumableUploadError("Файл загрузки больше не хранится на сервере, загрузите видео заново", 410)
+        return path, state["filename"]
+
+
+# Глобальные возобновляемые загрузки
+resumable_uploads = ResumableUploads()
@@ -0,0 +1,335 @@
+"""
+Планировщик тяжелых стадий: приоритеты, справедливое разделение и отмена
+
+Транскодирование и загрузка на YouTube занимают слоты общих для процесса
+ресурсов (SCHEDULER_SLOTS), а не только воркеры своего конвейера: иначе
+каждый пакет запускает свои ffmpeg и одиночная загрузка ждет, пока CPU
+занят пакетом из сотни видео. Освободившийся слот получает задание:
+
+1. из самого приоритетного класса: single (одиночная загрузка) > batch >
+   background (фоновые загрузки из Google Drive). Очередь класса ниже
+   вытесняется новыми заданиями класса выше; чтобы фоновые задания не
+   голодали, каждые SCHEDULER_AGING_SECONDS ожидания поднимают задание на класс;
+2. внутри класса - кампании с наименьшим виртуальным временем: каждый
+   выданный слот прибавляет кампании 1 / вес (SCHEDULER_TENANT_WEIGHTS),
+   поэтому две кампании с равными весами получают слоты по очереди, как бы
+   ни различались размеры их пакетов. Вернувшаяся после простоя кампания
+   начинает с текущего времени, а не с накопленного «кредита»;
+3. внутри кампании - в порядке постановки.
+
+Задание отменяется по job_id или целиком пакетом: ожидающие слоты
+снимаются с очереди сразу, выполняющаяся стадия прерывается (ffmpeg
+останавливается), остальные стадии задания пропускаются.
+"""
+import asyncio
+import itertools
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from config import SCHEDULER_SLOTS, SCHEDULER_AGING_SECONDS, SCHEDULER_TENANT_WEIGHTS
+from coordination import coordinator
+from metrics import SCHEDULER_WAIT_SECONDS, SCHEDULER_WAITING, SCHEDULER_RUNNING, SCHEDULER_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета по убыванию
+PRIORITIES = ("single", "batch", "background")
+
+# Сколько хранится отметка об отмене для других воркеров (задание может день ждать квоту)
+_CANCEL_TTL = 24 * 3600
+# Ожидания, по которым считается статистика классов
+_WAIT_WINDOW = 1000
+
+
+class JobCancelledError(Exception):
+    """Задание отменено пользователем"""
+
+
+class _Ticket:
+    """Заявка задания на слот ресурса (или на выполнение стадии без слота)"""
+
+    def __init__(self, seq: int, resource: Optional[str], job_id: str, batch_id: Optional[str],
+                 priority: str, tenant: str):
+        self.seq = seq
+        self.resource = resource
+        self.job_id = job_id
+        self.batch_id = batch_id
+        self.priority = priority
+        self.tenant = tenant
+        self.enqueued_at = time.monotonic()
+        self.future: Optional[asyncio.Future] = None
+        self.task: Optional[asyncio.Task] = None
+        self.killed = False
+
+    def describe(self, now: float) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "batch_id": self.batch_id,
+            "priority": self.priority,
+            "tenant": self.tenant,
+            "seconds": round(now - self.enqueued_at, 1)
+        }
+
+
+class _Resource:
+    """Ресурс с ограниченным числом слотов и очередью заявок"""
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.capacity = max(1, capacity)
+        self.running: List[_Ticket] = []
+        self.waiting: List[_Ticket] = []
+        # Виртуальное время кампаний и ресурса (справедливое разделение)
+        self.vtime: Dict[str, float] = {}
+        self.clock = 0.0
+
+    def active(self, tenant: str) -> bool:
+        return any(t.tenant == tenant for t in itertools.chain(self.running, self.waiting))
+
+
+class Scheduler:
+    """Слоты тяжелых стадий, очереди с приоритетами и отмена заданий"""
+
+    def __init__(self, slots: Optional[Dict[str, int]] = None, aging_seconds: float = SCHEDULER_AGING_SECONDS,
+                 weights: Optional[Dict[str, float]] = None):
+        slots = slots if slots is not None else SCHEDULER_SLOTS
+        self.resources = {name: _Resource(name, capacity) for name, capacity in slots.items()}
+        self.aging_seconds = aging_seconds
+        self.weights = dict(weights if weights is not None else SCHEDULER_TENANT_WEIGHTS)
+        self._seq = itertools.count()
+        # Выполняющиеся стадии (со слотом и без)
+        self._active: Set[_Ticket] = set()
+        self._cancelled_jobs: Set[str] = set()
+        self._cancelled_batches: Set[str] = set()
+        self._waits: Dict[str, Deque[float]] = {p: deque(maxlen=_WAIT_WINDOW) for p in PRIORITIES}
+
+    # ==================== ВЫПОЛНЕНИЕ ====================
+
+    async def run(self, resource: Optional[str], job_id: str, func: Callable[..., Awaitable[Any]], *args,
+                  priority: str = "batch", tenant: str = "", batch_id: Optional[str] = None,
+                  on_wait: Optional[Callable[[], Any]] = None, **kwargs) -> Any:
+        """Выполнение стадии задания в слоте resource (None - без слота, но с возможностью отмены)
+
+        on_wait вызывается, если слот занят и задание встает в очередь.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Неизвестный класс приоритета: {priority}")
+        await self.check(job_id, batch_id)
+        ticket = _Ticket(next(self._seq), resource, job_id, batch_id, priority, tenant)
+        if resource is not None:
+            await self._acquire(ticket, on_wait)
+        try:
+            # Ожидание слота могло быть долгим - отмена из другого воркера видна только сейчас
+            await self.check(job_id, batch_id)
+            ticket.task = asyncio.create_task(func(*args, **kwargs))
+            self._active.add(ticket)
+            try:
+                return await ticket.task
+            except asyncio.CancelledError:
+                if ticket.killed:
+                    raise JobCancelledError(self._cancel_message(ticket)) from None
+                raise
+            finally:
+                self._active.discard(ticket)
+        finally:
+            if resource is not None:
+                self._release(ticket)
+
+    def is_cancelled(self, job_id: str, batch_id: Optional[str] = None) -> bool:
+        return job_id in self._cancelled_jobs or (batch_id is not None and batch_id in self._cancelled_batches)
+
+    async def check(self, job_id: str, batch_id: Optional[str] = None):
+        """JobCancelledError, если задание или его пакет отменены (в том числе в другом воркере)"""
+        if not self.is_cancelled(job_id, batch_id) and coordinator.shared:
+            try:
+                if await coordinator.get(f"cancelled:job:{job_id}"):
+                    self._cancelled_jobs.add(job_id)
+                elif batch_id is not None and await coordinator.get(f"cancelled:batch:{batch_id}"):
+                    self._cancelled_batches.add(batch_id)
+            except Exception as e:
+                logger.warning(f"Cancellation check failed: {e}")
+        if self.is_cancelled(job_id, batch_id):
+            raise JobCancelledError(f"Задание {job_id} отменено")
+
+    # ==================== СЛОТЫ ====================
+
+    async def _acquire(self, ticket: _Ticket, on_wait: Optional[Callable[[], Any]]):
+        resource = self.resources[ticket.resource]
+        if not resource.active(ticket.tenant):
+            # Кампания после простоя не получает преимущества за прошлое время
+            resource.vtime[ticket.tenant] = max(resource.vtime.get(ticket.tenant, 0.0), resource.clock)
+
+        if len(resource.running) < resource.capacity and not resource.waiting:
+            self._grant(resource, ticket)
+            return
+
+        ticket.future = asyncio.get_running_loop().create_future()
+        resource.waiting.append(ticket)
+        SCHEDULER_WAITING.labels(resource.name, ticket.priority).inc()
+        if on_wait is not None:
+            on_wait()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket in resource.waiting:
+                resource.waiting.remove(ticket)
+                SCHEDULER_WAITING.labels(resource.name, ticket.priority).dec()
+            elif ticket in resource.running:
+                # Слот выдан одновременно с отменой ожидания - возвращаем его
+                self._release(ticket)
+            raise
+
+    def _grant(self, resource: _Resource, ticket: _Ticket):
+        weight = self.weights.get(ticket.tenant, 1.0) or 1.0
+        start = resource.vtime.get(ticket.tenant, resource.clock)
+        resource.clock = max(resource.clock, start)
+        resource.vtime[ticket.tenant] = start + 1 / weight
+        resource.running.append(ticket)
+
+        waited = time.monotonic() - ticket.enqueued_at
+        self._waits[ticket.priority].append(waited)
+        SCHEDULER_WAIT_SECONDS.labels(resource.name, ticket.priority).observe(waited)
+        SCHEDULER_RUNNING.labels(resource.name, ticket.priority).inc()
+
+    def _release(self, ticket: _Ticket):
+        resource = self.resources[ticket.resource]
+        if ticket not in resource.running:
+            return
+        resource.running.remove(ticket)
+        SCHEDULER_RUNNING.labels(resource.name, ticket.priority).dec()
+        if not resource.active(ticket.tenant) and resource.vtime.get(ticket.tenant, 0.0) <= resource.clock:
+            # Запись ничего не добавляет к текущему времени ресурса
+            resource.vtime.pop(ticket.tenant, None)
+        self._dispatch(resource)
+
+    def _rank(self, ticket: _Ticket, now: float) -> int:
+        rank = PRIORITIES.index(ticket.priority)
+        if self.aging_seconds > 0:
+            rank -= int((now - ticket.enqueued_at) / self.aging_seconds)
+        return max(0, rank)
+
+    def _next(self, resource: _Resource) -> _Ticket:
+        """Приоритет (с учетом старения), затем виртуальное время кампании, затем порядок постановки"""
+        now = time.monotonic()
+        return min(
+            resource.waiting,
+            key=lambda t: (self._rank(t, now), resource.vtime.get(t.tenant, resource.clock), t.seq)
+        )
+
+    def _dispatch(self, resource: _Resource):
+        while resource.waiting and len(resource.running) < resource.capacity:
+            ticket = self._next(resource)
+            resource.waiting.remove(ticket)
+            SCHEDULER_WAITING.labels(resource.name, ticket.priority).dec()
+            if ticket.future.done():
+                continue
+            self._grant(resource, ticket)
+            ticket.future.set_result(None)
+
+    # ==================== ОТМЕНА ====================
+
+    async def cancel(self, job_id: Optional[str] = None, batch_id: Optional[str] = None) -> Dict[str, int]:
+        """Отмена задания или пакета: снятие с очередей и прерывание выполняющихся стадий"""
+        if job_id is None and batch_id is None:
+            raise ValueError("Нужен job_id или batch_id")
+        if job_id is not None:
+            self._cancelled_jobs.add(job_id)
+        if batch_id is not None:
+            self._cancelled_batches.add(batch_id)
+        if coordinator.shared:
+            key = f"cancelled:job:{job_id}" if job_id is not None else f"cancelled:batch:{batch_id}"
+            await coordinator.set(key, True, ttl=_CANCEL_TTL)
+
+        def matches(ticket: _Ticket) -> bool:
+            return ticket.job_id == job_id or (batch_id is not None and ticket.batch_id == batch_id)
+
+        queued = 0
+        for resource in self.resources.values():
+            for ticket in [t for t in resource.waiting if matches(t)]:
+                resource.waiting.remove(ticket)
+                SCHEDULER_WAITING.labels(resource.name, ticket.priority).dec()
+                ticket.future.set_exception(JobCancelledError(self._cancel_message(ticket)))
+                SCHEDULER_CANCELLED.labels(ticket.priority, "queued").inc()
+                queued += 1
+
+        running = 0
+        for ticket in [t for t in self._active if matches(t)]:
+            ticket.killed = True
+            ticket.task.cancel()
+            SCHEDULER_CANCELLED.labels(ticket.priority, "running").inc()
+            running += 1
+
+        logger.info(f"Cancelled job={job_id} batch={batch_id}: queued {queued}, running {running}")
+        return {"queued": queued, "running": running}
+
+    @staticmethod
+    def _cancel_message(ticket: _Ticket) -> str:
+        return f"Задание {ticket.job_id} отменено"
+
+    async def forget(self, job_id: Optional[str] = None, batch_id: Optional[str] = None):
+        """Задание или пакет завершены (или запускаются повторно) - отметки об отмене снимаются
+
+        В Redis отметка живет _CANCEL_TTL и пережила бы задание: повтор пакета
+        с теми же batch_id и job_id сразу завершился бы отменой.
+        """
+        self._cancelled_jobs.discard(job_id)
+        self._cancelled_batches.discard(batch_id)
+        if coordinator.shared:
+            try:
+                if job_id is not None:
+                    await coordinator.delete(f"cancelled:job:{job_id}")
+                if batch_id is not None:
+                    await coordinator.delete(f"cancelled:batch:{batch_id}")
+            except Exception as e:
+                logger.warning(f"Cancellation mark cleanup failed: {e}")
+
+    # ==================== СОСТОЯНИЕ ====================
+
+    def status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+
+        def wait_stats(waits: Deque[float]) -> Dict[str, Any]:
+            if not waits:
+                return {"count": 0}
+            ordered = sorted(waits)
+            return {
+                "count": len(ordered),
+                "mean": round(statistics.fmean(ordered), 3),
+                "p50": round(ordered[len(ordered) // 2], 3),
+                "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+                "max": round(ordered[-1], 3)
+            }
+
+        resources = {}
+        for resource in self.resources.values():
+            resources[resource.name] = {
+                "capacity": resource.capacity,
+                "running": [t.describe(now) for t in resource.running],
+                "waiting": [t.describe(now) for t in sorted(
+                    resource.waiting,
+                    key=lambda t: (self._rank(t, now), resource.vtime.get(t.tenant, resource.clock), t.seq)
+                )],
+                "tenants": {tenant: round(v - resource.clock, 3) for tenant, v in resource.vtime.items()}
+            }
+        classes = {
+            priority: {
+                "waiting": sum(1 for r in self.resources.values() for t in r.waiting if t.priority == priority),
+                "running": sum(1 for r in self.resources.values() for t in r.running if t.priority == priority),
+                "wait_seconds": wait_stats(self._waits[priority])
+            }
+            for priority in PRIORITIES
+        }
+        return {
+            "resources": resources,
+            "classes": classes,
+            "aging_seconds": self.aging_seconds,
+            "weights": dict(self.weights),
+            "cancelled": {"jobs": len(self._cancelled_jobs), "batches": len(self._cancelled_batches)}
+        }
+
+
+# Глобальный планировщик тяжелых стадий
+scheduler = Scheduler()
@@ -61,17 +61,98 @@ CREATE TABLE IF NOT EXISTS uploads (
     thumbnail_image_id UUID REFERENCES modal_images(id),
     status TEXT NOT NULL DEFAULT 'active' CHECK (status IN ('active', 'banned', 'pending', 'error', 'limited')),
     performance JSONB, -- метрики GAds: spend, ctr, etc.
+    idempotency_key TEXT UNIQUE, -- задание и формат: повтор пакета не создает вторую запись
     upload_date TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Существующая база: ключ идемпотентности загрузок
+ALTER TABLE uploads ADD COLUMN IF NOT EXISTS idempotency_key TEXT UNIQUE;
+
+-- ==================== BATCH ITEMS ====================
+-- Чекпоинты заданий пакетной загрузки: последняя завершенная стадия и ее результаты
+CREATE TABLE IF NOT EXISTS batch_items (
+    batch_id TEXT NOT NULL,
+    item_index INTEGER NOT NULL,
+    job_id UUID NOT NULL, -- ID задания (имена файлов и ключи идемпотентности)
+    campaign_name TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'done', 'failed', 'cancelled')),
+    last_stage TEXT, -- ingest, transcode, thumbnail, upload, persist
+    params JSONB NOT NULL, -- параметры задания для повтора
+    checkpoint JSONB NOT NULL DEFAULT '{}', -- пути артефактов, форматы, загруженные на YouTube видео
+    error TEXT,
+    failed_stage TEXT,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (batch_id, item_index)
+);
+
 -- ==================== LOGS ====================
+-- Секционирование по месяцам: старые месяцы удаляются целиком (drop_log_partitions),
+-- а не DELETE по строкам. Секции создает ensure_log_partitions (раздел «ПАРТИЦИИ ЛОГОВ»).
+
+-- Существующая база: прежняя таблица logs переименовывается в logs_legacy,
+-- последние месяцы переносятся в новую таблицу в разделе «ПАРТИЦИИ ЛОГОВ»
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_class WHERE relname = 'logs' AND relkind = 'r' AND relnamespace = 'public'::regnamespace) THEN
+        ALTER TABLE logs RENAME TO logs_legacy;
+        ALTER TABLE logs_legacy RENAME CONSTRAINT logs_pkey TO logs_legacy_pkey;
+        DROP INDEX IF EXISTS idx_logs_action;
+        DROP INDEX IF EXISTS idx_logs_date;
+    END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS logs (
-    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    id UUID NOT NULL DEFAULT gen_random_uuid(),
     action TEXT NOT NULL,
     metadata JSONB,
     user_id UUID REFERENCES users(id),
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at) -- ключ секционирования входит в первичный ключ
+) PARTITION BY RANGE (created_at);
+
+-- Строки вне созданных месяцев (например, часы сервера ушли вперед) не теряются
+CREATE TABLE IF NOT EXISTS logs_default PARTITION OF logs DEFAULT;
+
+-- ==================== DRIVE SOURCES ====================
+CREATE TABLE IF NOT EXISTS drive_sources (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    folder_id TEXT NOT NULL, -- ID папки Google Drive
+    campaign_name TEXT NOT NULL, -- кампания по умолчанию для новых видео
+    thumbnail_option TEXT NOT NULL DEFAULT 'none' CHECK (thumbnail_option IN ('none', 'first_frame', 'soft_modal')),
+    modal_image_id UUID REFERENCES modal_images(id),
+    create_formats BOOLEAN DEFAULT FALSE,
+    page_token TEXT, -- чекпоинт ленты изменений Drive (changes.list)
+    known_files JSONB DEFAULT '{}', -- file_id -> md5Checksum уже загруженных файлов
+    pending_files JSONB DEFAULT '{}', -- file_id -> файл, номер копии и воркер: в очереди, загрузка не завершена
+    files_ingested INTEGER DEFAULT 0,
+    is_active BOOLEAN DEFAULT TRUE,
+    last_checked_at TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Существующая база: файлы, поставленные в очередь, но еще не загруженные
+ALTER TABLE drive_sources ADD COLUMN IF NOT EXISTS pending_files JSONB DEFAULT '{}';
+
+-- ==================== YOUTUBE QUOTA ====================
+-- Расход квоты YouTube Data API по суткам квоты (тихоокеанское время) и операциям
+CREATE TABLE IF NOT EXISTS youtube_quota_usage (
+    day DATE NOT NULL,
+    operation TEXT NOT NULL, -- videos.insert, thumbnails.set, channels.list
+    units INTEGER NOT NULL DEFAULT 0,
+    calls INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (day, operation)
+);
+
+-- ==================== SCHEMA MIGRATIONS ====================
+-- Одноразовые миграции данных (migrations.py), примененные к этой базе
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    name TEXT PRIMARY KEY,
+    applied_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
 -- ==================== ИНДЕКСЫ ====================
@@ -82,8 +163,21 @@ CREATE INDEX IF NOT EXISTS idx_oauth_service ON oauth_credentials(service);
 CREATE INDEX IF NOT EXISTS idx_uploads_status ON uploads(status);
 CREATE INDEX IF NOT EXISTS idx_uploads_campaign ON uploads(campaign_name);
 CREATE INDEX IF NOT EXISTS idx_uploads_date ON uploads(upload_date);
-CREATE INDEX IF NOT EXISTS idx_logs_action ON logs(action);
-CREATE INDEX IF NOT EXISTS idx_logs_date ON logs(created_at);
+-- Индексы секционированной таблицы создаются в каждой секции; /logs читает по (action, created_at)
+-- и по (created_at, id) без фильтра действий
+CREATE INDEX IF NOT EXISTS idx_logs_action_created ON logs(action, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_logs_created ON logs(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_drive_sources_active ON drive_sources(is_active);
+CREATE INDEX IF NOT EXISTS idx_batch_items_status ON batch_items(status);
+
+-- Фасеты шаблонов (поиск search_templates) и теги в characteristics (оператор @>)
+CREATE INDEX IF NOT EXISTS idx_templates_language ON templates(language);
+CREATE INDEX IF NOT EXISTS idx_templates_style ON templates(style);
+CREATE INDEX IF NOT EXISTS idx_templates_orientation ON templates(orientation);
+CREATE INDEX IF NOT EXISTS idx_templates_ai_tag ON templates(ai_tag);
+CREATE INDEX IF NOT EXISTS idx_templates_ai_hardness ON templates(ai_hardness);
+CREATE INDEX IF NOT EXISTS idx_templates_created ON templates(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_templates_characteristics ON templates USING GIN (characteristics jsonb_path_ops);
 
 -- ==================== RLS (Row Level Security) ====================
 
@@ -95,6 +189,10 @@ ALTER TABLE modal_images ENABLE ROW LEVEL SECURITY;
 ALTER TABLE templates ENABLE ROW LEVEL SECURITY;
 ALTER TABLE uploads ENABLE ROW LEVEL SECURITY;
 ALTER TABLE logs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE drive_sources ENABLE ROW LEVEL SECURITY;
+ALTER TABLE schema_migrations ENABLE ROW LEVEL SECURITY;
+ALTER TABLE youtube_quota_usage ENABLE ROW LEVEL SECURITY;
+ALTER TABLE batch_items ENABLE ROW LEVEL SECURITY;
 
 -- Политики доступа (пока разрешаем все для сервисного ключа)
 CREATE POLICY "Allow all operations for service role" ON roles FOR ALL USING (true);
@@ -104,6 +202,10 @@ CREATE POLICY "Allow all operations for service role" ON modal_images FOR ALL US
 CREATE POLICY "Allow all operations for service role" ON templates FOR ALL USING (true);
 CREATE POLICY "Allow all operations for service role" ON uploads FOR ALL USING (true);
 CREATE POLICY "Allow all operations for service role" ON logs FOR ALL USING (true);
+CREATE POLICY "Allow all operations for service role" ON drive_sources FOR ALL USING (true);
+CREATE POLICY "Allow all operations for service role" ON schema_migrations FOR ALL USING (true);
+CREATE POLICY "Allow all operations for service role" ON youtube_quota_usage FOR ALL USING (true);
+CREATE POLICY "Allow all operations for service role" ON batch_items FOR ALL USING (true);
 
 -- ==================== ФУНКЦИИ ====================
 
@@ -124,3 +226,294 @@ CREATE TRIGGER update_oauth_credentials_updated_at
 CREATE TRIGGER update_uploads_updated_at 
     BEFORE UPDATE ON uploads 
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE TRIGGER update_drive_sources_updated_at 
+    BEFORE UPDATE ON drive_sources 
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+CREATE TRIGGER update_batch_items_updated_at 
+    BEFORE UPDATE ON batch_items 
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+-- ==================== КВОТА YOUTUBE ====================
+
+-- Атомарное увеличение расхода квоты (несколько процессов пишут в одну строку дня)
+CREATE OR REPLACE FUNCTION increment_youtube_quota(p_day DATE, p_operation TEXT, p_units INTEGER)
+RETURNS VOID AS $$
+    INSERT INTO youtube_quota_usage (day, operation, units, calls)
+    VALUES (p_day, p_operation, p_units, 1)
+    ON CONFLICT (day, operation) DO UPDATE
+    SET units = youtube_quota_usage.units + EXCLUDED.units,
+        calls = youtube_quota_usage.calls + 1,
+        updated_at = NOW();
+$$ LANGUAGE sql;
+
+-- ==================== ПАРТИЦИИ ЛОГОВ ====================
+
+-- Секции logs_yYYYYmMM с p_months_back месяцев назад по p_months_ahead вперед и для месяцев,
+-- строки которых попали в logs_default, пока секции не было (например, задача хранения не работала).
+-- Секцию нельзя создать, пока в logs_default есть строки ее диапазона: секция по умолчанию
+-- отсоединяется, строки переносятся в новую секцию, и она присоединяется обратно.
+-- Выполняет DDL, поэтому вызывается по DATABASE_URL (backend/log_partitions.py), а не через API.
+DROP FUNCTION IF EXISTS ensure_log_partitions(INTEGER);
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_months_ahead INTEGER DEFAULT 2, p_months_back INTEGER DEFAULT 0)
+RETURNS TEXT[] AS $$
+DECLARE
+    month_start DATE;
+    month_end DATE;
+    partition_name TEXT;
+    created TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    FOR month_start IN
+        SELECT (date_trunc('month', NOW()) + make_interval(months => i))::DATE
+        FROM generate_series(-p_months_back, p_months_ahead) AS i
+        UNION
+        SELECT DISTINCT date_trunc('month', created_at)::DATE FROM logs_default
+        ORDER BY 1
+    LOOP
+        partition_name := format('logs_y%sm%s', to_char(month_start, 'YYYY'), to_char(month_start, 'MM'));
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        month_end := (month_start + INTERVAL '1 month')::DATE;
+
+        IF EXISTS (SELECT 1 FROM logs_default WHERE created_at >= month_start AND created_at < month_end) THEN
+            ALTER TABLE logs DETACH PARTITION logs_default;
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+            WITH moved AS (
+                DELETE FROM logs_default
+                WHERE created_at >= month_start AND created_at < month_end
+                RETURNING *
+            )
+            INSERT INTO logs SELECT * FROM moved;
+            ALTER TABLE logs ATTACH PARTITION logs_default DEFAULT;
+        ELSE
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF logs FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, month_end
+            );
+        END IF;
+        created := array_append(created, partition_name);
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Секции старше p_keep_months месяцев: удаление или (p_archive) отсоединение в отдельную
+-- таблицу logs_archive_yYYYYmMM, которую можно выгрузить pg_dump и удалить вручную
+CREATE OR REPLACE FUNCTION drop_log_partitions(p_keep_months INTEGER, p_archive BOOLEAN DEFAULT FALSE)
+RETURNS TEXT[] AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', NOW()) - make_interval(months => p_keep_months))::DATE;
+    part RECORD;
+    handled TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    FOR part IN
+        SELECT c.relname AS name, to_date(right(c.relname, 7), 'YYYY"m"MM') AS month_start
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'logs'::regclass AND c.relname ~ '^logs_y\d{4}m\d{2}$'
+    LOOP
+        CONTINUE WHEN part.month_start >= cutoff;
+        IF p_archive THEN
+            EXECUTE format('ALTER TABLE logs DETACH PARTITION %I', part.name);
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', part.name, replace(part.name, 'logs_', 'logs_archive_'));
+        ELSE
+            EXECUTE format('DROP TABLE %I', part.name);
+        END IF;
+        handled := array_append(handled, part.name);
+    END LOOP;
+    RETURN handled;
+END;
+$$ LANGUAGE plpgsql;
+
+-- DDL-функции недоступны ключам API (anon, authenticated): их вызывает только задача хранения
+REVOKE EXECUTE ON FUNCTION ensure_log_partitions(INTEGER, INTEGER), drop_log_partitions(INTEGER, BOOLEAN) FROM PUBLIC;
+DO $$
+DECLARE
+    api_role TEXT;
+BEGIN
+    FOREACH api_role IN ARRAY ARRAY['anon', 'authenticated'] LOOP
+        IF EXISTS (SELECT 1 FROM pg_roles WHERE rolname = api_role) THEN
+            EXECUTE format(
+                'REVOKE EXECUTE ON FUNCTION ensure_log_partitions(INTEGER, INTEGER), drop_log_partitions(INTEGER, BOOLEAN) FROM %I',
+                api_role
+            );
+        END IF;
+    END LOOP;
+END $$;
+
+SELECT ensure_log_partitions(2);
+
+-- Существующая база: последние три месяца прежней таблицы logs переносятся в секции
+-- (более старые строки остаются в logs_legacy; удалите ее, когда они станут не нужны)
+DO $$
+BEGIN
+    IF to_regclass('logs_legacy') IS NOT NULL THEN
+        PERFORM ensure_log_partitions(2, 3);
+        INSERT INTO logs (id, action, metadata, user_id, created_at)
+        SELECT id, action, metadata, user_id, created_at
+        FROM logs_legacy
+        WHERE created_at >= date_trunc('month', NOW()) - INTERVAL '3 months'
+        ON CONFLICT DO NOTHING;
+    END IF;
+END $$;
+
+-- Страница логов по ключу (created_at, id), новые первыми. Фильтры: действия, интервал времени
+-- и пары ключ-значение metadata (@>). Условия добавляются только для заданных фильтров, чтобы
+-- при заданном интервале отсекались лишние секции, а при действиях - использовался idx_logs_action_created.
+CREATE OR REPLACE FUNCTION query_logs(
+    p_actions TEXT[] DEFAULT NULL,
+    p_since TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_until TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_metadata JSONB DEFAULT NULL,
+    p_after_created_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL,
+    p_limit INTEGER DEFAULT 100
+)
+RETURNS SETOF logs AS $$
+DECLARE
+    conditions TEXT[] := ARRAY['TRUE'];
+BEGIN
+    IF p_actions IS NOT NULL THEN conditions := array_append(conditions, 'action = ANY($1)'); END IF;
+    IF p_since IS NOT NULL THEN conditions := array_append(conditions, 'created_at >= $2'); END IF;
+    IF p_until IS NOT NULL THEN conditions := array_append(conditions, 'created_at < $3'); END IF;
+    IF p_metadata IS NOT NULL THEN conditions := array_append(conditions, 'metadata @> $4'); END IF;
+    IF p_after_created_at IS NOT NULL THEN
+        conditions := array_append(conditions, '(created_at, id) < ($5, $6)');
+    END IF;
+
+    RETURN QUERY EXECUTE format(
+        'SELECT * FROM logs WHERE %s ORDER BY created_at DESC, id DESC LIMIT $7',
+        array_to_string(conditions, ' AND ')
+    )
+    USING p_actions, p_since, p_until, p_metadata, p_after_created_at, p_after_id, p_limit;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- ==================== ПОИСК ШАБЛОНОВ ====================
+
+-- Поиск шаблонов по фасетам, диапазону ai_hardness и тегам characteristics.
+-- Возвращает страницу, общее число и счетчики значений фасетов по отфильтрованной
+-- выборке за один запрос. Условия добавляются только для заданных фильтров
+-- (динамический SQL), чтобы планировщик использовал индексы на каждый вызов.
+CREATE OR REPLACE FUNCTION search_templates(
+    p_language TEXT[] DEFAULT NULL,
+    p_style TEXT[] DEFAULT NULL,
+    p_orientation TEXT[] DEFAULT NULL,
+    p_ai_tag TEXT[] DEFAULT NULL,
+    p_hardness_min INTEGER DEFAULT NULL,
+    p_hardness_max INTEGER DEFAULT NULL,
+    p_characteristics JSONB DEFAULT NULL,
+    p_limit INTEGER DEFAULT 50,
+    p_offset INTEGER DEFAULT 0
+)
+RETURNS JSONB AS $$
+DECLARE
+    conditions TEXT[] := ARRAY['TRUE'];
+    result JSONB;
+BEGIN
+    IF p_language IS NOT NULL THEN conditions := array_append(conditions, 'language = ANY($1)'); END IF;
+    IF p_style IS NOT NULL THEN conditions := array_append(conditions, 'style = ANY($2)'); END IF;
+    IF p_orientation IS NOT NULL THEN conditions := array_append(conditions, 'orientation = ANY($3)'); END IF;
+    IF p_ai_tag IS NOT NULL THEN conditions := array_append(conditions, 'ai_tag = ANY($4)'); END IF;
+    IF p_hardness_min IS NOT NULL THEN conditions := array_append(conditions, 'ai_hardness >= $5'); END IF;
+    IF p_hardness_max IS NOT NULL THEN conditions := array_append(conditions, 'ai_hardness <= $6'); END IF;
+    IF p_characteristics IS NOT NULL THEN conditions := array_append(conditions, 'characteristics @> $7'); END IF;
+
+    EXECUTE format($query$
+        WITH filtered AS MATERIALIZED (
+            SELECT * FROM templates WHERE %s
+        ),
+        page AS (
+            SELECT * FROM filtered ORDER BY created_at DESC, id DESC LIMIT $8 OFFSET $9
+        )
+        SELECT jsonb_build_object(
+            'total', (SELECT count(*) FROM filtered),
+            'items', COALESCE((SELECT jsonb_agg(to_jsonb(p) ORDER BY p.created_at DESC, p.id DESC) FROM page p), '[]'::jsonb),
+            'facets', jsonb_build_object(
+                'language', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT language AS value, count(*) AS cnt FROM filtered WHERE language IS NOT NULL GROUP BY language) f),
+                'style', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT style AS value, count(*) AS cnt FROM filtered WHERE style IS NOT NULL GROUP BY style) f),
+                'orientation', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT orientation AS value, count(*) AS cnt FROM filtered WHERE orientation IS NOT NULL GROUP BY orientation) f),
+                'ai_tag', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT ai_tag AS value, count(*) AS cnt FROM filtered WHERE ai_tag IS NOT NULL GROUP BY ai_tag) f),
+                'ai_hardness', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT ai_hardness::TEXT AS value, count(*) AS cnt FROM filtered WHERE ai_hardness IS NOT NULL GROUP BY ai_hardness) f),
+                'characteristics', (SELECT COALESCE(jsonb_object_agg(value, cnt), '{}'::jsonb) FROM (
+                    SELECT tag AS value, count(*) AS cnt
+                    FROM filtered CROSS JOIN LATERAL jsonb_array_elements_text(
+                        CASE WHEN jsonb_typeof(characteristics) = 'array' THEN characteristics ELSE '[]'::jsonb END
+                    ) AS tag
+                    GROUP BY tag) f)
+            )
+        )
+    $query$, array_to_string(conditions, ' AND '))
+    INTO result
+    USING p_language, p_style, p_orientation, p_ai_tag, p_hardness_min, p_hardness_max,
+          p_characteristics, p_limit, p_offset;
+
+    RETURN result;
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+-- ==================== УВЕДОМЛЕНИЯ РЕЕСТРА ====================
+
+-- Изменение строки uploads/templates в канал registry_changes (LISTEN в backend/registry_events.py).
+-- Отправляется только разница: новая строка, измененные колонки или id удаленной строки;
+-- keys - значения колонок из аргументов триггера для фильтров подписчиков.
+-- Уведомление ограничено 8000 байт: большая разница заменяется признаком truncated.
+-- Массовый импорт (SET LOCAL uac.bulk_import = 'on') отправляет вместо строк один resync.
+CREATE OR REPLACE FUNCTION notify_registry_change()
+RETURNS TRIGGER AS $$
+DECLARE
+    source JSONB := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+    keys JSONB := '{}'::jsonb;
+    changes JSONB;
+    payload JSONB;
+    i INTEGER;
+BEGIN
+    IF current_setting('uac.bulk_import', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+
+    FOR i IN 0 .. TG_NARGS - 1 LOOP
+        keys := keys || jsonb_build_object(TG_ARGV[i], source -> TG_ARGV[i]);
+    END LOOP;
+
+    IF TG_OP = 'UPDATE' THEN
+        SELECT COALESCE(jsonb_object_agg(n.key, n.value), '{}'::jsonb) INTO changes
+        FROM jsonb_each(source) n
+        WHERE to_jsonb(OLD) -> n.key IS DISTINCT FROM n.value;
+        -- Изменился только updated_at - клиентам сообщать нечего
+        IF changes - 'updated_at' = '{}'::jsonb THEN
+            RETURN NULL;
+        END IF;
+        payload := jsonb_build_object('changes', changes);
+    ELSIF TG_OP = 'INSERT' THEN
+        payload := jsonb_build_object('row', source);
+    ELSE
+        payload := '{}'::jsonb;
+    END IF;
+
+    payload := payload || jsonb_build_object('table', TG_TABLE_NAME, 'op', lower(TG_OP), 'id', source -> 'id', 'keys', keys);
+    IF octet_length(payload::text) > 7900 THEN
+        payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', lower(TG_OP), 'id', source -> 'id', 'keys', keys, 'truncated', true);
+    END IF;
+    PERFORM pg_notify('registry_changes', payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS notify_uploads_change ON uploads;
+CREATE TRIGGER notify_uploads_change
+    AFTER INSERT OR UPDATE OR DELETE ON uploads
+    FOR EACH ROW EXECUTE FUNCTION notify_registry_change('campaign_name', 'status', 'template_id');
+
+DROP TRIGGER IF EXISTS notify_templates_change ON templates;
+CREATE TRIGGER notify_templates_change
+    AFTER INSERT OR UPDATE OR DELETE ON templates
+    FOR EACH ROW EXECUTE FUNCTION notify_registry_change('language', 'style', 'orientation', 'ai_tag');
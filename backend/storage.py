@@ -0,0 +1,489 @@
+"""
+Хранилище файлов: локальный диск или S3-совместимый бакет (AWS S3, MinIO)
+
+Файлы адресуются ключом - путем относительно UPLOAD_DIR ("modals/<id>_a.png",
+"videos/<uuid>_b.mp4"), и этот ключ, а не путь узла, хранится в БД.
+LocalStorage пишет прямо в UPLOAD_DIR (раскладка каталогов прежняя).
+S3Storage хранит объекты в бакете, а UPLOAD_DIR служит локальным кэшем:
+записанный файл остается в кэше (write-through), недостающий скачивается
+при первом обращении (read-through) - ffmpeg и PIL по-прежнему работают с
+локальными путями. Большие объекты передаются частями параллельно
+(multipart upload и диапазонные GET), потоки читаются и пишутся частями без
+загрузки файла в память целиком.
+
+Кэшированные копии каталогов с квотами артефактов (videos, processed, ...)
+вытесняет менеджер артефактов, остальные (модалки и их превью) - LRU
+хранилища с лимитом STORAGE_CACHE_MAX_MB.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import AsyncIterable, AsyncIterator, Dict, Optional
+
+import aiofiles
+
+from config import (
+    UPLOAD_DIR, ARTIFACT_QUOTAS, STORAGE_BACKEND, STORAGE_CHUNK_SIZE, STORAGE_CACHE_MAX_MB,
+    S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION, S3_ACCESS_KEY_ID, S3_SECRET_ACCESS_KEY,
+    S3_PART_SIZE, S3_MAX_CONCURRENCY
+)
+from metrics import BYTES_IN, BYTES_OUT, STORAGE_CACHE_BYTES, observe_cache
+
+logger = logging.getLogger(__name__)
+
+# Минимальный размер части multipart upload в S3 (кроме последней)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def key_for(path: str) -> str:
+    """Ключ хранилища для ключа или локального пути (записи, сохраненные до хранилища, содержат путь)"""
+    normalized = Path(os.path.normpath(path))
+    root = Path(os.path.normpath(UPLOAD_DIR))
+    for base in (root, root.resolve()):
+        try:
+            return normalized.relative_to(base).as_posix()
+        except ValueError:
+            continue
+    return normalized.as_posix()
+
+
+def _tmp_path(path: Path) -> Path:
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+async def iter_file(path: str, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Чтение диапазона [start, end] локального файла частями"""
+    async with aiofiles.open(path, "rb") as f:
+        await f.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            chunk = await f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+
+class LocalStorage:
+    """Файлы в UPLOAD_DIR на диске узла"""
+
+    name = "local"
+
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = Path(root)
+
+    def cache_path(self, key: str) -> Path:
+        return self.root / key
+
+    async def write_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        """Запись потока; файл появляется под ключом только целиком"""
+        path = self.cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _tmp_path(path)
+        size = 0
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                async for chunk in chunks:
+                    await f.write(chunk)
+                    size += len(chunk)
+            tmp_path.replace(path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        return size
+
+    async def put_bytes(self, key: str, data: bytes) -> int:
+        async def chunks():
+            yield data
+        return await self.write_stream(key, chunks())
+
+    async def put_file(self, key: str, path: str, move: bool = False) -> int:
+        """Сохранение локального файла под ключом (move=True - файл переносится, а не копируется)
+
+        Файл, уже лежащий в UPLOAD_DIR под этим ключом, не копируется.
+        """
+        target = self.cache_path(key)
+        if Path(path).resolve() != target.resolve():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if move:
+                Path(path).replace(target)
+            else:
+                await asyncio.to_thread(shutil.copyfile, path, target)
+        return target.stat().st_size
+
+    async def read_stream(self, key: str, start: int = 0, end: Optional[int] = None,
+                          chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Чтение диапазона байт [start, end] (end включительно, None - до конца)"""
+        path = self.cache_path(key)
+        if not path.exists():
+            raise FileNotFoundError(key)
+        async for chunk in iter_file(str(path), start, end, chunk_size):
+            yield chunk
+
+    async def local_path(self, key: str) -> str:
+        """Локальный путь файла для ffmpeg/PIL; FileNotFoundError, если файла нет"""
+        path = self.cache_path(key)
+        if not path.exists():
+            raise FileNotFoundError(key)
+        return str(path)
+
+    async def size(self, key: str) -> Optional[int]:
+        path = self.cache_path(key)
+        return path.stat().st_size if path.exists() else None
+
+    async def exists(self, key: str) -> bool:
+        return self.cache_path(key).exists()
+
+    async def delete(self, key: str):
+        self.cache_path(key).unlink(missing_ok=True)
+
+    def status(self) -> Dict[str, object]:
+        return {"backend": self.name, "root": str(self.root)}
+
+
+class S3Storage(LocalStorage):
+    """Объекты в S3-совместимом бакете, UPLOAD_DIR - локальный кэш"""
+
+    name = "s3"
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        endpoint_url: Optional[str] = S3_ENDPOINT_URL or None,
+        region: Optional[str] = S3_REGION or None,
+        root: str = UPLOAD_DIR,
+        part_size: int = S3_PART_SIZE,
+        concurrency: int = S3_MAX_CONCURRENCY,
+        cache_max_bytes: int = STORAGE_CACHE_MAX_MB * 1024 * 1024,
+        client=None
+    ):
+        if not bucket:
+            raise ValueError("Для STORAGE_BACKEND=s3 нужен S3_BUCKET")
+        super().__init__(root)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.part_size = max(S3_MIN_PART_SIZE, part_size)
+        self.concurrency = max(1, concurrency)
+        self.cache_max_bytes = cache_max_bytes
+        self._client = client
+        self._client_lock = threading.Lock()
+        # Скачивание ключа в кэш выполняется один раз, остальные ждут его
+        self._downloads: Dict[str, asyncio.Future] = {}
+        # Кэш вне каталогов с квотами артефактов: ключ -> размер, в порядке обращений
+        self._cached: "OrderedDict[str, int]" = OrderedDict()
+        STORAGE_CACHE_BYTES.set_function(lambda: sum(self._cached.values()))
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    import boto3
+                    from botocore.config import Config
+
+                    # Повторы и таймауты вызовов - в resilience.call, не в botocore
+                    self._client = boto3.client(
+                        "s3",
+                        endpoint_url=self.endpoint_url,
+                        region_name=self.region,
+                        aws_access_key_id=S3_ACCESS_KEY_ID or None,
+                        aws_secret_access_key=S3_SECRET_ACCESS_KEY or None,
+                        config=Config(
+                            max_pool_connections=self.concurrency * 2,
+                            retries={"max_attempts": 1},
+                            s3={"addressing_style": "path"} if self.endpoint_url else None
+                        )
+                    )
+        return self._client
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    async def _call(self, operation: str, func, **kwargs):
+        from resilience import call
+        return await call("s3", operation, func, Bucket=self.bucket, **kwargs)
+
+    @staticmethod
+    def _not_found(error: Exception) -> bool:
+        response = getattr(error, "response", None)
+        if not isinstance(response, dict):
+            return False
+        code = str(response.get("Error", {}).get("Code", ""))
+        return code in ("404", "NoSuchKey", "NotFound")
+
+    # ==================== ЗАПИСЬ ====================
+
+    async def _upload(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        """Загрузка потока в бакет: маленький объект одним PUT, большой - частями параллельно
+
+        Одновременно в памяти и в полете не больше concurrency частей:
+        чтение источника ждет, пока одна из них не загрузится.
+        """
+        object_key = self._object_key(key)
+        buffer = bytearray()
+        size = 0
+        upload_id = None
+        parts: Dict[int, str] = {}
+        tasks = []
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def send_part(number: int, data: bytes):
+            try:
+                response = await self._call(
+                    "upload_part", self.client.upload_part,
+                    Key=object_key, UploadId=upload_id, PartNumber=number, Body=data
+                )
+                parts[number] = response["ETag"]
+            finally:
+                slots.release()
+
+        async def flush(data: bytes):
+            nonlocal upload_id
+            if upload_id is None:
+                response = await self._call("create_multipart_upload", self.client.create_multipart_upload, Key=object_key)
+                upload_id = response["UploadId"]
+            await slots.acquire()
+            # Ошибка уже загруженной части прерывает загрузку, не дочитывая источник
+            for task in tasks:
+                if task.done() and task.exception():
+                    slots.release()
+                    raise task.exception()
+            tasks.append(asyncio.create_task(send_part(len(tasks) + 1, data)))
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+                while len(buffer) >= self.part_size:
+                    data = bytes(buffer[:self.part_size])
+                    del buffer[:self.part_size]
+                    await flush(data)
+            if upload_id is None:
+                await self._call("put_object", self.client.put_object, Key=object_key, Body=bytes(buffer))
+            else:
+                if buffer:
+                    await flush(bytes(buffer))
+                await asyncio.gather(*tasks)
+                await self._call(
+                    "complete_multipart_upload", self.client.complete_multipart_upload,
+                    Key=object_key, UploadId=upload_id,
+                    MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]}
+                )
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if upload_id is not None:
+                try:
+                    await self._call("abort_multipart_upload", self.client.abort_multipart_upload,
+                                     Key=object_key, UploadId=upload_id)
+                except Exception as e:
+                    logger.warning(f"Не удалось отменить multipart upload {object_key}: {e}")
+            raise
+        BYTES_OUT.labels("storage").inc(size)
+        return size
+
+    async def write_stream(self, key: str, chunks: AsyncIterable[bytes]) -> int:
+        """Запись потока в бакет с копией в локальном кэше"""
+        path = self.cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _tmp_path(path)
+        try:
+            async with aiofiles.open(tmp_path, "wb") as cache_file:
+                async def tee():
+                    async for chunk in chunks:
+                        await cache_file.write(chunk)
+                        yield chunk
+                size = await self._upload(key, tee())
+            tmp_path.replace(path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self._remember(key, size)
+        return size
+
+    async def put_file(self, key: str, path: str, move: bool = False) -> int:
+        """Загрузка локального файла в бакет; файл становится копией в кэше (move=True) или копируется в кэш"""
+        target = self.cache_path(key)
+        if not move and Path(path).resolve() != target.resolve():
+            return await self.write_stream(key, iter_file(path, chunk_size=self.part_size))
+        size = await self._upload(key, iter_file(path, chunk_size=self.part_size))
+        if Path(path).resolve() != target.resolve():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            Path(path).replace(target)
+        self._remember(key, size)
+        return size
+
+    # ==================== ЧТЕНИЕ ====================
+
+    async def _get_range(self, object_key: str, start: int, end: Optional[int]):
+        try:
+            return await self._call(
+                "get_object", self.client.get_object,
+                Key=object_key, Range=f"bytes={start}-{'' if end is None else end}"
+            )
+        except Exception as e:
+            if self._not_found(e):
+                raise FileNotFoundError(object_key) from e
+            raise
+
+    async def read_stream(self, key: str, start: int = 0, end: Optional[int] = None,
+                          chunk_size: int = STORAGE_CHUNK_SIZE) -> AsyncIterator[bytes]:
+        """Чтение диапазона байт: из кэша, если копия есть, иначе диапазонным GET из бакета"""
+        path = self.cache_path(key)
+        if path.exists():
+            observe_cache("storage", True)
+            self._touch(key)
+            async for chunk in iter_file(str(path), start, end, chunk_size):
+                yield chunk
+            return
+
+        observe_cache("storage", False)
+        response = await self._get_range(self._object_key(key), start, end)
+        body = response["Body"]
+        try:
+            while True:
+                chunk = await asyncio.to_thread(body.read, chunk_size)
+                if not chunk:
+                    break
+                BYTES_IN.labels("storage").inc(len(chunk))
+                yield chunk
+        finally:
+            body.close()
+
+    async def size(self, key: str) -> Optional[int]:
+        try:
+            response = await self._call("head_object", self.client.head_object, Key=self._object_key(key))
+        except Exception as e:
+            if self._not_found(e):
+                return None
+            raise
+        return int(response["ContentLength"])
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def delete(self, key: str):
+        await self._call("delete_object", self.client.delete_object, Key=self._object_key(key))
+        self._forget(key)
+        self.cache_path(key).unlink(missing_ok=True)
+
+    async def local_path(self, key: str) -> str:
+        """Локальная копия объекта: из кэша или скачанная (read-through)"""
+        path = self.cache_path(key)
+        if path.exists():
+            observe_cache("storage", True)
+            self._touch(key)
+            return str(path)
+
+        observe_cache("storage", False)
+        download = self._downloads.get(key)
+        if download is None:
+            download = asyncio.ensure_future(self._download(key))
+            self._downloads[key] = download
+            download.add_done_callback(lambda _: self._downloads.pop(key, None))
+        await asyncio.shield(download)
+        return str(path)
+
+    async def _download(self, key: str):
+        """Скачивание объекта в кэш: большой - параллельными диапазонными GET по частям"""
+        size = await self.size(key)
+        if size is None:
+            raise FileNotFoundError(key)
+        path = self.cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = _tmp_path(path)
+        object_key = self._object_key(key)
+        slots = asyncio.Semaphore(self.concurrency)
+
+        def write_at(fd: int, offset: int, data: bytes):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                view, offset = view[written:], offset + written
+
+        async def fetch(fd: int, start: int, end: int):
+            async with slots:
+                response = await self._get_range(object_key, start, end)
+                body = response["Body"]
+                try:
+                    data = await asyncio.to_thread(body.read)
+                finally:
+                    body.close()
+                await asyncio.to_thread(write_at, fd, start, data)
+                BYTES_IN.labels("storage").inc(len(data))
+
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            await asyncio.gather(*(
+                fetch(fd, start, min(start + self.part_size, size) - 1)
+                for start in range(0, size, self.part_size)
+            ))
+            os.close(fd)
+            fd = None
+            tmp_path.replace(path)
+        except BaseException:
+            if fd is not None:
+                os.close(fd)
+            tmp_path.unlink(missing_ok=True)
+            raise
+        self._remember(key, size)
+
+    # ==================== КЭШ ====================
+
+    def _managed_by_artifacts(self, key: str) -> bool:
+        return key.split("/", 1)[0] in ARTIFACT_QUOTAS
+
+    def _remember(self, key: str, size: int):
+        if self._managed_by_artifacts(key):
+            return
+        self._cached[key] = size
+        self._cached.move_to_end(key)
+        self._evict()
+
+    def _touch(self, key: str):
+        if key in self._cached:
+            self._cached.move_to_end(key)
+
+    def _forget(self, key: str):
+        self._cached.pop(key, None)
+
+    def _evict(self):
+        """Вытеснение давно не использованных копий сверх лимита (объекты остаются в бакете)"""
+        total = sum(self._cached.values())
+        while total > self.cache_max_bytes and len(self._cached) > 1:
+            key, size = self._cached.popitem(last=False)
+            self.cache_path(key).unlink(missing_ok=True)
+            total -= size
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "backend": self.name,
+            "bucket": self.bucket,
+            "endpoint_url": self.endpoint_url,
+            "cache_root": str(self.root),
+            "cache_bytes": sum(self._cached.values()),
+            "cache_objects": len(self._cached),
+        }
+
+
+def create_storage():
+    if STORAGE_BACKEND == "s3":
+        return S3Storage()
+    if STORAGE_BACKEND != "local":
+        logger.warning(f"Неизвестный STORAGE_BACKEND={STORAGE_BACKEND}, используется local")
+    return LocalStorage()
+
+
+# Глобальное хранилище
+storage = create_storage()
@@ -0,0 +1,189 @@
+"""
+Загрузка форматов на YouTube без промежуточного файла
+
+ffmpeg пишет фрагментированный MP4 в stdout, фоновый поток складывает его
+в ограниченный буфер в памяти, а возобновляемая сессия YouTube забирает из
+буфера части по YOUTUBE_UPLOAD_CHUNK_SIZE. Кодирование и загрузка идут
+одновременно, на диск формат не пишется. Если сессия или ffmpeg упали,
+вызывающий код переходит на обычный путь через файл.
+"""
+import asyncio
+import subprocess
+import threading
+from typing import Any, Dict, List, Optional
+
+from googleapiclient.http import MediaUpload
+
+from config import YOUTUBE_UPLOAD_CHUNK_SIZE, STREAMING_BUFFER_CHUNKS
+from metrics import ACTIVE_FFMPEG, BYTES_OUT
+
+READ_SIZE = 1024 * 1024
+
+# Фрагментированный MP4 не требует перемотки в начало файла, поэтому пишется в пайп
+FRAGMENTED_MP4_ARGS = ['-movflags', 'frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+
+
+class StreamAbortedError(Exception):
+    """Поток прерван: ffmpeg завершился с ошибкой или загрузка отменена"""
+
+
+class PipeMediaUpload(MediaUpload):
+    """MediaUpload для googleapiclient поверх ограниченного буфера в памяти
+
+    Размер заранее неизвестен: пока идет кодирование, size() возвращает None,
+    а после конца потока - итоговый размер, чтобы последняя часть закрыла
+    сессию даже при длине, кратной размеру части. В буфере хранятся только
+    данные начиная с последнего запрошенного смещения (повтор части после
+    ошибки сети возможен), производитель ждет, если буфер заполнен.
+    """
+
+    def __init__(self, chunksize: int = YOUTUBE_UPLOAD_CHUNK_SIZE, buffer_chunks: int = STREAMING_BUFFER_CHUNKS,
+                 mimetype: str = "video/mp4"):
+        self._chunksize = chunksize
+        self._mimetype = mimetype
+        self._limit = chunksize * max(2, buffer_chunks)
+        self._buffer = bytearray()
+        self._buffer_start = 0  # абсолютное смещение первого байта буфера
+        self._next_offset = 0   # ожидаемое начало следующей части
+        self._started = False
+        self._eof = False
+        self._error: Optional[Exception] = None
+        self._cond = threading.Condition()
+        self.bytes_total = 0
+
+    # ==================== ПРОИЗВОДИТЕЛЬ ====================
+
+    def feed(self, data: bytes):
+        with self._cond:
+            while len(self._buffer) >= self._limit and not self._error:
+                self._cond.wait()
+            if self._error:
+                raise self._error
+            self._buffer.extend(data)
+            self.bytes_total += len(data)
+            self._cond.notify_all()
+
+    def close(self, error: Optional[Exception] = None):
+        """Конец потока (или ошибка - тогда загрузка прервется)"""
+        with self._cond:
+            self._eof = True
+            if error and not self._error:
+                self._error = error
+            self._cond.notify_all()
+
+    def abort(self, error: Exception):
+        """Отмена со стороны загрузки: производитель перестанет ждать места в буфере"""
+        self.close(error)
+
+    # ==================== MediaUpload ====================
+
+    def chunksize(self):
+        return self._chunksize
+
+    def mimetype(self):
+        return self._mimetype
+
+    def resumable(self):
+        return True
+
+    def size(self):
+        if not self._started:
+            return None
+        with self._cond:
+            # Ждем, пока станет ясно, последняя ли следующая часть
+            while not self._eof and self._buffer_start + len(self._buffer) <= self._next_offset + self._chunksize:
+                self._cond.wait()
+            if self._error:
+                raise self._error
+            return self.bytes_total if self._eof else None
+
+    def getbytes(self, begin, length):
+        with self._cond:
+            self._started = True
+            if begin < self._buffer_start:
+                raise StreamAbortedError(f"Смещение {begin} уже вытеснено из буфера")
+            # Подтвержденные сервером данные до begin больше не нужны
+            del self._buffer[:begin - self._buffer_start]
+            self._buffer_start = begin
+            self._cond.notify_all()
+
+            while not self._eof and len(self._buffer) < length:
+                self._cond.wait()
+            if self._error:
+                raise self._error
+
+            data = bytes(self._buffer[:length])
+            self._next_offset = begin + len(data)
+            return data
+
+    def has_stream(self):
+        return False
+
+    def to_json(self):
+        raise NotImplementedError("PipeMediaUpload не сериализуется")
+
+
+def _pump(process: subprocess.Popen, media: PipeMediaUpload, stderr_lines: List[str]):
+    """Перекладывание stdout ffmpeg в буфер загрузки"""
+    try:
+        while True:
+            data = process.stdout.read(READ_SIZE)
+            if not data:
+                break
+            media.feed(data)
+    except Exception as e:
+        media.close(e)
+        process.kill()
+        return
+    finally:
+        process.stdout.close()
+
+    returncode = process.wait()
+    error = None
+    if returncode != 0:
+        error = StreamAbortedError(f"ffmpeg завершился с кодом {returncode}: {''.join(stderr_lines[-3:]).strip()}")
+    media.close(error)
+
+
+async def upload_stream(ffmpeg_cmd: List[str], title: str, description: str = "",
+                        thumbnail_path: Optional[str] = None, progress_callback=None) -> Dict[str, Any]:
+    """Кодирование ffmpeg_cmd (без выходного файла) сразу в сессию загрузки YouTube"""
+    from integrations import integration_manager
+
+    cmd = [*ffmpeg_cmd, *FRAGMENTED_MP4_ARGS, 'pipe:1']
+    media = PipeMediaUpload()
+    stderr_lines: List[str] = []
+
+    active = ACTIVE_FFMPEG.labels('ffmpeg')
+    active.inc()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+    stderr_reader = threading.Thread(
+        target=lambda: stderr_lines.extend(line.decode(errors="replace") for line in process.stderr),
+        daemon=True
+    )
+    pump = threading.Thread(target=_pump, args=(process, media, stderr_lines), daemon=True)
+    stderr_reader.start()
+    pump.start()
+
+    try:
+        result = await integration_manager.upload_video_to_youtube(
+            video_path=None,
+            title=title,
+            description=description,
+            thumbnail_path=thumbnail_path,
+            progress_callback=progress_callback,
+            media_body=media
+        )
+    finally:
+        if process.poll() is None:
+            # Загрузка упала раньше ffmpeg - останавливаем кодирование
+            media.abort(StreamAbortedError("Загрузка прервана"))
+            process.kill()
+        await asyncio.to_thread(pump.join)
+        await asyncio.to_thread(stderr_reader.join)
+        active.dec()
+
+    if result.get("success"):
+        BYTES_OUT.labels("youtube").inc(media.bytes_total)
+        result["bytes_streamed"] = media.bytes_total
+    return result
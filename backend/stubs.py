@@ -0,0 +1,229 @@
+"""
+Локальные заглушки внешних сервисов для проверки без сети и без учетных данных
+"""
+import asyncio
+import hashlib
+import json
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class LocalDriveClient:
+    """Локальная замена Google Drive API с лентой изменений (совместима с GoogleDriveClient)"""
+
+    def __init__(self, page_size: int = 100):
+        self.page_size = page_size
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.contents: Dict[str, bytes] = {}
+        self.changes: List[Dict[str, Any]] = []  # индекс в списке = page token
+
+    # ==================== УПРАВЛЕНИЕ ФАЙЛАМИ ====================
+
+    def add_file(self, folder_id: str, name: str, content: bytes = b"", mime_type: str = "video/mp4") -> Dict[str, Any]:
+        """Добавление файла в папку"""
+        file_id = uuid.uuid4().hex
+        self.files[file_id] = {
+            "id": file_id,
+            "name": name,
+            "mimeType": mime_type,
+            "parents": [folder_id],
+            "trashed": False
+        }
+        self._write(file_id, content)
+        return dict(self.files[file_id])
+
+    def update_file(self, file_id: str, content: Optional[bytes] = None, name: Optional[str] = None):
+        """Изменение содержимого или метаданных файла"""
+        if name is not None:
+            self.files[file_id]["name"] = name
+        if content is not None:
+            self._write(file_id, content)
+        else:
+            self._record_change(file_id)
+
+    def trash_file(self, file_id: str):
+        """Перемещение файла в корзину"""
+        self.files[file_id]["trashed"] = True
+        self._record_change(file_id)
+
+    def remove_file(self, file_id: str):
+        """Удаление файла (в ленте - изменение removed без метаданных)"""
+        del self.files[file_id]
+        self.contents.pop(file_id, None)
+        self.changes.append({"fileId": file_id, "removed": True})
+
+    def _write(self, file_id: str, content: bytes):
+        self.contents[file_id] = content
+        self.files[file_id].update({
+            "md5Checksum": hashlib.md5(content).hexdigest(),
+            "size": str(len(content)),
+            "modifiedTime": datetime.now().isoformat()
+        })
+        self._record_change(file_id)
+
+    def _record_change(self, file_id: str):
+        self.changes.append({"fileId": file_id, "removed": False, "file": dict(self.files[file_id])})
+
+    # ==================== API ====================
+
+    async def get_start_page_token(self) -> str:
+        return str(len(self.changes))
+
+    async def list_changes(self, page_token: str) -> Dict[str, Any]:
+        start = int(page_token)
+        end = min(start + self.page_size, len(self.changes))
+        response = {"changes": self.changes[start:end]}
+        if end < len(self.changes):
+            response["nextPageToken"] = str(end)
+        else:
+            response["newStartPageToken"] = str(end)
+        return response
+
+    async def list_folder(self, folder_id: str, page_token: Optional[str] = None) -> Dict[str, Any]:
+        matching = [
+            dict(f) for f in self.files.values()
+            if folder_id in f["parents"] and not f["trashed"] and f["mimeType"].startswith("video/")
+        ]
+        start = int(page_token or 0)
+        end = start + self.page_size
+        response = {"files": matching[start:end]}
+        if end < len(matching):
+            response["nextPageToken"] = str(end)
+        return response
+
+    async def download(self, file_id: str, destination: Path) -> None:
+        Path(destination).write_bytes(self.contents[file_id])
+
+
+class StubDatabaseManager:
+    """Хранение в памяти вместо Supabase (подмножество методов DatabaseManager)"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {
+            "modal_images": [], "uploads": [], "templates": [], "logs": [], "oauth_credentials": [],
+            "youtube_quota_usage": [], "batch_items": [], "drive_sources": []
+        }
+
+    def _insert(self, table: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        row = {"id": str(uuid.uuid4()), "created_at": datetime.now().isoformat(), **data}
+        self.tables[table].append(row)
+        return row
+
+    def _find(self, table: str, **filters) -> Optional[Dict[str, Any]]:
+        return next((r for r in self.tables[table] if all(r.get(k) == v for k, v in filters.items())), None)
+
+    async def create_modal_image(self, filename: str, file_path: str, file_size: int) -> Dict[str, Any]:
+        return self._insert("modal_images", {"filename": filename, "file_path": file_path, "file_size": file_size, "is_active": True})
+
+    async def get_modal_images(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.tables["modal_images"]))
+
+    async def get_modal_image_by_id(self, modal_id: str) -> Optional[Dict[str, Any]]:
+        return self._find("modal_images", id=modal_id)
+
+    async def create_upload(self, upload_data: Dict[str, Any]) -> Dict[str, Any]:
+        return self._insert("uploads", {"status": "active", **upload_data, "upload_date": datetime.now().isoformat()})
+
+    async def get_or_create_upload(self, upload_data: Dict[str, Any], idempotency_key: str) -> Tuple[Dict[str, Any], bool]:
+        existing = self._find("uploads", idempotency_key=idempotency_key)
+        if existing is not None:
+            return existing, False
+        return await self.create_upload({**upload_data, "idempotency_key": idempotency_key}), True
+
+    async def get_uploads(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.tables["uploads"]))
+
+    async def save_batch_items(self, items: List[Dict[str, Any]]):
+        # Копия через JSON, как при записи в БД: задание меняет свои списки дальше
+        for item in json.loads(json.dumps(items, default=str)):
+            row = self._find("batch_items", batch_id=item["batch_id"], item_index=item["item_index"])
+            if row is None:
+                self.tables["batch_items"].append(dict(item))
+            else:
+                row.update(item)
+
+    async def update_batch_item(self, batch_id: str, item_index: int, data: Dict[str, Any]) -> bool:
+        row = self._find("batch_items", batch_id=batch_id, item_index=item_index)
+        if row is not None:
+            row.update(json.loads(json.dumps(data, default=str)))
+        return row is not None
+
+    async def get_batch_items(self, batch_id: str) -> List[Dict[str, Any]]:
+        return sorted((r for r in self.tables["batch_items"] if r["batch_id"] == batch_id), key=lambda r: r["item_index"])
+
+    async def create_drive_source(self, source_data: Dict[str, Any]) -> Dict[str, Any]:
+        row = self._insert("drive_sources", {"is_active": True, **json.loads(json.dumps(source_data))})
+        return json.loads(json.dumps(row))
+
+    async def get_drive_sources(self, active_only: bool = False) -> List[Dict[str, Any]]:
+        rows = [r for r in self.tables["drive_sources"] if r["is_active"] or not active_only]
+        return json.loads(json.dumps(rows))
+
+    async def get_drive_source_by_id(self, source_id: str) -> Optional[Dict[str, Any]]:
+        row = self._find("drive_sources", id=source_id)
+        return json.loads(json.dumps(row)) if row is not None else None
+
+    async def update_drive_source(self, source_id: str, source_data: Dict[str, Any]) -> bool:
+        row = self._find("drive_sources", id=source_id)
+        if row is not None:
+            row.update(json.loads(json.dumps(source_data, default=str)))
+        return row is not None
+
+    async def get_templates(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.tables["templates"]))
+
+    async def get_oauth_credentials(self, service: str, use_cache: bool = True) -> Optional[Dict[str, Any]]:
+        return self._find("oauth_credentials", service=service)
+
+    async def create_log(self, action: str, metadata: Dict[str, Any] = None, user_id: str = None) -> Dict[str, Any]:
+        return self._insert("logs", {"action": action, "metadata": metadata or {}, "user_id": user_id})
+
+    async def get_youtube_quota_usage(self, day: str) -> List[Dict[str, Any]]:
+        return [r for r in self.tables["youtube_quota_usage"] if r["day"] == day]
+
+    async def add_youtube_quota_usage(self, day: str, operation: str, units: int):
+        row = self._find("youtube_quota_usage", day=day, operation=operation)
+        if row is None:
+            row = self._insert("youtube_quota_usage", {"day": day, "operation": operation, "units": 0, "calls": 0})
+        row["units"] += units
+        row["calls"] += 1
+
+
+class StubIntegrationManager:
+    """Имитация загрузки на YouTube: чтение файла и заданная сетевая задержка"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.uploaded: List[Dict[str, Any]] = []
+
+    async def upload_video_to_youtube(self, video_path: Optional[str], title: str, description: str = "", thumbnail_path: str = None, progress_callback=None, media_body=None) -> Dict[str, Any]:
+        if media_body is not None:
+            # Поток читаем частями, как возобновляемая сессия googleapiclient
+            size = await asyncio.to_thread(self._read_media, media_body)
+        else:
+            # Читаем файл целиком, как это делает клиент YouTube при отправке
+            size = len(await asyncio.to_thread(Path(video_path).read_bytes))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if progress_callback:
+            progress_callback({"percent": 100.0})
+
+        video_id = uuid.uuid4().hex[:11]
+        self.uploaded.append({"video_id": video_id, "title": title, "size": size, "thumbnail_path": thumbnail_path})
+        return {
+            "success": True,
+            "video_id": video_id,
+            "video_url": f"https://www.youtube.com/watch?v={video_id}"
+        }
+
+    @staticmethod
+    def _read_media(media) -> int:
+        offset = 0
+        while True:
+            data = media.getbytes(offset, media.chunksize())
+            offset += len(data)
+            if len(data) < media.chunksize() or media.size() == offset:
+                return offset
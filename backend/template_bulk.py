@@ -0,0 +1,411 @@
+"""
+Массовый импорт и экспорт шаблонов (CSV, NDJSON) через COPY
+
+Импорт читает файл пачками по TEMPLATE_IMPORT_BATCH_SIZE строк. Пачка
+проверяется по колонкам (одним проходом на колонку, а не валидатором на
+строку), ошибки собираются с номером строки и полем. Корректные строки
+пачки загружаются одним COPY во временную таблицу templates_import и
+переносятся в templates одним INSERT ... ON CONFLICT (id): существующие
+шаблоны обновляются (on_conflict=update) или пропускаются (skip). Каждая
+пачка - отдельная транзакция, поэтому ошибка БД теряет только ее строки.
+
+На время импорта триггер уведомлений реестра отключен параметром сессии
+uac.bulk_import: вместо тысяч событий подписчики получают один resync.
+
+Экспорт - COPY (SELECT ...) TO STDOUT в CSV с заголовком (тот же формат,
+что принимает импорт) или построчный NDJSON через серверный курсор.
+Нужен psycopg2 и прямое соединение DATABASE_URL.
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import queue
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import DATABASE_URL, TEMPLATE_IMPORT_BATCH_SIZE, TEMPLATE_IMPORT_MAX_ERRORS
+from registry_events import CHANNEL as REGISTRY_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id", "language", "style", "orientation", "background", "ai_tag", "ai_text", "ai_hardness", "characteristics", "created_at")
+TEXT_COLUMNS = ("language", "style", "background", "ai_tag", "ai_text")
+ORIENTATIONS = ("vertical", "horizontal", "square")
+FORMATS = ("csv", "ndjson")
+# Размер части потока экспорта
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+STAGING_TABLE = """
+CREATE TEMP TABLE IF NOT EXISTS templates_import (
+    row_no INTEGER NOT NULL,
+    id UUID NOT NULL,
+    language TEXT,
+    style TEXT,
+    orientation TEXT,
+    background TEXT,
+    ai_tag TEXT,
+    ai_text TEXT,
+    ai_hardness INTEGER,
+    characteristics JSONB,
+    created_at TIMESTAMP WITH TIME ZONE
+) ON COMMIT DELETE ROWS
+"""
+
+# Повтор id в файле: берется последняя строка (ON CONFLICT не обновляет строку дважды)
+MERGE_SELECT = """
+SELECT DISTINCT ON (id) id, language, style, orientation, background, ai_tag, ai_text, ai_hardness,
+       characteristics, COALESCE(created_at, NOW())
+FROM templates_import
+ORDER BY id, row_no DESC
+"""
+
+MERGE = {
+    "update": f"""
+        INSERT INTO templates ({", ".join(COLUMNS)}) {MERGE_SELECT}
+        ON CONFLICT (id) DO UPDATE SET
+            {", ".join(f"{c} = EXCLUDED.{c}" for c in COLUMNS if c not in ("id", "created_at"))}
+        RETURNING (xmax = 0)
+    """,
+    "skip": f"""
+        INSERT INTO templates ({", ".join(COLUMNS)}) {MERGE_SELECT}
+        ON CONFLICT (id) DO NOTHING
+        RETURNING TRUE
+    """,
+}
+
+
+class TemplateImportError(Exception):
+    """Файл нельзя импортировать целиком (формат, заголовок, нет соединения с БД)"""
+
+
+# ==================== ПРОВЕРКА ПАЧКИ ====================
+
+class _Invalid:
+    def __init__(self, message: str):
+        self.message = message
+
+
+def _blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _check_id(values: List[Any]) -> List[Any]:
+    result = []
+    for value in values:
+        if _blank(value):
+            result.append(str(uuid.uuid4()))
+            continue
+        try:
+            result.append(str(uuid.UUID(str(value).strip())))
+        except ValueError:
+            result.append(_Invalid("некорректный UUID"))
+    return result
+
+
+def _check_text(values: List[Any]) -> List[Any]:
+    return [
+        None if _blank(v) else v.strip() if isinstance(v, str) else _Invalid("ожидается строка")
+        for v in values
+    ]
+
+
+def _check_orientation(values: List[Any]) -> List[Any]:
+    return [
+        v if v is None or v in ORIENTATIONS else _Invalid(f"ожидается одно из: {', '.join(ORIENTATIONS)}")
+        for v in _check_text(values)
+    ]
+
+
+def _check_hardness(values: List[Any]) -> List[Any]:
+    result = []
+    for value in values:
+        if _blank(value):
+            result.append(None)
+            continue
+        try:
+            number = int(str(value).strip()) if not isinstance(value, bool) else None
+        except ValueError:
+            number = None
+        result.append(number if number is not None and 1 <= number <= 5 else _Invalid("ожидается целое от 1 до 5"))
+    return result
+
+
+def _check_characteristics(values: List[Any]) -> List[Any]:
+    result = []
+    for value in values:
+        if _blank(value):
+            result.append(None)
+            continue
+        if isinstance(value, str):
+            # В CSV характеристики - JSON-строка (так же их выгружает экспорт)
+            try:
+                value = json.loads(value)
+            except ValueError:
+                result.append(_Invalid("некорректный JSON"))
+                continue
+        result.append(json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else _Invalid("ожидается массив или объект JSON"))
+    return result
+
+
+def _check_created_at(values: List[Any]) -> List[Any]:
+    result = []
+    for value in values:
+        if _blank(value):
+            result.append(None)
+            continue
+        try:
+            result.append(datetime.fromisoformat(str(value).strip().replace("Z", "+00:00")).isoformat())
+        except ValueError:
+            result.append(_Invalid("ожидается дата ISO 8601"))
+    return result
+
+
+VALIDATORS: Dict[str, Callable[[List[Any]], List[Any]]] = {
+    "id": _check_id,
+    **{column: _check_text for column in TEXT_COLUMNS},
+    "orientation": _check_orientation,
+    "ai_hardness": _check_hardness,
+    "characteristics": _check_characteristics,
+    "created_at": _check_created_at,
+}
+
+
+def validate_batch(rows: List[Tuple[int, Dict[str, Any]]]) -> Tuple[List[Tuple[Any, ...]], List[Dict[str, Any]]]:
+    """Проверка пачки по колонкам: (строки для COPY, ошибки {row, field, error})"""
+    numbers = [number for number, _ in rows]
+    checked = {column: VALIDATORS[column]([row.get(column) for _, row in rows]) for column in COLUMNS}
+    valid, errors = [], []
+    for i, number in enumerate(numbers):
+        row_errors = [
+            {"row": number, "field": column, "error": checked[column][i].message}
+            for column in COLUMNS if isinstance(checked[column][i], _Invalid)
+        ]
+        if row_errors:
+            errors.extend(row_errors)
+        else:
+            valid.append((number, *(checked[column][i] for column in COLUMNS)))
+    return valid, errors
+
+
+# ==================== ЧТЕНИЕ ФАЙЛА ====================
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in (content_type or "") or "jsonl" in (content_type or ""):
+        return "ndjson"
+    if name.endswith(".csv") or "csv" in (content_type or ""):
+        return "csv"
+    raise TemplateImportError("Не удалось определить формат: ожидается .csv или .ndjson (или параметр format)")
+
+
+def iter_rows(binary, fmt: str, errors: List[Dict[str, Any]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """Строки файла с номерами (номер строки файла; для CSV заголовок - строка 1)"""
+    text = io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        reader = csv.DictReader(text)
+        if not reader.fieldnames:
+            raise TemplateImportError("Пустой файл или нет заголовка CSV")
+        unknown = set(reader.fieldnames) - set(COLUMNS)
+        if unknown:
+            raise TemplateImportError(f"Неизвестные колонки: {', '.join(sorted(unknown))}. Доступны: {', '.join(COLUMNS)}")
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            errors.append({"row": number, "field": None, "error": f"некорректный JSON: {e}"})
+            continue
+        if not isinstance(row, dict):
+            errors.append({"row": number, "field": None, "error": "ожидается объект JSON"})
+            continue
+        unknown = set(row) - set(COLUMNS)
+        if unknown:
+            errors.append({"row": number, "field": None, "error": f"неизвестные поля: {', '.join(sorted(unknown))}"})
+            continue
+        yield number, row
+
+
+def _batches(rows: Iterator[Tuple[int, Dict[str, Any]]], size: int) -> Iterator[List[Tuple[int, Dict[str, Any]]]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ==================== ИМПОРТ И ЭКСПОРТ ====================
+
+class TemplateBulk:
+    """COPY шаблонов через прямое соединение с PostgreSQL"""
+
+    def __init__(self, dsn: str = DATABASE_URL, batch_size: int = TEMPLATE_IMPORT_BATCH_SIZE,
+                 max_errors: int = TEMPLATE_IMPORT_MAX_ERRORS):
+        self.dsn = dsn
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+    def _connect(self):
+        import psycopg2
+
+        try:
+            return psycopg2.connect(self.dsn)
+        except psycopg2.Error as e:
+            raise TemplateImportError(f"Нет соединения с PostgreSQL: {e}")
+
+    def _load_batch(self, connection, valid: List[Tuple[Any, ...]], on_conflict: str) -> Tuple[int, int]:
+        """COPY пачки во временную таблицу и перенос в templates: (вставлено, обновлено)"""
+        buffer = io.StringIO()
+        # Пустое поле без кавычек - NULL в COPY CSV
+        csv.writer(buffer).writerows(valid)
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL uac.bulk_import = 'on'")
+            cursor.execute(STAGING_TABLE)
+            cursor.copy_expert(f"COPY templates_import (row_no, {', '.join(COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            cursor.execute(MERGE[on_conflict])
+            results = cursor.fetchall()
+        connection.commit()
+        inserted = sum(1 for (is_insert,) in results if is_insert)
+        return inserted, len(results) - inserted
+
+    def import_file(self, binary, fmt: str, on_conflict: str = "update", dry_run: bool = False) -> Dict[str, Any]:
+        """Импорт файла (синхронно, вызывать в потоке): счетчики и ошибки по строкам"""
+        import psycopg2
+
+        if on_conflict not in MERGE:
+            raise TemplateImportError(f"on_conflict: ожидается одно из {', '.join(MERGE)}")
+        errors: List[Dict[str, Any]] = []
+        summary = {"rows": 0, "valid": 0, "inserted": 0, "updated": 0, "skipped": 0, "failed": 0, "batches": 0}
+        connection = None if dry_run else self._connect()
+        try:
+            for batch in _batches(iter_rows(binary, fmt, errors), self.batch_size):
+                summary["rows"] += len(batch)
+                summary["batches"] += 1
+                valid, batch_errors = validate_batch(batch)
+                errors.extend(batch_errors)
+                summary["valid"] += len(valid)
+                if dry_run or not valid:
+                    continue
+                try:
+                    inserted, updated = self._load_batch(connection, valid, on_conflict)
+                except psycopg2.Error as e:
+                    # Пачка откатывается целиком; предыдущие уже зафиксированы
+                    connection.rollback()
+                    summary["failed"] += len(valid)
+                    errors.append({"row": valid[0][0], "to_row": valid[-1][0], "field": None, "error": f"ошибка БД: {e}".strip()})
+                    logger.warning(f"Template import batch {summary['batches']} failed: {e}")
+                    continue
+                summary["inserted"] += inserted
+                summary["updated"] += updated
+                summary["skipped"] += len(valid) - inserted - updated
+        except (UnicodeDecodeError, csv.Error) as e:
+            # Уже загруженные пачки остаются, в ответе - где чтение остановилось
+            raise TemplateImportError(f"Файл не читается после строки {summary['rows']}: {e}")
+        finally:
+            if connection is not None:
+                if summary["inserted"] + summary["updated"]:
+                    self._notify_resync(connection)
+                connection.close()
+        # Строки NDJSON, которые не разобрались, в пачки не попадают
+        summary["rows"] += sum(1 for e in errors if e["field"] is None and "to_row" not in e)
+        summary["invalid"] = len({e["row"] for e in errors if "to_row" not in e})
+        return {**summary, "errors": errors[:self.max_errors], "errors_truncated": len(errors) > self.max_errors}
+
+    @staticmethod
+    def _notify_resync(connection):
+        """Один resync подписчикам реестра вместо событий по каждой строке"""
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", (REGISTRY_CHANNEL, json.dumps({"table": "templates", "op": "resync", "reason": "bulk_import"})))
+            connection.commit()
+        except Exception as e:
+            logger.warning(f"Registry resync after template import failed: {e}")
+
+    def _export(self, connection, fmt: str, sink: "queue.Queue", cancelled: threading.Event):
+        """Выгрузка в очередь частями (выполняется в потоке); None - конец, исключение - ошибка"""
+
+        class Writer:
+            def __init__(self):
+                self.buffer = io.StringIO()
+
+            def write(self, data):
+                self.buffer.write(data)
+                if self.buffer.tell() >= EXPORT_CHUNK_SIZE:
+                    self.flush()
+
+            def flush(self):
+                if self.buffer.tell():
+                    data = self.buffer.getvalue().encode()
+                    self.buffer = io.StringIO()
+                    while True:
+                        try:
+                            sink.put(data, timeout=1)
+                            return
+                        except queue.Full:
+                            # Клиент отключился - COPY прерывается, соединение освобождается
+                            if cancelled.is_set():
+                                raise TemplateImportError("Выгрузка прервана клиентом")
+
+        writer = Writer()
+        try:
+            if fmt == "csv":
+                with connection.cursor() as cursor:
+                    cursor.copy_expert(
+                        f"COPY (SELECT {', '.join(COLUMNS)} FROM templates ORDER BY created_at, id) TO STDOUT WITH (FORMAT csv, HEADER)",
+                        writer
+                    )
+            else:
+                # Серверный курсор: строки читаются порциями, а не всей таблицей в память
+                with connection.cursor(name="templates_export") as cursor:
+                    cursor.itersize = self.batch_size
+                    cursor.execute(f"SELECT row_to_json(t)::text FROM (SELECT {', '.join(COLUMNS)} FROM templates ORDER BY created_at, id) t")
+                    for (line,) in cursor:
+                        writer.write(line + "\n")
+            writer.flush()
+            sink.put(None)
+        except Exception as e:
+            if not cancelled.is_set():
+                sink.put(e)
+        finally:
+            connection.close()
+
+    async def export(self, fmt: str) -> AsyncIterator[bytes]:
+        """Поток выгрузки: поток COPY пишет в ограниченную очередь, ответ отдает части по мере готовности
+
+        Соединение открывается до первого yield: недоступная БД - ошибка до начала ответа.
+        """
+        if fmt not in FORMATS:
+            raise TemplateImportError(f"format: ожидается одно из {', '.join(FORMATS)}")
+        connection = await asyncio.to_thread(self._connect)
+        sink: "queue.Queue" = queue.Queue(maxsize=8)
+        cancelled = threading.Event()
+        threading.Thread(target=self._export, args=(connection, fmt, sink, cancelled), name="templates-export", daemon=True).start()
+        return self._drain(sink, cancelled)
+
+    @staticmethod
+    async def _drain(sink: "queue.Queue", cancelled: threading.Event) -> AsyncIterator[bytes]:
+        try:
+            while True:
+                chunk = await asyncio.to_thread(sink.get)
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield chunk
+        finally:
+            cancelled.set()
+
+
+# Глобальный импорт/экспорт шаблонов
+template_bulk = TemplateBulk()
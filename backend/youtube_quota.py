@@ -0,0 +1,345 @@
+"""
+Учет квоты YouTube Data API и допуск загрузок в конвейер
+
+Каждый вызов API списывает единицы дневной квоты (videos.insert - самый
+дорогой), квота сбрасывается в полночь по тихоокеанскому времени. Журнал
+хранит расход по дням и операциям в таблице youtube_quota_usage. Задание
+конвейера до транскодирования резервирует оценку своей стоимости (число
+форматов x (videos.insert + thumbnails.set)); если свободной квоты не хватает,
+задание ждет (до YOUTUBE_QUOTA_MAX_WAIT) или сразу завершается ошибкой, и CPU
+не тратится на видео, которое сегодня все равно не загрузится. Задания
+допускаются строго по очереди, прогноз показывает, в какой день квоты хватит
+на оставшиеся задания пакета.
+
+Расход, резервы и отметка об исчерпании квоты за сутки - общие счетчики
+координатора (Redis при REDIS_URL), поэтому воркеры uvicorn --workers N
+допускают задания из одной квоты. Резерв берется атомарно (INCRBY с откатом,
+если сумма превысила лимит) и перечитывается при каждой попытке допуска.
+Очередь допуска и прогноз - по заданиям этого воркера.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from coordination import coordinator
+from config import YOUTUBE_DAILY_QUOTA, YOUTUBE_QUOTA_COSTS, YOUTUBE_QUOTA_TIMEZONE, YOUTUBE_QUOTA_MAX_WAIT
+from metrics import YOUTUBE_QUOTA_UNITS, YOUTUBE_QUOTA_REMAINING, YOUTUBE_QUOTA_RESERVED, YOUTUBE_QUOTA_WAITING
+
+logger = logging.getLogger(__name__)
+
+# Причины ошибок YouTube, после которых загрузки до сброса квоты бессмысленны
+QUOTA_ERROR_REASONS = ("quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded")
+# Счетчики суток живут дольше суток квоты: резерв, взятый до полуночи, возвращается в свой день
+LEDGER_TTL = 2 * 86400
+# Ожидающее задание перечитывает общие счетчики: резерв мог вернуть другой воркер
+SHARED_POLL_INTERVAL = 5
+
+
+class QuotaExhaustedError(Exception):
+    """Квоты YouTube не хватает на загрузку"""
+
+
+class QuotaReservation:
+    """Резерв квоты допущенного задания; списывается по мере вызовов API"""
+
+    def __init__(self, key: str, units: int, batch_id: Optional[str] = None, day: Optional[str] = None):
+        self.key = key
+        self.units = units
+        self.remaining = units
+        self.batch_id = batch_id
+        self.day = day
+
+
+_current_reservation: contextvars.ContextVar[Optional[QuotaReservation]] = contextvars.ContextVar(
+    "youtube_quota_reservation", default=None
+)
+
+
+def is_quota_error(error: Exception) -> bool:
+    """HttpError YouTube из-за исчерпанной квоты или дневного лимита загрузок канала"""
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status not in (403, 429):
+        return False
+    details = getattr(error, "error_details", None) or []
+    reasons = [d.get("reason") for d in details if isinstance(d, dict)]
+    return any(reason in QUOTA_ERROR_REASONS for reason in reasons) or any(r in str(error) for r in QUOTA_ERROR_REASONS)
+
+
+def _quota_timezone():
+    try:
+        from zoneinfo import ZoneInfo
+        return ZoneInfo(YOUTUBE_QUOTA_TIMEZONE)
+    except Exception:
+        # Нет базы часовых поясов (tzdata) - тихоокеанское стандартное время
+        return timezone(timedelta(hours=-8))
+
+
+class YouTubeQuota:
+    """Журнал расхода квоты за текущие сутки и очередь допуска заданий"""
+
+    def __init__(self, daily_limit: int = YOUTUBE_DAILY_QUOTA, costs: Optional[Dict[str, int]] = None, db=None):
+        self.daily_limit = daily_limit
+        self.costs = dict(costs if costs is not None else YOUTUBE_QUOTA_COSTS)
+        self.tz = _quota_timezone()
+        self._db = db
+        self._day: Optional[str] = None
+        self._used = 0
+        self._by_operation: Dict[str, int] = {}
+        self._exhausted = False
+        self._reserved = 0
+        # Задания, еще не получившие резерв (в порядке постановки): key -> {units, batch_id, waiting, since}
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._changed = asyncio.Event()
+
+    @property
+    def db(self):
+        if self._db is None:
+            from database import db_manager
+            self._db = db_manager
+        return self._db
+
+    # ==================== СУТКИ КВОТЫ ====================
+
+    def quota_day(self) -> str:
+        return datetime.now(self.tz).date().isoformat()
+
+    def resets_at(self, days_ahead: int = 0) -> datetime:
+        """Момент сброса квоты (полночь по времени квоты) через days_ahead суток"""
+        day = datetime.now(self.tz).date() + timedelta(days=1 + days_ahead)
+        return datetime(day.year, day.month, day.day, tzinfo=self.tz)
+
+    def _counter(self, name: str, day: Optional[str] = None) -> str:
+        return f"youtube_quota:{day or self._day}:{name}"
+
+    async def _refresh(self):
+        """Чтение общих счетчиков суток; при смене суток первый воркер заносит в них расход из журнала в БД"""
+        day = self.quota_day()
+        if day != self._day:
+            self._day = day
+            used = 0
+            try:
+                used = sum(row["units"] for row in await self.db.get_youtube_quota_usage(day))
+            except Exception as e:
+                logger.warning(f"YouTube quota ledger unavailable, counting from zero: {e}")
+            await coordinator.add(self._counter("used"), used, ttl=LEDGER_TTL)
+        used, reserved, exhausted = await asyncio.gather(
+            coordinator.get(self._counter("used")),
+            coordinator.get(self._counter("reserved")),
+            coordinator.get(self._counter("exhausted"))
+        )
+        state = (int(used or 0), max(0, int(reserved or 0)), bool(exhausted))
+        if state != (self._used, self._reserved, self._exhausted):
+            # Ожидающие задания будятся только изменением, иначе они перечитывали бы счетчики друг за другом
+            self._used, self._reserved, self._exhausted = state
+            self._notify()
+
+    def _notify(self):
+        YOUTUBE_QUOTA_REMAINING.set(self.free_units())
+        YOUTUBE_QUOTA_RESERVED.set(self._reserved)
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def free_units(self) -> int:
+        """Свободная квота на сегодня с учетом резервов (по последнему чтению общих счетчиков)"""
+        if self._exhausted:
+            return 0
+        return max(0, self.daily_limit - self._used - self._reserved)
+
+    # ==================== ОЦЕНКА И ДОПУСК ====================
+
+    def estimate_units(self, videos: int, thumbnail: bool) -> int:
+        per_video = self.costs.get("videos.insert", 0) + (self.costs.get("thumbnails.set", 0) if thumbnail else 0)
+        return videos * per_video
+
+    def add_pending(self, key: str, units: int, batch_id: Optional[str] = None):
+        """Задание поставлено в конвейер (учитывается в прогнозе до допуска)"""
+        self._pending[key] = {"units": units, "batch_id": batch_id, "waiting": False, "since": datetime.now().isoformat()}
+
+    def discard_pending(self, key: str):
+        if self._pending.pop(key, None) is not None:
+            self._notify()
+
+    def _is_next(self, key: str) -> bool:
+        """Допуск по очереди: раньше задания не должно быть ожидающих"""
+        for other, entry in self._pending.items():
+            if other == key:
+                return True
+            if entry["waiting"]:
+                return False
+        return True
+
+    async def admit(self, key: str, units: int, batch_id: Optional[str] = None,
+                    max_wait: Optional[float] = YOUTUBE_QUOTA_MAX_WAIT) -> QuotaReservation:
+        """Резерв квоты для задания; ждет освобождения или сброса квоты не дольше max_wait (-1 или None - без ограничения)"""
+        if units > self.daily_limit:
+            raise QuotaExhaustedError(f"Заданию нужно {units} единиц квоты YouTube, дневной лимит {self.daily_limit}")
+
+        entry = self._pending.setdefault(key, {"units": units, "batch_id": batch_id, "since": datetime.now().isoformat()})
+        entry["waiting"] = True
+        deadline = None if max_wait is None or max_wait < 0 else time.monotonic() + max_wait
+        YOUTUBE_QUOTA_WAITING.inc()
+        try:
+            while True:
+                await self._refresh()
+                if self._is_next(key) and self.free_units() >= units and await self._reserve(units):
+                    del self._pending[key]
+                    self._notify()
+                    return QuotaReservation(key, units, batch_id, self._day)
+
+                now = time.monotonic()
+                if deadline is not None and now >= deadline:
+                    del self._pending[key]
+                    self._notify()
+                    raise QuotaExhaustedError(
+                        f"Недостаточно квоты YouTube: нужно {units}, свободно {self.free_units()}, "
+                        f"сброс в {self.resets_at().isoformat()}"
+                    )
+                # Просыпаемся при изменении журнала, в момент сброса квоты или по истечении ожидания
+                timeout = (self.resets_at() - datetime.now(self.tz)).total_seconds() + 1
+                if deadline is not None:
+                    timeout = min(timeout, deadline - now)
+                if coordinator.shared:
+                    timeout = min(timeout, SHARED_POLL_INTERVAL)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=max(0.0, timeout))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            YOUTUBE_QUOTA_WAITING.dec()
+
+    async def _reserve(self, units: int) -> bool:
+        """Атомарный резерв: счетчик увеличивается сразу и откатывается, если сумма превысила лимит"""
+        reserved = await coordinator.incr(self._counter("reserved"), units, ttl=LEDGER_TTL)
+        used = int(await coordinator.get(self._counter("used")) or 0)
+        if used + reserved > self.daily_limit:
+            await coordinator.incr(self._counter("reserved"), -units, ttl=LEDGER_TTL)
+            return False
+        self._used, self._reserved = used, reserved
+        return True
+
+    async def release(self, reservation: Optional[QuotaReservation]):
+        """Возврат неизрасходованного резерва (загрузка завершена или задание упало)"""
+        if reservation and reservation.remaining:
+            remaining, reservation.remaining = reservation.remaining, 0
+            try:
+                await coordinator.incr(self._counter("reserved", reservation.day), -remaining, ttl=LEDGER_TTL)
+            except Exception as e:
+                logger.warning(f"YouTube quota release failed ({remaining} units): {e}")
+            if reservation.day == self._day:
+                self._reserved = max(0, self._reserved - remaining)
+            self._notify()
+
+    @contextmanager
+    def use(self, reservation: Optional[QuotaReservation]):
+        """Вызовы API внутри блока списываются с резерва задания"""
+        token = _current_reservation.set(reservation)
+        try:
+            yield
+        finally:
+            _current_reservation.reset(token)
+
+    # ==================== ЖУРНАЛ ====================
+
+    async def record(self, operation: str, units: Optional[int] = None):
+        """Учет вызова API (квота списывается и за неуспешные вызовы)"""
+        await self._refresh()
+        units = self.costs.get(operation, 1) if units is None else units
+        self._by_operation[operation] = self._by_operation.get(operation, 0) + units
+        self._used = await coordinator.incr(self._counter("used"), units, ttl=LEDGER_TTL)
+        reservation = _current_reservation.get()
+        if reservation and reservation.remaining:
+            taken = min(reservation.remaining, units)
+            reservation.remaining -= taken
+            reserved = await coordinator.incr(self._counter("reserved", reservation.day), -taken, ttl=LEDGER_TTL)
+            if reservation.day == self._day:
+                self._reserved = max(0, reserved)
+        YOUTUBE_QUOTA_UNITS.labels(operation).inc(units)
+        self._notify()
+        try:
+            await self.db.add_youtube_quota_usage(self._day, operation, units)
+        except Exception as e:
+            logger.warning(f"YouTube quota ledger write failed: {e}")
+
+    async def mark_exhausted(self):
+        """YouTube ответил quotaExceeded - до сброса новые задания не допускаются ни одним воркером"""
+        self._exhausted = True
+        self._notify()
+        try:
+            await coordinator.set(self._counter("exhausted", self._day or self.quota_day()), True, ttl=LEDGER_TTL)
+        except Exception as e:
+            logger.warning(f"YouTube quota exhausted mark failed: {e}")
+
+    # ==================== СОСТОЯНИЕ И ПРОГНОЗ ====================
+
+    async def status(self) -> Dict[str, Any]:
+        await self._refresh()
+        try:
+            # Расход по операциям - из журнала: в нем вызовы всех воркеров
+            self._by_operation = {row["operation"]: row["units"] for row in await self.db.get_youtube_quota_usage(self._day)}
+        except Exception as e:
+            logger.warning(f"YouTube quota ledger unavailable, showing this worker's usage: {e}")
+        return {
+            "day": self._day,
+            "daily_limit": self.daily_limit,
+            "used": self._used,
+            "reserved": self._reserved,
+            "remaining": self.free_units(),
+            "exhausted": self._exhausted,
+            "by_operation": dict(self._by_operation),
+            "costs": dict(self.costs),
+            "resets_at": self.resets_at().isoformat(),
+            "pending": [{"key": key, **entry} for key, entry in self._pending.items()]
+        }
+
+    async def forecast(self, batch_id: Optional[str] = None, extra_units: Optional[List[int]] = None) -> Dict[str, Any]:
+        """Когда квоты хватит на задания в очереди (по порядку) и на гипотетические extra_units
+
+        День 0 - сегодня; задание, допущенное в день N > 0, стартует сразу после N-го сброса квоты.
+        """
+        await self._refresh()
+        queue = [(entry["batch_id"], entry["units"]) for entry in self._pending.values()]
+        queue += [("__extra__", units) for units in extra_units or []]
+
+        available = self.free_units()
+        day_offset = 0
+        batches: Dict[str, Dict[str, Any]] = {}
+        for key, units in queue:
+            summary = batches.setdefault(key or "__single__", {"jobs": 0, "units": 0, "last_day_offset": 0, "unschedulable": 0})
+            if units > self.daily_limit:
+                summary["unschedulable"] += 1
+                continue
+            while units > available:
+                day_offset += 1
+                available = self.daily_limit
+            available -= units
+            summary["jobs"] += 1
+            summary["units"] += units
+            summary["last_day_offset"] = day_offset
+
+        def describe(summary: Dict[str, Any]) -> Dict[str, Any]:
+            offset = summary["last_day_offset"]
+            return {
+                **summary,
+                "admitted_by": "now" if offset == 0 else self.resets_at(offset - 1).isoformat()
+            }
+
+        result = {
+            "remaining_today": self.free_units(),
+            "daily_limit": self.daily_limit,
+            "queued_jobs": len(self._pending),
+            "queued_units": sum(entry["units"] for entry in self._pending.values()),
+            "batches": {key: describe(summary) for key, summary in batches.items() if key != "__extra__"}
+        }
+        if batch_id is not None:
+            result["batch"] = describe(batches[batch_id]) if batch_id in batches else None
+        if extra_units:
+            result["new_batch"] = describe(batches["__extra__"])
+        return result
+
+
+# Глобальный учет квоты YouTube
+youtube_quota = YouTubeQuota()
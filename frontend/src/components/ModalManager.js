@@ -171,7 +171,8 @@ const ModalManager = () => {
                   {/* Превью изображения */}
                   <div className="mt-3 bg-gray-100 rounded-lg overflow-hidden">
                     <img
-                      src={`http://localhost:8000/modals/${modal.id}/preview`}
+                      src={`http://localhost:8000/modals/${modal.id}/preview?size=thumb`}
+                      loading="lazy"
                       alt={modal.filename}
                       className="w-full h-32 object-cover"
                       onError={(e) => {
@@ -14,9 +14,38 @@ const Registry = () => {
     fetchData();
   }, []);
 
-  const fetchData = async () => {
+  // Изменения реестра приходят с сервера построчно - полный список перечитывается только при resync
+  useEffect(() => {
+    const source = new EventSource('http://localhost:8000/registry/events');
+    const applyChange = (setRows) => (change) => {
+      setRows(rows => {
+        if (change.op === 'insert') {
+          return [change.row, ...rows.filter(row => row.id !== change.id)];
+        }
+        if (change.op === 'delete') {
+          return rows.filter(row => row.id !== change.id);
+        }
+        return rows.map(row => (row.id === change.id ? { ...row, ...change.changes } : row));
+      });
+    };
+    const handlers = { uploads: applyChange(setUploads), templates: applyChange(setTemplates) };
+    const onChange = (event) => {
+      const change = JSON.parse(event.data);
+      // Строка не поместилась в уведомление - берем актуальный список
+      if (change.truncated) {
+        fetchData(true);
+        return;
+      }
+      handlers[change.table]?.(change);
+    };
+    ['insert', 'update', 'delete'].forEach(type => source.addEventListener(type, onChange));
+    source.addEventListener('resync', () => fetchData(true));
+    return () => source.close();
+  }, []);
+
+  const fetchData = async (silent = false) => {
     try {
-      setLoading(true);
+      if (!silent) setLoading(true);
       const [uploadsResponse, templatesResponse] = await Promise.all([
         axios.get('http://localhost:8000/uploads'),
         axios.get('http://localhost:8000/templates')
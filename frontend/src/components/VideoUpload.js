@@ -18,6 +18,7 @@ const VideoUpload = () => {
   const [uploadResult, setUploadResult] = useState(null);
   const [modalImages, setModalImages] = useState([]);
   const [selectedModal, setSelectedModal] = useState(null);
+  const [uploadProgress, setUploadProgress] = useState(null);
 
   // Загрузка списка модалок при монтировании компонента
   React.useEffect(() => {
@@ -84,9 +85,20 @@ const VideoUpload = () => {
 
     setIsUploading(true);
     setUploadResult(null);
+    setUploadProgress(null);
+
+    // Поток прогресса открываем до отправки формы, чтобы не пропустить первые стадии
+    const batchId = `${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
+    const progressSource = new EventSource(`http://localhost:8000/uploads/progress/${batchId}`);
+    progressSource.onmessage = (event) => setUploadProgress(JSON.parse(event.data));
+    progressSource.addEventListener('done', (event) => {
+      setUploadProgress(JSON.parse(event.data));
+      progressSource.close();
+    });
 
     try {
       const submitData = new FormData();
+      submitData.append('batch_id', batchId);
       submitData.append('campaign_name', formData.campaign_name);
       submitData.append('video_source', formData.video_source);
       submitData.append('thumbnail_option', formData.thumbnail_option);
@@ -146,10 +158,22 @@ const VideoUpload = () => {
       console.error('Ошибка загрузки:', error);
       toast.error('Ошибка загрузки видео');
     } finally {
+      progressSource.close();
       setIsUploading(false);
     }
   };
 
+  const stageNames = {
+    queued: 'В очереди',
+    admission: 'Ожидание квоты YouTube',
+    ingest: 'Получение файла',
+    transcode: 'Обработка видео',
+    format_render: 'Создание форматов',
+    thumbnail: 'Миниатюры',
+    upload: 'Загрузка на YouTube',
+    persist: 'Сохранение'
+  };
+
   return (
     <div className="max-w-4xl mx-auto">
       <div className="bg-white rounded-lg shadow-sm border p-6">
@@ -319,6 +343,33 @@ const VideoUpload = () => {
           </div>
         </form>
 
+        {/* Прогресс загрузки */}
+        {isUploading && uploadProgress && uploadProgress.items.length > 0 && (
+          <div className="mt-6 space-y-3">
+            {uploadProgress.items.map((item) => (
+              <div key={item.index}>
+                <div className="flex justify-between text-sm text-gray-700 mb-1">
+                  <span>
+                    Видео #{item.index + 1}: {item.status === 'done' ? 'Готово' : item.status === 'error' ? 'Ошибка' : stageNames[item.stage] || item.stage}
+                    {item.format && ` (${item.format})`}
+                    {item.orientation && ` (${item.orientation})`}
+                  </span>
+                  <span className="text-gray-500">
+                    {item.speed ? `${item.speed}x ` : ''}
+                    {item.percent != null ? `${Math.round(item.percent)}%` : ''}
+                  </span>
+                </div>
+                <div className="w-full bg-gray-200 rounded-full h-2">
+                  <div
+                    className={`h-2 rounded-full transition-all ${item.status === 'error' ? 'bg-red-500' : 'bg-primary-600'}`}
+                    style={{ width: `${item.percent || 0}%` }}
+                  />
+                </div>
+              </div>
+            ))}
+          </div>
+        )}
+
         {/* Результат загрузки */}
         {uploadResult && (
           <div className="mt-6 p-4 bg-green-50 border border-green-200 rounded-lg">
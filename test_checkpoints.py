@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Тесты выбора стадии, с которой продолжается задание пакета (checkpoints.resume_stage)
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from checkpoints import resume_stage, CheckpointError, STAGES
+
+
+@pytest.fixture
+def files(tmp_path):
+    """Создание файлов на диске по имени; путь к несуществующему файлу - missing"""
+    def make(*names):
+        paths = []
+        for name in names:
+            path = tmp_path / name
+            path.write_bytes(b"data")
+            paths.append(str(path))
+        return paths
+
+    make.missing = str(tmp_path / "missing.mp4")
+    return make
+
+
+def make_row(last_stage=None, video_source="drive", upload_ref=None, **checkpoint):
+    return {
+        "last_stage": last_stage,
+        "params": {"video_source": video_source, "upload_ref": upload_ref},
+        "checkpoint": checkpoint
+    }
+
+
+def variant(orientation, path, thumbnail_path=None, **extra):
+    return {"orientation": orientation, "path": path, "thumbnail_path": thumbnail_path, **extra}
+
+
+def test_finished_job_skips_all_stages():
+    assert resume_stage(make_row("persist")) == len(STAGES)
+
+
+def test_all_variants_uploaded_resumes_at_persist():
+    """Все форматы уже на YouTube - файлы на диске не нужны"""
+    row = make_row("upload", variants=[variant("vertical", "/gone.mp4")], uploaded={"vertical": "yt-1"})
+    assert STAGES[resume_stage(row)] == "persist"
+
+
+def test_pending_variants_with_thumbnails_resume_at_upload(files):
+    video, thumb = files("vertical.mp4", "vertical.jpg")
+    row = make_row(
+        "thumbnail",
+        variants=[variant("horizontal", "/gone.mp4"), variant("vertical", video, thumb)],
+        uploaded={"horizontal": "yt-1"}
+    )
+    assert STAGES[resume_stage(row)] == "upload"
+
+
+def test_missing_thumbnail_resumes_at_thumbnail(files):
+    [video] = files("vertical.mp4")
+    row = make_row("thumbnail", variants=[variant("vertical", video, files.missing)])
+    assert STAGES[resume_stage(row)] == "thumbnail"
+
+
+def test_stream_source_counts_as_variant_file(files):
+    """Формат без своего файла читается из исходника (stream_source)"""
+    [source] = files("source.mp4")
+    row = make_row("transcode", variants=[variant("vertical", None, stream_source=source)])
+    assert STAGES[resume_stage(row)] == "thumbnail"
+
+
+def test_missing_variant_files_resume_at_transcode(files):
+    [processed] = files("processed.mp4")
+    row = make_row("thumbnail", variants=[variant("vertical", files.missing)], processed_path=processed)
+    assert STAGES[resume_stage(row)] == "transcode"
+
+
+def test_source_path_is_enough_for_transcode(files):
+    [source] = files("source.mp4")
+    row = make_row("ingest", source_path=source, processed_path=files.missing)
+    assert STAGES[resume_stage(row)] == "transcode"
+
+
+def test_later_stage_is_not_chosen_before_it_ran(files):
+    """Стадии после last_stage не пропускаются, даже если их файлы есть"""
+    [source] = files("source.mp4")
+    row = make_row(None, source_path=source)
+    assert STAGES[resume_stage(row)] == "ingest"
+
+
+@pytest.mark.parametrize("video_source,upload_ref", [("drive", None), ("path", None), ("local", "upload-1")])
+def test_nothing_on_disk_downloads_again(files, video_source, upload_ref):
+    """Без файлов задание начинается заново, если исходник можно получить снова"""
+    row = make_row("transcode", video_source=video_source, upload_ref=upload_ref,
+                   source_path=files.missing, variants=[variant("vertical", files.missing)])
+    assert STAGES[resume_stage(row)] == "ingest"
+
+
+def test_lost_local_upload_cannot_resume(files):
+    """Файл из запроса не сохранен и не возобновляемый - CheckpointError"""
+    row = make_row("transcode", video_source="local", source_path=files.missing)
+    with pytest.raises(CheckpointError):
+        resume_stage(row)
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Тесты наблюдателя за папками Google Drive на локальной ленте изменений (LocalDriveClient)
+"""
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+import drive_watcher as watcher_module
+from drive_watcher import DriveWatcher
+from stubs import LocalDriveClient, StubDatabaseManager
+
+FOLDER = "folder-1"
+
+
+@pytest.fixture
+def drive():
+    return LocalDriveClient(page_size=2)
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    stub = StubDatabaseManager()
+    monkeypatch.setattr(watcher_module, "db_manager", stub)
+    monkeypatch.setattr(watcher_module, "UPLOAD_DIR", str(tmp_path))
+    return stub
+
+
+class HttpError(Exception):
+    """Ошибка API с HTTP-статусом, как googleapiclient.errors.HttpError"""
+
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Response", (), {"status": status})()
+
+
+def make_watcher(drive, failures=None, **options):
+    """failures - ошибки обработчика по очереди; None в списке - успешная загрузка"""
+    async def client_factory():
+        return drive
+
+    options = {"poll_interval": 60, "queue_size": 100, **options}
+    watcher = DriveWatcher(client_factory=client_factory, **options)
+    watcher.handled = []
+    failures = list(failures or [])
+
+    async def handler(source, file, file_path, copy_number):
+        error = failures.pop(0) if failures else None
+        if error is not None:
+            raise error
+        watcher.handled.append({"id": file["id"], "name": file["name"], "copy_number": copy_number, "path": file_path})
+
+    watcher.set_handler(handler)
+    return watcher
+
+
+async def drain(watcher):
+    """Обработка очереди так же, как фоновый обработчик"""
+    worker = asyncio.create_task(watcher._worker_loop())
+    try:
+        await watcher.queue.join()
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+
+async def poll(watcher, source_id, db):
+    return await watcher._poll_source(await db.get_drive_source_by_id(source_id))
+
+
+def test_registration_starts_from_start_page_token(drive, db):
+    """Файлы, появившиеся до регистрации, не попадают в очередь без ingest_existing"""
+    async def scenario():
+        drive.add_file(FOLDER, "old.mp4", b"old")
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+
+        assert source["page_token"] == str(len(drive.changes))
+        assert await poll(watcher, source["id"], db) == 0
+        assert watcher.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_registration_ingests_existing_files(drive, db):
+    """ingest_existing ставит в очередь видео папки, а лента не повторяет их"""
+    async def scenario():
+        drive.add_file(FOLDER, "a.mp4", b"a")
+        drive.add_file(FOLDER, "cover.png", b"png", mime_type="image/png")
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания", ingest_existing=True)
+        await drain(watcher)
+
+        assert [f["name"] for f in watcher.handled] == ["a.mp4"]
+        assert await poll(watcher, source["id"], db) == 0
+
+    asyncio.run(scenario())
+
+
+def test_poll_picks_up_only_new_or_modified_files(drive, db):
+    """Следующий опрос забирает только новые файлы и файлы с новым содержимым"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        first = drive.add_file(FOLDER, "first.mp4", b"1")
+        drive.add_file(FOLDER, "second.mp4", b"2")
+        drive.add_file(FOLDER, "third.mp4", b"3")
+
+        assert await poll(watcher, source["id"], db) == 3
+        await drain(watcher)
+        assert [f["copy_number"] for f in watcher.handled] == [1, 2, 3]
+
+        assert await poll(watcher, source["id"], db) == 0
+
+        drive.update_file(first["id"], content=b"1-v2")
+        drive.add_file(FOLDER, "fourth.mp4", b"4")
+        assert await poll(watcher, source["id"], db) == 2
+        await drain(watcher)
+        assert [f["name"] for f in watcher.handled[3:]] == ["first.mp4", "fourth.mp4"]
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert stored["files_ingested"] == 5
+        assert stored["pending_files"] == {}
+        assert stored["known_files"][first["id"]] == drive.files[first["id"]]["md5Checksum"]
+
+    asyncio.run(scenario())
+
+
+def test_rename_and_permission_change_are_skipped(drive, db):
+    """Переименование и изменение прав не меняют отпечаток - файл не загружается повторно"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        file = drive.add_file(FOLDER, "video.mp4", b"video")
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+
+        drive.update_file(file["id"], name="renamed.mp4")
+        drive.update_file(file["id"])
+        assert await poll(watcher, source["id"], db) == 0
+        assert len(watcher.handled) == 1
+
+    asyncio.run(scenario())
+
+
+def test_removed_and_trashed_files_are_skipped(drive, db):
+    """Удаленные и перемещенные в корзину файлы не ставятся в очередь"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        trashed = drive.add_file(FOLDER, "trashed.mp4", b"t")
+        removed = drive.add_file(FOLDER, "removed.mp4", b"r")
+        assert await poll(watcher, source["id"], db) == 2
+        await drain(watcher)
+
+        drive.trash_file(trashed["id"])
+        drive.remove_file(removed["id"])
+        assert await poll(watcher, source["id"], db) == 0
+        assert watcher.queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_non_video_and_foreign_folder_files_are_skipped(drive, db):
+    """Не видео и файлы вне наблюдаемой папки пропускаются"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        drive.add_file(FOLDER, "notes.txt", b"txt", mime_type="text/plain")
+        drive.add_file("folder-2", "other.mp4", b"other")
+        drive.add_file(FOLDER, "video.mp4", b"video")
+
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+        assert [f["name"] for f in watcher.handled] == ["video.mp4"]
+
+    asyncio.run(scenario())
+
+
+def test_queued_files_survive_worker_restart(drive, db):
+    """Файлы из очереди упавшего воркера забирает следующий опрос, хотя лента уже сдвинута"""
+    async def scenario():
+        crashed = make_watcher(drive)
+        source = await crashed.register_source(FOLDER, "Кампания")
+        drive.add_file(FOLDER, "a.mp4", b"a")
+        drive.add_file(FOLDER, "b.mp4", b"b")
+        assert await poll(crashed, source["id"], db) == 2
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert stored["page_token"] == str(len(drive.changes))
+        assert stored["known_files"] == {}
+        assert len(stored["pending_files"]) == 2
+
+        # Очередь упавшего воркера потеряна; новый воркер занимает его место в реестре
+        restarted = make_watcher(drive)
+        assert await poll(restarted, source["id"], db) == 2
+        await drain(restarted)
+        assert sorted(f["name"] for f in restarted.handled) == ["a.mp4", "b.mp4"]
+        assert sorted(f["copy_number"] for f in restarted.handled) == [1, 2]
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert stored["pending_files"] == {}
+        assert len(stored["known_files"]) == 2
+        assert await poll(restarted, source["id"], db) == 0
+
+    asyncio.run(scenario())
+
+
+def test_files_of_running_worker_are_not_taken(drive, db):
+    """Файлы в очереди работающего воркера не ставятся в очередь повторно"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        drive.add_file(FOLDER, "a.mp4", b"a")
+        assert await poll(watcher, source["id"], db) == 1
+        assert await poll(watcher, source["id"], db) == 0
+        assert watcher.queue.qsize() == 1
+
+    asyncio.run(scenario())
+
+
+def test_transient_failure_keeps_file_pending_until_retry(drive, db):
+    """Временная ошибка не завершает файл: опрос забирает его снова после паузы"""
+    async def scenario():
+        watcher = make_watcher(drive, failures=[ConnectionError("drive down")])
+        source = await watcher.register_source(FOLDER, "Кампания")
+        file = drive.add_file(FOLDER, "video.mp4", b"video")
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        entry = stored["pending_files"][file["id"]]
+        assert stored["known_files"] == {}
+        assert entry["worker"] is None and entry["attempts"] == 1
+        assert entry["retry_at"] > time.time()
+
+        # Пауза еще не истекла
+        assert await poll(watcher, source["id"], db) == 0
+
+        stored["pending_files"][file["id"]]["retry_at"] = 0
+        await db.update_drive_source(source["id"], {"pending_files": stored["pending_files"]})
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+
+        assert [f["copy_number"] for f in watcher.handled] == [1]
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert stored["pending_files"] == {}
+        assert stored["known_files"] == {file["id"]: file["md5Checksum"]}
+
+    asyncio.run(scenario())
+
+
+def test_failed_file_is_completed_after_max_attempts(drive, db):
+    """Исчерпав попытки, файл завершается и больше не повторяется"""
+    async def scenario():
+        errors = [RuntimeError("ffmpeg crashed")] * 2
+        watcher = make_watcher(drive, failures=errors, max_attempts=2, retry_max_delay=0)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        file = drive.add_file(FOLDER, "video.mp4", b"video")
+
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert stored["pending_files"] == {}
+        assert file["id"] in stored["known_files"]
+        assert await poll(watcher, source["id"], db) == 0
+        assert watcher.handled == []
+
+    asyncio.run(scenario())
+
+
+def test_rejected_file_is_not_retried(drive, db):
+    """Отказ по самому файлу (4xx) завершает его сразу, лимит 429 повторяется"""
+    async def scenario():
+        watcher = make_watcher(drive, failures=[HttpError(404), HttpError(429)])
+        source = await watcher.register_source(FOLDER, "Кампания")
+        rejected = drive.add_file(FOLDER, "rejected.mp4", b"r")
+        limited = drive.add_file(FOLDER, "limited.mp4", b"l")
+        assert await poll(watcher, source["id"], db) == 2
+        await drain(watcher)
+
+        stored = await db.get_drive_source_by_id(source["id"])
+        assert list(stored["known_files"]) == [rejected["id"]]
+        assert list(stored["pending_files"]) == [limited["id"]]
+
+    asyncio.run(scenario())
+
+
+def test_file_name_with_slash_is_downloaded(drive, db, tmp_path):
+    """Имя файла Drive с "/" не превращается в несуществующий подкаталог"""
+    async def scenario():
+        watcher = make_watcher(drive)
+        source = await watcher.register_source(FOLDER, "Кампания")
+        drive.add_file(FOLDER, "clips/2026/video.mp4", b"video")
+        assert await poll(watcher, source["id"], db) == 1
+        await drain(watcher)
+
+        [handled] = watcher.handled
+        path = Path(handled["path"])
+        assert path.parent == tmp_path / "downloaded"
+        assert path.name.endswith("_video.mp4") and path.read_bytes() == b"video"
+
+    asyncio.run(scenario())
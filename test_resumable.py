@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Тесты протокола возобновляемой загрузки (backend/resumable.py) на LocalStorage и локальном координаторе
+"""
+import asyncio
+import hashlib
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from resumable import ResumableUploads, ResumableUploadError
+from storage import LocalStorage
+
+
+@pytest.fixture
+def make_uploads(monkeypatch, tmp_path):
+    """Экземпляры ResumableUploads над одним каталогом (как воркеры одного узла)"""
+    storage = LocalStorage(str(tmp_path))
+    monkeypatch.setattr(ResumableUploads, "storage", property(lambda self: storage))
+    return lambda: ResumableUploads(root=str(tmp_path), max_size=1024)
+
+
+async def body(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+async def expect_error(status_code, coroutine):
+    with pytest.raises(ResumableUploadError) as error:
+        await coroutine
+    assert error.value.status_code == status_code
+    return error.value
+
+
+def test_offset_mismatch_is_rejected(make_uploads):
+    """PATCH не с принятого объема - 409, принятые байты не меняются"""
+    async def scenario():
+        uploads = make_uploads()
+        state = await uploads.create(10, {"filename": "video.mp4"})
+        assert await uploads.append(state["id"], 0, body(b"01234")) == 5
+
+        await expect_error(409, uploads.append(state["id"], 0, body(b"01234")))
+        await expect_error(409, uploads.append(state["id"], 7, body(b"789")))
+        assert uploads.offset(state["id"]) == 5
+
+    asyncio.run(scenario())
+
+
+def test_data_over_upload_length_is_rejected(make_uploads):
+    """Часть сверх Upload-Length - 413; байты до нее приняты"""
+    async def scenario():
+        uploads = make_uploads()
+        state = await uploads.create(4, {"filename": "video.mp4"})
+
+        await expect_error(413, uploads.append(state["id"], 0, body(b"ab", b"cde")))
+        assert uploads.offset(state["id"]) == 2
+        assert await uploads.append(state["id"], 2, body(b"cd")) == 4
+
+    asyncio.run(scenario())
+
+
+def test_hash_is_recomputed_from_part_file(make_uploads):
+    """Продолжение на другом воркере (хэша в памяти нет) досчитывает SHA-256 по файлу части"""
+    async def scenario():
+        first = make_uploads()
+        state = await first.create(6, {"filename": "clip.mp4"})
+        await first.append(state["id"], 0, body(b"abc"))
+
+        second = make_uploads()
+        assert second.offset(state["id"]) == 3
+        assert await second.append(state["id"], 3, body(b"def")) == 6
+
+        digest = hashlib.sha256(b"abcdef").hexdigest()
+        final = await second.finalize(state["id"], sha256=digest.upper())
+        assert final["status"] == "final" and final["sha256"] == digest
+        path = await second.storage.local_path(final["key"])
+        assert Path(path).read_bytes() == b"abcdef"
+        assert not second.part_path(state["id"]).exists()
+
+    asyncio.run(scenario())
+
+
+def test_checksum_mismatch_deletes_upload(make_uploads):
+    """Неверная контрольная сумма - 422, часть и описание загрузки удаляются"""
+    async def scenario():
+        uploads = make_uploads()
+        state = await uploads.create(3, {"filename": "video.mp4"})
+        await uploads.append(state["id"], 0, body(b"abc"))
+
+        await expect_error(422, uploads.finalize(state["id"], sha256="0" * 64))
+        assert not uploads.part_path(state["id"]).exists()
+        await expect_error(404, uploads.get(state["id"]))
+
+    asyncio.run(scenario())
+
+
+def test_upload_is_claimed_by_one_job(make_uploads):
+    """Завершенную загрузку берет одно задание; его повтор получает ее снова, другое задание - 409"""
+    async def scenario():
+        uploads = make_uploads()
+        state = await uploads.create(3, {"filename": "video.mp4"})
+        await expect_error(409, uploads.claim(state["id"], "job-1"))
+
+        await uploads.append(state["id"], 0, body(b"abc"))
+        await uploads.finalize(state["id"])
+
+        path, filename = await uploads.claim(state["id"], "job-1")
+        assert Path(path).read_bytes() == b"abc" and filename == "video.mp4"
+        assert await uploads.claim(state["id"], "job-1") == (path, filename)
+
+        await expect_error(409, uploads.claim(state["id"], "job-2"))
+        await expect_error(409, uploads.delete(state["id"]))
+
+    asyncio.run(scenario())
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Тесты планировщика тяжелых стадий: классы приоритета, справедливое разделение и отмена
+"""
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent / "backend"))
+
+from scheduler import Scheduler, JobCancelledError
+
+
+async def settle():
+    """Несколько проходов цикла событий: задачи успевают встать в очередь"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Harness:
+    """Планировщик с одним слотом cpu, занятым блокирующим заданием"""
+
+    def __init__(self, **options):
+        options = {"slots": {"cpu": 1}, "aging_seconds": 0, **options}
+        self.scheduler = Scheduler(**options)
+        self.order = []
+        self.gate = asyncio.Event()
+        self.tasks = []
+
+    async def block(self):
+        self.tasks.append(asyncio.create_task(
+            self.scheduler.run("cpu", "blocker", self.gate.wait, tenant="blocker")
+        ))
+        await settle()
+
+    def submit(self, job_id, priority="batch", tenant="", batch_id=None):
+        async def stage():
+            self.order.append(job_id)
+
+        task = asyncio.create_task(self.scheduler.run(
+            "cpu", job_id, stage, priority=priority, tenant=tenant, batch_id=batch_id
+        ))
+        self.tasks.append(task)
+        return task
+
+    async def finish(self):
+        self.gate.set()
+        return await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def test_higher_class_is_granted_first():
+    """Освободившийся слот получает single, затем batch, затем background"""
+    async def scenario():
+        harness = Harness()
+        await harness.block()
+        harness.submit("background", priority="background")
+        harness.submit("batch", priority="batch")
+        harness.submit("single", priority="single")
+        await settle()
+
+        waiting = harness.scheduler.status()["resources"]["cpu"]["waiting"]
+        assert [t["job_id"] for t in waiting] == ["single", "batch", "background"]
+        await harness.finish()
+        assert harness.order == ["single", "batch", "background"]
+
+    asyncio.run(scenario())
+
+
+def test_aging_lifts_waiting_background_job():
+    """Фоновое задание, прождавшее SCHEDULER_AGING_SECONDS, поднимается на класс"""
+    async def scenario():
+        harness = Harness(aging_seconds=10)
+        await harness.block()
+        harness.submit("background", priority="background")
+        await settle()
+        harness.submit("batch", priority="batch")
+        await settle()
+
+        # Фоновое задание ждет 15 с: класс batch, и в нем оно поставлено раньше
+        [background] = [t for t in harness.scheduler.resources["cpu"].waiting if t.job_id == "background"]
+        background.enqueued_at -= 15
+        await harness.finish()
+        assert harness.order == ["background", "batch"]
+
+    asyncio.run(scenario())
+
+
+def test_equal_weights_alternate_tenants():
+    """Кампании с равными весами получают слоты по очереди, как бы ни различались размеры пакетов"""
+    async def scenario():
+        harness = Harness()
+        await harness.block()
+        for i in range(4):
+            harness.submit(f"a{i}", tenant="a")
+        for i in range(2):
+            harness.submit(f"b{i}", tenant="b")
+        await settle()
+
+        await harness.finish()
+        assert harness.order == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+    asyncio.run(scenario())
+
+
+def test_weights_split_slots_proportionally():
+    """Кампания с весом 2 получает вдвое больше слотов, пока обе ждут"""
+    async def scenario():
+        harness = Harness(weights={"a": 2, "b": 1})
+        await harness.block()
+        for i in range(8):
+            harness.submit(f"a{i}", tenant="a")
+            harness.submit(f"b{i}", tenant="b")
+        await settle()
+
+        await harness.finish()
+        first = harness.order[:9]
+        assert sum(job.startswith("a") for job in first) == 6
+        assert sum(job.startswith("b") for job in first) == 3
+
+    asyncio.run(scenario())
+
+
+def test_cancel_queued_job_releases_its_place():
+    """Отмена пакета снимает его задания с очереди, остальные выполняются"""
+    async def scenario():
+        harness = Harness()
+        await harness.block()
+        first = harness.submit("job-1", batch_id="batch-1")
+        second = harness.submit("job-2", batch_id="batch-1")
+        other = harness.submit("job-3", batch_id="batch-2")
+        await settle()
+
+        assert await harness.scheduler.cancel(batch_id="batch-1") == {"queued": 2, "running": 0}
+        for task in (first, second):
+            with pytest.raises(JobCancelledError):
+                await task
+        harness.tasks = [t for t in harness.tasks if t not in (first, second)]
+        await harness.finish()
+        assert harness.order == ["job-3"]
+        assert other.done() and other.exception() is None
+
+    asyncio.run(scenario())
+
+
+def test_cancel_running_job_interrupts_stage():
+    """Отмена выполняющегося задания прерывает стадию и освобождает слот"""
+    async def scenario():
+        scheduler = Scheduler(slots={"cpu": 1}, aging_seconds=0)
+        started = asyncio.Event()
+        interrupted = []
+
+        async def long_stage():
+            started.set()
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                interrupted.append(True)
+                raise
+
+        async def quick_stage():
+            return "done"
+
+        running = asyncio.create_task(scheduler.run("cpu", "job-1", long_stage))
+        await started.wait()
+        queued = asyncio.create_task(scheduler.run("cpu", "job-2", quick_stage))
+        await settle()
+
+        assert await scheduler.cancel(job_id="job-1") == {"queued": 0, "running": 1}
+        with pytest.raises(JobCancelledError):
+            await running
+        assert interrupted == [True]
+        assert await queued == "done"
+        assert scheduler.resources["cpu"].running == []
+
+    asyncio.run(scenario())
+
+
+def test_forget_allows_cancelled_job_to_run_again():
+    """Отмененное задание не запускается, пока отметка не снята forget"""
+    async def scenario():
+        scheduler = Scheduler(slots={"cpu": 1}, aging_seconds=0)
+
+        async def stage():
+            return "done"
+
+        await scheduler.cancel(batch_id="batch-1")
+        with pytest.raises(JobCancelledError):
+            await scheduler.run("cpu", "job-1", stage, batch_id="batch-1")
+        assert scheduler.resources["cpu"].running == []
+
+        await scheduler.forget(batch_id="batch-1")
+        assert await scheduler.run("cpu", "job-1", stage, batch_id="batch-1") == "done"
+        assert scheduler.status()["cancelled"] == {"jobs": 0, "batches": 0}
+
+    asyncio.run(scenario())